@@ -1,3 +1,29 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import CameraDevice, Gate, Lot, Subscription
+
+
+class GateInline(admin.TabularInline):
+    model = Gate
+    extra = 0
+
+
+@admin.register(Lot)
+class LotAdmin(admin.ModelAdmin):
+    list_display = ('code', 'name', 'capacity', 'is_active')
+    search_fields = ('code', 'name')
+    inlines = [GateInline]
+
+
+@admin.register(CameraDevice)
+class CameraDeviceAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'name', 'lot', 'gate', 'is_active', 'updated_at')
+    list_filter = ('lot', 'is_active')
+    search_fields = ('device_id', 'name')
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('license_plate', 'kind', 'lot', 'holder', 'valid_from', 'valid_until', 'is_active')
+    list_filter = ('kind', 'lot', 'is_active')
+    search_fields = ('license_plate', 'holder')
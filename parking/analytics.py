@@ -0,0 +1,153 @@
+"""
+Phân tích lượng xe trong bãi theo thời gian (phục vụ bố trí nhân viên)
+
+Từ các cặp (giờ vào, giờ ra) của ParkingSession:
+    - occupancy: số xe trong bãi ở đầu mỗi khung BASE_BUCKET phút
+    - peak: số xe lớn nhất trong khung
+    - arrivals / departures: số lượt vào / ra trong khung
+    - dwell: phân bố thời lượng đỗ của các xe ra trong ngày (DWELL_BINS phút)
+
+Cách tính (numpy, một lượt cho cả khoảng ngày): mỗi phiên sinh sự kiện +1
+lúc vào và -1 lúc ra, sắp theo thời gian rồi cộng dồn (cumsum) ra số xe sau
+mỗi sự kiện; số xe đầu khung lấy bằng searchsorted, peak bằng maximum.at,
+lượt vào/ra bằng histogram.
+
+Kết quả từng ngày ĐÃ KẾT THÚC được lưu vào DailyOccupancy (khung 5 phút,
+khung 15/30/60 phút gộp lại khi đọc); tác vụ refresh_daily_rollup xóa bản
+lưu khi có phiên của ngày đó thay đổi. Ngày hôm nay luôn tính trực tiếp.
+Múi giờ Asia/Ho_Chi_Minh không đổi giờ mùa hè nên ngày luôn dài 24 giờ.
+"""
+
+from datetime import datetime, time as time_cls, timedelta
+
+import numpy as np
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DailyOccupancy, Lot, ParkingSession
+
+
+BASE_BUCKET = 5                                  # phút
+BUCKET_CHOICES = (5, 15, 30, 60)
+BUCKETS_PER_DAY = 24 * 60 // BASE_BUCKET
+DWELL_BINS = [0, 15, 30, 60, 90, 120, 180, 240, 360, 480, 720, 1440]   # phút, khung cuối: >= 1440
+MAX_DAYS = 366
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time_cls.min))
+
+
+def dwell_labels():
+    labels = [f'{low}-{high}' for low, high in zip(DWELL_BINS, DWELL_BINS[1:])]
+    return labels + [f'{DWELL_BINS[-1]}+']
+
+
+def compute_days(lot_id, first_day, last_day):
+    """
+    Tính chuỗi khung 5 phút cho các ngày [first_day, last_day] của một bãi
+
+    Returns:
+        dict: {date: {'occupancy', 'peak', 'arrivals', 'departures', 'dwell'}} (list số nguyên)
+    """
+    n_days = (last_day - first_day).days + 1
+    start = _day_start(first_day)
+    end = start + timedelta(days=n_days)
+    start_ts = start.timestamp()
+
+    rows = list(ParkingSession.objects.filter(lot_id=lot_id, entry_time__lt=end).filter(
+        Q(exit_time__isnull=True) | Q(exit_time__gte=start)
+    ).values_list('entry_time', 'exit_time', 'duration_minutes'))
+    entries = np.array([entry.timestamp() for entry, _, _ in rows], dtype=np.float64)
+    completed = [(exit_time.timestamp(), minutes or 0) for _, exit_time, minutes in rows if exit_time is not None]
+    exits = np.array([exit_ts for exit_ts, _ in completed], dtype=np.float64)
+    minutes = np.array([minutes for _, minutes in completed], dtype=np.float64)
+
+    bucket_seconds = BASE_BUCKET * 60
+    n_buckets = n_days * BUCKETS_PER_DAY
+    edges = start_ts + np.arange(n_buckets + 1, dtype=np.float64) * bucket_seconds
+
+    # Sự kiện +1/-1 sắp theo thời gian (cùng thời điểm thì xe ra trước để không thổi phồng peak)
+    times = np.concatenate([entries, exits])
+    deltas = np.concatenate([np.ones(len(entries), dtype=np.int64), -np.ones(len(exits), dtype=np.int64)])
+    order = np.lexsort((deltas, times))
+    times = times[order]
+    # inside[k] = số xe sau k sự kiện đầu tiên (inside[0] = 0)
+    inside = np.concatenate([[0], np.cumsum(deltas[order])])
+
+    occupancy = inside[np.searchsorted(times, edges[:-1], side='right')]
+    peak = occupancy.copy()
+    event_bucket = np.searchsorted(edges, times, side='right') - 1
+    in_range = (event_bucket >= 0) & (event_bucket < n_buckets)
+    np.maximum.at(peak, event_bucket[in_range], inside[1:][in_range])
+
+    arrivals = np.histogram(entries, bins=edges)[0]
+    departures = np.histogram(exits, bins=edges)[0]
+
+    dwell = np.zeros((n_days, len(DWELL_BINS)), dtype=np.int64)
+    exit_day = np.floor((exits - start_ts) / 86400).astype(np.int64)
+    exit_in_range = (exit_day >= 0) & (exit_day < n_days)
+    dwell_bin = np.clip(np.searchsorted(DWELL_BINS, minutes, side='right') - 1, 0, len(DWELL_BINS) - 1)
+    np.add.at(dwell, (exit_day[exit_in_range], dwell_bin[exit_in_range]), 1)
+
+    result = {}
+    for i in range(n_days):
+        window = slice(i * BUCKETS_PER_DAY, (i + 1) * BUCKETS_PER_DAY)
+        result[first_day + timedelta(days=i)] = {
+            'occupancy': occupancy[window].tolist(),
+            'peak': peak[window].tolist(),
+            'arrivals': arrivals[window].tolist(),
+            'departures': departures[window].tolist(),
+            'dwell': dwell[i].tolist(),
+        }
+    return result
+
+
+def day_series(lot_ids, first_day, last_day):
+    """
+    Chuỗi khung 5 phút của các ngày, cộng gộp các bãi - ngày đã kết thúc đọc từ DailyOccupancy
+
+    Returns:
+        dict: {date: {'occupancy', 'peak', 'arrivals', 'departures', 'dwell'}}
+    """
+    today = timezone.localtime().date()
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    totals = {}
+
+    for lot_id in lot_ids:
+        cached = {
+            row.date: row.data
+            for row in DailyOccupancy.objects.filter(lot_id=lot_id, date__gte=first_day, date__lte=last_day)
+        }
+        missing = [day for day in days if day not in cached]
+        if missing:
+            computed = compute_days(lot_id, missing[0], missing[-1])
+            DailyOccupancy.objects.bulk_create(
+                [DailyOccupancy(lot_id=lot_id, date=day, data=computed[day]) for day in missing if day < today],
+                ignore_conflicts=True,
+            )
+            cached.update((day, computed[day]) for day in missing)
+
+        for day in days:
+            data = cached[day]
+            total = totals.get(day)
+            if total is None:
+                totals[day] = {key: list(values) for key, values in data.items()}
+            else:
+                # Các khung giống nhau nên cộng từng phần tử được (peak cộng lại là chặn trên)
+                for key, values in data.items():
+                    total[key] = [a + b for a, b in zip(total[key], values)]
+    return totals
+
+
+def resample(values, factor, how):
+    """Gộp khung 5 phút thành khung lớn hơn: 'first' (số xe đầu khung), 'max', 'sum'"""
+    array = np.asarray(values).reshape(-1, factor)
+    if how == 'first':
+        return array[:, 0].tolist()
+    return (array.max(axis=1) if how == 'max' else array.sum(axis=1)).tolist()
+
+
+def lot_ids_for(lot):
+    """Bãi cần tính: một bãi cụ thể hoặc tất cả các bãi"""
+    return [lot.id] if lot is not None else list(Lot.objects.values_list('id', flat=True))
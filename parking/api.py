@@ -1,38 +1,41 @@
 from django.http import JsonResponse
 from django.contrib.auth.models import User
 from django.views.decorators.http import require_http_methods
+import logging
+
+logger = logging.getLogger(__name__)
 
 @require_http_methods(["GET"])
 def check_username(request):
     """API kiểm tra username đã tồn tại chưa"""
     username = request.GET.get('username', '').strip()
-    print(f"Checking username: {username}")  # Debug line
+    logger.debug("Checking username: %s", username)
     if len(username) < 3:
         response = {
             'exists': True,
             'message': 'Tên đăng nhập phải có ít nhất 3 ký tự'
         }
-        print(f"Response: {response}")  # Debug line
+        logger.debug("Response: %s", response)
         return JsonResponse(response)
     exists = User.objects.filter(username__iexact=username).exists()
     response = {
         'exists': exists,
         'message': 'Tên đăng nhập đã tồn tại' if exists else 'Tên đăng nhập hợp lệ'
     }
-    print(f"Response: {response}")  # Debug line
+    logger.debug("Response: %s", response)
     return JsonResponse(response)
 
 @require_http_methods(["GET"])
 def check_email(request):
     """API kiểm tra email đã được sử dụng chưa"""
     email = request.GET.get('email', '').strip().lower()
-    print(f"Checking email: {email}")  # Debug line
+    logger.debug("Checking email: %s", email)
     exists = User.objects.filter(email__iexact=email).exists()
     response = {
         'exists': exists,
         'message': 'Email đã được sử dụng' if exists else 'Email hợp lệ'
     }
-    print(f"Response: {response}")  # Debug line
+    logger.debug("Response: %s", response)
     return JsonResponse(response)
 
 @require_http_methods(["GET"])
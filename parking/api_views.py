@@ -3,42 +3,48 @@ API Views cho hệ thống quản lý bãi đỗ xe
 Bao gồm: Thống kê doanh thu, quản lý giao dịch, thanh toán
 """
 
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.db.models import Sum, Count, Q, Avg
 from django.db.models.functions import TruncDate, TruncMonth
 from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
+import csv
 import json
 
-from .models import ParkingSession, VehicleDetection
+from . import analytics, profiles, tariffs
+from .lots import lot_from_request
+from .models import Lot, ParkingSession, VehicleDetection
+from .payments import SettlementError, collected_totals, ledger_rows, settle
+from .plates import canonical_form, normalize
+from .thumbnails import thumbnail_urls_for_images
+
+
+def _filter_by_lot(request, queryset):
+    """
+    Lọc queryset theo tham số ?lot=<mã bãi> (không truyền = tất cả các bãi)
+
+    Returns:
+        tuple: (queryset, error_response)
+    """
+    lot, error = lot_from_request(request)
+    if error:
+        return None, JsonResponse({'success': False, 'error': error}, status=404)
+    if lot is not None:
+        queryset = queryset.filter(lot=lot)
+    return queryset, None
 
 
 # ==================== API THỐNG KÊ DOANH THU ====================
 
-@require_http_methods(["GET"])
-def revenue_statistics(request):
+def _revenue_period(request):
     """
-    API thống kê doanh thu tổng quát
-    
-    Query Parameters:
-        - period: 'day', 'week', 'month', 'year' (mặc định: 'day')
-        - date: 'YYYY-MM-DD' (mặc định: hôm nay)
-    
+    Đọc ?period= và ?date= của API thống kê doanh thu
+
     Returns:
-        {
-            "period": "day",
-            "date": "2025-11-17",
-            "total_revenue": 150000,
-            "total_transactions": 25,
-            "paid_transactions": 20,
-            "unpaid_transactions": 3,
-            "free_transactions": 2,
-            "average_fee": 6000,
-            "average_duration": 85
-        }
+        tuple: (period, start_time, end_time, period_label, error_response)
     """
     period = request.GET.get('period', 'day')
     date_str = request.GET.get('date')
@@ -48,7 +54,8 @@ def revenue_statistics(request):
         try:
             target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
         except ValueError:
-            return JsonResponse({'error': 'Định dạng ngày không hợp lệ. Dùng YYYY-MM-DD'}, status=400)
+            return period, None, None, None, JsonResponse(
+                {'error': 'Định dạng ngày không hợp lệ. Dùng YYYY-MM-DD'}, status=400)
     else:
         target_date = timezone.localtime().date()
     
@@ -78,26 +85,24 @@ def revenue_statistics(request):
         period_label = str(target_date.year)
     
     else:
-        return JsonResponse({'error': 'Period không hợp lệ. Chọn: day, week, month, year'}, status=400)
-    
-    # Truy vấn dữ liệu
-    sessions = ParkingSession.objects.filter(
-        exit_time__gte=start_time,
-        exit_time__lt=end_time,
-        status='COMPLETED'
-    )
-    
-    # Tính toán thống kê
-    stats = sessions.aggregate(
-        total_revenue=Sum('fee'),
-        total_transactions=Count('id'),
-        paid_count=Count('id', filter=Q(payment_status='PAID')),
-        unpaid_count=Count('id', filter=Q(payment_status='UNPAID')),
-        free_count=Count('id', filter=Q(payment_status='FREE')),
-        avg_fee=Avg('fee'),
-        avg_duration=Avg('duration_minutes')
-    )
+        return period, None, None, None, JsonResponse(
+            {'error': 'Period không hợp lệ. Chọn: day, week, month, year'}, status=400)
     
+    return period, start_time, end_time, period_label, None
+
+
+REVENUE_AGGREGATES = {
+    'total_revenue': Sum('fee'),
+    'total_transactions': Count('id'),
+    'paid_count': Count('id', filter=Q(payment_status='PAID')),
+    'unpaid_count': Count('id', filter=Q(payment_status='UNPAID')),
+    'free_count': Count('id', filter=Q(payment_status='FREE')),
+    'avg_fee': Avg('fee'),
+    'avg_duration': Avg('duration_minutes'),
+}
+
+
+def _revenue_response(period, period_label, start_time, end_time, stats):
     return JsonResponse({
         'success': True,
         'period': period,
@@ -116,6 +121,47 @@ def revenue_statistics(request):
     })
 
 
+@require_http_methods(["GET"])
+def revenue_statistics(request):
+    """
+    API thống kê doanh thu tổng quát
+    
+    Query Parameters:
+        - period: 'day', 'week', 'month', 'year' (mặc định: 'day')
+        - date: 'YYYY-MM-DD' (mặc định: hôm nay)
+        - lot: mã bãi đỗ (mặc định: tất cả các bãi)
+    
+    Returns:
+        {
+            "period": "day",
+            "date": "2025-11-17",
+            "total_revenue": 150000,
+            "total_transactions": 25,
+            "paid_transactions": 20,
+            "unpaid_transactions": 3,
+            "free_transactions": 2,
+            "average_fee": 6000,
+            "average_duration": 85
+        }
+    """
+    period, start_time, end_time, period_label, error = _revenue_period(request)
+    if error:
+        return error
+    
+    # Truy vấn dữ liệu
+    sessions, error = _filter_by_lot(request, ParkingSession.objects.filter(
+        exit_time__gte=start_time,
+        exit_time__lt=end_time,
+        status='COMPLETED'
+    ))
+    if error:
+        return error
+    
+    # Tính toán thống kê
+    stats = sessions.aggregate(**REVENUE_AGGREGATES)
+    return _revenue_response(period, period_label, start_time, end_time, stats)
+
+
 @require_http_methods(["GET"])
 def revenue_by_day(request):
     """
@@ -123,6 +169,7 @@ def revenue_by_day(request):
     
     Query Parameters:
         - days: số ngày lấy dữ liệu (mặc định: 7)
+        - lot: mã bãi đỗ (mặc định: tất cả các bãi)
     
     Returns:
         {
@@ -137,11 +184,15 @@ def revenue_by_day(request):
     start_date = end_date - timedelta(days=days-1)
     
     # Truy vấn theo ngày
-    daily_stats = ParkingSession.objects.filter(
+    sessions, error = _filter_by_lot(request, ParkingSession.objects.filter(
         exit_time__date__gte=start_date,
         exit_time__date__lte=end_date,
         status='COMPLETED'
-    ).annotate(
+    ))
+    if error:
+        return error
+    
+    daily_stats = sessions.annotate(
         date=TruncDate('exit_time')
     ).values('date').annotate(
         revenue=Sum('fee'),
@@ -183,6 +234,7 @@ def revenue_by_month(request):
     
     Query Parameters:
         - year: năm cần thống kê (mặc định: năm hiện tại)
+        - lot: mã bãi đỗ (mặc định: tất cả các bãi)
     
     Returns:
         {
@@ -194,10 +246,14 @@ def revenue_by_month(request):
     year = int(request.GET.get('year', timezone.localtime().year))
     
     # Truy vấn theo tháng
-    monthly_stats = ParkingSession.objects.filter(
+    sessions, error = _filter_by_lot(request, ParkingSession.objects.filter(
         exit_time__year=year,
         status='COMPLETED'
-    ).annotate(
+    ))
+    if error:
+        return error
+    
+    monthly_stats = sessions.annotate(
         month=TruncMonth('exit_time')
     ).values('month').annotate(
         revenue=Sum('fee'),
@@ -232,6 +288,26 @@ def revenue_by_month(request):
 
 # ==================== API QUẢN LÝ GIAO DỊCH ====================
 
+def _active_session_row(session, current_time, thumbs):
+    # Tính thời gian đỗ hiện tại
+    duration = current_time - timezone.localtime(session.entry_time)
+    duration_minutes = int(duration.total_seconds() / 60)
+    
+    # Tính phí ước tính nếu xe ra ngay
+    estimated_fee = session.calculate_fee(duration_minutes)
+    
+    return {
+        'id': session.id,
+        'license_plate': session.license_plate,
+        'entry_time': timezone.localtime(session.entry_time).strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_minutes': duration_minutes,
+        'estimated_fee': int(estimated_fee),
+        'entry_image': session.entry_image or '',
+        'entry_thumbs': thumbs.get(session.entry_image),
+        'needs_review': session.needs_review
+    }
+
+
 @require_http_methods(["GET"])
 def get_active_sessions(request):
     """
@@ -247,32 +323,21 @@ def get_active_sessions(request):
                     "license_plate": "30A12345",
                     "entry_time": "2025-11-17 08:30:00",
                     "duration_minutes": 45,
-                    "entry_image": "detections/entry_123.jpg"
+                    "entry_image": "detections/entry_123.jpg",
+                    "entry_thumbs": {"sm": "/thumbs/<digest>_sm.webp", "md": "/thumbs/<digest>_md.webp"},
+                    "needs_review": false
                 }
             ]
         }
     """
-    sessions = ParkingSession.objects.filter(status='ACTIVE').order_by('-entry_time')
+    sessions, error = _filter_by_lot(request, ParkingSession.objects.filter(status='ACTIVE'))
+    if error:
+        return error
+    sessions = list(sessions.order_by('-entry_time'))
+    thumbs = thumbnail_urls_for_images(session.entry_image for session in sessions)
     
-    data = []
     current_time = timezone.localtime()
-    
-    for session in sessions:
-        # Tính thời gian đỗ hiện tại
-        duration = current_time - timezone.localtime(session.entry_time)
-        duration_minutes = int(duration.total_seconds() / 60)
-        
-        # Tính phí ước tính nếu xe ra ngay
-        estimated_fee = session.calculate_fee(duration_minutes)
-        
-        data.append({
-            'id': session.id,
-            'license_plate': session.license_plate,
-            'entry_time': timezone.localtime(session.entry_time).strftime('%Y-%m-%d %H:%M:%S'),
-            'duration_minutes': duration_minutes,
-            'estimated_fee': int(estimated_fee),
-            'entry_image': session.entry_image or ''
-        })
+    data = [_active_session_row(session, current_time, thumbs) for session in sessions]
     
     return JsonResponse({
         'success': True,
@@ -320,8 +385,11 @@ def get_session_detail(request, session_id):
         'status': session.status,
         'status_display': session.get_status_display(),
         'entry_image': session.entry_image or '',
-        'exit_image': session.exit_image or ''
+        'exit_image': session.exit_image or '',
     }
+    thumbs = thumbnail_urls_for_images([session.entry_image, session.exit_image])
+    data['entry_thumbs'] = thumbs.get(session.entry_image)
+    data['exit_thumbs'] = thumbs.get(session.exit_image)
     
     return JsonResponse({
         'success': True,
@@ -329,13 +397,13 @@ def get_session_detail(request, session_id):
     })
 
 
-@csrf_exempt
+@login_required
 @require_http_methods(["POST"])
 def mark_session_paid(request, session_id):
     """
     Đánh dấu giao dịch đã thanh toán
     
-    POST /api/sessions/<id>/pay/
+    POST /api/sessions/<id>/pay/  (cần đăng nhập, gửi kèm header X-CSRFToken)
     Body: {} (không cần data)
     
     Returns:
@@ -346,35 +414,190 @@ def mark_session_paid(request, session_id):
         }
     """
     try:
-        session = ParkingSession.objects.get(id=session_id)
-    except ParkingSession.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'Giao dịch không tồn tại'}, status=404)
+        result = settle(session_ids=[session_id], cashier=request.user)['results'][0]
+    except SettlementError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
     
     # Kiểm tra trạng thái
-    if session.status != 'COMPLETED':
-        return JsonResponse({'success': False, 'error': 'Chỉ thanh toán được giao dịch đã hoàn thành'}, status=400)
+    errors = {
+        'not_found': ('Giao dịch không tồn tại', 404),
+        'not_completed': ('Chỉ thanh toán được giao dịch đã hoàn thành', 400),
+        'already_paid': ('Giao dịch đã được thanh toán rồi', 400),
+        'free': ('Giao dịch miễn phí không cần thanh toán', 400),
+    }
+    if result['outcome'] in errors:
+        error, status = errors[result['outcome']]
+        return JsonResponse({'success': False, 'error': error}, status=status)
+    
+    return JsonResponse({
+        'success': True,
+        'message': 'Đã thanh toán thành công',
+        'session': {
+            'id': result['id'],
+            'license_plate': result['license_plate'],
+            'fee': result['fee'],
+            'payment_status': 'PAID'
+        }
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def settle_sessions(request):
+    """
+    Thu tiền nhiều giao dịch trong một yêu cầu (cuối ca, khách đoàn xe) - xem parking/payments.py
+    
+    POST /api/sessions/settle/?lot=<mã bãi>  (cần đăng nhập, gửi kèm header X-CSRFToken)
+    Body: {"session_ids": [1, 2, 3], "method": "CASH"}
+       hoặc {"license_plate": "30A12345"}  # mọi giao dịch chưa thanh toán của xe
+    
+    Returns:
+        {
+            "success": true,
+            "batch": "6f1c...",
+            "paid_count": 2,
+            "paid_amount": 13000,
+            "results": [{"id": 1, "license_plate": "30A12345", "fee": 5000, "outcome": "paid"}, ...]
+        }
+        outcome: paid / already_paid / free / not_completed / not_found
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Dữ liệu không hợp lệ'}, status=400)
     
-    if session.payment_status == 'PAID':
-        return JsonResponse({'success': False, 'error': 'Giao dịch đã được thanh toán rồi'}, status=400)
+    lot, error = lot_from_request(request)
+    if error:
+        return JsonResponse({'success': False, 'error': error}, status=404)
     
-    if session.payment_status == 'FREE':
-        return JsonResponse({'success': False, 'error': 'Giao dịch miễn phí không cần thanh toán'}, status=400)
+    try:
+        result = settle(
+            session_ids=data.get('session_ids'),
+            license_plate=data.get('license_plate'),
+            lot=lot,
+            method=data.get('method', 'CASH'),
+            cashier=request.user,
+        )
+    except SettlementError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
+    
+    return JsonResponse({'success': True, **result})
+
+
+@login_required
+@require_http_methods(["GET"])
+def payment_totals(request):
+    """
+    Tiền đã thu trong ca hiện tại / hôm nay (đọc ShiftTotal, không quét giao dịch)
     
-    # Thanh toán
-    session.mark_as_paid()
+    GET /api/payments/totals/?lot=<mã bãi>
+    
+    Returns:
+        {
+            "success": true,
+            "shift": {"start": "2025-11-17 06:00", "end": "2025-11-17 14:00", "count": 12, "amount": 80000,
+                      "cash_amount": 60000, "cashiers": [{"cashier": "thungan1", "count": 8, "amount": 50000, ...}]},
+            "today": {"count": 40, "amount": 250000, "cash_amount": 200000},
+            "mine": {"count": 8, "amount": 50000, "cash_amount": 40000}     # người đang đăng nhập, ca hiện tại
+        }
+    """
+    lot, error = lot_from_request(request)
+    if error:
+        return JsonResponse({'success': False, 'error': error}, status=404)
+    return JsonResponse({'success': True, **collected_totals(lot=lot, cashier=request.user)})
+
+
+class _Echo:
+    """File giả cho csv.writer: trả lại dòng vừa ghi để stream"""
+    def write(self, value):
+        return value
+
+
+@login_required
+@require_http_methods(["GET"])
+def payment_ledger(request):
+    """
+    Xuất sổ thanh toán dạng CSV để đối soát (stream theo lô, không nạp hết vào bộ nhớ) - chỉ quản trị viên
+    
+    Query Parameters:
+        - from, to: 'YYYY-MM-DD' (mặc định: hôm nay)
+        - cashier: tên đăng nhập thu ngân
+        - lot: mã bãi đỗ
+    """
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({'success': False, 'error': 'Chỉ quản trị viên được xuất sổ thanh toán'}, status=403)
+    try:
+        today = timezone.localtime().date()
+        from_date = datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from') else today
+        to_date = datetime.strptime(request.GET['to'], '%Y-%m-%d').date() if request.GET.get('to') else from_date
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Định dạng ngày không hợp lệ. Dùng YYYY-MM-DD'}, status=400)
+    lot, error = lot_from_request(request)
+    if error:
+        return JsonResponse({'success': False, 'error': error}, status=404)
+    
+    start_time = timezone.make_aware(datetime.combine(from_date, datetime.min.time()))
+    end_time = timezone.make_aware(datetime.combine(to_date, datetime.min.time())) + timedelta(days=1)
+    rows = ledger_rows(start_time, end_time, lot=lot, cashier=request.GET.get('cashier') or None)
+    
+    def lines():
+        writer = csv.writer(_Echo())
+        yield writer.writerow(['created_at', 'batch', 'cashier', 'lot', 'license_plate', 'session_id', 'method', 'amount'])
+        for created_at, batch, cashier, lot_code, plate, session_id, method, amount in rows:
+            yield writer.writerow([timezone.localtime(created_at).strftime('%Y-%m-%d %H:%M:%S'), batch, cashier or '',
+                                   lot_code or '', plate, session_id, method, int(amount)])
+    
+    response = StreamingHttpResponse(lines(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="payments_{from_date:%Y%m%d}_{to_date:%Y%m%d}.csv"'
+    return response
+
+
+@login_required
+@require_http_methods(["GET"])
+def vehicle_profile(request, plate):
+    """
+    Hồ sơ xe theo biển số: số lượt, lần cuối, nợ chưa thanh toán (xem parking/profiles.py)
+    
+    GET /api/vehicles/30A12345/
+    
+    Returns:
+        {
+            "success": true,
+            "profile": {"license_plate": "30A12345", "visit_count": 12, "last_seen": "2025-11-17 08:30:00",
+                        "unpaid_count": 2, "outstanding_amount": 13000, "subscription_until": null}
+        }
+    """
+    plate = canonical_form(normalize(plate))
+    profile = profiles.lookup(plate)
+    if profile is None:
+        return JsonResponse({'success': False, 'error': 'Chưa có dữ liệu của xe này'}, status=404)
     
     return JsonResponse({
         'success': True,
-        'message': 'Đã thanh toán thành công',
-        'session': {
-            'id': session.id,
-            'license_plate': session.license_plate,
-            'fee': int(session.fee),
-            'payment_status': session.payment_status
+        'profile': {
+            'license_plate': plate,
+            'visit_count': profile['visit_count'],
+            'last_seen': timezone.localtime(profile['last_seen']).strftime('%Y-%m-%d %H:%M:%S') if profile['last_seen'] else None,
+            'unpaid_count': profile['unpaid_count'],
+            'outstanding_amount': int(profile['outstanding_amount']),
+            'subscription_until': profile['subscription_until'].isoformat() if profile['subscription_until'] else None,
         }
     })
 
 
+def _unpaid_row(session):
+    return {
+        'id': session.id,
+        'license_plate': session.license_plate,
+        'entry_time': timezone.localtime(session.entry_time).strftime('%Y-%m-%d %H:%M:%S'),
+        'exit_time': timezone.localtime(session.exit_time).strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_minutes': session.duration_minutes,
+        'fee': int(session.fee)
+    }
+
+
 @require_http_methods(["GET"])
 def get_unpaid_sessions(request):
     """
@@ -388,24 +611,20 @@ def get_unpaid_sessions(request):
             "sessions": [...]
         }
     """
-    sessions = ParkingSession.objects.filter(
+    sessions, error = _filter_by_lot(request, ParkingSession.objects.filter(
         status='COMPLETED',
         payment_status='UNPAID'
-    ).order_by('-exit_time')
+    ))
+    if error:
+        return error
+    sessions = sessions.order_by('-exit_time')
     
     data = []
     total_debt = 0
     
     for session in sessions:
         total_debt += session.fee
-        data.append({
-            'id': session.id,
-            'license_plate': session.license_plate,
-            'entry_time': timezone.localtime(session.entry_time).strftime('%Y-%m-%d %H:%M:%S'),
-            'exit_time': timezone.localtime(session.exit_time).strftime('%Y-%m-%d %H:%M:%S'),
-            'duration_minutes': session.duration_minutes,
-            'fee': int(session.fee)
-        })
+        data.append(_unpaid_row(session))
     
     return JsonResponse({
         'success': True,
@@ -417,6 +636,62 @@ def get_unpaid_sessions(request):
 
 # ==================== API LỊCH SỬ GIAO DỊCH ====================
 
+def _history_page(request):
+    return int(request.GET.get('page', 1)), int(request.GET.get('limit', 20))
+
+
+def _apply_history_filters(request, queryset):
+    """Các filter của API lịch sử (chỉ dựng queryset, không truy vấn - dùng chung với bản async)"""
+    license_plate = request.GET.get('license_plate')
+    if license_plate:
+        queryset = queryset.filter(license_plate__icontains=license_plate)
+    
+    payment_status = request.GET.get('payment_status')
+    if payment_status:
+        queryset = queryset.filter(payment_status=payment_status)
+    
+    from_date = request.GET.get('from_date')
+    if from_date:
+        try:
+            from_dt = datetime.strptime(from_date, '%Y-%m-%d')
+            queryset = queryset.filter(exit_time__gte=timezone.make_aware(from_dt))
+        except ValueError:
+            pass
+    
+    to_date = request.GET.get('to_date')
+    if to_date:
+        try:
+            to_dt = datetime.strptime(to_date, '%Y-%m-%d') + timedelta(days=1)
+            queryset = queryset.filter(exit_time__lt=timezone.make_aware(to_dt))
+        except ValueError:
+            pass
+    return queryset
+
+
+def _history_row(session):
+    return {
+        'id': session.id,
+        'license_plate': session.license_plate,
+        'entry_time': timezone.localtime(session.entry_time).strftime('%Y-%m-%d %H:%M:%S'),
+        'exit_time': timezone.localtime(session.exit_time).strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_minutes': session.duration_minutes,
+        'fee': int(session.fee),
+        'payment_status': session.payment_status,
+        'payment_status_display': session.get_payment_status_display()
+    }
+
+
+def _history_response(page, limit, total, data):
+    return JsonResponse({
+        'success': True,
+        'page': page,
+        'limit': limit,
+        'total': total,
+        'total_pages': (total + limit - 1) // limit,
+        'sessions': data
+    })
+
+
 @require_http_methods(["GET"])
 def get_transaction_history(request):
     """
@@ -429,6 +704,7 @@ def get_transaction_history(request):
         - payment_status: PAID, UNPAID, FREE
         - from_date: YYYY-MM-DD
         - to_date: YYYY-MM-DD
+        - lot: mã bãi đỗ
     
     Returns:
         {
@@ -439,36 +715,13 @@ def get_transaction_history(request):
             "sessions": [...]
         }
     """
-    page = int(request.GET.get('page', 1))
-    limit = int(request.GET.get('limit', 20))
+    page, limit = _history_page(request)
     
     # Base query
-    queryset = ParkingSession.objects.filter(status='COMPLETED')
-    
-    # Filters
-    license_plate = request.GET.get('license_plate')
-    if license_plate:
-        queryset = queryset.filter(license_plate__icontains=license_plate)
-    
-    payment_status = request.GET.get('payment_status')
-    if payment_status:
-        queryset = queryset.filter(payment_status=payment_status)
-    
-    from_date = request.GET.get('from_date')
-    if from_date:
-        try:
-            from_dt = datetime.strptime(from_date, '%Y-%m-%d')
-            queryset = queryset.filter(exit_time__gte=timezone.make_aware(from_dt))
-        except ValueError:
-            pass
-    
-    to_date = request.GET.get('to_date')
-    if to_date:
-        try:
-            to_dt = datetime.strptime(to_date, '%Y-%m-%d') + timedelta(days=1)
-            queryset = queryset.filter(exit_time__lt=timezone.make_aware(to_dt))
-        except ValueError:
-            pass
+    queryset, error = _filter_by_lot(request, ParkingSession.objects.filter(status='COMPLETED'))
+    if error:
+        return error
+    queryset = _apply_history_filters(request, queryset)
     
     # Count total
     total = queryset.count()
@@ -476,26 +729,290 @@ def get_transaction_history(request):
     # Pagination
     start = (page - 1) * limit
     end = start + limit
-    sessions = queryset.order_by('-exit_time')[start:end]
+    data = [_history_row(session) for session in queryset.order_by('-exit_time')[start:end]]
+    return _history_response(page, limit, total, data)
+
+
+
+# ==================== API NHIỀU BÃI ĐỖ ====================
+
+@require_http_methods(["GET"])
+def lots_summary(request):
+    """
+    Báo cáo tổng hợp tất cả các bãi (1 truy vấn gom nhóm theo bãi)
     
-    data = []
-    for session in sessions:
-        data.append({
-            'id': session.id,
-            'license_plate': session.license_plate,
-            'entry_time': timezone.localtime(session.entry_time).strftime('%Y-%m-%d %H:%M:%S'),
-            'exit_time': timezone.localtime(session.exit_time).strftime('%Y-%m-%d %H:%M:%S'),
-            'duration_minutes': session.duration_minutes,
-            'fee': int(session.fee),
-            'payment_status': session.payment_status,
-            'payment_status_display': session.get_payment_status_display()
-        })
+    Query Parameters:
+        - date: 'YYYY-MM-DD' - ngày tính doanh thu (mặc định: hôm nay)
+    
+    Returns:
+        {
+            "success": true,
+            "date": "2025-11-17",
+            "lots": [
+                {
+                    "code": "default",
+                    "name": "Bãi đỗ chính",
+                    "capacity": 6,
+                    "occupied": 2,
+                    "revenue": 50000,
+                    "transactions": 10,
+                    "unpaid_count": 1,
+                    "unpaid_amount": 5000
+                }
+            ],
+            "totals": {...}
+        }
+    """
+    date_str = request.GET.get('date')
+    if date_str:
+        try:
+            target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return JsonResponse({'error': 'Định dạng ngày không hợp lệ. Dùng YYYY-MM-DD'}, status=400)
+    else:
+        target_date = timezone.localtime().date()
+    
+    start_time = timezone.make_aware(datetime.combine(target_date, datetime.min.time()))
+    end_time = start_time + timedelta(days=1)
+    day_filter = Q(status='COMPLETED', exit_time__gte=start_time, exit_time__lt=end_time)
+    unpaid_filter = Q(status='COMPLETED', payment_status='UNPAID')
+    
+    stats = {
+        row['lot']: row
+        for row in ParkingSession.objects.values('lot').annotate(
+            occupied=Count('id', filter=Q(status='ACTIVE')),
+            revenue=Sum('fee', filter=day_filter),
+            transactions=Count('id', filter=day_filter),
+            unpaid_count=Count('id', filter=unpaid_filter),
+            unpaid_amount=Sum('fee', filter=unpaid_filter),
+        ).order_by()
+    }
+    
+    lots = []
+    totals = {'capacity': 0, 'occupied': 0, 'revenue': 0, 'transactions': 0, 'unpaid_count': 0, 'unpaid_amount': 0}
+    for lot in Lot.objects.filter(is_active=True):
+        row = stats.get(lot.id, {})
+        item = {
+            'code': lot.code,
+            'name': lot.name,
+            'capacity': lot.capacity,
+            'occupied': row.get('occupied', 0),
+            'revenue': int(row.get('revenue') or 0),
+            'transactions': row.get('transactions', 0),
+            'unpaid_count': row.get('unpaid_count', 0),
+            'unpaid_amount': int(row.get('unpaid_amount') or 0),
+        }
+        lots.append(item)
+        for key in totals:
+            totals[key] += item[key]
     
     return JsonResponse({
         'success': True,
-        'page': page,
-        'limit': limit,
-        'total': total,
-        'total_pages': (total + limit - 1) // limit,
-        'sessions': data
+        'date': target_date.strftime('%Y-%m-%d'),
+        'lots': lots,
+        'totals': totals
+    })
+
+
+
+# ==================== API PHÂN TÍCH LƯỢNG XE ====================
+
+def _analytics_params(request):
+    """
+    Đọc ?start=&end= (YYYY-MM-DD, mặc định 7 ngày gần nhất), ?bucket= (phút) và ?lot=
+
+    Returns:
+        tuple: (params, error_response)
+    """
+    today = timezone.localtime().date()
+    try:
+        end_date = datetime.strptime(request.GET['end'], '%Y-%m-%d').date() if request.GET.get('end') else today
+        start_date = (datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if request.GET.get('start')
+                      else end_date - timedelta(days=6))
+        bucket = int(request.GET.get('bucket', 15))
+    except ValueError:
+        return None, JsonResponse({'success': False, 'error': 'Tham số không hợp lệ. Ngày dùng YYYY-MM-DD'}, status=400)
+    if bucket not in analytics.BUCKET_CHOICES:
+        return None, JsonResponse({'success': False, 'error': f'bucket phải là một trong {list(analytics.BUCKET_CHOICES)}'},
+                                  status=400)
+    if start_date > end_date or (end_date - start_date).days >= analytics.MAX_DAYS:
+        return None, JsonResponse({'success': False, 'error': f'Khoảng ngày không hợp lệ (tối đa {analytics.MAX_DAYS} ngày)'},
+                                  status=400)
+    end_date = min(end_date, today)
+    start_date = min(start_date, end_date)
+
+    lot, error = lot_from_request(request)
+    if error:
+        return None, JsonResponse({'success': False, 'error': error}, status=404)
+    return {'start': start_date, 'end': end_date, 'bucket': bucket, 'lot_ids': analytics.lot_ids_for(lot)}, None
+
+
+@require_http_methods(["GET"])
+def occupancy_series(request):
+    """
+    API số xe trong bãi theo khung thời gian (biểu đồ lượng xe, bố trí nhân viên)
+
+    Query Parameters:
+        - start, end: 'YYYY-MM-DD' (mặc định: 7 ngày gần nhất)
+        - bucket: độ dài khung, phút - 5/15/30/60 (mặc định: 15)
+        - lot: mã bãi đỗ (mặc định: tất cả các bãi)
+
+    Returns:
+        {
+            "labels": ["2025-11-17 00:00", ...],
+            "occupancy": [3, ...],      # số xe đầu khung
+            "peak": [5, ...],           # số xe lớn nhất trong khung
+            "arrivals": [2, ...],
+            "departures": [1, ...]
+        }
+    """
+    params, error = _analytics_params(request)
+    if error:
+        return error
+    series = analytics.day_series(params['lot_ids'], params['start'], params['end'])
+    factor = params['bucket'] // analytics.BASE_BUCKET
+
+    labels, occupancy, peak, arrivals, departures = [], [], [], [], []
+    for day, data in sorted(series.items()):
+        labels.extend(f"{day:%Y-%m-%d} {minute // 60:02d}:{minute % 60:02d}"
+                      for minute in range(0, 24 * 60, params['bucket']))
+        occupancy.extend(analytics.resample(data['occupancy'], factor, 'first'))
+        peak.extend(analytics.resample(data['peak'], factor, 'max'))
+        arrivals.extend(analytics.resample(data['arrivals'], factor, 'sum'))
+        departures.extend(analytics.resample(data['departures'], factor, 'sum'))
+
+    return JsonResponse({
+        'success': True,
+        'bucket': params['bucket'],
+        'labels': labels,
+        'occupancy': occupancy,
+        'peak': peak,
+        'arrivals': arrivals,
+        'departures': departures,
+    })
+
+
+@require_http_methods(["GET"])
+def dwell_histogram(request):
+    """
+    API phân bố thời lượng đỗ của các xe ra trong khoảng ngày
+
+    Query Parameters:
+        - start, end, lot: như occupancy_series
+
+    Returns:
+        {
+            "labels": ["0-15", "15-30", ..., "1440+"],   # phút
+            "counts": [12, 30, ...]
+        }
+    """
+    params, error = _analytics_params(request)
+    if error:
+        return error
+    series = analytics.day_series(params['lot_ids'], params['start'], params['end'])
+    counts = [0] * len(analytics.DWELL_BINS)
+    for data in series.values():
+        counts = [a + b for a, b in zip(counts, data['dwell'])]
+
+    return JsonResponse({
+        'success': True,
+        'labels': analytics.dwell_labels(),
+        'counts': counts,
+    })
+
+
+@require_http_methods(["GET"])
+def peak_load(request):
+    """
+    API giờ cao điểm: số xe lớn nhất từng ngày và lượng xe trung bình theo giờ trong ngày
+
+    Query Parameters:
+        - start, end, lot: như occupancy_series
+
+    Returns:
+        {
+            "days": [{"date": "2025-11-17", "peak": 6, "time": "08:15"}, ...],
+            "hourly": {"labels": ["00:00", ...], "average": [1.5, ...], "peak": [3, ...]}
+        }
+    """
+    params, error = _analytics_params(request)
+    if error:
+        return error
+    series = analytics.day_series(params['lot_ids'], params['start'], params['end'])
+    factor = 60 // analytics.BASE_BUCKET
+
+    days = []
+    hourly_average = [0.0] * 24
+    hourly_peak = [0] * 24
+    for day, data in sorted(series.items()):
+        peak = max(data['peak'])
+        index = data['peak'].index(peak)
+        minute = index * analytics.BASE_BUCKET
+        days.append({'date': day.strftime('%Y-%m-%d'), 'peak': peak, 'time': f'{minute // 60:02d}:{minute % 60:02d}'})
+        average = [sum(values) / factor for values in zip(*[iter(data['occupancy'])] * factor)]
+        hourly_average = [a + b for a, b in zip(hourly_average, average)]
+        hourly_peak = [max(a, b) for a, b in zip(hourly_peak, analytics.resample(data['peak'], factor, 'max'))]
+
+    return JsonResponse({
+        'success': True,
+        'days': days,
+        'hourly': {
+            'labels': [f'{hour:02d}:00' for hour in range(24)],
+            'average': [round(value / max(len(days), 1), 2) for value in hourly_average],
+            'peak': hourly_peak,
+        },
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def tariff_simulation(request):
+    """
+    Mô phỏng doanh thu các phiên đã hoàn thành theo biểu phí khác + dự báo (xem parking/tariffs.py) - chỉ quản trị viên
+
+    Gửi kèm header X-CSRFToken như các form POST khác.
+
+    POST /api/analytics/tariff-simulation/?lot=<mã bãi>
+    Body: {
+        "start": "2025-01-01", "end": "2025-11-17",     # mặc định: 30 ngày gần nhất
+        "tariff": {"BASE_FEE": 6000, "UNIT_FEE": 4000}, # khóa thiếu lấy theo biểu phí hiện tại
+        "forecast_days": 14
+    }
+
+    Returns:
+        {
+            "success": true,
+            "tariff": {...},
+            "simulation": {"sessions": ..., "current": ..., "simulated": ..., "delta": ..., "ratio": ...,
+                           "days": [{"label": "2025-01-01", "sessions", "current", "simulated", "delta"}],
+                           "durations": [{"label": "0-15", ...}]},
+            "forecast": [{"date": "2025-11-18", "baseline": 50000, "simulated": 60000}]
+        }
+    """
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({'success': False, 'error': 'Chỉ quản trị viên được mô phỏng biểu phí'}, status=403)
+    try:
+        data = json.loads(request.body or b'{}')
+        today = timezone.localtime().date()
+        end_date = datetime.strptime(data['end'], '%Y-%m-%d').date() if data.get('end') else today
+        start_date = (datetime.strptime(data['start'], '%Y-%m-%d').date() if data.get('start')
+                      else end_date - timedelta(days=29))
+        forecast_days = int(data.get('forecast_days', 14))
+        tariff = tariffs.parse_tariff(data.get('tariff') or {})
+    except (ValueError, TypeError, AttributeError) as e:
+        return JsonResponse({'success': False, 'error': str(e) or 'Dữ liệu không hợp lệ'}, status=400)
+    if start_date > end_date or not 0 <= forecast_days <= 366:
+        return JsonResponse({'success': False, 'error': 'Khoảng ngày hoặc forecast_days không hợp lệ'}, status=400)
+
+    lot, error = lot_from_request(request)
+    if error:
+        return JsonResponse({'success': False, 'error': error}, status=404)
+    lot_ids = [lot.id] if lot is not None else None
+
+    simulation = tariffs.simulate(tariff, start_date, end_date, lot_ids=lot_ids)
+    return JsonResponse({
+        'success': True,
+        'tariff': tariff,
+        'simulation': simulation,
+        'forecast': tariffs.forecast(forecast_days, lot_ids=lot_ids, ratio=simulation['ratio']),
     })
@@ -4,5 +4,10 @@ from django.apps import AppConfig
 class ParkingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'parking'
-def ready(self):
-        import parking.signals                      
\ No newline at end of file
+
+    def ready(self):
+        from parking.log import apply_level_overrides
+        apply_level_overrides()  # LOG_LEVELS="parking.gate=DEBUG,..."
+
+        import parking.signals  # noqa: F401
+        import parking.tasks  # noqa: F401  (đăng ký tác vụ nền)
@@ -0,0 +1,136 @@
+"""
+Bản async của các API chỉ đọc mà dashboard / quầy thu ngân poll liên tục
+
+Khi chạy dưới ASGI (smartparking/asgi.py), view sync được handler đẩy sang
+thread qua sync_to_async: mỗi request một lần chuyển thread và số request
+đồng thời bị giới hạn bởi thread pool. Các view dưới đây dùng ORM async
+(aaggregate, acount, aiterator, afirst) nên chạy thẳng trên event loop,
+chỉ phần truy vấn SQL đi qua thread của kết nối database.
+
+Cùng tham số, cùng JSON với bản sync (dùng chung các hàm dựng queryset /
+serialize trong api_views.py và views.py). parking/urls.py trỏ các URL sang
+bản async khi settings.ASYNC_READ_API = True - bật khi chạy ASGI (uvicorn,
+daphne); dưới WSGI giữ bản sync. So sánh thông lượng hai bản:
+python manage.py bench --scenario poll
+"""
+
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods
+
+from .api_views import (
+    REVENUE_AGGREGATES, _active_session_row, _apply_history_filters, _history_page, _history_response,
+    _history_row, _revenue_period, _revenue_response, _unpaid_row,
+)
+from .lots import alot_from_request
+from .models import ParkingSession, VehicleDetection
+from .thumbnails import athumbnail_urls_for_images
+from .views import _detection_row
+
+
+async def _afilter_by_lot(request, queryset):
+    """Bản async của api_views._filter_by_lot"""
+    lot, error = await alot_from_request(request)
+    if error:
+        return None, JsonResponse({'success': False, 'error': error}, status=404)
+    if lot is not None:
+        queryset = queryset.filter(lot=lot)
+    return queryset, None
+
+
+@require_http_methods(["GET"])
+async def revenue_statistics(request):
+    """Như api_views.revenue_statistics"""
+    period, start_time, end_time, period_label, error = _revenue_period(request)
+    if error:
+        return error
+    sessions, error = await _afilter_by_lot(request, ParkingSession.objects.filter(
+        exit_time__gte=start_time,
+        exit_time__lt=end_time,
+        status='COMPLETED'
+    ))
+    if error:
+        return error
+    stats = await sessions.aaggregate(**REVENUE_AGGREGATES)
+    return _revenue_response(period, period_label, start_time, end_time, stats)
+
+
+@require_http_methods(["GET"])
+async def get_active_sessions(request):
+    """Như api_views.get_active_sessions"""
+    sessions, error = await _afilter_by_lot(request, ParkingSession.objects.filter(status='ACTIVE'))
+    if error:
+        return error
+    sessions = [session async for session in sessions.order_by('-entry_time').aiterator()]
+    thumbs = await athumbnail_urls_for_images(session.entry_image for session in sessions)
+
+    current_time = timezone.localtime()
+    data = [_active_session_row(session, current_time, thumbs) for session in sessions]
+    return JsonResponse({
+        'success': True,
+        'count': len(data),
+        'sessions': data
+    })
+
+
+@require_http_methods(["GET"])
+async def get_unpaid_sessions(request):
+    """Như api_views.get_unpaid_sessions"""
+    sessions, error = await _afilter_by_lot(request, ParkingSession.objects.filter(
+        status='COMPLETED',
+        payment_status='UNPAID'
+    ))
+    if error:
+        return error
+
+    data = []
+    total_debt = 0
+    async for session in sessions.order_by('-exit_time').aiterator():
+        total_debt += session.fee
+        data.append(_unpaid_row(session))
+    return JsonResponse({
+        'success': True,
+        'count': len(data),
+        'total_debt': int(total_debt),
+        'sessions': data
+    })
+
+
+@require_http_methods(["GET"])
+async def get_transaction_history(request):
+    """Như api_views.get_transaction_history"""
+    page, limit = _history_page(request)
+    queryset, error = await _afilter_by_lot(request, ParkingSession.objects.filter(status='COMPLETED'))
+    if error:
+        return error
+    queryset = _apply_history_filters(request, queryset)
+
+    total = await queryset.acount()
+    start = (page - 1) * limit
+    data = [_history_row(session) async for session in queryset.order_by('-exit_time')[start:start + limit]]
+    return _history_response(page, limit, total, data)
+
+
+@login_required
+async def latest_detections(request):
+    """Như views.latest_detections"""
+    try:
+        lot, error = await alot_from_request(request)
+        if error:
+            return JsonResponse({'success': False, 'message': error}, status=404)
+
+        detections = VehicleDetection.objects.all()
+        if lot is not None:
+            detections = detections.filter(lot=lot)
+        history = [_detection_row(det) async for det in detections.order_by('-detected_at')[:20]]
+        return JsonResponse({
+            'success': True,
+            'latest': history[0] if history else None,
+            'history': history
+        })
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'message': str(e)
+        }, status=500)
@@ -0,0 +1,389 @@
+"""
+Bộ benchmark cho các luồng nóng của hệ thống
+
+Kịch bản:
+    ingest     - xe vào/ra liên tục qua /api/upload/ (ENTRY/EXIT churn)
+    stream     - N camera đẩy frame vào /api/stream/<src>, M viewer xem /video_feed/<src>
+    dashboard  - polling tất cả API thống kê/giao dịch trong api_views
+    poll       - nhiều client poll đồng thời các API chỉ đọc qua handler ASGI,
+                 lần lượt với bản sync và bản async (parking/async_views.py)
+
+Chạy trong process bằng Django test client (database test riêng, đo được số
+truy vấn SQL) hoặc bắn vào server đang chạy qua HTTP (--url). Kết quả
+(p50/p95/p99, throughput, số query) lưu ra JSON để so sánh với baseline.
+Dùng qua lệnh: python manage.py bench (parking/management/commands/bench.py)
+"""
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .device_auth import compute_signature
+
+
+DASHBOARD_ENDPOINTS = [
+    '/api/revenue/stats/?period=day',
+    '/api/revenue/stats/?period=month',
+    '/api/revenue/daily/?days=30',
+    '/api/revenue/monthly/',
+    '/api/sessions/active/',
+    '/api/sessions/unpaid/',
+    '/api/sessions/history/?page=1&limit=20',
+    '/api/lots/summary/',
+    '/api/latest_detections/',
+]
+
+
+# ==================== ĐO LƯỜNG ====================
+
+def percentile(sorted_values, pct):
+    """Percentile theo nearest-rank trên danh sách đã sắp xếp"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Gom latency/số query/lỗi theo từng nhãn (endpoint hoặc thao tác)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, label, seconds, queries=None, ok=True):
+        with self._lock:
+            sample = self.samples.setdefault(label, {'latencies': [], 'queries': [], 'errors': 0})
+            sample['latencies'].append(seconds)
+            if queries is not None:
+                sample['queries'].append(queries)
+            if not ok:
+                sample['errors'] += 1
+
+    def summary(self, elapsed):
+        result = {}
+        for label, sample in sorted(self.samples.items()):
+            latencies = sorted(sample['latencies'])
+            queries = sample['queries']
+            result[label] = {
+                'requests': len(latencies),
+                'errors': sample['errors'],
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+                'avg_queries': round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        return result
+
+
+# ==================== CLIENT ====================
+
+class InProcessClient:
+    """Django test client - đếm được số truy vấn SQL của từng request"""
+
+    def __init__(self, user=None):
+        self._local = threading.local()
+        self.user = user
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            from django.test import Client
+            client = self._local.client = Client()
+            if self.user is not None:
+                client.force_login(self.user)
+        return client
+
+    def request(self, method, path, body=b'', content_type=None, headers=None):
+        extra = {f"HTTP_{k.upper().replace('-', '_')}": v for k, v in (headers or {}).items()}
+        with CaptureQueriesContext(connection) as ctx:
+            if method == 'GET':
+                response = self.client.get(path, **extra)
+            else:
+                response = self.client.generic(method, path, body, content_type=content_type, **extra)
+        return response.status_code, len(ctx.captured_queries), response
+
+    def close(self):
+        connection.close()
+
+
+class HttpClient:
+    """Gửi request tới server đang chạy (không đếm được số query)"""
+
+    def __init__(self, base_url, session_cookie=None):
+        self.base_url = base_url.rstrip('/')
+        self.session_cookie = session_cookie
+
+    def request(self, method, path, body=b'', content_type=None, headers=None):
+        req = urllib.request.Request(self.base_url + path, data=body if method != 'GET' else None, method=method)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        if self.session_cookie:
+            req.add_header('Cookie', f'sessionid={self.session_cookie}')
+        for key, value in (headers or {}).items():
+            req.add_header(key, value)
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                response.read()
+                return response.status, None, response
+        except urllib.error.HTTPError as e:
+            return e.code, None, e
+
+    def close(self):
+        pass
+
+
+def _signed_headers(device, body):
+    if device is None:
+        return {}
+    device_id, secret_key = device
+    timestamp = str(int(time.time()))
+    return {
+        'X-Device-Id': device_id,
+        'X-Timestamp': timestamp,
+        'X-Signature': compute_signature(secret_key, device_id, timestamp, body),
+    }
+
+
+# ==================== KỊCH BẢN ====================
+
+def run_ingest(client, recorder, iterations=200, plates=50, concurrency=4, device=None, seed=42):
+    """
+    ENTRY/EXIT liên tục: mỗi biển số lần lượt vào rồi ra
+
+    device: (device_id, secret_key) để ký request (None nếu server không bắt buộc ký)
+    """
+    rng = random.Random(seed)
+    pool = [f'{rng.randint(11, 99)}A{rng.randint(10000, 99999)}' for _ in range(plates)]
+
+    def one(i):
+        plate = pool[i % plates]
+        body = encode_multipart(BOUNDARY, {'plate': plate, 'confidence': '0.95'})
+        started = time.perf_counter()
+        status, queries, _ = client.request('POST', '/api/upload/', body, MULTIPART_CONTENT,
+                                            _signed_headers(device, body))
+        recorder.add('POST /api/upload/', time.perf_counter() - started, queries, status == 200)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(iterations)))
+
+
+def run_stream(client, recorder, cameras=4, viewers=4, frames=60, frame_bytes=50_000, viewer_frames=10,
+               devices=None):
+    """
+    N camera đẩy frame (~30 fps) song song với M viewer đọc MJPEG
+
+    devices: {camera_id: secret_key} để ký request (None nếu server không bắt buộc ký)
+    """
+    frame = b'\xff\xd8' + bytes(frame_bytes - 4) + b'\xff\xd9'
+
+    def camera(index):
+        camera_id = f'bench_cam_{index}'
+        for _ in range(frames):
+            headers = _signed_headers((camera_id, devices[camera_id]), frame) if devices else {}
+            started = time.perf_counter()
+            status, queries, _ = client.request('POST', f'/api/stream/{camera_id}', frame, 'image/jpeg', headers)
+            label = 'POST /api/stream/<src> (throttled)' if status == 429 else 'POST /api/stream/<src>'
+            recorder.add(label, time.perf_counter() - started, queries, status in (200, 429))
+            time.sleep(1 / 30)
+        client.close()
+
+    def viewer(index):
+        camera_id = f'bench_cam_{index % cameras}'
+        if not isinstance(client, InProcessClient):
+            return
+        started = time.perf_counter()
+        response = client.client.get(f'/video_feed/{camera_id}')
+        received = 0
+        first_frame_at = None
+        for chunk in response.streaming_content:
+            if first_frame_at is None:
+                first_frame_at = time.perf_counter()
+                recorder.add('GET /video_feed/<src> first frame', first_frame_at - started)
+            received += 1
+            if received >= viewer_frames:
+                break
+        response.close()
+        if first_frame_at is not None and received > 1:
+            recorder.add('GET /video_feed/<src> frame interval',
+                         (time.perf_counter() - first_frame_at) / (received - 1))
+        client.close()
+
+    with ThreadPoolExecutor(max_workers=cameras + viewers) as executor:
+        futures = [executor.submit(camera, i) for i in range(cameras)]
+        time.sleep(0.2)   # để camera có frame đầu tiên
+        futures += [executor.submit(viewer, i) for i in range(viewers)]
+        for future in futures:
+            future.result()
+
+
+def run_dashboard(client, recorder, rounds=20, concurrency=4, endpoints=None):
+    """Polling đồng thời tất cả API dashboard"""
+    endpoints = endpoints or DASHBOARD_ENDPOINTS
+
+    def one(i):
+        path = endpoints[i % len(endpoints)]
+        started = time.perf_counter()
+        status, queries, _ = client.request('GET', path)
+        recorder.add(f"GET {path.split('?')[0]}", time.perf_counter() - started, queries, status == 200)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(rounds * len(endpoints))))
+
+
+POLL_ENDPOINTS = [
+    '/api/revenue/stats/?period=day',
+    '/api/sessions/active/',
+    '/api/sessions/unpaid/',
+    '/api/sessions/history/?page=1&limit=20',
+    '/api/latest_detections/',
+]
+
+
+async def _asgi_get(app, path, cookie=None):
+    """Gửi một request GET thẳng vào ứng dụng ASGI (không qua mạng)"""
+    path, _, query = path.partition('?')
+    headers = [(b'host', b'testserver')]
+    if cookie:
+        headers.append((b'cookie', f'sessionid={cookie}'.encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': headers, 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Client không ngắt kết nối: handler hủy tác vụ chờ này khi trả xong response
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+def run_poll(recorder, use_async, rounds=20, concurrency=64, cookie=None, endpoints=None):
+    """
+    `concurrency` client poll đồng thời POLL_ENDPOINTS qua handler ASGI (chạy trong process)
+
+    use_async: True - URL trỏ tới parking/async_views.py, False - bản sync
+    """
+    from django.core.asgi import get_asgi_application
+    from django.test.utils import override_settings
+
+    from .urls import read_api_patterns
+
+    endpoints = endpoints or POLL_ENDPOINTS
+    urlconf = type('PollUrlConf', (), {'urlpatterns': read_api_patterns(use_async)})
+    app = get_asgi_application()
+
+    async def poller(index):
+        for i in range(rounds):
+            path = endpoints[(index + i) % len(endpoints)]
+            started = time.perf_counter()
+            status = await _asgi_get(app, path, cookie)
+            elapsed = time.perf_counter() - started
+            recorder.add(f"GET {path.split('?')[0]}", elapsed, None, status == 200)
+            recorder.add('(tất cả)', elapsed, None, status == 200)
+
+    async def main():
+        await asyncio.gather(*(poller(index) for index in range(concurrency)))
+
+    with override_settings(ROOT_URLCONF=urlconf):
+        asyncio.run(main())
+
+
+SCENARIOS = {
+    'ingest': run_ingest,
+    'stream': run_stream,
+    'dashboard': run_dashboard,
+    'poll': run_poll,
+}
+
+
+# ==================== DỮ LIỆU MẪU (IN-PROCESS) ====================
+
+def seed_sessions(count=2000, seed=42):
+    """Tạo sẵn phiên đỗ xe để các API dashboard có dữ liệu để quét"""
+    from .lots import get_default_lot
+    from .models import ParkingSession, VehicleDetection
+
+    rng = random.Random(seed)
+    lot = get_default_lot()
+    now = timezone.now()
+    sessions = []
+    detections = []
+    for i in range(count):
+        entry_time = now - timedelta(minutes=rng.randint(10, 60 * 24 * 60))
+        plate = f'{rng.randint(11, 99)}B{rng.randint(10000, 99999)}'
+        session = ParkingSession(license_plate=plate, entry_time=entry_time, lot=lot)
+        if i % 20:
+            duration = rng.randint(5, 600)
+            session.status = 'COMPLETED'
+            session.exit_time = entry_time + timedelta(minutes=duration)
+            session.duration_minutes = duration
+            session.fee = session.calculate_fee(duration)
+            session.payment_status = 'PAID' if i % 3 else 'UNPAID'
+        sessions.append(session)
+        detections.append(VehicleDetection(license_plate=plate, confidence=0.9, event_type='ENTRY', lot=lot))
+    ParkingSession.objects.bulk_create(sessions, batch_size=500)
+    VehicleDetection.objects.bulk_create(detections, batch_size=500)
+
+
+# ==================== SO SÁNH BASELINE ====================
+
+def compare(results, baseline, threshold):
+    """
+    So sánh kết quả với baseline
+
+    Returns:
+        list[str]: các dòng mô tả regression (p95 hoặc số query tăng quá threshold)
+    """
+    regressions = []
+    for scenario, labels in results.get('scenarios', {}).items():
+        for label, current in labels.items():
+            previous = baseline.get('scenarios', {}).get(scenario, {}).get(label)
+            if not previous:
+                continue
+            for metric in ('p95_ms', 'avg_queries'):
+                old, new = previous.get(metric), current.get(metric)
+                if old is None or new is None:
+                    continue
+                # Bỏ qua dao động rất nhỏ (dưới 1ms / dưới 1 query)
+                floor = 1.0
+                if new > old * (1 + threshold) and new - old >= floor:
+                    regressions.append(f'{scenario} {label} {metric}: {old} -> {new}')
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,217 @@
+"""
+Giám sát sức khỏe camera (chạy nền, ngoài request)
+
+Mỗi INTERVAL giây một thread duy nhất trong process xét tất cả camera đã
+từng gửi frame (frame broker trong bộ nhớ + file media/streams/<src>.jpg do
+worker khác ghi):
+    - thời điểm frame cuối, fps và kích thước frame trung bình trong WINDOW giây
+    - số lần nhận diện biển số trong DETECTION_WINDOW giây
+và gán trạng thái:
+    live      frame mới (<= LIVE_MAX_AGE giây) và fps >= MIN_FPS
+    degraded  frame trễ hoặc fps thấp
+    stale     không có frame mới quá STALE_AFTER giây
+
+Viewer (gen_frames) và dashboard đọc trạng thái từ bộ nhớ thay vì tự stat
+file mỗi lần. Khi trạng thái đổi, signal `camera_state_changed` được gửi
+(và `camera_stale` khi camera chuyển sang stale).
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+
+from django.conf import settings
+from django.dispatch import Signal
+
+from .streaming import broker
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAMERA_HEALTH = {
+    'INTERVAL': 1.0,             # giây giữa 2 lần kiểm tra
+    'LIVE_MAX_AGE': 2.0,         # frame cuối cũ hơn -> degraded
+    'STALE_AFTER': 10.0,         # frame cuối cũ hơn -> stale
+    'MIN_FPS': 5.0,              # fps thấp hơn -> degraded
+    'WINDOW': 10.0,              # cửa sổ tính fps / kích thước frame (giây)
+    'DETECTION_WINDOW': 300.0,   # cửa sổ tính tần suất nhận diện (giây)
+    'MAX_EVENTS': 200,
+}
+
+# Gửi kèm: camera_id, old_state, new_state, health (CameraHealth)
+camera_state_changed = Signal()
+camera_stale = Signal()
+
+
+def get_config():
+    config = dict(DEFAULT_CAMERA_HEALTH)
+    config.update(getattr(settings, 'CAMERA_HEALTH', {}))
+    return config
+
+
+@dataclass
+class CameraHealth:
+    camera_id: str
+    state: str = 'unknown'
+    since: float = None                  # thời điểm chuyển sang trạng thái hiện tại
+    last_frame_at: float = None
+    frame_age: float = None
+    fps: float = None                    # None: frame đến từ worker khác, không đo được
+    avg_frame_bytes: int = None
+    detections: int = 0                  # số lần nhận diện trong DETECTION_WINDOW
+    last_detection_at: float = None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class CameraSupervisor:
+    def __init__(self, broker, config=None):
+        self.broker = broker
+        self.config = config or get_config()
+        self._health = {}                # camera_id -> CameraHealth (thay nguyên object, đọc không cần lock)
+        self._samples = {}               # camera_id -> deque[(t, accepted, bytes_in)]
+        self._detections = {}            # camera_id -> deque[t]
+        self._detections_lock = threading.Lock()
+        self.events = deque(maxlen=self.config['MAX_EVENTS'])
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    # ---------- thread nền ----------
+
+    def start(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            thread = threading.Thread(target=self._run, name='camera-supervisor', daemon=True)
+            thread.start()
+            self._started = True
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Camera health check failed')
+            time.sleep(self.config['INTERVAL'])
+
+    # ---------- ghi nhận ----------
+
+    def record_detection(self, camera_id, at=None):
+        """Gọi khi camera nhận diện được một biển số (chỉ thao tác bộ nhớ)"""
+        with self._detections_lock:
+            self._detections.setdefault(camera_id, deque()).append(at or time.time())
+
+    # ---------- đánh giá ----------
+
+    def _camera_ids(self):
+        camera_ids = set(self.broker.stats())
+        try:
+            for filename in os.listdir(self.broker.config['STREAM_DIR']):
+                if filename.endswith('.jpg'):
+                    camera_ids.add(filename[:-4])
+        except OSError:
+            pass
+        return camera_ids
+
+    def check(self, now=None):
+        """Tính lại trạng thái của tất cả camera (thread nền gọi mỗi INTERVAL giây)"""
+        now = now or time.time()
+        config = self.config
+        broker_stats = self.broker.stats()
+
+        for camera_id in self._camera_ids():
+            row = broker_stats.get(camera_id)
+            last_frame_at = row['last_frame_at'] if row else None
+            fps = avg_frame_bytes = None
+
+            if row:
+                samples = self._samples.setdefault(camera_id, deque())
+                samples.append((now, row['accepted'], row['bytes_in']))
+                while len(samples) > 2 and now - samples[0][0] > config['WINDOW']:
+                    samples.popleft()
+                first_t, first_accepted, first_bytes = samples[0]
+                frames = row['accepted'] - first_accepted
+                if now > first_t:
+                    fps = round(frames / (now - first_t), 2)
+                if frames:
+                    avg_frame_bytes = int((row['bytes_in'] - first_bytes) / frames)
+
+            # Frame do worker khác nhận: chỉ biết thời điểm ghi file
+            if last_frame_at is None or now - last_frame_at > config['LIVE_MAX_AGE']:
+                frame_path = os.path.join(self.broker.config['STREAM_DIR'], f'{camera_id}.jpg')
+                try:
+                    stat = os.stat(frame_path)
+                    if last_frame_at is None or stat.st_mtime > last_frame_at:
+                        last_frame_at = stat.st_mtime
+                        avg_frame_bytes = avg_frame_bytes or stat.st_size
+                        fps = None
+                except OSError:
+                    pass
+
+            with self._detections_lock:
+                detections = self._detections.get(camera_id, ())
+                while detections and now - detections[0] > config['DETECTION_WINDOW']:
+                    detections.popleft()
+                detection_count = len(detections)
+                last_detection_at = detections[-1] if detections else None
+
+            frame_age = None if last_frame_at is None else max(0.0, now - last_frame_at)
+            if frame_age is None or frame_age > config['STALE_AFTER']:
+                state = 'stale'
+            elif frame_age > config['LIVE_MAX_AGE'] or (fps is not None and fps < config['MIN_FPS']):
+                state = 'degraded'
+            else:
+                state = 'live'
+
+            previous = self._health.get(camera_id)
+            old_state = previous.state if previous else 'unknown'
+            health = CameraHealth(
+                camera_id=camera_id,
+                state=state,
+                since=previous.since if previous and previous.state == state else now,
+                last_frame_at=last_frame_at,
+                frame_age=None if frame_age is None else round(frame_age, 2),
+                fps=fps,
+                avg_frame_bytes=avg_frame_bytes,
+                detections=detection_count,
+                last_detection_at=last_detection_at,
+            )
+            self._health[camera_id] = health
+
+            if state != old_state:
+                self._on_state_change(camera_id, old_state, health)
+
+    def _on_state_change(self, camera_id, old_state, health):
+        self.events.append({'camera_id': camera_id, 'from': old_state, 'to': health.state, 'at': health.since})
+        if health.state == 'stale':
+            logger.warning('Camera %s is stale (last frame %ss ago)', camera_id, health.frame_age,
+                           extra={'camera_id': camera_id, 'state': health.state})
+        else:
+            logger.info('Camera %s: %s -> %s', camera_id, old_state, health.state,
+                        extra={'camera_id': camera_id, 'state': health.state})
+
+        for signal in (camera_state_changed, camera_stale) if health.state == 'stale' else (camera_state_changed,):
+            signal.send_robust(sender=self.__class__, camera_id=camera_id, old_state=old_state,
+                               new_state=health.state, health=health)
+
+    # ---------- đọc ----------
+
+    def get(self, camera_id):
+        """CameraHealth hiện tại (None nếu camera chưa từng gửi frame)"""
+        return self._health.get(camera_id)
+
+    def state(self, camera_id):
+        health = self._health.get(camera_id)
+        return health.state if health else 'unknown'
+
+    def snapshot(self):
+        return {camera_id: health.as_dict() for camera_id, health in sorted(self._health.items())}
+
+
+supervisor = CameraSupervisor(broker)
@@ -0,0 +1,140 @@
+"""
+Cắt clip video quanh mỗi lần nhận diện biển số (để đối chiếu khi có khiếu nại)
+
+Frame broker giữ ring buffer vài giây frame gần nhất của mỗi camera (xem
+RING_SECONDS trong STREAM_INGEST). Khi có VehicleDetection, gate gọi
+clip_writer.schedule(): yêu cầu được đưa vào queue (không chặn, queue đầy
+thì bỏ qua), một thread nền đợi đủ POST_SECONDS sau sự kiện rồi lấy các
+frame trong [sự kiện - PRE_SECONDS, sự kiện + POST_SECONDS] từ ring buffer,
+ghi tuần tự thành file MJPEG (các JPEG nối liền - xem bằng `ffplay -f mjpeg`)
+vào media/clips/<năm>/<tháng>/ và gắn vào VehicleDetection.clip.
+
+Ring buffer nằm trong bộ nhớ của process nhận frame: khi chạy nhiều worker,
+clip chỉ gồm các frame mà worker hiện tại nhận được.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+from .streaming import broker
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIP_RECORDING = {
+    'ENABLED': True,
+    'PRE_SECONDS': 3.0,
+    'POST_SECONDS': 2.0,
+    'MAX_PENDING': 100,        # số clip chờ ghi tối đa, quá thì bỏ
+    'CLIP_DIR': 'clips',       # thư mục con trong MEDIA_ROOT
+}
+
+
+def get_config():
+    config = dict(DEFAULT_CLIP_RECORDING)
+    config.update(getattr(settings, 'CLIP_RECORDING', {}))
+    return config
+
+
+class ClipWriter:
+    def __init__(self, broker):
+        self.broker = broker
+        self.config = get_config()
+        self._queue = queue.Queue(maxsize=self.config['MAX_PENDING'])
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.skipped = 0
+
+    def start(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            thread = threading.Thread(target=self._run, name='clip-writer', daemon=True)
+            thread.start()
+            self._started = True
+
+    def schedule(self, camera_id, detection_id, event_time=None):
+        """
+        Yêu cầu ghi clip quanh một lần nhận diện (không chặn)
+
+        Returns:
+            bool: False nếu tắt ghi clip hoặc queue đầy
+        """
+        if not self.config['ENABLED']:
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait((camera_id, detection_id, event_time or time.time()))
+            return True
+        except queue.Full:
+            self.skipped += 1
+            logger.warning('Clip queue full, skipping clip for detection #%s', detection_id)
+            return False
+
+    def _run(self):
+        while True:
+            camera_id, detection_id, event_time = self._queue.get()
+            # Các yêu cầu vào theo thứ tự thời gian nên chỉ cần đợi yêu cầu đầu hàng
+            delay = event_time + self.config['POST_SECONDS'] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.write_clip(camera_id, detection_id, event_time)
+            except Exception:
+                logger.exception('Failed to write clip for detection #%s', detection_id)
+
+    def write_clip(self, camera_id, detection_id, event_time):
+        """
+        Ghi frame quanh `event_time` ra file và gắn vào VehicleDetection
+
+        Returns:
+            str | None: đường dẫn clip (tương đối với MEDIA_ROOT), None nếu không có frame
+                hoặc ring buffer không còn giữ frame của lúc đó (sự kiện ghi lại muộn từ journal)
+        """
+        from .models import VehicleDetection
+
+        if event_time - self.config['PRE_SECONDS'] < time.time() - self.broker.config['RING_SECONDS']:
+            self.skipped += 1
+            logger.info('Ring buffer no longer covers detection #%s, skipping clip', detection_id,
+                        extra={'camera_id': camera_id})
+            return None
+
+        frames = self.broker.frames_between(
+            camera_id, event_time - self.config['PRE_SECONDS'], event_time + self.config['POST_SECONDS']
+        )
+        if not frames:
+            self.skipped += 1
+            return None
+
+        month = datetime.fromtimestamp(event_time).strftime('%Y/%m')
+        name = f"{self.config['CLIP_DIR']}/{month}/detection_{detection_id}_{camera_id}.mjpeg"
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Ghi tuần tự vào file tạm rồi replace để không ai đọc được clip dở dang
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for _, frame in frames:
+                f.write(frame)
+        os.replace(temp_path, path)
+
+        VehicleDetection.objects.filter(id=detection_id).update(clip=name)
+        self.written += 1
+        logger.info('Clip for detection #%s: %d frames, %.1fs', detection_id, len(frames),
+                    frames[-1][0] - frames[0][0], extra={'camera_id': camera_id, 'clip': name})
+        return name
+
+    def stats(self):
+        return {'pending': self._queue.qsize(), 'written': self.written, 'skipped': self.skipped}
+
+
+clip_writer = ClipWriter(broker)
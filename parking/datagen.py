@@ -0,0 +1,249 @@
+"""
+Sinh dữ liệu lịch sử giả lập (ParkingSession + VehicleDetection) với quy mô
+thật để đánh giá index, rollup, phân trang
+
+- Biển số theo định dạng Việt Nam (ô tô 30A12345 / 30A1234, xe máy 29Y303658),
+  ưu tiên mã tỉnh "nhà" của bãi
+- Lượt vào theo giờ trong ngày (cao điểm sáng/chiều), theo thứ trong tuần,
+  theo mùa (Tết vắng) và tăng trưởng dần theo thời gian
+- Thời lượng đỗ là hỗn hợp: ghé ngắn, đỗ cả ngày làm việc, đỗ qua đêm
+- Khách quen (pool biển số cố định) quay lại nhiều lần, nhất là giờ đi làm
+- Trạng thái thanh toán PAID / UNPAID / FREE theo tỉ lệ, các ngày gần đây
+  còn nhiều phiên chưa thanh toán; xe chưa ra tính đến `end` là ACTIVE
+
+Dữ liệu được chia thành chunk theo (bãi, ngày). Mỗi chunk có RNG riêng sinh
+từ (seed, mã bãi, ngày) nên kết quả chỉ phụ thuộc vào tham số (không phụ
+thuộc số worker) và các chunk sinh song song được trên nhiều process.
+Dùng qua lệnh: python manage.py generate_parking_data
+"""
+
+import bisect
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, time as time_cls, timedelta
+
+
+# Trọng số lượt vào theo giờ (0h..23h)
+HOURLY_WEIGHTS = [
+    0.2, 0.1, 0.1, 0.1, 0.2, 0.6, 2.0, 5.5, 7.0, 4.5, 3.5, 3.5,
+    4.0, 3.5, 3.5, 3.8, 4.5, 5.5, 6.0, 4.5, 3.0, 2.0, 1.0, 0.5,
+]
+
+# Thứ 2 .. Chủ nhật
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.02, 1.1, 0.85, 0.65]
+
+# Tháng 1..12 (tháng 2 có Tết)
+MONTH_WEIGHTS = [1.05, 0.7, 0.95, 1.0, 1.0, 0.95, 0.95, 0.95, 1.0, 1.0, 1.05, 1.15]
+
+# Mã tỉnh đang dùng trên biển số (bỏ các mã không cấp)
+PROVINCE_CODES = [c for c in range(11, 100) if c not in (13, 42, 44, 45, 46, 87, 91, 96)]
+HOME_PROVINCES = [29, 30, 31, 32, 33, 40]          # Hà Nội
+SERIES_LETTERS = 'ABCDEFGHKLMNPSTUVXYZ'
+
+PAYMENT_MIX = [('PAID', 0.88), ('UNPAID', 0.1), ('FREE', 0.02)]
+RECENT_PAYMENT_MIX = [('PAID', 0.5), ('UNPAID', 0.48), ('FREE', 0.02)]
+RECENT_DAYS = 2
+
+CONFIDENCE_MEAN = 0.92
+CONFIDENCE_STDDEV = 0.04
+
+
+@dataclass
+class GenerationConfig:
+    """Tham số sinh dữ liệu - dùng chung cho mọi chunk (gửi sang worker một lần)"""
+    seed: int = 42
+    end: datetime = None                 # aware - không sinh sự kiện sau thời điểm này
+    days: int = 730
+    repeat_rate: float = 0.35            # tỉ lệ lượt vào là khách quen
+    regulars: int = 2000                 # số biển số khách quen
+    car_ratio: float = 0.7               # còn lại là xe máy
+    home_ratio: float = 0.6              # tỉ lệ biển số tỉnh "nhà"
+    detections: bool = True
+    # lot_id -> {'code', 'entry_gates': [(gate_id, camera_source)], 'exit_gates': [...]}
+    lots: dict = field(default_factory=dict)
+
+
+def random_plate(rng, car_ratio=0.7, home_ratio=0.6):
+    """Một biển số ngẫu nhiên đã chuẩn hóa (chữ in hoa, không dấu gạch/chấm)"""
+    if rng.random() < home_ratio:
+        province = rng.choice(HOME_PROVINCES)
+    else:
+        province = rng.choice(PROVINCE_CODES)
+    letter = rng.choice(SERIES_LETTERS)
+
+    if rng.random() < car_ratio:
+        # Ô tô: 30A12345 (mới) hoặc 30A1234 (cũ)
+        if rng.random() < 0.8:
+            return f'{province}{letter}{rng.randint(0, 99999):05d}'
+        return f'{province}{letter}{rng.randint(0, 9999):04d}'
+    # Xe máy: 29Y303658 (series chữ + số)
+    return f'{province}{letter}{rng.randint(1, 9)}{rng.randint(0, 99999):05d}'
+
+
+def regular_plates(config):
+    """
+    Pool khách quen và trọng số tích lũy (phân bố kiểu Zipf: vài xe đến rất thường xuyên)
+
+    Returns:
+        tuple: (list biển số, list cum_weights)
+    """
+    rng = random.Random(f'{config.seed}:regulars')
+    plates = []
+    seen = set()
+    while len(plates) < config.regulars:
+        plate = random_plate(rng, config.car_ratio, config.home_ratio)
+        if plate not in seen:
+            seen.add(plate)
+            plates.append(plate)
+
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, len(plates) + 1):
+        total += 1.0 / rank ** 0.8
+        cum_weights.append(total)
+    return plates, cum_weights
+
+
+def plan_days(config, total_sessions):
+    """
+    Chia tổng số phiên cho từng (bãi, ngày) theo thứ, mùa, tăng trưởng và sức chứa bãi
+
+    Returns:
+        list[tuple]: (lot_id, date, số phiên) theo thứ tự thời gian
+    """
+    last_day = config.end.date()
+    first_day = last_day - timedelta(days=config.days - 1)
+
+    day_weights = []
+    for offset in range(config.days):
+        day = first_day + timedelta(days=offset)
+        growth = 0.8 + 0.2 * offset / max(1, config.days - 1)
+        day_weights.append(WEEKDAY_WEIGHTS[day.weekday()] * MONTH_WEIGHTS[day.month - 1] * growth)
+    # Ngày cuối chỉ sinh đến thời điểm `end`
+    elapsed = (config.end - config.end.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+    day_weights[-1] *= elapsed / 86400
+
+    lot_weights = {lot_id: max(1, lot.get('capacity') or 1) for lot_id, lot in config.lots.items()}
+    total_weight = sum(day_weights) * sum(lot_weights.values())
+
+    plan = []
+    carry = 0.0
+    for offset, day_weight in enumerate(day_weights):
+        day = first_day + timedelta(days=offset)
+        for lot_id, lot_weight in lot_weights.items():
+            # Cộng dồn phần lẻ để tổng đúng bằng total_sessions
+            expected = total_sessions * day_weight * lot_weight / total_weight + carry
+            count = int(expected)
+            carry = expected - count
+            if count:
+                plan.append((lot_id, day, count))
+    return plan
+
+
+def _duration_minutes(rng, hour):
+    """Thời lượng đỗ: xe đi làm đỗ cả ngày, còn lại chủ yếu ghé ngắn, một ít đỗ qua đêm"""
+    workday_share = 0.6 if 6 <= hour < 10 else 0.12
+    roll = rng.random()
+    if roll < 0.04:
+        return rng.randint(12 * 60, 36 * 60)
+    if roll < 0.04 + workday_share:
+        return max(60, int(rng.gauss(540, 60)))
+    return max(1, int(rng.lognormvariate(3.7, 0.7)))   # trung vị ~40 phút
+
+
+def _pick(rng, weighted):
+    roll = rng.random()
+    for value, weight in weighted:
+        roll -= weight
+        if roll < 0:
+            return value
+    return weighted[-1][0]
+
+
+def _confidence(rng):
+    return round(min(0.999, max(0.5, rng.gauss(CONFIDENCE_MEAN, CONFIDENCE_STDDEV))), 4)
+
+
+_worker_config = None
+_worker_regulars = None
+
+
+def init_worker(config):
+    """Khởi tạo process worker: chuẩn bị Django và pool khách quen một lần"""
+    global _worker_config, _worker_regulars
+    import django
+    django.setup()
+    _worker_config = config
+    _worker_regulars = regular_plates(config)
+
+
+def generate_chunk(chunk):
+    """
+    Sinh các phiên (và lần phát hiện) của một bãi trong một ngày
+
+    Args:
+        chunk (tuple): (lot_id, date, số phiên)
+
+    Returns:
+        tuple: (session_rows, detection_rows) - tuple thuần để gửi giữa các process
+            session_rows: (plate, entry_time, exit_time, duration, fee, status,
+                           payment_status, lot_id, entry_gate_id, exit_gate_id)
+            detection_rows: (plate, confidence, detected_at, event_type,
+                             camera_source, lot_id, gate_id)
+    """
+    from django.utils import timezone
+    from .models import ParkingSession
+
+    config = _worker_config
+    plates, cum_weights = _worker_regulars
+    lot_id, day, count = chunk
+    lot = config.lots[lot_id]
+    rng = random.Random(f"{config.seed}:{lot['code']}:{day.isoformat()}")
+    calculate_fee = ParkingSession().calculate_fee
+    total_weight = cum_weights[-1] if cum_weights else 0
+
+    day_start = timezone.make_aware(datetime.combine(day, time_cls.min))
+    recent = (config.end.date() - day).days < RECENT_DAYS
+    entry_gates = lot['entry_gates'] or [(None, 'raspberrypi_cam')]
+    exit_gates = lot['exit_gates'] or [(None, 'raspberrypi_cam')]
+
+    # Giờ vào sắp xếp tăng dần để id tăng theo thời gian như dữ liệu thật
+    entries = []
+    for _ in range(count):
+        hour = rng.choices(range(24), weights=HOURLY_WEIGHTS)[0]
+        entry_time = day_start + timedelta(seconds=hour * 3600 + rng.randrange(3600))
+        if entry_time <= config.end:
+            entries.append((entry_time, hour))
+    entries.sort()
+
+    sessions = []
+    detections = []
+    for entry_time, hour in entries:
+        duration = _duration_minutes(rng, hour)
+        exit_time = entry_time + timedelta(minutes=duration, seconds=rng.randrange(60))
+        active = exit_time > config.end
+        commuter = 6 <= hour < 10
+
+        # Xe đang đỗ luôn dùng biển số vãng lai để không có 2 phiên ACTIVE cùng biển
+        repeat_rate = min(0.9, config.repeat_rate * (1.6 if commuter else 1.0))
+        if plates and not active and rng.random() < repeat_rate:
+            plate = plates[bisect.bisect_left(cum_weights, rng.random() * total_weight)]
+        else:
+            plate = random_plate(rng, config.car_ratio, config.home_ratio)
+
+        entry_gate_id, entry_source = rng.choice(entry_gates)
+        if active:
+            sessions.append((plate, entry_time, None, None, 0, 'ACTIVE', 'UNPAID',
+                             lot_id, entry_gate_id, None))
+        else:
+            exit_gate_id, exit_source = rng.choice(exit_gates)
+            payment_status = _pick(rng, RECENT_PAYMENT_MIX if recent else PAYMENT_MIX)
+            sessions.append((plate, entry_time, exit_time, duration, int(calculate_fee(duration)), 'COMPLETED',
+                             payment_status, lot_id, entry_gate_id, exit_gate_id))
+
+        if config.detections:
+            detections.append((plate, _confidence(rng), entry_time, 'ENTRY', entry_source, lot_id, entry_gate_id))
+            if not active:
+                detections.append((plate, _confidence(rng), exit_time, 'EXIT', exit_source, lot_id, exit_gate_id))
+
+    return sessions, detections
@@ -0,0 +1,235 @@
+"""
+Xác thực thiết bị camera (Raspberry Pi) cho các endpoint nhận dữ liệu
+
+Mỗi request từ Pi gửi kèm 3 header:
+    X-Device-Id:  mã thiết bị (CameraDevice.device_id)
+    X-Timestamp:  unix timestamp (giây) lúc ký
+    X-Signature:  hex(HMAC-SHA256(secret_key, "<device_id>\\n<timestamp>\\n" + body))
+
+Khóa bí mật được cache trong bộ nhớ (LRU có TTL ngắn) nên các request
+stream 30 fps không phải truy vấn database. Mỗi thiết bị có token bucket
+riêng cho từng loại endpoint ('ingest') để một camera lỗi không làm ngập
+server; endpoint frame được giới hạn bởi streaming.frame_admission.
+"""
+
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+
+DEFAULT_DEVICE_AUTH = {
+    'REQUIRED': True,
+    'MAX_CLOCK_SKEW': 300,        # giây - chống replay request cũ
+    'SECRET_CACHE_SIZE': 256,
+    'SECRET_CACHE_TTL': 60,       # giây
+    'RATE_LIMITS': {
+        # scope: (số token nạp mỗi giây, dung lượng bucket)
+        'ingest': (2, 10),
+    },
+}
+
+
+def get_config():
+    config = dict(DEFAULT_DEVICE_AUTH)
+    config.update(getattr(settings, 'DEVICE_AUTH', {}))
+    return config
+
+
+@dataclass(frozen=True)
+class DeviceInfo:
+    """Thông tin thiết bị đã xác thực (gắn vào request.device)"""
+    device_id: str
+    secret_key: str
+    lot_id: int
+    gate_id: int
+
+
+class DeviceSecretCache:
+    """LRU cache khóa bí mật của thiết bị, mỗi entry sống tối đa `ttl` giây"""
+
+    def __init__(self, max_size=256, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, device_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None:
+                expires_at, info = entry
+                if expires_at > now:
+                    self._entries.move_to_end(device_id)
+                    return info
+                del self._entries[device_id]
+
+        # Cache miss: đọc database ngoài lock (thiết bị không tồn tại cũng được cache)
+        info = self._load(device_id)
+        with self._lock:
+            self._entries[device_id] = (now + self.ttl, info)
+            self._entries.move_to_end(device_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return info
+
+    def invalidate(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device_id, None)
+
+    def _load(self, device_id):
+        from .models import CameraDevice
+
+        device = CameraDevice.objects.filter(device_id=device_id, is_active=True).only(
+            'device_id', 'secret_key', 'lot_id', 'gate_id'
+        ).first()
+        if device is None:
+            return None
+        return DeviceInfo(device.device_id, device.secret_key, device.lot_id, device.gate_id)
+
+
+class TokenBucket:
+    """Token bucket đơn giản: nạp `rate` token/giây, tối đa `capacity` token"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount=1):
+        """
+        Lấy `amount` token
+
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True, 0.0
+            if self.rate <= 0:
+                return False, 1.0
+            return False, (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Quản lý token bucket theo (thiết bị, scope)"""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key, scope):
+        bucket = self._buckets.get((key, scope))
+        if bucket is None:
+            rate, capacity = self.limits.get(scope, (0, 0))
+            with self._lock:
+                bucket = self._buckets.setdefault((key, scope), TokenBucket(rate, capacity))
+        return bucket
+
+    def consume(self, key, scope, amount=1):
+        if scope not in self.limits:
+            return True, 0.0
+        return self.bucket(key, scope).consume(amount)
+
+
+_config = get_config()
+secret_cache = DeviceSecretCache(_config['SECRET_CACHE_SIZE'], _config['SECRET_CACHE_TTL'])
+rate_limiter = RateLimiter(_config['RATE_LIMITS'])
+
+
+def compute_signature(secret_key, device_id, timestamp, body):
+    """Tính chữ ký HMAC-SHA256 (hex) cho một request - dùng chung cho server và client Pi"""
+    message = f"{device_id}\n{timestamp}\n".encode('utf-8') + body
+    return hmac.new(secret_key.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+class DeviceAuthError(Exception):
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
+
+
+def authenticate_device(request):
+    """
+    Xác thực request theo header X-Device-Id / X-Timestamp / X-Signature
+
+    Returns:
+        DeviceInfo | None: None nếu request không ký và REQUIRED = False
+
+    Raises:
+        DeviceAuthError
+    """
+    config = get_config()
+    device_id = request.headers.get('X-Device-Id')
+    timestamp = request.headers.get('X-Timestamp')
+    signature = request.headers.get('X-Signature')
+
+    if not (device_id and timestamp and signature):
+        if config['REQUIRED']:
+            raise DeviceAuthError('Missing device credentials')
+        return None
+
+    try:
+        skew = abs(time.time() - float(timestamp))
+    except ValueError:
+        raise DeviceAuthError('Invalid timestamp')
+    if skew > config['MAX_CLOCK_SKEW']:
+        raise DeviceAuthError('Timestamp outside allowed window')
+
+    device = secret_cache.get(device_id)
+    if device is None:
+        raise DeviceAuthError('Unknown or inactive device', status=403)
+
+    expected = compute_signature(device.secret_key, device_id, timestamp, request.body)
+    if not hmac.compare_digest(expected, signature.lower()):
+        raise DeviceAuthError('Invalid signature')
+
+    return device
+
+
+def device_required(scope=None):
+    """
+    Decorator cho các endpoint nhận dữ liệu từ camera
+
+    - Xác thực HMAC, gắn request.device (DeviceInfo hoặc None)
+    - Giới hạn tốc độ theo token bucket của từng thiết bị trong `scope`
+      (scope None: không giới hạn, endpoint tự giới hạn trước khi đọc body)
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            try:
+                request.device = authenticate_device(request)
+            except DeviceAuthError as e:
+                return JsonResponse({"status": "error", "msg": str(e)}, status=e.status)
+            if scope is None:
+                return view_func(request, *args, **kwargs)
+
+            # Request không ký (chỉ khi REQUIRED = False) dùng chung bucket theo IP
+            key = request.device.device_id if request.device else request.META.get('REMOTE_ADDR', 'anonymous')
+            allowed, retry_after = rate_limiter.consume(key, scope)
+            if not allowed:
+                response = JsonResponse({"status": "error", "msg": "Rate limit exceeded"}, status=429)
+                response['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+                return response
+
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
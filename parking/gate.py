@@ -0,0 +1,185 @@
+"""
+Xử lý một lần đọc biển số tại cổng: xác định ENTRY/EXIT, ghi VehicleDetection
+và ParkingSession, trả về dữ liệu phản hồi cho Pi (mở barrier).
+
+Chỉ những việc cần cho quyết định mở barrier chạy trong request; phần còn
+lại (thống kê ngày, hóa đơn, ...) được đẩy sang hàng đợi nền (parking/tasks.py).
+"""
+
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .camera_health import supervisor
+from .clips import clip_writer
+from .lots import get_gate, lot_lock
+from .models import ParkingSession, VehicleDetection
+from . import profiles
+from .plates import active_plates, canonicalize
+from .subscriptions import subscriptions
+from .task_queue import enqueue
+
+
+logger = logging.getLogger(__name__)
+
+
+def process_plate_read(plate, confidence, source, image_file, lot_id, gate_id, raw_plate=None, at=None):
+    """
+    Ghi nhận một lần đọc biển số (TỰ ĐỘNG ENTRY/EXIT)
+
+    Args:
+        plate (str): biển số như camera/Pi đọc được (chuẩn hóa ở đây)
+        confidence (float): độ tin cậy 0..1
+        source (str): mã camera
+        image_file (UploadedFile | None): ảnh crop biển số
+        lot_id (int): bãi đỗ
+        gate_id (int | None): cổng
+        raw_plate (str | None): chuỗi đọc được ban đầu nếu `plate` đã qua bầu chọn (parking/voting.py)
+        at (datetime | None): thời điểm xe qua cổng (mặc định: bây giờ) - khi ghi lại sự kiện
+            từ journal của chế độ degraded (parking/gate_decision.py)
+
+    Returns:
+        dict: dữ liệu phản hồi cho Pi
+    """
+    # Tuần tự hóa ENTRY/EXIT trong cùng một bãi, các bãi khác chạy song song
+    raw_plate = raw_plate or plate
+    event_time = at or timezone.now()
+    with lot_lock(lot_id):
+        # Gộp các cách đọc khác nhau của cùng một xe về biển số của xe đang đỗ
+        plate = canonicalize(raw_plate, lot_id) or raw_plate
+
+        # ⭐ TỰ ĐỘNG XÁC ĐỊNH EVENT TYPE (Lần 1 = ENTRY, Lần 2 = EXIT)
+        active_session = ParkingSession.objects.filter(
+            lot_id=lot_id,
+            license_plate=plate,
+            status='ACTIVE'
+        ).first()
+
+        # Xe đọc được ở cổng chỉ-vào mà vẫn đang có phiên: lần ra trước đã bị lỡ.
+        # Đóng phiên cũ (cần kiểm tra phí) thay vì coi lần vào này là EXIT
+        if active_session and gate_id and getattr(get_gate(gate_id), 'direction', 'BOTH') == 'ENTRY':
+            active_session.needs_review = True
+            active_session.complete_session(event_time, close_reason='CONTRADICTED')
+            profiles.record_exit(active_session)
+            logger.warning('Closed session #%s of %s: re-entered at entry-only gate', active_session.id, plate,
+                           extra={'session_id': active_session.id, 'plate': plate, 'gate_id': gate_id})
+            active_session = None
+
+        if active_session:
+            event_type = 'EXIT'
+            message = f'🚗 Xe {plate} RA bãi'
+        else:
+            event_type = 'ENTRY'
+            message = f'🚗 Xe {plate} VÀO bãi'
+
+        # Lưu ảnh - Django ImageField sẽ tự động lưu vào media/detections/
+        # ✅ LƯU VÀO DATABASE (VehicleDetection)
+        detection = VehicleDetection.objects.create(
+            license_plate=plate,
+            raw_plate=raw_plate,
+            confidence=confidence,
+            event_type=event_type,
+            detected_at=event_time,
+            camera_source=source,
+            lot_id=lot_id,
+            gate_id=gate_id,
+            image_path=image_file if image_file else None  # Django tự động lưu file
+        )
+
+        # Lấy đường dẫn file đã lưu
+        filename = detection.image_path.name if detection.image_path else None
+
+        # ✅ XỬ LÝ PARKING SESSION
+        response_data = {
+            "status": "ok",
+            "plate": plate,
+            "raw_plate": raw_plate,
+            "confidence": f"{confidence:.2%}",
+            "event_type": event_type,
+            "message": message,
+            "detection_id": detection.id,
+            "file": filename
+        }
+
+        # Nợ từ các lần trước (đọc trước khi cộng phí của lần ra này)
+        profile = profiles.lookup(plate)
+        outstanding = int(profile['outstanding_amount']) if profile else 0
+        response_data['outstanding_debt'] = outstanding
+        response_data['unpaid_sessions'] = profile['unpaid_count'] if profile else 0
+        response_data['visit_count'] = (profile['visit_count'] if profile else 0) + (event_type == 'ENTRY')
+
+        # Vé tháng: tra chỉ mục trong bộ nhớ, không truy vấn database
+        subscription_until = subscriptions.valid_until(plate, lot_id)
+        response_data['subscription_until'] = subscription_until.isoformat() if subscription_until else None
+
+        if event_type == 'ENTRY':
+            # Tạo phiên đỗ xe mới
+            session = ParkingSession.objects.create(
+                license_plate=plate,
+                entry_time=event_time,
+                entry_image=filename,
+                status='ACTIVE',
+                lot_id=lot_id,
+                entry_gate_id=gate_id
+            )
+            active_plates.add(lot_id, plate)
+            profiles.record_entry(plate, session.entry_time)
+            response_data['session_id'] = session.id
+            response_data['action'] = 'open_barrier'
+
+        elif event_type == 'EXIT':
+            # Kết thúc phiên đỗ xe - TỰ ĐỘNG TÍNH TOÁN
+            session = active_session
+            session.complete_session(event_time, filename, exit_gate_id=gate_id)
+            active_plates.discard(lot_id, plate)
+            profiles.record_exit(session)
+
+            response_data['session_id'] = session.id
+            response_data['duration_minutes'] = session.duration_minutes
+            response_data['fee'] = int(session.fee)
+            response_data['payment_status'] = session.payment_status
+            response_data['fee_breakdown'] = session.get_fee_breakdown()
+            response_data['action'] = 'open_barrier'
+
+            # Message thân thiện
+            if session.payment_status == 'FREE' and subscription_until:
+                response_data['display_message'] = f"Vé tháng đến {subscription_until:%d/%m/%Y} - miễn phí"
+            elif session.fee == 0:
+                response_data['display_message'] = f"Cảm ơn! Miễn phí ({session.duration_minutes} phút)"
+            else:
+                response_data['display_message'] = f"Phí đỗ xe: {int(session.fee):,}đ ({session.duration_minutes} phút)"
+
+        if outstanding:
+            response_data['debt_message'] = f"Xe còn nợ {outstanding:,}đ từ các lần trước"
+
+    transaction.on_commit(lambda: schedule_post_event_tasks(session, event_type))
+    transaction.on_commit(lambda: clip_writer.schedule(source, detection.id, event_time=event_time.timestamp()))
+    if filename:
+        transaction.on_commit(lambda: enqueue('generate_thumbnails', key=f'thumbs:{detection.id}',
+                                              detection_id=detection.id))
+    supervisor.record_detection(source)
+
+    log_fields = {'event': event_type, 'plate': plate, 'raw_plate': raw_plate, 'source': source, 'confidence': round(confidence, 4),
+                  'lot_id': lot_id, 'gate_id': gate_id, 'session_id': session.id}
+    if event_type == 'ENTRY':
+        logger.info('ENTRY %s from %s -> session #%s', plate, source, session.id, extra=log_fields)
+    else:
+        log_fields.update(duration_minutes=session.duration_minutes, fee=int(session.fee))
+        logger.info('EXIT %s from %s -> %sp, %s VND', plate, source, session.duration_minutes, int(session.fee),
+                    extra=log_fields)
+
+    return response_data
+
+
+def schedule_post_event_tasks(session, event_type):
+    """Đẩy các việc không cần cho quyết định mở barrier sang hàng đợi nền"""
+    if event_type == 'ENTRY':
+        event_time = session.entry_time
+    else:
+        event_time = session.exit_time
+        enqueue('render_receipt', key=session.license_plate, session_id=session.id)
+
+    # Thống kê ngày khóa theo (bãi, ngày) để các lần tính lại không chạy chồng nhau
+    day = timezone.localtime(event_time).date().isoformat()
+    enqueue('refresh_daily_rollup', key=f'rollup:{session.lot_id}:{day}', lot_id=session.lot_id, date=day)
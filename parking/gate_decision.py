@@ -0,0 +1,516 @@
+"""
+Quyết định mở barrier trong ngân sách thời gian, ghi database phía sau
+
+Barrier mở cho cả ENTRY lẫn EXIT, nên quyết định không cần chờ database:
+mỗi lần chốt biển số (request /api/upload/ hoặc lượt xe của parking/voting.py)
+được ghi (process_plate_read) trên thread pool riêng và chỉ được chờ tối đa
+LATENCY_BUDGET_MS. Quá thời gian đó cổng nhận ngay quyết định tạm
+("pending": true, ENTRY/EXIT đoán theo chỉ mục biển số trong bộ nhớ) còn lần
+ghi tiếp tục chạy nền.
+
+Chế độ degraded: sau DEGRADE_AFTER lần ghi liên tiếp quá ngân sách, hoặc
+ngay khi lần ghi lỗi database (ví dụ "database is locked"), mọi lần đọc mới
+được ghi vào journal trên đĩa (mỗi sự kiện một file JSON theo thứ tự thời
+gian + ảnh, ghi file tạm rồi rename như parking/task_queue.py) thay vì chạm
+database. Thread nền mỗi REPLAY_INTERVAL giây đợi các lần ghi dở xong rồi
+ghi lại journal theo đúng thứ tự với thời điểm gốc của sự kiện; hết journal
+thì quay về chế độ bình thường. Journal còn sót khi server khởi động lại
+được ghi tiếp ở lần chạy sau.
+
+Nhiều worker dùng chung JOURNAL_DIR nên trạng thái degraded cũng dùng chung:
+file đánh dấu JOURNAL_DIR/degraded. Khi file còn đó mọi process đều ghi
+journal (không process nào ghi thẳng database vượt lên trước sự kiện cũ hơn
+đang nằm trong journal). Ghi journal giữ khóa chia sẻ journal.lock, xóa file
+đánh dấu giữ khóa độc quyền nên không có sự kiện nào vào journal sau khi đã
+thoát degraded; chỉ một process ghi lại journal tại một thời điểm (replay.lock).
+
+Độ trễ quyết định (tách khỏi độ trễ request) xuất ở /metrics:
+parking_gate_decision_seconds{outcome="written|pending|journaled"}.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .gate import process_plate_read
+from .lots import get_gate
+from .metrics import Histogram, register_collector
+from .plates import active_plates, canonical_form, normalize
+from .task_queue import _pid_alive
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GATE_DECISION = {
+    'ENABLED': True,
+    'LATENCY_BUDGET_MS': 150,          # thời gian tối đa chờ ghi database trước khi trả quyết định tạm
+    'WRITE_WORKERS': 4,                # thread ghi database
+    'DEGRADE_AFTER': 3,                # số lần ghi liên tiếp quá ngân sách -> chế độ degraded
+    'JOURNAL_DIR': 'var/gate_journal',
+    'REPLAY_INTERVAL': 5.0,            # giây giữa các lần thử ghi lại journal
+}
+
+DECISION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5)
+
+
+def get_config():
+    config = dict(DEFAULT_GATE_DECISION)
+    config.update(getattr(settings, 'GATE_DECISION', {}))
+    return config
+
+
+def write_event(event):
+    """Ghi một sự kiện cổng vào database (cả lần ghi hoặc không gì cả)"""
+    with transaction.atomic():
+        return process_plate_read(event['plate'], event['confidence'], event['source'], event['image'],
+                                  event['lot_id'], event['gate_id'], raw_plate=event['raw_plate'], at=event['at'])
+
+
+class GateDecisionService:
+    def __init__(self, config=None, writer=write_event):
+        self.config = config or get_config()
+        self._writer = writer
+        self._executor = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)   # báo khi không còn lần ghi đang chạy
+        self._slow_streak = 0
+        self._in_flight = 0
+        self._journaling = 0      # số sự kiện đang được ghi ra journal (ngoài self._lock)
+        self._pending = {}        # (lot_id, biển số) -> event_type đã journal, chưa ghi lại
+        self.counters = {'decisions': 0, 'written': 0, 'pending': 0, 'journaled': 0, 'replayed': 0,
+                         'late_errors': 0, 'replay_errors': 0, 'degraded': 0}
+        self.histograms = {}      # outcome -> Histogram độ trễ quyết định
+        self.latencies = deque(maxlen=1000)
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    @property
+    def degraded(self):
+        """Chế độ degraded dùng chung cho mọi process (file đánh dấu trong JOURNAL_DIR)"""
+        return os.path.exists(os.path.join(self.config['JOURNAL_DIR'], 'degraded'))
+
+    def start(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._executor = ThreadPoolExecutor(self.config['WRITE_WORKERS'], thread_name_prefix='gate-write')
+            self._recover()
+            thread = threading.Thread(target=self._run, name='gate-replay', daemon=True)
+            thread.start()
+            self._started = True
+
+    # ---------- journal ----------
+
+    def _dir(self, state):
+        path = os.path.join(self.config['JOURNAL_DIR'], state)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _write_file(self, state, filename, data):
+        directory = self._dir(state)
+        temp_path = os.path.join(directory, f'.{filename}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, os.path.join(directory, filename))
+
+    def _journal_names(self):
+        return sorted(name for name in os.listdir(self._dir('pending')) if name.endswith('.json'))
+
+    @contextmanager
+    def _file_lock(self, name, operation):
+        """
+        flock trên JOURNAL_DIR/<name>: khóa giữa các process (và giữa các thread, mỗi lần mở fd riêng)
+
+        Yields:
+            bool: False nếu `operation` có LOCK_NB và khóa đang bị giữ
+        """
+        os.makedirs(self.config['JOURNAL_DIR'], exist_ok=True)
+        fd = os.open(os.path.join(self.config['JOURNAL_DIR'], name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, operation)
+            except BlockingIOError:
+                yield False
+            else:
+                yield True
+        finally:
+            os.close(fd)
+
+    def _recover(self):
+        """Trả các sự kiện đang ghi dở của process đã tắt về journal; còn journal thì vào chế độ degraded"""
+        replaying_dir = self._dir('replaying')
+        for filename in os.listdir(replaying_dir):
+            pid = filename.split('-', 1)[0]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                try:
+                    os.rename(os.path.join(replaying_dir, filename),
+                              os.path.join(self._dir('pending'), filename.split('-', 1)[1]))
+                except OSError:
+                    pass
+        if self._journal_names():
+            self._enter_degraded('journal has unreplayed events')
+
+    def _reserve_journal(self):
+        """Giữ chỗ ghi journal (gọi khi giữ self._lock): replay không thoát degraded khi còn lần ghi dở"""
+        self._journaling += 1
+
+    def _journal(self, event, reason=None):
+        """
+        Ghi sự kiện vào journal sau _reserve_journal(), không giữ self._lock
+
+        Tên file theo thời điểm xe qua cổng (không phải lúc ghi journal) nên lần
+        ghi quá ngân sách lỗi muộn vẫn được ghi lại trước các sự kiện sau nó.
+
+        Args:
+            reason (str, optional): lần ghi database đã lỗi - vào chế độ degraded rồi ghi journal.
+                None: chỉ ghi nếu đang degraded
+
+        Returns:
+            bool: False nếu không còn degraded (nơi gọi ghi thẳng database)
+        """
+        try:
+            # Bật file đánh dấu và ghi journal trong cùng khóa chia sẻ: replay không thể
+            # thoát degraded giữa hai bước này
+            with self._file_lock('journal.lock', fcntl.LOCK_SH):
+                if reason is not None:
+                    self._enter_degraded(reason)
+                elif not self.degraded:
+                    return False
+                name = f"{int(event['at'].timestamp() * 1_000_000):017d}-{uuid.uuid4().hex[:8]}"
+                payload = dict(event, at=event['at'].isoformat(), image=None)
+                image = event['image']
+                if image is not None:
+                    payload['image'] = {'name': os.path.basename(image.name), 'file': f'{name}.img'}
+                    image.seek(0)
+                    self._write_file('images', payload['image']['file'], image.read())
+                self._write_file('pending', f'{name}.json', json.dumps(payload).encode('utf-8'))
+                return True
+        finally:
+            with self._lock:
+                self._journaling -= 1
+                self._idle.notify_all()
+
+    def _load(self, path):
+        with open(path, encoding='utf-8') as f:
+            event = json.load(f)
+        event['at'] = datetime.fromisoformat(event['at'])
+        image = event['image']
+        if image is not None:
+            with open(os.path.join(self._dir('images'), image['file']), 'rb') as f:
+                event['image'] = ContentFile(f.read(), name=image['name'])
+            event['image_file'] = image['file']
+        return event
+
+    # ---------- quyết định ----------
+
+    def decide(self, plate, confidence, source, image_file, lot_id, gate_id, raw_plate=None):
+        """
+        Quyết định cho một lần chốt biển số trong LATENCY_BUDGET_MS
+
+        Cùng tham số với gate.process_plate_read
+
+        Returns:
+            dict: dữ liệu phản hồi cho Pi - kết quả ghi database, hoặc quyết định tạm
+                có "pending": true khi lần ghi chưa xong / sự kiện đã vào journal
+        """
+        started = time.monotonic()
+        event = {'plate': plate, 'raw_plate': raw_plate or plate, 'confidence': confidence, 'source': source,
+                 'image': image_file, 'lot_id': lot_id, 'gate_id': gate_id, 'at': timezone.now()}
+        in_transaction = connection.in_atomic_block
+        if self.enabled and not in_transaction:
+            self.start()
+        journaled = False
+        if self.enabled and self.degraded:
+            with self._lock:
+                self._reserve_journal()
+            journaled = self._journal(event)
+        elif self._pending:
+            # Process khác đã ghi lại journal và thoát degraded
+            with self._lock:
+                self._pending.clear()
+
+        if journaled:
+            result, outcome = self._provisional(event, journaled=True), 'journaled'
+        elif not self.enabled or in_transaction:
+            # Đang trong transaction của nơi gọi: lần ghi phải thuộc transaction đó
+            result, outcome = self._writer(event), 'written'
+        else:
+            if image_file is not None:
+                # Request có thể trả về trước khi ghi xong, file upload bị đóng khi request kết thúc
+                image_file.seek(0)
+                event['image'] = ContentFile(image_file.read(), name=os.path.basename(image_file.name))
+            result, outcome = self._write_within_budget(event, started)
+
+        self._observe(outcome, time.monotonic() - started)
+        return result
+
+    def _write_within_budget(self, event, started):
+        with self._lock:
+            self._in_flight += 1
+        future = self._executor.submit(self._write, event)
+        budget = self.config['LATENCY_BUDGET_MS'] / 1000
+        try:
+            result = future.result(timeout=max(0.0, budget - (time.monotonic() - started)))
+        except FutureTimeout:
+            future.add_done_callback(lambda done: self._finish_late(event, done))
+            self._record_slow()
+            return self._provisional(event), 'pending'
+        except DatabaseError:
+            # Lần ghi đã rollback: đưa vào journal để ghi lại sau (_write đã giữ chỗ journal)
+            logger.exception('Gate write for %s failed, journaling', event['plate'])
+            self._journal(event, 'write failed')
+            return self._provisional(event, journaled=True), 'journaled'
+        with self._lock:
+            self._slow_streak = 0
+        return result, 'written'
+
+    def _write(self, event):
+        close_old_connections()
+        failed = False
+        try:
+            return self._writer(event)
+        except DatabaseError:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if failed:
+                    # Giữ chỗ journal ngay khi rời _in_flight: replay không được chạy
+                    # trước khi sự kiện cũ này vào journal
+                    self._reserve_journal()
+                self._idle.notify_all()
+
+    def _finish_late(self, event, future):
+        """Lần ghi đã quá ngân sách kết thúc (thread ghi); lỗi database đã được _write giữ chỗ journal"""
+        error = future.exception()
+        if error is None:
+            return
+        journal = isinstance(error, DatabaseError)
+        with self._lock:
+            self.counters['late_errors'] += 1
+        if journal:
+            self._journal(event, 'write failed')
+            logger.warning('Late gate write for %s failed (%s), journaled', event['plate'], error,
+                           extra={'plate': event['plate'], 'lot_id': event['lot_id']})
+            return
+        logger.error('Late gate write for %s failed', event['plate'], exc_info=error,
+                     extra={'plate': event['plate'], 'lot_id': event['lot_id']})
+
+    def _record_slow(self):
+        with self._lock:
+            self._slow_streak += 1
+            streak = self._slow_streak
+        if streak >= self.config['DEGRADE_AFTER']:
+            self._enter_degraded(f'{streak} writes over budget')
+
+    def _enter_degraded(self, reason):
+        """Chuyển mọi process sang chế độ degraded (tạo file đánh dấu, không giữ self._lock)"""
+        if self.degraded:
+            return
+        self._write_file('', 'degraded', f'{os.getpid()} {reason}'.encode('utf-8'))
+        with self._lock:
+            self.counters['degraded'] += 1
+        logger.warning('Gate decisions degraded: %s, journaling events', reason)
+
+    def _leave_degraded(self, replayed):
+        """Xóa file đánh dấu (gọi khi giữ khóa độc quyền journal.lock và journal đã rỗng)"""
+        try:
+            os.remove(os.path.join(self.config['JOURNAL_DIR'], 'degraded'))
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._slow_streak = 0
+            self._pending.clear()
+        logger.info('Gate journal replayed (%d events), back to normal mode', replayed)
+
+    def _provisional(self, event, journaled=False):
+        """
+        Quyết định tạm khi chưa ghi được database: ENTRY/EXIT theo chỉ mục biển số
+        trong bộ nhớ (không nạp lại từ database) và các sự kiện đã journal
+        """
+        lot_id = event['lot_id']
+        plate = canonical_form(normalize(event['plate']))
+        plate = active_plates.match(lot_id, plate, refresh=False) or plate
+        with self._lock:
+            last = self._pending.get((lot_id, plate))
+        parked = last == 'ENTRY' if last is not None else active_plates.match(lot_id, plate, refresh=False) is not None
+        if parked and event['gate_id'] and \
+                getattr(get_gate(event['gate_id'], cached_only=True), 'direction', 'BOTH') == 'ENTRY':
+            parked = False
+        event_type = 'EXIT' if parked else 'ENTRY'
+        if journaled:
+            with self._lock:
+                self._pending[(lot_id, plate)] = event_type
+
+        return {
+            "status": "ok",
+            "plate": plate,
+            "raw_plate": event['raw_plate'],
+            "confidence": f"{event['confidence']:.2%}",
+            "event_type": event_type,
+            "message": f'🚗 Xe {plate} {"RA" if parked else "VÀO"} bãi',
+            "action": "open_barrier",
+            "pending": True,
+        }
+
+    def provisional_decision(self, plate, confidence, lot_id, gate_id, raw_plate=None):
+        """Quyết định tạm mở barrier khi lần chốt chưa xong (lượt xe quá hạn ở parking/voting.py)"""
+        return self._provisional({'plate': plate, 'raw_plate': raw_plate or plate, 'confidence': confidence,
+                                  'lot_id': lot_id, 'gate_id': gate_id})
+
+    def _observe(self, outcome, seconds):
+        with self._lock:
+            self.counters['decisions'] += 1
+            self.counters[outcome] += 1
+            histogram = self.histograms.get(outcome)
+            if histogram is None:
+                histogram = self.histograms[outcome] = Histogram(DECISION_BUCKETS)
+            histogram.observe(seconds)
+        self.latencies.append(seconds)
+
+    # ---------- ghi lại journal ----------
+
+    def _run(self):
+        while True:
+            time.sleep(self.config['REPLAY_INTERVAL'])
+            if not self.degraded and not self._journal_names():
+                continue
+            try:
+                self.replay()
+            except Exception:
+                logger.exception('Gate journal replay failed')
+
+    def replay(self):
+        """
+        Ghi lại journal theo thứ tự khi database đã ghi được; hết journal thì thoát chế độ degraded
+
+        Chỉ một process ghi lại tại một thời điểm (process khác đang giữ replay.lock thì trả 0).
+
+        Returns:
+            int: số sự kiện đã ghi lại
+        """
+        with self._idle:
+            # Các lần ghi quá ngân sách còn chạy (hoặc đang vào journal) là sự kiện cũ hơn journal
+            if not self._idle.wait_for(lambda: self._in_flight == 0 and self._journaling == 0,
+                                       self.config['REPLAY_INTERVAL']):
+                return 0
+
+        with self._file_lock('replay.lock', fcntl.LOCK_EX | fcntl.LOCK_NB) as acquired:
+            return self._replay() if acquired else 0
+
+    def _replay(self):
+        replayed = 0
+        while True:
+            names = self._journal_names()
+            if not names:
+                with self._idle:
+                    self._idle.wait_for(lambda: self._journaling == 0, self.config['REPLAY_INTERVAL'])
+                # Khóa độc quyền: không process nào đang ghi journal khi kiểm tra lần cuối và xóa file đánh dấu
+                with self._file_lock('journal.lock', fcntl.LOCK_EX):
+                    with self._lock:
+                        journaling = self._journaling
+                    if not journaling and not self._journal_names():
+                        self._leave_degraded(replayed)
+                        return replayed
+                continue
+            for name in names:
+                claimed = os.path.join(self._dir('replaying'), f'{os.getpid()}-{name}')
+                try:
+                    os.rename(os.path.join(self._dir('pending'), name), claimed)
+                except OSError:
+                    continue    # process khác đang ghi lại
+                try:
+                    event = self._load(claimed)
+                except (OSError, ValueError):
+                    logger.exception('Unreadable gate journal entry %s', name)
+                    os.replace(claimed, os.path.join(self._dir('failed'), name))
+                    with self._lock:
+                        self.counters['replay_errors'] += 1
+                    continue
+
+                close_old_connections()
+                try:
+                    self._writer(event)
+                except DatabaseError as e:
+                    os.rename(claimed, os.path.join(self._dir('pending'), name))
+                    logger.warning('Gate journal replay paused: %s', e)
+                    return replayed
+                except Exception:
+                    logger.exception('Failed to replay gate event %s', name)
+                    os.replace(claimed, os.path.join(self._dir('failed'), name))
+                    with self._lock:
+                        self.counters['replay_errors'] += 1
+                    continue
+
+                os.remove(claimed)
+                if event.get('image_file'):
+                    try:
+                        os.remove(os.path.join(self._dir('images'), event['image_file']))
+                    except OSError:
+                        pass
+                replayed += 1
+                with self._lock:
+                    self.counters['replayed'] += 1
+
+    # ---------- thống kê ----------
+
+    def stats(self):
+        with self._lock:
+            data = dict(self.counters)
+            data.update(in_flight=self._in_flight)
+        latencies = sorted(self.latencies)
+        data.update(
+            mode='degraded' if self.degraded else 'normal',
+            enabled=self.enabled,
+            budget_ms=self.config['LATENCY_BUDGET_MS'],
+            journal_depth=len(self._journal_names()) if self._started else 0,
+            decision_p50=round(latencies[len(latencies) // 2], 4) if latencies else None,
+            decision_p95=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4) if latencies else None,
+        )
+        return data
+
+
+gate_decisions = GateDecisionService()
+
+
+@register_collector
+def _gate_decision_metrics():
+    if not gate_decisions.enabled:
+        return
+    stats = gate_decisions.stats()
+    with gate_decisions._lock:
+        histograms = {outcome: (h.buckets, list(h.counts), h.sum, h.count)
+                      for outcome, h in gate_decisions.histograms.items()}
+    yield 'parking_gate_decision_seconds', 'histogram', 'Thời gian từ lần chốt biển số đến quyết định mở barrier', [
+        ({'outcome': outcome}, value) for outcome, value in histograms.items()
+    ]
+    yield 'parking_gate_decisions_total', 'counter', 'Quyết định ở cổng theo kết quả ghi database', [
+        ({'outcome': key}, stats[key]) for key in ('written', 'pending', 'journaled')
+    ]
+    yield 'parking_gate_degraded', 'gauge', '1 khi cổng đang ở chế độ degraded (ghi journal)', [
+        ({}, int(stats['mode'] == 'degraded'))
+    ]
+    yield 'parking_gate_journal_depth', 'gauge', 'Sự kiện trong journal chờ ghi lại', [({}, stats['journal_depth'])]
+    yield 'parking_gate_replayed_total', 'counter', 'Sự kiện journal đã ghi lại vào database', [
+        ({}, stats['replayed'])
+    ]
@@ -0,0 +1,148 @@
+"""
+Logging có cấu trúc, không chặn request
+
+- AsyncStreamHandler: request thread chỉ đưa record vào queue (put_nowait),
+  một thread nền format JSON và ghi ra stdout. Queue đầy thì bỏ record và
+  đếm lại, không bao giờ chặn luồng frame/ingest
+- JsonFormatter: mỗi record là một dòng JSON (ts, level, logger, msg, các
+  field truyền qua extra=..., traceback)
+- RateLimitFilter: cùng một dòng log (logger + dòng code + message đã format)
+  chỉ cho qua `burst` lần trong mỗi `interval` giây; số lần bị chặn được ghi
+  vào field "suppressed" của record kế tiếp được cho qua. Message khác nhau
+  (vd: ENTRY/EXIT của các biển số khác nhau) không dùng chung hạn mức
+- apply_level_overrides: chỉnh level từng module qua biến môi trường
+  LOG_LEVELS="parking.gate=DEBUG,parking.views=WARNING"
+
+Cấu hình trong settings.LOGGING.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Thuộc tính có sẵn của LogRecord - phần còn lại là field truyền qua extra=...
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_JSON_TYPES = (str, int, float, bool, type(None), list, tuple, dict)
+
+
+class JsonFormatter(logging.Formatter):
+    """Một record -> một dòng JSON"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            # Bỏ các object không phải dữ liệu (vd: request/socket Django gắn vào record)
+            if key not in _RECORD_ATTRS and not key.startswith('_') and isinstance(value, _JSON_TYPES):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Chặn log lặp lại: mỗi message (đã format) tối đa `burst` record trong `interval` giây"""
+
+    def __init__(self, interval=10.0, burst=5, max_keys=10000):
+        super().__init__()
+        self.interval = float(interval)
+        self.burst = int(burst)
+        self.max_keys = max_keys
+        self._windows = {}     # key -> [bắt đầu cửa sổ, số đã cho qua, số bị chặn]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.pathname, record.lineno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class AsyncStreamHandler(QueueHandler):
+    """
+    Handler không chặn: format và ghi stream (mặc định stdout) ở thread nền
+
+    Formatter gán cho handler này (formatter trong LOGGING) được dùng ở thread nền.
+    """
+
+    def __init__(self, stream=None, max_queue=10000):
+        super().__init__(queue.Queue(maxsize=max_queue))
+        self.dropped = 0
+        self._dropped_unreported = 0
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Chỉ ghép message và traceback ở thread gọi (args/exc_info có thể đổi sau đó),
+        # phần format JSON để thread nền làm
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._dropped_unreported:
+            record.dropped = self._dropped_unreported
+        try:
+            self.queue.put_nowait(record)
+            self._dropped_unreported = 0
+        except queue.Full:
+            self.dropped += 1
+            self._dropped_unreported += 1
+
+    def stop(self):
+        """Ghi nốt các record còn trong queue rồi dừng thread nền"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self.stop()
+        super().close()
+
+
+def apply_level_overrides(value=None):
+    """
+    Đặt level từng logger theo chuỗi "tên=LEVEL,tên=LEVEL" (mặc định lấy từ
+    biến môi trường LOG_LEVELS). Tên "root" là root logger.
+    """
+    value = os.environ.get('LOG_LEVELS', '') if value is None else value
+    for item in value.split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            logger_name = None if name.strip() == 'root' else name.strip()
+            logging.getLogger(logger_name).setLevel(level.strip().upper())
@@ -0,0 +1,115 @@
+"""
+Tiện ích cho nhiều bãi đỗ trên cùng một hệ thống
+
+- Cache Lot theo mã bãi và Gate theo id trong bộ nhớ (bãi/cổng hầu như không đổi)
+- Khóa theo từng bãi: ingest ENTRY/EXIT của một bãi được tuần tự hóa để
+  tránh tạo trùng phiên, các bãi khác nhau chạy song song không tranh chấp
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+_lot_cache = {}
+_gate_cache = {}
+_lot_cache_lock = threading.Lock()
+
+_lot_locks = {}
+_lot_locks_guard = threading.Lock()
+
+
+def get_lot(code):
+    """Lấy Lot theo mã (có cache), None nếu không tồn tại"""
+    from .models import Lot
+
+    lot = _lot_cache.get(code)
+    if lot is None:
+        lot = Lot.objects.filter(code=code).first()
+        if lot is not None:
+            with _lot_cache_lock:
+                _lot_cache[code] = lot
+    return lot
+
+
+async def aget_lot(code):
+    """Bản async của get_lot (cache trúng thì không truy vấn)"""
+    from .models import Lot
+
+    lot = _lot_cache.get(code)
+    if lot is None:
+        lot = await Lot.objects.filter(code=code).afirst()
+        if lot is not None:
+            with _lot_cache_lock:
+                _lot_cache[code] = lot
+    return lot
+
+
+def get_default_lot():
+    """Bãi mặc định - dùng cho camera chưa đăng ký và dữ liệu cũ"""
+    from .models import Lot
+
+    lot = get_lot(Lot.DEFAULT_CODE)
+    if lot is None:
+        lot, _ = Lot.objects.get_or_create(
+            code=Lot.DEFAULT_CODE, defaults={'name': 'Bãi đỗ chính', 'capacity': 6}
+        )
+        with _lot_cache_lock:
+            _lot_cache[lot.code] = lot
+    return lot
+
+
+def get_gate(gate_id, cached_only=False):
+    """Lấy Gate theo id (có cache), None nếu không tồn tại (hoặc chưa có trong cache khi `cached_only`)"""
+    from .models import Gate
+
+    gate = _gate_cache.get(gate_id)
+    if gate is None and not cached_only:
+        gate = Gate.objects.filter(id=gate_id).first()
+        if gate is not None:
+            with _lot_cache_lock:
+                _gate_cache[gate_id] = gate
+    return gate
+
+
+def invalidate_lot_cache():
+    with _lot_cache_lock:
+        _lot_cache.clear()
+        _gate_cache.clear()
+
+
+@contextmanager
+def lot_lock(lot_id):
+    """Khóa ingest của một bãi (trong process hiện tại)"""
+    lock = _lot_locks.get(lot_id)
+    if lock is None:
+        with _lot_locks_guard:
+            lock = _lot_locks.setdefault(lot_id, threading.Lock())
+    with lock:
+        yield
+
+
+def lot_from_request(request):
+    """
+    Đọc tham số ?lot=<mã bãi>
+
+    Returns:
+        tuple: (lot, error) - lot là None nếu không truyền tham số (tất cả các bãi)
+    """
+    code = request.GET.get('lot')
+    if not code:
+        return None, None
+    lot = get_lot(code)
+    if lot is None:
+        return None, f'Bãi đỗ "{code}" không tồn tại'
+    return lot, None
+
+
+async def alot_from_request(request):
+    """Bản async của lot_from_request"""
+    code = request.GET.get('lot')
+    if not code:
+        return None, None
+    lot = await aget_lot(code)
+    if lot is None:
+        return None, f'Bãi đỗ "{code}" không tồn tại'
+    return lot, None
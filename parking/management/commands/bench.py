@@ -0,0 +1,175 @@
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases
+from django.utils import timezone
+
+from parking import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ingest / stream / dashboard (p50/p95/p99, throughput, số query) và so sánh với baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', nargs='+', choices=sorted(benchmarks.SCENARIOS),
+                            default=sorted(benchmarks.SCENARIOS), help='Kịch bản cần chạy')
+        parser.add_argument('--url', help='Bắn vào server đang chạy thay vì test client (vd: http://localhost:8000)')
+        parser.add_argument('--device-id', help='(--url) device_id để ký request camera')
+        parser.add_argument('--secret', help='(--url) secret_key của thiết bị')
+        parser.add_argument('--session-cookie', help='(--url) sessionid để gọi API cần đăng nhập')
+        parser.add_argument('--iterations', type=int, default=200, help='ingest: số lần đọc biển số')
+        parser.add_argument('--plates', type=int, default=50, help='ingest: số biển số khác nhau')
+        parser.add_argument('--cameras', type=int, default=4, help='stream: số camera')
+        parser.add_argument('--viewers', type=int, default=4, help='stream: số viewer')
+        parser.add_argument('--frames', type=int, default=60, help='stream: số frame mỗi camera gửi')
+        parser.add_argument('--rounds', type=int, default=20, help='dashboard: số vòng polling')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--poll-concurrency', type=int, default=64,
+                            help='poll: số client poll đồng thời (bản sync và bản async)')
+        parser.add_argument('--seed-sessions', type=int, default=2000, help='Số phiên mẫu tạo trước (in-process)')
+        parser.add_argument('--save', help='Lưu kết quả ra file JSON')
+        parser.add_argument('--baseline', help='File JSON baseline để so sánh')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Tỉ lệ tăng tối đa của p95/số query so với baseline (mặc định 0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            results = self.run_remote(options)
+        else:
+            results = self.run_in_process(options)
+
+        self.print_results(results)
+
+        if options['save']:
+            benchmarks.save_results(options['save'], results)
+            self.stdout.write(f"Đã lưu kết quả: {options['save']}")
+
+        if options['baseline']:
+            regressions = benchmarks.compare(results, benchmarks.load_baseline(options['baseline']),
+                                             options['threshold'])
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(f'REGRESSION {line}')
+                raise CommandError(f'{len(regressions)} chỉ số vượt ngưỡng {options["threshold"]:.0%} so với baseline')
+            self.stdout.write(self.style.SUCCESS('Không có regression so với baseline'))
+
+    # ---------- chạy ----------
+
+    def run_scenarios(self, client, options, ingest_device=None, stream_devices=None, poll_cookie=None):
+        scenario_results = {}
+        for name in options['scenario']:
+            if name == 'poll':
+                if options['url']:
+                    self.stderr.write('Bỏ qua poll: chỉ chạy trong process (so sánh bản sync / async)')
+                    continue
+                for mode in ('sync', 'async'):
+                    recorder = benchmarks.Recorder()
+                    started = time.perf_counter()
+                    benchmarks.run_poll(recorder, mode == 'async', rounds=options['rounds'],
+                                        concurrency=options['poll_concurrency'], cookie=poll_cookie)
+                    scenario_results[f'poll-{mode}'] = recorder.summary(time.perf_counter() - started)
+                    self.stdout.write(f'✓ poll-{mode}')
+                continue
+            recorder = benchmarks.Recorder()
+            started = time.perf_counter()
+            if name == 'ingest':
+                benchmarks.run_ingest(client, recorder, iterations=options['iterations'], plates=options['plates'],
+                                      concurrency=options['concurrency'], device=ingest_device)
+            elif name == 'stream':
+                benchmarks.run_stream(client, recorder, cameras=options['cameras'], viewers=options['viewers'],
+                                      frames=options['frames'], devices=stream_devices)
+            elif name == 'dashboard':
+                benchmarks.run_dashboard(client, recorder, rounds=options['rounds'],
+                                         concurrency=options['concurrency'])
+            scenario_results[name] = recorder.summary(time.perf_counter() - started)
+            self.stdout.write(f'✓ {name}')
+        return {
+            'created_at': timezone.now().isoformat(),
+            'mode': 'http' if options['url'] else 'in-process',
+            'python': platform.python_version(),
+            'options': {k: options[k] for k in ('iterations', 'plates', 'cameras', 'viewers', 'frames',
+                                                 'rounds', 'concurrency', 'poll_concurrency', 'seed_sessions')},
+            'scenarios': scenario_results,
+        }
+
+    def run_remote(self, options):
+        client = benchmarks.HttpClient(options['url'], options['session_cookie'])
+        device = (options['device_id'], options['secret']) if options['device_id'] else None
+        stream_devices = {f'bench_cam_{i}': options['secret'] for i in range(options['cameras'])} if device else None
+        return self.run_scenarios(client, options, device, stream_devices)
+
+    def run_in_process(self, options):
+        from django.contrib.auth.models import User
+        from parking.device_auth import rate_limiter, secret_cache
+        from parking.lots import get_default_lot, invalidate_lot_cache
+        from parking.models import CameraDevice
+        from parking.streaming import broker
+        from parking.task_queue import task_queue
+
+        tmp_dir = tempfile.mkdtemp(prefix='parking-bench-')
+        setup_test_environment()
+        # SQLite in-memory (shared cache) khóa theo bảng, không chịu được truy cập đồng thời
+        # -> dùng file tạm giống môi trường thật
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+        old_config = setup_databases(verbosity=0, interactive=False)
+        old_stream_dir = broker.config['STREAM_DIR']
+        old_limits = rate_limiter.limits
+        try:
+            with override_settings(
+                MEDIA_ROOT=tmp_dir,
+                TASK_QUEUE=dict(getattr(settings, 'TASK_QUEUE', {}), SPOOL_DIR=os.path.join(tmp_dir, 'tasks')),
+            ):
+                broker.config['STREAM_DIR'] = os.path.join(tmp_dir, 'streams')
+                # Đo đường xử lý, không đo giới hạn tốc độ theo thiết bị
+                rate_limiter.limits = {}
+                secret_cache.invalidate()
+                invalidate_lot_cache()
+
+                lot = get_default_lot()
+                user = User.objects.create_superuser('bench', 'bench@example.com', 'bench')
+                ingest = CameraDevice.objects.create(device_id='bench_gate', lot=lot)
+                stream_devices = {}
+                for i in range(options['cameras']):
+                    camera = CameraDevice.objects.create(device_id=f'bench_cam_{i}', lot=lot)
+                    stream_devices[camera.device_id] = camera.secret_key
+                if options['seed_sessions']:
+                    benchmarks.seed_sessions(options['seed_sessions'])
+
+                client = benchmarks.InProcessClient(user)
+                results = self.run_scenarios(client, options, (ingest.device_id, ingest.secret_key), stream_devices,
+                                             client.client.cookies['sessionid'].value)
+
+                # Chờ tác vụ nền chạy xong trước khi xóa database test
+                deadline = time.time() + 10
+                while task_queue.stats()['depth'] and time.time() < deadline:
+                    time.sleep(0.1)
+                results['task_queue'] = task_queue.stats()
+                return results
+        finally:
+            broker.config['STREAM_DIR'] = old_stream_dir
+            rate_limiter.limits = old_limits
+            secret_cache.invalidate()
+            invalidate_lot_cache()
+            teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # ---------- báo cáo ----------
+
+    def print_results(self, results):
+        header = f"{'scenario':<10} {'endpoint':<42} {'req':>6} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'queries':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for scenario, labels in results['scenarios'].items():
+            for label, row in labels.items():
+                queries = '-' if row['avg_queries'] is None else row['avg_queries']
+                self.stdout.write(
+                    f"{scenario:<10} {label[:42]:<42} {row['requests']:>6} {row['errors']:>4} "
+                    f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8} {row['throughput_rps']:>8} {queries:>8}"
+                )
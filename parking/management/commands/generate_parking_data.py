@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as time_cls
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from parking import datagen, profiles
+from parking.models import CameraDevice, DailyRollup, Lot, ParkingSession, VehicleDetection
+
+
+@contextmanager
+def historical_timestamps():
+    """Tắt auto_now/auto_now_add để bulk_create giữ được thời điểm trong quá khứ"""
+    fields = [
+        ParkingSession._meta.get_field('created_at'),
+        ParkingSession._meta.get_field('updated_at'),
+        VehicleDetection._meta.get_field('detected_at'),
+    ]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Sinh lịch sử ParkingSession/VehicleDetection giả lập quy mô lớn '
+            '(biển số VN, cao điểm theo giờ/thứ/mùa, khách quen) - cùng --seed và --end cho cùng dữ liệu')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=100_000, help='Tổng số phiên đỗ cần sinh')
+        parser.add_argument('--days', type=int, default=730, help='Số ngày lịch sử (tính lùi từ --end)')
+        parser.add_argument('--end', help='Thời điểm kết thúc YYYY-MM-DD[THH:MM] (mặc định: bây giờ)')
+        parser.add_argument('--lots', help='Danh sách mã bãi, phân tách bằng dấu phẩy (mặc định: bãi mặc định)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Số process sinh dữ liệu (ghi database vẫn ở process chính)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Số dòng mỗi lần bulk_create')
+        parser.add_argument('--regulars', type=int, help='Số khách quen (mặc định: sessions / 200)')
+        parser.add_argument('--repeat-rate', type=float, default=0.35, help='Tỉ lệ lượt vào là khách quen')
+        parser.add_argument('--no-detections', action='store_true', help='Chỉ sinh ParkingSession')
+        parser.add_argument('--no-rollups', action='store_true', help='Không tính lại DailyRollup / hồ sơ xe sau khi sinh')
+        parser.add_argument('--clear', action='store_true',
+                            help='XÓA toàn bộ phiên/lần phát hiện/thống kê của các bãi đã chọn trước khi sinh')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['sessions'] < 1:
+            raise CommandError('--days và --sessions phải lớn hơn 0')
+
+        lots = self.resolve_lots(options['lots'])
+        config = datagen.GenerationConfig(
+            seed=options['seed'],
+            end=self.parse_end(options['end']),
+            days=options['days'],
+            repeat_rate=options['repeat_rate'],
+            regulars=options['regulars'] if options['regulars'] is not None else max(100, options['sessions'] // 200),
+            detections=not options['no_detections'],
+            lots=self.lot_layout(lots),
+        )
+
+        if options['clear']:
+            lot_ids = [lot.id for lot in lots]
+            VehicleDetection.objects.filter(lot_id__in=lot_ids).delete()
+            ParkingSession.objects.filter(lot_id__in=lot_ids).delete()
+            DailyRollup.objects.filter(lot_id__in=lot_ids).delete()
+            self.stdout.write('Đã xóa dữ liệu cũ của ' + ', '.join(lot.code for lot in lots))
+
+        plan = datagen.plan_days(config, options['sessions'])
+        self.stdout.write(f"Sinh {options['sessions']:,} phiên cho {len(lots)} bãi, {config.days} ngày "
+                          f"đến {timezone.localtime(config.end):%Y-%m-%d %H:%M} ({len(plan)} chunk, "
+                          f"{options['workers']} worker)")
+
+        started = time.perf_counter()
+        totals = self.write(plan, config, options['workers'], options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã ghi {totals['sessions']:,} phiên, {totals['detections']:,} lần phát hiện "
+            f"trong {elapsed:.1f}s ({(totals['sessions'] + totals['detections']) / max(elapsed, 1e-9):,.0f} dòng/s)"
+        ))
+
+        if not options['no_rollups']:
+            self.refresh_rollups(plan)
+            self.stdout.write(f'Đã tính lại {profiles.rebuild():,} hồ sơ xe')
+
+    # ---------- tham số ----------
+
+    def parse_end(self, value):
+        if not value:
+            return timezone.now()
+        try:
+            end = datetime.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'--end không hợp lệ: {value}')
+        if len(value) == 10:
+            end = datetime.combine(end.date(), time_cls.max)
+        return timezone.make_aware(end) if timezone.is_naive(end) else end
+
+    def resolve_lots(self, codes):
+        from parking.lots import get_default_lot
+
+        if not codes:
+            return [get_default_lot()]
+        codes = [code.strip() for code in codes.split(',') if code.strip()]
+        lots = list(Lot.objects.filter(code__in=codes))
+        missing = set(codes) - {lot.code for lot in lots}
+        if missing:
+            raise CommandError('Không tìm thấy bãi: ' + ', '.join(sorted(missing)))
+        return sorted(lots, key=lambda lot: lot.code)
+
+    def lot_layout(self, lots):
+        """Cổng vào/ra và mã camera của từng bãi (dữ liệu thuần gửi sang worker)"""
+        cameras = dict(CameraDevice.objects.filter(gate__isnull=False).values_list('gate_id', 'device_id'))
+        layout = {}
+        for lot in lots:
+            gates = list(lot.gates.order_by('code'))
+            layout[lot.id] = {
+                'code': lot.code,
+                'capacity': lot.capacity,
+                'entry_gates': [(g.id, cameras.get(g.id, 'raspberrypi_cam')) for g in gates if g.direction != 'EXIT'],
+                'exit_gates': [(g.id, cameras.get(g.id, 'raspberrypi_cam')) for g in gates if g.direction != 'ENTRY'],
+            }
+        return layout
+
+    # ---------- ghi database ----------
+
+    def chunks(self, plan, config, workers):
+        """Kết quả từng chunk theo đúng thứ tự plan (imap giữ thứ tự nên id ổn định)"""
+        if workers <= 1:
+            datagen.init_worker(config)
+            for chunk in plan:
+                yield datagen.generate_chunk(chunk)
+            return
+
+        with multiprocessing.Pool(workers, initializer=datagen.init_worker, initargs=(config,)) as pool:
+            yield from pool.imap(datagen.generate_chunk, plan, chunksize=4)
+
+    def write(self, plan, config, workers, batch_size):
+        totals = {'sessions': 0, 'detections': 0}
+        sessions, detections = [], []
+        last_report = time.perf_counter()
+
+        if workers > 1:
+            # Không để process con thừa kế kết nối database đang mở
+            connections.close_all()
+        if connection.vendor == 'sqlite':
+            # Dữ liệu giả lập sinh lại được - không cần fsync từng transaction
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+
+        with historical_timestamps():
+            for session_rows, detection_rows in self.chunks(plan, config, workers):
+                for (plate, entry_time, exit_time, duration, fee, status, payment_status,
+                     lot_id, entry_gate_id, exit_gate_id) in session_rows:
+                    sessions.append(ParkingSession(
+                        license_plate=plate, entry_time=entry_time, exit_time=exit_time,
+                        duration_minutes=duration, fee=fee, status=status, payment_status=payment_status,
+                        lot_id=lot_id, entry_gate_id=entry_gate_id, exit_gate_id=exit_gate_id,
+                        created_at=entry_time, updated_at=exit_time or entry_time,
+                    ))
+                for plate, confidence, detected_at, event_type, source, lot_id, gate_id in detection_rows:
+                    detections.append(VehicleDetection(
+                        license_plate=plate, confidence=confidence, detected_at=detected_at,
+                        event_type=event_type, camera_source=source, lot_id=lot_id, gate_id=gate_id,
+                    ))
+
+                if len(sessions) + len(detections) >= batch_size:
+                    self.flush(sessions, detections, totals, batch_size)
+                    sessions, detections = [], []
+                    if time.perf_counter() - last_report > 5:
+                        last_report = time.perf_counter()
+                        self.stdout.write(f"  ... {totals['sessions']:,} phiên, {totals['detections']:,} lần phát hiện")
+
+            self.flush(sessions, detections, totals, batch_size)
+        return totals
+
+    def flush(self, sessions, detections, totals, batch_size):
+        with transaction.atomic():
+            ParkingSession.objects.bulk_create(sessions, batch_size=batch_size)
+            VehicleDetection.objects.bulk_create(detections, batch_size=batch_size)
+        totals['sessions'] += len(sessions)
+        totals['detections'] += len(detections)
+
+    def refresh_rollups(self, plan):
+        from parking.tasks import refresh_daily_rollup
+
+        keys = sorted({(lot_id, day) for lot_id, day, _ in plan})
+        for lot_id, day in keys:
+            refresh_daily_rollup(lot_id=lot_id, date=day.isoformat())
+        self.stdout.write(f'Đã tính lại {len(keys):,} DailyRollup')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from parking.models import VehicleDetection
+from parking.thumbnails import generate_for_detection
+
+
+class Command(BaseCommand):
+    help = 'Tạo ảnh thu nhỏ cho ảnh nhận diện chưa có (dữ liệu cũ trước khi bật THUMBNAILS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Tạo lại cả ảnh đã có digest (bỏ qua file đã tồn tại)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        detections = VehicleDetection.objects.exclude(image_path='').exclude(image_path__isnull=True)
+        if not options['all']:
+            detections = detections.filter(image_digest='')
+        ids = detections.order_by('id').values_list('id', flat=True)
+
+        done = failed = 0
+        last_id = 0
+        while True:
+            batch = list(ids.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for detection_id in batch:
+                if generate_for_detection(detection_id):
+                    done += 1
+                else:
+                    failed += 1
+            last_id = batch[-1]
+            self.stdout.write(f'... {done + failed} ảnh')
+
+        self.stdout.write(self.style.SUCCESS(f'Đã tạo ảnh thu nhỏ cho {done} ảnh ({failed} ảnh lỗi/thiếu file)'))
@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parking.subscriptions import import_rows
+
+
+class Command(BaseCommand):
+    help = ('Nhập danh sách vé tháng / xe miễn phí từ file CSV '
+            '(cột: license_plate, valid_from, valid_until, tùy chọn lot, kind, holder, note)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Đường dẫn file CSV (dòng đầu là tên cột)')
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ kiểm tra, không ghi database')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8-sig') as f:
+                reader = csv.DictReader(f)
+                missing = {'license_plate', 'valid_from', 'valid_until'} - set(reader.fieldnames or ())
+                if missing:
+                    raise CommandError(f"Thiếu cột: {', '.join(sorted(missing))}")
+                result = import_rows(reader, dry_run=options['dry_run'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for line, error in result['errors']:
+            # +1: dòng tiêu đề
+            self.stderr.write(f'Dòng {line + 1}: {error}')
+        prefix = '[dry-run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Thêm {result['created']:,} vé, bỏ qua {result['skipped']:,} vé đã có, "
+            f"{len(result['errors']):,} dòng lỗi"
+        ))
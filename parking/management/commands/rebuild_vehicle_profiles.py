@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from parking.profiles import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Tính lại hồ sơ xe (số lượt, nợ chưa thanh toán) từ ParkingSession'
+
+    def add_arguments(self, parser):
+        parser.add_argument('plates', nargs='*', help='Biển số cần tính lại (mặc định: tất cả)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild(options['plates'] or None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã tính lại {count:,} hồ sơ xe trong {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,62 @@
+import json
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from parking.lots import get_lot
+from parking.tariffs import CURRENT_TARIFF, forecast, parse_tariff, simulate
+
+
+class Command(BaseCommand):
+    help = 'Tính lại doanh thu các phiên đã hoàn thành theo biểu phí khác và dự báo doanh thu'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='Ngày đầu (YYYY-MM-DD), mặc định: 1 năm trước')
+        parser.add_argument('--end', type=date.fromisoformat, help='Ngày cuối (YYYY-MM-DD), mặc định: hôm nay')
+        parser.add_argument('--lot', help='Mã bãi đỗ (mặc định: tất cả các bãi)')
+        parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                            help=f"Thay đổi biểu phí, KEY trong {', '.join(CURRENT_TARIFF)}")
+        parser.add_argument('--forecast-days', type=int, default=14)
+        parser.add_argument('--json', action='store_true', help='In kết quả dạng JSON')
+
+    def handle(self, *args, **options):
+        try:
+            values = dict(item.split('=', 1) for item in options['set'])
+            tariff = parse_tariff({key.upper(): None if value.lower() == 'none' else value
+                                   for key, value in values.items()})
+        except ValueError as e:
+            raise CommandError(str(e) or 'Dùng --set KEY=VALUE')
+        end = options['end'] or timezone.localtime().date()
+        start = options['start'] or end - timedelta(days=365)
+        lot_ids = None
+        if options['lot']:
+            lot = get_lot(options['lot'])
+            if lot is None:
+                raise CommandError(f"Bãi đỗ \"{options['lot']}\" không tồn tại")
+            lot_ids = [lot.id]
+
+        started = time.perf_counter()
+        result = simulate(tariff, start, end, lot_ids=lot_ids)
+        elapsed = time.perf_counter() - started
+        result['forecast'] = forecast(options['forecast_days'], lot_ids=lot_ids, ratio=result['ratio'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'tariff': tariff, **result}, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"Biểu phí: {tariff}")
+        self.stdout.write(f"{'Thời lượng (phút)':<18}{'Số phiên':>10}{'Thực thu':>15}{'Mô phỏng':>15}{'Chênh lệch':>15}")
+        for row in result['durations']:
+            self.stdout.write(f"{row['label']:<18}{row['sessions']:>10}{row['current']:>15,}"
+                              f"{row['simulated']:>15,}{row['delta']:>+15,}")
+        self.stdout.write('')
+        self.stdout.write('Dự báo: ' + ', '.join(
+            f"{row['date']}: {row['baseline']:,}" + (f" → {row['simulated']:,}" if row['simulated'] is not None else '')
+            for row in result['forecast'][:7]
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['sessions']} phiên ({start} - {end}) trong {elapsed:.2f}s: "
+            f"{result['current']:,}đ → {result['simulated']:,}đ ({result['delta']:+,}đ)"
+        ))
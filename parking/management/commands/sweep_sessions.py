@@ -0,0 +1,53 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from parking.sweeper import get_config, sweep_sessions
+from parking.tasks import refresh_daily_rollup
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Đánh dấu / tự đóng các phiên ACTIVE bị treo theo chính sách SESSION_SWEEP (chạy từ cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ liệt kê số phiên sẽ bị xử lý')
+        parser.add_argument('--flag-after', type=float, help='Số giờ trước khi đánh dấu cần kiểm tra')
+        parser.add_argument('--close-after', type=float, help='Số giờ trước khi tự đóng')
+        parser.add_argument('--loop', action='store_true',
+                            help="Chạy như process riêng, quét mỗi SESSION_SWEEP['INTERVAL'] giây (thay cho cron)")
+
+    def handle(self, *args, **options):
+        config = get_config()
+        if options['flag_after'] is not None:
+            config['FLAG_AFTER_HOURS'] = options['flag_after']
+        if options['close_after'] is not None:
+            config['CLOSE_AFTER_HOURS'] = options['close_after']
+
+        if not options['loop']:
+            self.sweep(config, options['dry_run'])
+            return
+        # Chỉ chạy đúng MỘT process --loop cho cả hệ thống
+        try:
+            while True:
+                try:
+                    self.sweep(config, options['dry_run'])
+                except Exception:
+                    logger.exception('Session sweep failed')
+                time.sleep(config['INTERVAL'])
+        except KeyboardInterrupt:
+            pass
+
+    def sweep(self, config, dry_run):
+        summary = sweep_sessions(config=config, dry_run=dry_run)
+        for lot_id, day in summary['rollups'] if not dry_run else ():
+            refresh_daily_rollup(lot_id, day)
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Đóng {summary['contradicted']} phiên bị xe vào lại, {summary['timed_out']} phiên quá hạn; "
+            f"đánh dấu {summary['flagged']} phiên cần kiểm tra"
+        ))
@@ -0,0 +1,173 @@
+"""
+Phục vụ file media (ảnh nhận diện, ảnh stream, clip, hóa đơn)
+
+Django chỉ kiểm tra quyền và header điều kiện, phần truyền file giao cho:
+    'nginx'   X-Accel-Redirect tới location internal ACCEL_PREFIX
+    'apache'  X-Sendfile (mod_xsendfile, lighttpd) với đường dẫn tuyệt đối
+    'django'  FileResponse - WSGI server có wsgi.file_wrapper (gunicorn,
+              uWSGI) gửi bằng sendfile, không copy qua Python
+Cả 3 chế độ đều trả ETag/Last-Modified và xử lý If-None-Match /
+If-Modified-Since (304); chế độ 'django' xử lý thêm Range (206) cho clip.
+
+Cấu hình nginx tương ứng BACKEND='nginx':
+    location /protected-media/ {
+        internal;
+        alias /path/to/media/;
+    }
+"""
+
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+
+DEFAULT_MEDIA_SERVING = {
+    'BACKEND': 'django',                    # 'django' | 'nginx' | 'apache'
+    'ACCEL_PREFIX': '/protected-media/',    # location internal của nginx trỏ tới MEDIA_ROOT
+    'LOGIN_REQUIRED': True,                 # chỉ người dùng đã đăng nhập mới xem được media
+    'PUBLIC_PREFIXES': [],                  # thư mục không cần đăng nhập (ảnh thu nhỏ cũng có biển số)
+    'CACHE_CONTROL': {                      # theo tiền tố đường dẫn, khớp dài nhất
+        '': 'private, max-age=3600',
+        'streams/': 'no-cache',             # ảnh stream ghi đè liên tục
+        'thumbs/': 'private, max-age=31536000, immutable',
+    },
+}
+
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CHUNK_SIZE = 64 * 1024
+
+
+def get_config():
+    config = dict(DEFAULT_MEDIA_SERVING)
+    config.update(getattr(settings, 'MEDIA_SERVING', {}))
+    return config
+
+
+def _cache_control(path, config):
+    prefix = max((p for p in config['CACHE_CONTROL'] if path.startswith(p)), key=len, default=None)
+    return config['CACHE_CONTROL'].get(prefix)
+
+
+def _parse_range(header, size):
+    """
+    Một khoảng byte duy nhất "bytes=a-b" / "bytes=a-" / "bytes=-n"
+
+    Returns:
+        tuple | None | False: (start, end) bao gồm end; None nếu không có/không hỗ trợ
+            (trả cả file); False nếu khoảng nằm ngoài file (416)
+    """
+    match = _RANGE_PATTERN.match(header.strip()) if header else None
+    if not match or not (match[1] or match[2]):
+        return None
+    if match[1]:
+        start = int(match[1])
+        end = min(int(match[2]), size - 1) if match[2] else size - 1
+    else:
+        start, end = max(0, size - int(match[2])), size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, path, cache_control=None, config=None):
+    """
+    Trả file `path` (tương đối với MEDIA_ROOT) theo BACKEND, có xử lý GET điều kiện
+
+    Không kiểm tra quyền - view gọi hàm này tự kiểm tra trước.
+    """
+    config = config or get_config()
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid path')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('File not found')
+    if not os.path.isfile(full_path):
+        raise Http404('File not found')
+
+    etag = f'"{int(stat.st_mtime_ns):x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+    cache_control = cache_control or _cache_control(path, config)
+
+    def add_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        if cache_control:
+            response['Cache-Control'] = cache_control
+        return response
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        return add_headers(conditional)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if config['BACKEND'] == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = config['ACCEL_PREFIX'].rstrip('/') + '/' + quote(path)
+        return add_headers(response)
+    if config['BACKEND'] == 'apache':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return add_headers(response)
+
+    # Range (tua clip): chỉ khi If-Range (nếu có) còn khớp phiên bản hiện tại
+    byte_range = None
+    if request.method == 'GET' and 'Range' in request.headers:
+        if_range = request.headers.get('If-Range')
+        if if_range is None or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+            byte_range = _parse_range(request.headers['Range'], stat.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return add_headers(response)
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(full_path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    else:
+        # FileResponse: WSGI server gửi bằng wsgi.file_wrapper (sendfile) nếu hỗ trợ
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    return add_headers(response)
+
+
+def can_view(request, path, config=None):
+    """Người dùng của request có được xem file media `path` không (LOGIN_REQUIRED / PUBLIC_PREFIXES)"""
+    config = config or get_config()
+    public = any(path.startswith(prefix) for prefix in config['PUBLIC_PREFIXES'])
+    return not config['LOGIN_REQUIRED'] or public or request.user.is_authenticated
+
+
+def serve_media(request, path):
+    """View thay cho static(MEDIA_URL): kiểm tra quyền rồi giao file cho serve_file"""
+    config = get_config()
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=405, headers={'Allow': 'GET, HEAD'})
+    if not can_view(request, path, config):
+        return HttpResponseForbidden('Login required')
+    return serve_file(request, path, config=config)
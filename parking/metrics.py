@@ -0,0 +1,418 @@
+"""
+Đo lường từng request: latency, số truy vấn SQL và thời gian SQL, số byte
+trả về, số kết nối streaming đang mở - xuất ra /metrics theo định dạng
+Prometheus
+
+- MetricsMiddleware đặt đầu MIDDLEWARE, bọc mỗi request bằng
+  connection.execute_wrapper để đếm truy vấn (chỉ cộng dồn số, không format
+  SQL) nên chi phí đủ thấp để bật thường xuyên trên production
+- Nhãn theo view (resolver_match.view_name), không theo URL, để số series
+  không tăng theo id trong đường dẫn
+- Request chậm hơn SLOW_REQUEST_MS được ghi log kèm các câu SQL của request
+- Module khác đăng ký thêm số liệu riêng bằng register_collector()
+- Registry nằm trong bộ nhớ của từng process: với nhiều worker, mỗi lần
+  scrape chỉ thấy số liệu của worker trả lời request đó (counter có thể
+  "lùi" giữa hai lần scrape) - cần cộng theo worker ở phía Prometheus
+- Khi DEBUG = False, /metrics yêu cầu TOKEN hoặc phiên đăng nhập staff
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('parking.metrics.slow')
+
+DEFAULT_METRICS = {
+    'ENABLED': True,
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'QUERY_BUCKETS': (0, 1, 2, 5, 10, 20, 50, 100, 500),
+    'SLOW_REQUEST_MS': 1000,       # None: tắt log request chậm
+    'SLOW_LOG_MAX_QUERIES': 20,    # số câu SQL tối đa (chậm nhất) ghi kèm mỗi request chậm
+    'TOKEN': None,                 # header "Authorization: Bearer <TOKEN>" (không có: chỉ staff đăng nhập, trừ khi DEBUG)
+}
+
+
+def get_config():
+    config = dict(DEFAULT_METRICS)
+    config.update(getattr(settings, 'METRICS', {}))
+    return config
+
+
+class Histogram:
+    """Histogram bucket cố định (đếm theo bucket, chưa cộng dồn) + tổng + số mẫu"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # phần tử cuối: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collectors = []
+        self.reset()
+
+    def reset(self):
+        config = get_config()
+        with self._lock:
+            self.config = config
+            self.latency = {}           # (view, method) -> Histogram
+            self.query_counts = {}      # view -> Histogram
+            self.requests = {}          # (view, method, status) -> int
+            self.query_time = {}        # view -> giây
+            self.response_bytes = {}    # view -> byte
+            self.streams_open = {}      # view -> số kết nối đang mở
+            self.streams_total = {}     # view -> số kết nối đã mở
+
+    def register_collector(self, func):
+        """
+        Đăng ký hàm trả về số liệu bổ sung khi xuất /metrics
+
+        func() -> iterable of (name, type, help, [(labels dict, value), ...])
+
+        Với type 'histogram', value là (buckets, counts, sum, count) như Histogram
+        """
+        self._collectors.append(func)
+        return func
+
+    def record_request(self, view, method, status, duration, queries, query_time, response_bytes):
+        with self._lock:
+            histogram = self.latency.get((view, method))
+            if histogram is None:
+                histogram = self.latency[(view, method)] = Histogram(self.config['LATENCY_BUCKETS'])
+            histogram.observe(duration)
+
+            histogram = self.query_counts.get(view)
+            if histogram is None:
+                histogram = self.query_counts[view] = Histogram(self.config['QUERY_BUCKETS'])
+            histogram.observe(queries)
+
+            key = (view, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.query_time[view] = self.query_time.get(view, 0.0) + query_time
+            if response_bytes:
+                self.response_bytes[view] = self.response_bytes.get(view, 0) + response_bytes
+
+    def stream_opened(self, view):
+        with self._lock:
+            self.streams_open[view] = self.streams_open.get(view, 0) + 1
+            self.streams_total[view] = self.streams_total.get(view, 0) + 1
+
+    def stream_closed(self, view, sent_bytes):
+        with self._lock:
+            self.streams_open[view] = self.streams_open.get(view, 1) - 1
+            self.response_bytes[view] = self.response_bytes.get(view, 0) + sent_bytes
+
+    # ---------- xuất Prometheus ----------
+
+    def render(self):
+        lines = []
+
+        with self._lock:
+            latency = {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in self.latency.items()}
+            query_counts = {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in self.query_counts.items()}
+            requests = dict(self.requests)
+            query_time = dict(self.query_time)
+            response_bytes = dict(self.response_bytes)
+            streams_open = dict(self.streams_open)
+            streams_total = dict(self.streams_total)
+
+        _render_histograms(lines, 'parking_http_request_duration_seconds',
+                           'Thời gian xử lý request (streaming: đến khi trả header)',
+                           {_labels(view=v, method=m): h for (v, m), h in latency.items()})
+        _render_histograms(lines, 'parking_db_queries_per_request', 'Số truy vấn SQL mỗi request',
+                           {_labels(view=v): h for v, h in query_counts.items()})
+        _render_samples(lines, 'parking_http_requests_total', 'counter', 'Số request theo view/method/status',
+                        [(_labels(view=v, method=m, status=s), n) for (v, m, s), n in requests.items()])
+        _render_samples(lines, 'parking_db_query_seconds_total', 'counter', 'Tổng thời gian chạy SQL theo view',
+                        [(_labels(view=v), t) for v, t in query_time.items()])
+        _render_samples(lines, 'parking_http_response_bytes_total', 'counter', 'Tổng số byte body đã gửi',
+                        [(_labels(view=v), n) for v, n in response_bytes.items()])
+        _render_samples(lines, 'parking_streaming_connections', 'gauge', 'Kết nối streaming đang mở',
+                        [(_labels(view=v), n) for v, n in streams_open.items()])
+        _render_samples(lines, 'parking_streaming_connections_total', 'counter', 'Số kết nối streaming đã mở',
+                        [(_labels(view=v), n) for v, n in streams_total.items()])
+
+        for collector in self._collectors:
+            try:
+                for name, kind, help_text, samples in collector():
+                    if kind == 'histogram':
+                        _render_histograms(lines, name, help_text,
+                                           {_labels(**labels): value for labels, value in samples})
+                        continue
+                    _render_samples(lines, name, kind, help_text,
+                                    [(_labels(**labels), value) for labels, value in samples])
+            except Exception:
+                logger.exception('Metrics collector %r failed', collector)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _render_samples(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        lines.append(f'{name}{{{labels}}} {_number(value)}' if labels else f'{name} {_number(value)}')
+
+
+def _render_histograms(lines, name, help_text, histograms):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, (buckets, counts, total, count) in histograms.items():
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{_number(float(bound))}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {_number(total)}')
+        lines.append(f'{name}_count{{{labels}}} {count}')
+
+
+registry = MetricsRegistry()
+
+
+def register_collector(func):
+    return registry.register_collector(func)
+
+
+# ==================== MIDDLEWARE ====================
+
+class QueryCounter:
+    """execute_wrapper: đếm số truy vấn và thời gian SQL của một request"""
+
+    __slots__ = ('count', 'time', 'captured', 'capture')
+
+    def __init__(self, capture):
+        self.count = 0
+        self.time = 0.0
+        self.captured = []
+        self.capture = capture
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.time += elapsed
+            if self.capture:
+                # Chỉ giữ tham chiếu tới chuỗi SQL (không format params) - format khi thật sự ghi log
+                self.captured.append((elapsed, sql))
+
+
+class MetricsMiddleware:
+    """
+    Ghi số liệu cho mọi request. Đặt ở đầu MIDDLEWARE để đo cả các middleware
+    khác (session, auth, ...)
+    """
+
+    # Chạy được trong chuỗi middleware sync (WSGI) lẫn async (ASGI, view async không bị ép về thread)
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        config = get_config()
+        self.enabled = config['ENABLED']
+        self.slow_seconds = None if config['SLOW_REQUEST_MS'] is None else config['SLOW_REQUEST_MS'] / 1000
+        self.slow_log_max_queries = config['SLOW_LOG_MAX_QUERIES']
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        counter = QueryCounter(capture=self.slow_seconds is not None)
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        return self._record(request, response, counter, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        counter = QueryCounter(capture=self.slow_seconds is not None)
+        started = time.perf_counter()
+        # Kết nối database theo thread: gắn bộ đếm trong thread mà view sync / ORM async của request dùng
+        await sync_to_async(_add_wrapper)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_wrapper)(counter)
+        return self._record(request, response, counter, time.perf_counter() - started)
+
+    def _record(self, request, response, counter, duration):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unmatched'
+
+        response_bytes = 0
+        if response.streaming:
+            if not getattr(response, 'is_async', False):
+                registry.stream_opened(view)
+                response.streaming_content = _count_stream(response.streaming_content, view)
+        else:
+            response_bytes = len(response.content)
+
+        registry.record_request(view, request.method, response.status_code, duration,
+                                counter.count, counter.time, response_bytes)
+
+        if self.slow_seconds is not None and duration >= self.slow_seconds:
+            slowest = sorted(counter.captured, key=lambda item: item[0], reverse=True)
+            slow_logger.warning(
+                'Slow request %s %s -> %s in %.0fms (%d queries, %.0fms SQL)\n%s',
+                request.method, request.get_full_path(), response.status_code, duration * 1000,
+                counter.count, counter.time * 1000,
+                '\n'.join(f'  {elapsed * 1000:7.1f}ms  {sql}' for elapsed, sql in slowest[:self.slow_log_max_queries]),
+            )
+        return response
+
+
+def _add_wrapper(counter):
+    connection.execute_wrappers.append(counter)
+
+
+def _remove_wrapper(counter):
+    connection.execute_wrappers.remove(counter)
+
+
+def _count_stream(content, view):
+    """Bọc body streaming: đếm byte đã gửi, giảm số kết nối khi client ngắt"""
+    sent = 0
+    try:
+        for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        close = getattr(content, 'close', None)
+        if close is not None:
+            close()
+        registry.stream_closed(view, sent)
+
+
+# ==================== ENDPOINT ====================
+
+def metrics_view(request):
+    """GET /metrics - định dạng text của Prometheus (số liệu của riêng process trả lời)"""
+    token = get_config()['TOKEN']
+    user = getattr(request, 'user', None)
+    is_staff = user is not None and user.is_authenticated and (user.is_staff or user.is_superuser)
+    if token:
+        allowed = is_staff or request.headers.get('Authorization') == f'Bearer {token}'
+    else:
+        allowed = is_staff or settings.DEBUG
+    if not allowed:
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+
+# ==================== SỐ LIỆU HÀNG ĐỢI / STREAM ====================
+
+@register_collector
+def _task_queue_metrics():
+    from .task_queue import task_queue
+
+    stats = task_queue.stats()
+    yield 'parking_task_queue_depth', 'gauge', 'Số tác vụ nền đang chờ', [({}, stats['depth'])]
+    yield 'parking_tasks_total', 'counter', 'Số tác vụ nền theo kết quả', [
+        ({'result': result}, stats[result]) for result in ('enqueued', 'completed', 'retried', 'failed')
+    ]
+
+
+@register_collector
+def _stream_metrics():
+    from .streaming import broker
+
+    stats = broker.stats()
+    yield 'parking_stream_frames_total', 'counter', 'Số frame camera gửi lên theo kết quả', [
+        ({'camera': camera_id, 'result': result}, row[key])
+        for camera_id, row in stats.items()
+        for result, key in (('accepted', 'accepted'), ('rate_limited', 'dropped_rate_limited'),
+                            ('too_large', 'dropped_too_large'), ('stale', 'dropped_stale'))
+    ]
+    yield 'parking_stream_bytes_in_total', 'counter', 'Số byte frame đã nhận', [
+        ({'camera': camera_id}, row['bytes_in']) for camera_id, row in stats.items()
+    ]
+
+
+@register_collector
+def _camera_health_metrics():
+    from .camera_health import supervisor
+
+    cameras = supervisor.snapshot()
+    yield 'parking_camera_state', 'gauge', 'Trạng thái camera (1 = đang ở trạng thái này)', [
+        ({'camera': camera_id, 'state': state}, int(health['state'] == state))
+        for camera_id, health in cameras.items()
+        for state in ('live', 'degraded', 'stale')
+    ]
+    yield 'parking_camera_frame_age_seconds', 'gauge', 'Tuổi của frame mới nhất', [
+        ({'camera': camera_id}, health['frame_age']) for camera_id, health in cameras.items()
+        if health['frame_age'] is not None
+    ]
+
+
+@register_collector
+def _recognition_metrics():
+    from .recognition import recognizer_pool
+
+    if not recognizer_pool.enabled:
+        return
+    stats = recognizer_pool.stats()
+    yield 'parking_recognition_frames_total', 'counter', 'Frame gửi tới nhận diện phía server theo kết quả', [
+        ({'result': key}, stats[key]) for key in ('submitted', 'sampled', 'skipped', 'dropped', 'frames')
+    ]
+    yield 'parking_recognition_plates_total', 'counter', 'Biển số đọc được / đưa vào ENTRY-EXIT', [
+        ({'result': 'read'}, stats['plates']), ({'result': 'event'}, stats['events']),
+    ]
+    yield 'parking_recognition_pending', 'gauge', 'Frame chờ nhận diện', [({}, stats['pending'])]
+    yield 'parking_recognition_errors_total', 'counter', 'Batch nhận diện lỗi', [({}, stats['errors'])]
+
+
+@register_collector
+def _voting_metrics():
+    from .voting import plate_voter
+
+    if not plate_voter.enabled:
+        return
+    stats = plate_voter.stats()
+    yield 'parking_plate_reads_total', 'counter', 'Lần đọc biển số đưa vào bầu chọn', [({}, stats['reads'])]
+    yield 'parking_plate_passes_total', 'counter', 'Lượt xe qua cổng theo kết quả', [
+        ({'result': key}, stats[key]) for key in ('committed', 'rejected', 'duplicates', 'errors')
+    ]
+    yield 'parking_plate_passes_open', 'gauge', 'Lượt xe đang gom lần đọc', [({}, stats['open_passes'])]
@@ -1,18 +1,38 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.shortcuts import redirect
 from django.contrib import messages
 
 class RoleMiddleware:
+    # Hỗ trợ cả chuỗi middleware async (ASGI) để view async không bị ép chạy sync
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        if request.user.is_authenticated:
-            if 'dashboard' in request.path:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self._dashboard_redirect(request.user, request.path)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        response = self._dashboard_redirect(await request.auser(), request.path)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+    @staticmethod
+    def _dashboard_redirect(user, path):
+        if user.is_authenticated:
+            if 'dashboard' in path:
                 # Sử dụng is_superuser thay vì profile.role
-                if request.user.is_superuser and 'dashboard_admin' not in request.path:
+                if user.is_superuser and 'dashboard_admin' not in path:
                     return redirect('dashboard_admin')
-                elif not request.user.is_superuser and 'dashboard_user' not in request.path and 'dashboard' in request.path:
+                elif not user.is_superuser and 'dashboard_user' not in path and 'dashboard' in path:
                     return redirect('dashboard_user')
-        
-        response = self.get_response(request)
-        return response
\ No newline at end of file
+        return None
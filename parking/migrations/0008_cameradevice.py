@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:55
+
+import parking.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0007_alter_parkingsession_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CameraDevice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=50, unique=True, verbose_name='Mã thiết bị')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='Tên thiết bị')),
+                ('secret_key', models.CharField(default=parking.models.generate_device_secret, max_length=64, verbose_name='Khóa bí mật (HMAC)')),
+                ('lot', models.CharField(default='default', max_length=50, verbose_name='Bãi đỗ')),
+                ('gate', models.CharField(blank=True, max_length=50, verbose_name='Cổng')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Đang hoạt động')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Ngày tạo')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')),
+            ],
+            options={
+                'verbose_name': 'Thiết bị camera',
+                'verbose_name_plural': 'Thiết bị camera',
+                'ordering': ['device_id'],
+            },
+        ),
+    ]
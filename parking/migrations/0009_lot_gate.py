@@ -0,0 +1,148 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def assign_lots(apps, schema_editor):
+    """Tạo bãi mặc định, chuyển lot/gate dạng text của camera sang bảng Lot/Gate"""
+    Lot = apps.get_model('parking', 'Lot')
+    Gate = apps.get_model('parking', 'Gate')
+    CameraDevice = apps.get_model('parking', 'CameraDevice')
+    ParkingSession = apps.get_model('parking', 'ParkingSession')
+    VehicleDetection = apps.get_model('parking', 'VehicleDetection')
+
+    default_lot, _ = Lot.objects.get_or_create(
+        code='default', defaults={'name': 'Bãi đỗ chính', 'capacity': 6}
+    )
+    for device in CameraDevice.objects.all():
+        lot = default_lot
+        if device.lot_code and device.lot_code != default_lot.code:
+            lot, _ = Lot.objects.get_or_create(code=device.lot_code, defaults={'name': device.lot_code})
+        device.lot = lot
+        if device.gate_code:
+            device.gate, _ = Gate.objects.get_or_create(lot=lot, code=device.gate_code)
+        device.save(update_fields=['lot', 'gate'])
+
+    # Dữ liệu cũ đều thuộc bãi mặc định (hệ thống trước đây chỉ có 1 bãi)
+    ParkingSession.objects.filter(lot__isnull=True).update(lot=default_lot)
+    VehicleDetection.objects.filter(lot__isnull=True).update(lot=default_lot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0008_cameradevice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Gate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, verbose_name='Mã cổng')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='Tên cổng')),
+                ('direction', models.CharField(choices=[('BOTH', 'Vào và ra'), ('ENTRY', 'Chỉ vào'), ('EXIT', 'Chỉ ra')], default='BOTH', max_length=10, verbose_name='Chiều')),
+            ],
+            options={
+                'verbose_name': 'Cổng',
+                'verbose_name_plural': 'Cổng',
+                'ordering': ['lot', 'code'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, unique=True, verbose_name='Mã bãi')),
+                ('name', models.CharField(max_length=100, verbose_name='Tên bãi')),
+                ('capacity', models.PositiveIntegerField(default=0, verbose_name='Sức chứa')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Đang hoạt động')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Ngày tạo')),
+            ],
+            options={
+                'verbose_name': 'Bãi đỗ',
+                'verbose_name_plural': 'Bãi đỗ',
+                'ordering': ['code'],
+            },
+        ),
+        migrations.AddField(
+            model_name='parkingsession',
+            name='entry_gate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='parking.gate', verbose_name='Cổng vào'),
+        ),
+        migrations.AddField(
+            model_name='parkingsession',
+            name='exit_gate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='parking.gate', verbose_name='Cổng ra'),
+        ),
+        migrations.AddField(
+            model_name='vehicledetection',
+            name='gate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='detections', to='parking.gate'),
+        ),
+        migrations.AddField(
+            model_name='gate',
+            name='lot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gates', to='parking.lot', verbose_name='Bãi đỗ'),
+        ),
+        migrations.AddField(
+            model_name='parkingsession',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sessions', to='parking.lot', verbose_name='Bãi đỗ'),
+        ),
+        migrations.AddField(
+            model_name='vehicledetection',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='detections', to='parking.lot'),
+        ),
+        migrations.RenameField(
+            model_name='cameradevice',
+            old_name='lot',
+            new_name='lot_code',
+        ),
+        migrations.RenameField(
+            model_name='cameradevice',
+            old_name='gate',
+            new_name='gate_code',
+        ),
+        migrations.AddField(
+            model_name='cameradevice',
+            name='lot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='cameras', to='parking.lot', verbose_name='Bãi đỗ'),
+        ),
+        migrations.AddField(
+            model_name='cameradevice',
+            name='gate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cameras', to='parking.gate', verbose_name='Cổng'),
+        ),
+        migrations.RunPython(assign_lots, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='cameradevice',
+            name='lot_code',
+        ),
+        migrations.RemoveField(
+            model_name='cameradevice',
+            name='gate_code',
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['lot', 'status', 'license_plate'], name='parking_par_lot_id_a87677_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['lot', 'status', '-exit_time'], name='parking_par_lot_id_3d4c08_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['lot', 'payment_status'], name='parking_par_lot_id_a7a7ec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicledetection',
+            index=models.Index(fields=['lot', '-detected_at'], name='parking_veh_lot_id_92f5f1_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='gate',
+            constraint=models.UniqueConstraint(fields=('lot', 'code'), name='unique_gate_code_per_lot'),
+        ),
+    ]
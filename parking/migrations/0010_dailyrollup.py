@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0009_lot_gate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Ngày')),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name='Lượt vào')),
+                ('exits', models.PositiveIntegerField(default=0, verbose_name='Lượt ra')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Doanh thu')),
+                ('total_duration_minutes', models.BigIntegerField(default=0, verbose_name='Tổng thời lượng đỗ (phút)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='parking.lot', verbose_name='Bãi đỗ')),
+            ],
+            options={
+                'verbose_name': 'Thống kê ngày',
+                'verbose_name_plural': 'Thống kê ngày',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('lot', 'date'), name='unique_rollup_per_lot_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0010_dailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicledetection',
+            name='clip',
+            field=models.FileField(blank=True, null=True, upload_to='clips/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0011_vehicledetection_clip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicledetection',
+            name='raw_plate',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
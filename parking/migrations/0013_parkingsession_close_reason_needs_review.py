@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0012_vehicledetection_raw_plate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingsession',
+            name='close_reason',
+            field=models.CharField(blank=True, choices=[('EXIT', 'Xe ra (đọc biển số)'), ('TIMEOUT', 'Tự đóng: quá thời gian'), ('CONTRADICTED', 'Tự đóng: xe vào lại ở cổng khác')], default='', max_length=20, verbose_name='Lý do đóng'),
+        ),
+        migrations.AddField(
+            model_name='parkingsession',
+            name='needs_review',
+            field=models.BooleanField(default=False, verbose_name='Cần kiểm tra'),
+        ),
+    ]
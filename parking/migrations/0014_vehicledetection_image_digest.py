@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0013_parkingsession_close_reason_needs_review'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicledetection',
+            name='image_digest',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32),
+        ),
+    ]
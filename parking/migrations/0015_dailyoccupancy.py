@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0014_vehicledetection_image_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Ngày')),
+                ('data', models.JSONField(verbose_name='Dữ liệu')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_occupancy', to='parking.lot', verbose_name='Bãi đỗ')),
+            ],
+            options={
+                'verbose_name': 'Lượng xe theo ngày',
+                'verbose_name_plural': 'Lượng xe theo ngày',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('lot', 'date'), name='unique_occupancy_per_lot_day')],
+            },
+        ),
+    ]
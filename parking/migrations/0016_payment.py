@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0015_dailyoccupancy'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('license_plate', models.CharField(max_length=20, verbose_name='Biển số xe')),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=10, verbose_name='Số tiền')),
+                ('method', models.CharField(choices=[('CASH', 'Tiền mặt'), ('TRANSFER', 'Chuyển khoản'), ('CARD', 'Thẻ')], default='CASH', max_length=20, verbose_name='Hình thức')),
+                ('batch', models.UUIDField(db_index=True, verbose_name='Mã lần thu')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Thời điểm thu')),
+                ('cashier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Thu ngân')),
+                ('lot', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='parking.lot', verbose_name='Bãi đỗ')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='parking.parkingsession', verbose_name='Giao dịch đỗ xe')),
+            ],
+            options={
+                'verbose_name': 'Thanh toán',
+                'verbose_name_plural': 'Thanh toán',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['cashier', 'created_at'], name='parking_pay_cashier_44918e_idx'), models.Index(fields=['lot', 'created_at'], name='parking_pay_lot_id_1282cc_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0016_payment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShiftTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shift_start', models.DateTimeField(verbose_name='Đầu ca')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Số lần thu')),
+                ('amount', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Tổng tiền')),
+                ('cash_amount', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Tiền mặt')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')),
+                ('cashier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Thu ngân')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parking.lot', verbose_name='Bãi đỗ')),
+            ],
+            options={
+                'verbose_name': 'Tổng thu theo ca',
+                'verbose_name_plural': 'Tổng thu theo ca',
+                'ordering': ['-shift_start'],
+                'indexes': [models.Index(fields=['shift_start', 'lot'], name='parking_shi_shift_s_c77403_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('cashier__isnull', False)), fields=('lot', 'shift_start', 'cashier'), name='unique_total_per_shift_cashier'), models.UniqueConstraint(condition=models.Q(('cashier__isnull', True)), fields=('lot', 'shift_start'), name='unique_total_per_shift_anonymous')],
+            },
+        ),
+    ]
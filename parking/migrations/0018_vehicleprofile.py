@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:50
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def build_profiles(apps, schema_editor):
+    """Tạo hồ sơ xe từ các phiên đã có (sau đó được cập nhật cộng dồn)"""
+    ParkingSession = apps.get_model('parking', 'ParkingSession')
+    VehicleProfile = apps.get_model('parking', 'VehicleProfile')
+    unpaid = Q(status='COMPLETED', payment_status='UNPAID')
+    rows = ParkingSession.objects.values('license_plate').annotate(
+        visits=Count('id'), last_entry=Max('entry_time'), last_exit=Max('exit_time'),
+        unpaid=Count('id', filter=unpaid), outstanding=Sum('fee', filter=unpaid),
+    ).order_by()
+    VehicleProfile.objects.bulk_create([
+        VehicleProfile(
+            license_plate=row['license_plate'],
+            visit_count=row['visits'],
+            last_seen=max(filter(None, (row['last_entry'], row['last_exit']))),
+            unpaid_count=row['unpaid'],
+            outstanding_amount=row['outstanding'] or 0,
+        )
+        for row in rows
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0017_shifttotal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('license_plate', models.CharField(max_length=20, unique=True, verbose_name='Biển số xe')),
+                ('visit_count', models.PositiveIntegerField(default=0, verbose_name='Số lượt vào')),
+                ('last_seen', models.DateTimeField(blank=True, null=True, verbose_name='Lần cuối thấy xe')),
+                ('unpaid_count', models.IntegerField(default=0, verbose_name='Số phiên chưa thanh toán')),
+                ('outstanding_amount', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Nợ chưa thanh toán')),
+                ('subscription_until', models.DateField(blank=True, null=True, verbose_name='Vé tháng đến ngày')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')),
+            ],
+            options={
+                'verbose_name': 'Hồ sơ xe',
+                'verbose_name_plural': 'Hồ sơ xe',
+                'ordering': ['license_plate'],
+            },
+        ),
+        migrations.RunPython(build_profiles, migrations.RunPython.noop),
+    ]
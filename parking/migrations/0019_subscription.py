@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0018_vehicleprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('license_plate', models.CharField(db_index=True, max_length=20, verbose_name='Biển số xe')),
+                ('kind', models.CharField(choices=[('MONTHLY', 'Vé tháng'), ('RESIDENT', 'Cư dân'), ('STAFF', 'Nhân viên')], default='MONTHLY', max_length=10, verbose_name='Loại')),
+                ('holder', models.CharField(blank=True, max_length=100, verbose_name='Chủ xe')),
+                ('valid_from', models.DateField(verbose_name='Từ ngày')),
+                ('valid_until', models.DateField(verbose_name='Đến ngày')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Đang hiệu lực')),
+                ('note', models.CharField(blank=True, max_length=200, verbose_name='Ghi chú')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Ngày tạo')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')),
+                ('lot', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to='parking.lot', verbose_name='Bãi đỗ')),
+            ],
+            options={
+                'verbose_name': 'Vé tháng',
+                'verbose_name_plural': 'Vé tháng',
+                'ordering': ['license_plate', '-valid_until'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0019_subscription'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vehicledetection',
+            name='detected_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,8 +1,55 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from decimal import Decimal
 
 
+# ========== MODELS CHO BÃI ĐỖ / CỔNG ==========
+
+class Lot(models.Model):
+    """Bãi đỗ xe - mọi phiên đỗ, lần phát hiện và thống kê đều thuộc về một bãi"""
+    code = models.CharField(max_length=50, unique=True, verbose_name='Mã bãi')
+    name = models.CharField(max_length=100, verbose_name='Tên bãi')
+    capacity = models.PositiveIntegerField(default=0, verbose_name='Sức chứa')
+    is_active = models.BooleanField(default=True, verbose_name='Đang hoạt động')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Ngày tạo')
+
+    DEFAULT_CODE = 'default'
+
+    class Meta:
+        ordering = ['code']
+        verbose_name = 'Bãi đỗ'
+        verbose_name_plural = 'Bãi đỗ'
+
+    def __str__(self):
+        return self.name or self.code
+
+
+class Gate(models.Model):
+    """Cổng vào/ra của một bãi đỗ"""
+    DIRECTION_CHOICES = [
+        ('BOTH', 'Vào và ra'),
+        ('ENTRY', 'Chỉ vào'),
+        ('EXIT', 'Chỉ ra'),
+    ]
+
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name='gates', verbose_name='Bãi đỗ')
+    code = models.CharField(max_length=50, verbose_name='Mã cổng')
+    name = models.CharField(max_length=100, blank=True, verbose_name='Tên cổng')
+    direction = models.CharField(max_length=10, choices=DIRECTION_CHOICES, default='BOTH', verbose_name='Chiều')
+
+    class Meta:
+        ordering = ['lot', 'code']
+        constraints = [
+            models.UniqueConstraint(fields=['lot', 'code'], name='unique_gate_code_per_lot'),
+        ]
+        verbose_name = 'Cổng'
+        verbose_name_plural = 'Cổng'
+
+    def __str__(self):
+        return f"{self.lot.code}/{self.code}"
+
+
 # ========== MODELS CHO HỆ THỐNG PHÁT HIỆN XE TỰ ĐỘNG ==========
 
 class VehicleDetection(models.Model):
@@ -15,16 +62,26 @@ class VehicleDetection(models.Model):
     ]
     
     license_plate = models.CharField(max_length=20, db_index=True)
+    # Chuỗi đọc được trước khi chuẩn hóa (license_plate là biển số chuẩn - xem parking/plates.py)
+    raw_plate = models.CharField(max_length=32, blank=True, default='')
     confidence = models.FloatField()
-    detected_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Thời điểm xe qua cổng (sự kiện ghi lại từ journal giữ thời điểm gốc - xem parking/gate_decision.py)
+    detected_at = models.DateTimeField(default=timezone.now, db_index=True)
     event_type = models.CharField(max_length=10, choices=EVENT_CHOICES)
     image_path = models.ImageField(upload_to='detections/', null=True, blank=True)
+    # Digest nội dung ảnh - tên file ảnh thu nhỏ (xem parking/thumbnails.py), rỗng khi chưa tạo
+    image_digest = models.CharField(max_length=32, blank=True, default='', db_index=True)
     camera_source = models.CharField(max_length=50, default='raspberrypi_cam')
+    # Clip MJPEG vài giây quanh lúc nhận diện (ghi nền - xem parking/clips.py)
+    clip = models.FileField(upload_to='clips/', null=True, blank=True)
+    lot = models.ForeignKey(Lot, on_delete=models.PROTECT, null=True, blank=True, related_name='detections')
+    gate = models.ForeignKey(Gate, on_delete=models.SET_NULL, null=True, blank=True, related_name='detections')
     
     class Meta:
         ordering = ['-detected_at']
         indexes = [
             models.Index(fields=['-detected_at', 'license_plate']),
+            models.Index(fields=['lot', '-detected_at']),
         ]
     
     def __str__(self):
@@ -57,6 +114,12 @@ class ParkingSession(models.Model):
         ('FREE', 'Miễn phí'),
     ]
     
+    CLOSE_REASON_CHOICES = [
+        ('EXIT', 'Xe ra (đọc biển số)'),
+        ('TIMEOUT', 'Tự đóng: quá thời gian'),
+        ('CONTRADICTED', 'Tự đóng: xe vào lại ở cổng khác'),
+    ]
+    
     license_plate = models.CharField(max_length=20, db_index=True, verbose_name='Biển số xe')
     entry_time = models.DateTimeField(db_index=True, verbose_name='Thời điểm vào')
     exit_time = models.DateTimeField(null=True, blank=True, verbose_name='Thời điểm ra')
@@ -68,6 +131,12 @@ class ParkingSession(models.Model):
     exit_image = models.CharField(max_length=255, null=True, blank=True, verbose_name='Ảnh lúc ra')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Ngày tạo')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')
+    lot = models.ForeignKey(Lot, on_delete=models.PROTECT, null=True, blank=True, related_name='sessions', verbose_name='Bãi đỗ')
+    entry_gate = models.ForeignKey(Gate, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Cổng vào')
+    exit_gate = models.ForeignKey(Gate, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Cổng ra')
+    # Phiên bị đóng/đánh dấu tự động cần nhân viên xem lại (xem parking/sweeper.py)
+    close_reason = models.CharField(max_length=20, choices=CLOSE_REASON_CHOICES, blank=True, default='', verbose_name='Lý do đóng')
+    needs_review = models.BooleanField(default=False, verbose_name='Cần kiểm tra')
     
     class Meta:
         ordering = ['-entry_time']
@@ -76,6 +145,10 @@ class ParkingSession(models.Model):
             models.Index(fields=['-entry_time']),
             models.Index(fields=['payment_status']),
             models.Index(fields=['created_at']),
+            # Truy vấn nóng theo từng bãi chỉ quét phần index của bãi đó
+            models.Index(fields=['lot', 'status', 'license_plate']),
+            models.Index(fields=['lot', 'status', '-exit_time']),
+            models.Index(fields=['lot', 'payment_status']),
         ]
         verbose_name = 'Giao dịch đỗ xe'
         verbose_name_plural = 'Giao dịch đỗ xe'
@@ -114,7 +187,7 @@ class ParkingSession(models.Model):
         
         return Decimal(total_fee)
     
-    def complete_session(self, exit_time, exit_image=None):
+    def complete_session(self, exit_time, exit_image=None, exit_gate_id=None, close_reason='EXIT'):
         """
         Kết thúc phiên đỗ xe và tính phí tự động
         
@@ -128,9 +201,13 @@ class ParkingSession(models.Model):
         Args:
             exit_time (datetime): Thời điểm xe ra
             exit_image (str, optional): Đường dẫn ảnh lúc ra
+            exit_gate_id (int, optional): Cổng xe ra
+            close_reason (str, optional): EXIT / TIMEOUT / CONTRADICTED
         """
         self.exit_time = exit_time
         self.exit_image = exit_image
+        self.exit_gate_id = exit_gate_id
+        self.close_reason = close_reason
         self.status = 'COMPLETED'
         
         # Tính thời gian đỗ (phút)
@@ -140,8 +217,13 @@ class ParkingSession(models.Model):
         # Tính phí theo công thức mới (luôn tính phí, không miễn phí)
         self.fee = self.calculate_fee(self.duration_minutes)
         
-        # Luôn là UNPAID vì không còn miễn phí
-        self.payment_status = 'UNPAID'
+        # Xe có vé tháng còn hạn: miễn phí (tra chỉ mục trong bộ nhớ, không truy vấn)
+        from .subscriptions import subscriptions
+        if subscriptions.valid_until(self.license_plate, self.lot_id, self.exit_time):
+            self.fee = Decimal(0)
+            self.payment_status = 'FREE'
+        else:
+            self.payment_status = 'UNPAID'
         
         self.save()
     
@@ -188,3 +270,237 @@ class ParkingSession(models.Model):
             return f"{self.license_plate} - Đang đỗ"
         else:
             return f"{self.license_plate} - {self.duration_minutes}p - {self.fee:,.0f}đ - {self.get_payment_status_display()}"
+
+
+class VehicleProfile(models.Model):
+    """
+    Hồ sơ theo biển số: số lượt vào, lần cuối thấy xe, nợ chưa thanh toán.
+    Cập nhật cộng dồn ở cổng (ENTRY/EXIT) và khi thu tiền - đọc bằng một lần
+    tra index theo biển số (xem parking/profiles.py)
+    """
+    license_plate = models.CharField(max_length=20, unique=True, verbose_name='Biển số xe')
+    visit_count = models.PositiveIntegerField(default=0, verbose_name='Số lượt vào')
+    last_seen = models.DateTimeField(null=True, blank=True, verbose_name='Lần cuối thấy xe')
+    unpaid_count = models.IntegerField(default=0, verbose_name='Số phiên chưa thanh toán')
+    outstanding_amount = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name='Nợ chưa thanh toán')
+    # Vé tháng còn hạn đến ngày này (None: không có vé)
+    subscription_until = models.DateField(null=True, blank=True, verbose_name='Vé tháng đến ngày')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')
+
+    class Meta:
+        ordering = ['license_plate']
+        verbose_name = 'Hồ sơ xe'
+        verbose_name_plural = 'Hồ sơ xe'
+
+    def __str__(self):
+        return f"{self.license_plate} - {self.visit_count} lượt - nợ {self.outstanding_amount:,.0f}đ"
+
+
+class Subscription(models.Model):
+    """
+    Vé tháng / danh sách xe miễn phí (cư dân, nhân viên): phiên của biển số
+    ra trong thời hạn được miễn phí (FREE). Cổng tra trong bộ nhớ, không
+    truy vấn database (xem parking/subscriptions.py)
+    """
+    KIND_CHOICES = [
+        ('MONTHLY', 'Vé tháng'),
+        ('RESIDENT', 'Cư dân'),
+        ('STAFF', 'Nhân viên'),
+    ]
+
+    license_plate = models.CharField(max_length=20, db_index=True, verbose_name='Biển số xe')
+    # None: áp dụng cho mọi bãi
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, null=True, blank=True, related_name='subscriptions',
+                            verbose_name='Bãi đỗ')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='MONTHLY', verbose_name='Loại')
+    holder = models.CharField(max_length=100, blank=True, verbose_name='Chủ xe')
+    valid_from = models.DateField(verbose_name='Từ ngày')
+    valid_until = models.DateField(verbose_name='Đến ngày')
+    is_active = models.BooleanField(default=True, verbose_name='Đang hiệu lực')
+    note = models.CharField(max_length=200, blank=True, verbose_name='Ghi chú')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Ngày tạo')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')
+
+    class Meta:
+        ordering = ['license_plate', '-valid_until']
+        verbose_name = 'Vé tháng'
+        verbose_name_plural = 'Vé tháng'
+
+    def save(self, *args, **kwargs):
+        # Cùng dạng chuẩn với biển số đọc ở cổng (parking/plates.py)
+        from .plates import canonical_form, normalize
+        self.license_plate = canonical_form(normalize(self.license_plate))
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.license_plate} - {self.get_kind_display()} - {self.valid_from} → {self.valid_until}"
+
+
+class PaymentQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError('Sổ thanh toán chỉ được ghi thêm, không sửa')
+
+    def delete(self):
+        raise TypeError('Sổ thanh toán chỉ được ghi thêm, không xóa')
+
+
+class Payment(models.Model):
+    """
+    Sổ thanh toán (chỉ ghi thêm): mỗi dòng là một lần thu tiền cho một phiên
+    đỗ - ai thu, lúc nào, bao nhiêu, hình thức gì. Các phiên được thu cùng
+    một yêu cầu có chung batch. Mỗi lần ghi cộng dồn vào ShiftTotal
+    (xem parking/payments.py)
+    """
+    METHOD_CHOICES = [
+        ('CASH', 'Tiền mặt'),
+        ('TRANSFER', 'Chuyển khoản'),
+        ('CARD', 'Thẻ'),
+    ]
+
+    session = models.ForeignKey(ParkingSession, on_delete=models.PROTECT, related_name='payments', verbose_name='Giao dịch đỗ xe')
+    lot = models.ForeignKey(Lot, on_delete=models.PROTECT, null=True, blank=True, related_name='+', verbose_name='Bãi đỗ')
+    license_plate = models.CharField(max_length=20, verbose_name='Biển số xe')
+    amount = models.DecimalField(max_digits=10, decimal_places=0, verbose_name='Số tiền')
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES, default='CASH', verbose_name='Hình thức')
+    cashier = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Thu ngân')
+    batch = models.UUIDField(db_index=True, verbose_name='Mã lần thu')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Thời điểm thu')
+
+    objects = PaymentQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['cashier', 'created_at']),
+            models.Index(fields=['lot', 'created_at']),
+        ]
+        verbose_name = 'Thanh toán'
+        verbose_name_plural = 'Thanh toán'
+
+    def __str__(self):
+        return f"{self.license_plate} - {self.amount:,.0f}đ - {self.get_method_display()}"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise TypeError('Sổ thanh toán chỉ được ghi thêm, không sửa')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError('Sổ thanh toán chỉ được ghi thêm, không xóa')
+
+
+class ShiftTotal(models.Model):
+    """
+    Tổng tiền đã thu theo (bãi, ca, thu ngân) - cộng dồn trong cùng transaction
+    với mỗi lần ghi Payment, đọc tổng ca/ngày không phải quét sổ thanh toán
+    """
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name='+', verbose_name='Bãi đỗ')
+    shift_start = models.DateTimeField(verbose_name='Đầu ca')
+    cashier = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Thu ngân')
+    count = models.PositiveIntegerField(default=0, verbose_name='Số lần thu')
+    amount = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name='Tổng tiền')
+    cash_amount = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name='Tiền mặt')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')
+
+    class Meta:
+        ordering = ['-shift_start']
+        constraints = [
+            models.UniqueConstraint(fields=['lot', 'shift_start', 'cashier'], condition=models.Q(cashier__isnull=False),
+                                    name='unique_total_per_shift_cashier'),
+            models.UniqueConstraint(fields=['lot', 'shift_start'], condition=models.Q(cashier__isnull=True),
+                                    name='unique_total_per_shift_anonymous'),
+        ]
+        indexes = [
+            models.Index(fields=['shift_start', 'lot']),
+        ]
+        verbose_name = 'Tổng thu theo ca'
+        verbose_name_plural = 'Tổng thu theo ca'
+
+    def __str__(self):
+        return f"{self.lot_id} - {self.shift_start} - {self.cashier_id} - {self.amount:,.0f}đ"
+
+
+# ========== MODELS CHO THIẾT BỊ CAMERA ==========
+
+def generate_device_secret():
+    """Sinh khóa bí mật ngẫu nhiên (hex 64 ký tự) cho thiết bị camera"""
+    import secrets
+    return secrets.token_hex(32)
+
+
+class CameraDevice(models.Model):
+    """
+    Danh sách thiết bị camera (Raspberry Pi) được phép gửi dữ liệu lên server
+
+    Mỗi thiết bị có một khóa bí mật dùng để ký HMAC cho từng request
+    (xem parking/device_auth.py). device_id trùng với camera_source
+    trong VehicleDetection và tên stream trong /api/stream/<src>.
+    Mỗi camera gắn với một bãi và (tùy chọn) một cổng của bãi đó.
+    """
+    device_id = models.CharField(max_length=50, unique=True, verbose_name='Mã thiết bị')
+    name = models.CharField(max_length=100, blank=True, verbose_name='Tên thiết bị')
+    secret_key = models.CharField(max_length=64, default=generate_device_secret, verbose_name='Khóa bí mật (HMAC)')
+    lot = models.ForeignKey(Lot, on_delete=models.PROTECT, null=True, related_name='cameras', verbose_name='Bãi đỗ')
+    gate = models.ForeignKey(Gate, on_delete=models.SET_NULL, null=True, blank=True, related_name='cameras', verbose_name='Cổng')
+    is_active = models.BooleanField(default=True, verbose_name='Đang hoạt động')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Ngày tạo')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')
+
+    class Meta:
+        ordering = ['device_id']
+        verbose_name = 'Thiết bị camera'
+        verbose_name_plural = 'Thiết bị camera'
+
+    def __str__(self):
+        return f"{self.device_id} ({self.gate or self.lot})"
+
+
+# ========== MODELS CHO THỐNG KÊ TỔNG HỢP ==========
+
+class DailyRollup(models.Model):
+    """
+    Số liệu tổng hợp theo ngày của từng bãi (tính lại bởi tác vụ nền
+    sau mỗi lần xe vào/ra - xem parking/tasks.py)
+    """
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name='daily_rollups', verbose_name='Bãi đỗ')
+    date = models.DateField(verbose_name='Ngày')
+    entries = models.PositiveIntegerField(default=0, verbose_name='Lượt vào')
+    exits = models.PositiveIntegerField(default=0, verbose_name='Lượt ra')
+    revenue = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name='Doanh thu')
+    total_duration_minutes = models.BigIntegerField(default=0, verbose_name='Tổng thời lượng đỗ (phút)')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['lot', 'date'], name='unique_rollup_per_lot_day'),
+        ]
+        verbose_name = 'Thống kê ngày'
+        verbose_name_plural = 'Thống kê ngày'
+
+    def __str__(self):
+        return f"{self.lot_id} - {self.date} - {self.revenue:,.0f}đ"
+
+
+class DailyOccupancy(models.Model):
+    """
+    Chuỗi số xe trong bãi theo khung 5 phút của một ngày đã kết thúc (cache
+    cho API phân tích - xem parking/analytics.py, bị xóa khi phiên của ngày
+    đó thay đổi)
+    """
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name='daily_occupancy', verbose_name='Bãi đỗ')
+    date = models.DateField(verbose_name='Ngày')
+    # {'occupancy': [...288], 'peak': [...], 'arrivals': [...], 'departures': [...], 'dwell': [...]}
+    data = models.JSONField(verbose_name='Dữ liệu')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Ngày cập nhật')
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['lot', 'date'], name='unique_occupancy_per_lot_day'),
+        ]
+        verbose_name = 'Lượng xe theo ngày'
+        verbose_name_plural = 'Lượng xe theo ngày'
+
+    def __str__(self):
+        return f"{self.lot_id} - {self.date}"
@@ -0,0 +1,263 @@
+"""
+Thu tiền (quầy thu ngân, khách đoàn xe) và sổ thanh toán theo ca
+
+settle() đánh dấu PAID cả danh sách phiên bằng một câu UPDATE có điều kiện
+payment_status='UNPAID', ghi một dòng Payment cho mỗi phiên thực sự được
+thu (chung một batch) và trả kết quả từng phiên:
+    paid           vừa thu xong
+    already_paid   đã thu trước đó (gửi lại yêu cầu không thu trùng)
+    free           phiên miễn phí
+    not_completed  xe chưa ra
+    not_found      không có phiên (hoặc phiên thuộc bãi khác)
+
+Payment là sổ chỉ ghi thêm. Mỗi lần ghi cộng dồn (UPDATE ... SET amount =
+amount + x) vào ShiftTotal của (bãi, ca, thu ngân) trong cùng transaction,
+nên tổng ca / tổng ngày / phần của từng thu ngân chỉ đọc vài dòng. Ca làm
+việc theo giờ bắt đầu trong settings.PAYMENT_LEDGER['SHIFT_STARTS'] (ca
+cuối ngày kéo sang sáng hôm sau thuộc ngày bắt đầu ca). Báo cáo đối soát
+đọc thẳng sổ theo khoảng thời gian (ledger_rows).
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, time as time_cls, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import profiles
+from .models import ParkingSession, Payment, ShiftTotal
+from .plates import canonical_form, normalize
+
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = 500          # số phiên tối đa một lần thu
+
+DEFAULT_PAYMENT_LEDGER = {
+    'SHIFT_STARTS': ['06:00', '14:00', '22:00'],    # giờ bắt đầu các ca trong ngày
+    'REPORT_CHUNK_SIZE': 2000,                      # số dòng mỗi lần đọc khi xuất báo cáo
+}
+
+
+def get_config():
+    config = dict(DEFAULT_PAYMENT_LEDGER)
+    config.update(getattr(settings, 'PAYMENT_LEDGER', {}))
+    return config
+
+
+def shift_bounds(moment=None, config=None):
+    """
+    Ca làm việc chứa thời điểm `moment`
+
+    Returns:
+        tuple: (shift_start, shift_end) - datetime có múi giờ
+    """
+    config = config or get_config()
+    moment = timezone.localtime(moment)
+    starts = sorted(time_cls.fromisoformat(value) for value in config['SHIFT_STARTS'])
+    candidates = [
+        timezone.make_aware(datetime.combine(moment.date() + timedelta(days=offset), start))
+        for offset in (-1, 0, 1) for start in starts
+    ]
+    index = max(i for i, start in enumerate(candidates) if start <= moment)
+    return candidates[index], candidates[index + 1]
+
+
+def _add_to_totals(payments, config=None):
+    """Cộng các Payment vừa ghi vào ShiftTotal (gọi trong transaction ghi Payment)"""
+    from .lots import get_default_lot
+
+    groups = defaultdict(lambda: [0, Decimal(0), Decimal(0)])
+    for payment in payments:
+        shift_start = shift_bounds(payment.created_at, config)[0]
+        group = groups[(payment.lot_id or get_default_lot().id, shift_start, payment.cashier_id)]
+        group[0] += 1
+        group[1] += payment.amount
+        group[2] += payment.amount if payment.method == 'CASH' else 0
+
+    for (lot_id, shift_start, cashier_id), (count, amount, cash_amount) in groups.items():
+        rows = ShiftTotal.objects.filter(lot_id=lot_id, shift_start=shift_start, cashier_id=cashier_id)
+        increments = {
+            'count': F('count') + count,
+            'amount': F('amount') + amount,
+            'cash_amount': F('cash_amount') + cash_amount,
+            'updated_at': timezone.now(),
+        }
+        if rows.update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                ShiftTotal.objects.create(lot_id=lot_id, shift_start=shift_start, cashier_id=cashier_id,
+                                          count=count, amount=amount, cash_amount=cash_amount)
+        except IntegrityError:
+            # Yêu cầu khác vừa tạo dòng của ca này
+            rows.update(**increments)
+
+
+def record_payments(payments, config=None):
+    """Ghi các dòng Payment và cộng vào ShiftTotal - gọi trong transaction.atomic()"""
+    Payment.objects.bulk_create(payments)       # auto_now_add gán created_at cho từng object
+    _add_to_totals(payments, config)
+    return payments
+
+
+class SettlementError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def settle(session_ids=None, license_plate=None, lot=None, method='CASH', cashier=None):
+    """
+    Thu tiền các phiên `session_ids`, hoặc mọi phiên chưa thanh toán của `license_plate`
+
+    Returns:
+        dict: {'batch', 'paid_count', 'paid_amount', 'results': [{'id', 'license_plate', 'fee', 'outcome'}]}
+
+    Raises:
+        SettlementError: tham số không hợp lệ (400), không có thu ngân đã đăng nhập (403)
+            hoặc phiên vừa bị thu ở nơi khác (409)
+    """
+    # Mỗi dòng Payment phải trả lời được "ai đã thu"
+    if cashier is None or not cashier.is_authenticated:
+        raise SettlementError('Cần thu ngân đã đăng nhập', status=403)
+    if method not in dict(Payment.METHOD_CHOICES):
+        raise SettlementError(f'Hình thức thanh toán "{method}" không hợp lệ')
+    if license_plate is not None:
+        license_plate = canonical_form(normalize(license_plate))
+        if not license_plate:
+            raise SettlementError('Biển số không hợp lệ')
+    else:
+        try:
+            session_ids = list(dict.fromkeys(int(session_id) for session_id in session_ids or ()))
+        except (TypeError, ValueError):
+            raise SettlementError('session_ids phải là danh sách số nguyên')
+        if not session_ids:
+            raise SettlementError('Cần session_ids hoặc license_plate')
+    if session_ids is not None and len(session_ids) > MAX_SESSIONS:
+        raise SettlementError(f'Tối đa {MAX_SESSIONS} phiên một lần thu')
+
+    batch = uuid.uuid4()
+    with transaction.atomic():
+        queryset = ParkingSession.objects.select_for_update()
+        if license_plate is not None:
+            queryset = queryset.filter(license_plate=license_plate, status='COMPLETED', payment_status='UNPAID')
+        else:
+            queryset = queryset.filter(id__in=session_ids)
+        if lot is not None:
+            queryset = queryset.filter(lot=lot)
+        rows = {
+            row[0]: row for row in
+            queryset.order_by('exit_time', 'id')[:MAX_SESSIONS]
+            .values_list('id', 'license_plate', 'lot_id', 'status', 'payment_status', 'fee')
+        }
+        if session_ids is None:
+            session_ids = list(rows)
+
+        payable = [session_id for session_id, (_, _, _, status, payment_status, _) in rows.items()
+                   if status == 'COMPLETED' and payment_status == 'UNPAID']
+        if payable:
+            updated = ParkingSession.objects.filter(
+                id__in=payable, status='COMPLETED', payment_status='UNPAID',
+            ).update(payment_status='PAID', updated_at=timezone.now())
+            if updated != len(payable):
+                # Rollback cả lô: có phiên vừa được thu bởi yêu cầu khác, thu ngân gửi lại là đủ
+                raise SettlementError('Có phiên vừa được thanh toán ở nơi khác, vui lòng thử lại', status=409)
+            record_payments([
+                Payment(session_id=session_id, lot_id=rows[session_id][2], license_plate=rows[session_id][1],
+                        amount=rows[session_id][5], method=method, cashier=cashier, batch=batch)
+                for session_id in payable
+            ])
+            by_plate = defaultdict(lambda: [0, 0])
+            for session_id in payable:
+                by_plate[rows[session_id][1]][0] += 1
+                by_plate[rows[session_id][1]][1] += rows[session_id][5]
+            for plate, (count, amount) in by_plate.items():
+                profiles.record_paid(plate, count, amount)
+
+    results = []
+    for session_id in session_ids:
+        row = rows.get(session_id)
+        if row is None:
+            results.append({'id': session_id, 'license_plate': None, 'fee': 0, 'outcome': 'not_found'})
+            continue
+        _, plate, _, status, payment_status, fee = row
+        if status != 'COMPLETED':
+            outcome = 'not_completed'
+        elif payment_status == 'UNPAID':
+            outcome = 'paid'
+        else:
+            outcome = 'already_paid' if payment_status == 'PAID' else 'free'
+        results.append({'id': session_id, 'license_plate': plate, 'fee': int(fee), 'outcome': outcome})
+
+    paid_amount = sum(int(rows[session_id][5]) for session_id in payable)
+    if payable:
+        logger.info('Settled %d sessions (%sđ) in batch %s', len(payable), paid_amount, batch,
+                    extra={'batch': str(batch), 'cashier': getattr(cashier, 'username', None), 'method': method})
+    return {'batch': str(batch), 'paid_count': len(payable), 'paid_amount': paid_amount, 'results': results}
+
+
+def _sum_totals(rows):
+    totals = rows.order_by().aggregate(count=Sum('count'), amount=Sum('amount'), cash_amount=Sum('cash_amount'))
+    return {key: int(value or 0) for key, value in totals.items()}
+
+
+def collected_totals(lot=None, cashier=None, moment=None, config=None):
+    """
+    Tiền đã thu trong ca hiện tại (tổng + từng thu ngân), trong ngày và của `cashier` trong ca
+
+    Chỉ đọc ShiftTotal (vài dòng mỗi ca, 2 truy vấn), không quét Payment.
+    """
+    config = config or get_config()
+    moment = moment or timezone.now()
+    shift_start, shift_end = shift_bounds(moment, config)
+    day_start = timezone.make_aware(datetime.combine(timezone.localtime(moment).date(), time_cls.min))
+
+    rows = ShiftTotal.objects.all()
+    if lot is not None:
+        rows = rows.filter(lot=lot)
+    shift = {'count': 0, 'amount': 0, 'cash_amount': 0}
+    mine = dict(shift) if cashier is not None else None
+    by_cashier = defaultdict(lambda: {'count': 0, 'amount': 0, 'cash_amount': 0})
+    for cashier_id, username, count, amount, cash_amount in rows.filter(shift_start=shift_start).order_by().values_list(
+            'cashier_id', 'cashier__username', 'count', 'amount', 'cash_amount'):
+        targets = [shift, by_cashier[username]] + ([mine] if mine is not None and cashier_id == cashier.id else [])
+        for item in targets:
+            item['count'] += count
+            item['amount'] += int(amount)
+            item['cash_amount'] += int(cash_amount)
+
+    return {
+        'shift': {
+            'start': timezone.localtime(shift_start).strftime('%Y-%m-%d %H:%M'),
+            'end': timezone.localtime(shift_end).strftime('%Y-%m-%d %H:%M'),
+            **shift,
+            'cashiers': [{'cashier': username, **values} for username, values in sorted(
+                by_cashier.items(), key=lambda item: -item[1]['amount'])],
+        },
+        'today': _sum_totals(rows.filter(shift_start__gte=day_start, shift_start__lt=day_start + timedelta(days=1))),
+        'mine': mine,
+    }
+
+
+def ledger_rows(start, end, lot=None, cashier=None, config=None):
+    """
+    Các dòng sổ thanh toán trong [start, end), đọc theo lô (báo cáo đối soát)
+
+    Yields:
+        tuple: (created_at, batch, cashier, lot, license_plate, session_id, method, amount)
+    """
+    config = config or get_config()
+    payments = Payment.objects.filter(created_at__gte=start, created_at__lt=end)
+    if lot is not None:
+        payments = payments.filter(lot=lot)
+    if cashier is not None:
+        payments = payments.filter(cashier__username=cashier)
+    yield from payments.order_by('created_at', 'id').values_list(
+        'created_at', 'batch', 'cashier__username', 'lot__code', 'license_plate', 'session_id', 'method', 'amount',
+    ).iterator(chunk_size=config['REPORT_CHUNK_SIZE'])
@@ -0,0 +1,177 @@
+"""
+Chuẩn hóa biển số tại cổng
+
+Cùng một xe có thể bị đọc thành "51G-123.45", "51G12345" hay "51G1234S".
+Nếu lưu nguyên văn, mỗi cách đọc tạo một phiên riêng (phiên ACTIVE mồ côi,
+danh sách chưa thanh toán phình to). Các bước chuẩn hóa:
+
+1. normalize: in hoa, bỏ dấu gạch/chấm/khoảng trắng, Đ -> D
+2. canonical_form: sửa ký tự dễ nhầm theo vị trí, dựa trên cấu trúc biển
+   số Việt Nam: <mã tỉnh 2 số><sê-ri><4-5 số>
+       sê-ri ô tô: 1 chữ (30A12345, 30A1234) hoặc 2 chữ đặc biệt (30LD12345)
+       sê-ri xe máy: chữ + số (29Y303658)
+   (vị trí số: O/D/Q -> 0, I/L/J -> 1, Z -> 2, A -> 4, S -> 5, G -> 6, B -> 8;
+    vị trí chữ: ngược lại)
+3. Đối chiếu với biển số các xe đang đỗ trong bãi qua "khung" (skeleton) -
+   chuỗi mà mọi ký tự dễ nhầm được quy về một đại diện: nếu khung trùng
+   đúng một xe đang đỗ thì dùng biển số của xe đó
+
+Bước 1-2 là hàm thuần, được memo (lru_cache) nên lần đọc lặp lại tốn O(1).
+Bước 3 dùng chỉ mục khung -> biển số của từng bãi trong bộ nhớ, cập nhật
+ngay khi xe vào/ra và nạp lại từ database sau ACTIVE_INDEX_TTL giây (các
+worker khác cũng ghi phiên).
+"""
+
+import re
+import threading
+import time
+from functools import lru_cache
+
+
+_NON_ALNUM = re.compile(r'[^0-9A-Z]')
+
+TO_DIGIT = str.maketrans({'O': '0', 'D': '0', 'Q': '0', 'I': '1', 'L': '1', 'J': '1',
+                          'Z': '2', 'A': '4', 'S': '5', 'G': '6', 'B': '8'})
+TO_LETTER = str.maketrans({'0': 'D', '2': 'Z', '4': 'A', '5': 'S', '6': 'G', '8': 'B'})
+
+# Mỗi nhóm ký tự dễ nhầm quy về ký tự đầu tiên. Mỗi nhóm có tối đa một chữ số
+# và một chữ cái dùng trong sê-ri, nên hai biển số hợp lệ khác nhau gần như
+# không bao giờ có cùng khung
+CONFUSABLE_GROUPS = ['0ODQ', '1ILJ', '2Z', '4A', '5S', '6G', '8B']
+SKELETON = str.maketrans({c: group[0] for group in CONFUSABLE_GROUPS for c in group[1:]})
+
+# Sê-ri 2 chữ (xe ngoại giao, khu kinh tế, ...)
+SPECIAL_SERIES = frozenset(['LD', 'KT', 'NG', 'NN', 'QT', 'CV', 'DA', 'HC', 'MD', 'MK', 'NA', 'TD'])
+
+PLATE_PATTERN = re.compile(r'^\d{2}(?:[A-Z]|[A-Z]{2}|[A-Z]\d)\d{4,5}$')
+
+ACTIVE_INDEX_TTL = 30    # giây
+
+
+def normalize(raw):
+    """In hoa và bỏ mọi ký tự không phải chữ/số"""
+    return _NON_ALNUM.sub('', (raw or '').upper().replace('Đ', 'D'))
+
+
+def is_valid(plate):
+    return bool(PLATE_PATTERN.match(plate))
+
+
+@lru_cache(maxsize=65536)
+def canonical_form(plate):
+    """
+    Sửa ký tự dễ nhầm theo vị trí cho một biển số đã normalize
+
+    Returns:
+        str: biển số đúng cấu trúc, hoặc giữ nguyên nếu không sửa được
+    """
+    if len(plate) < 7 or is_valid(plate):
+        return plate
+
+    province = plate[:2].translate(TO_DIGIT)
+    rest = plate[2:]
+    series = rest[0].translate(TO_LETTER)
+
+    if len(rest) in (5, 6):
+        # Sê-ri 1 chữ + 4/5 số (sê-ri 2 chữ đặc biệt + 4 số nếu khớp)
+        if len(rest) == 6 and rest[:2] in SPECIAL_SERIES:
+            candidate = province + series + rest[1] + rest[2:].translate(TO_DIGIT)
+        else:
+            candidate = province + series + rest[1:].translate(TO_DIGIT)
+    elif len(rest) == 7:
+        # Sê-ri 2 ký tự + 5 số: chữ đặc biệt giữ nguyên, còn lại là sê-ri xe máy chữ + số
+        second = rest[1] if series + rest[1] in SPECIAL_SERIES else rest[1].translate(TO_DIGIT)
+        candidate = province + series + second + rest[2:].translate(TO_DIGIT)
+    else:
+        return plate
+
+    return candidate if is_valid(candidate) else plate
+
+
+@lru_cache(maxsize=65536)
+def skeleton(plate):
+    return plate.translate(SKELETON)
+
+
+class ActivePlateIndex:
+    """Chỉ mục khung -> biển số của các phiên ACTIVE, theo từng bãi"""
+
+    def __init__(self, ttl=ACTIVE_INDEX_TTL):
+        self.ttl = ttl
+        self._lots = {}      # lot_id -> (loaded_at, {skeleton: set(plate)})
+        self._lock = threading.Lock()
+
+    def _index(self, lot_id):
+        entry = self._lots.get(lot_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        from .models import ParkingSession
+
+        index = {}
+        plates = ParkingSession.objects.filter(lot_id=lot_id, status='ACTIVE').values_list('license_plate', flat=True)
+        for plate in plates.iterator():
+            index.setdefault(skeleton(plate), set()).add(plate)
+        with self._lock:
+            self._lots[lot_id] = (time.monotonic(), index)
+        return index
+
+    def match(self, lot_id, plate, refresh=True):
+        """
+        Biển số xe đang đỗ khớp với `plate` (trùng hẳn hoặc chỉ khác ký tự dễ nhầm)
+
+        Args:
+            refresh (bool): False: chỉ dùng chỉ mục đang có trong bộ nhớ, không nạp lại
+                từ database (quyết định nhanh ở cổng khi database chậm)
+
+        Returns:
+            str | None: None nếu không có hoặc có nhiều hơn một xe cùng khung
+        """
+        if refresh:
+            index = self._index(lot_id)
+        else:
+            entry = self._lots.get(lot_id)
+            index = entry[1] if entry is not None else {}
+        candidates = index.get(skeleton(plate))
+        if not candidates:
+            return None
+        if plate in candidates:
+            return plate
+        if len(candidates) == 1:
+            return next(iter(candidates))
+        return None
+
+    def add(self, lot_id, plate):
+        with self._lock:
+            entry = self._lots.get(lot_id)
+            if entry is not None:
+                entry[1].setdefault(skeleton(plate), set()).add(plate)
+
+    def discard(self, lot_id, plate):
+        with self._lock:
+            entry = self._lots.get(lot_id)
+            if entry is not None:
+                entry[1].get(skeleton(plate), set()).discard(plate)
+
+    def invalidate(self, lot_id=None):
+        with self._lock:
+            if lot_id is None:
+                self._lots.clear()
+            else:
+                self._lots.pop(lot_id, None)
+
+
+active_plates = ActivePlateIndex()
+
+
+def canonicalize(raw, lot_id=None):
+    """
+    Biển số chuẩn cho một lần đọc (gọi trong lot_lock của bãi)
+
+    Returns:
+        str: biển số của xe đang đỗ nếu khớp, nếu không là dạng chuẩn theo cấu trúc
+    """
+    plate = canonical_form(normalize(raw))
+    if lot_id is not None and plate:
+        return active_plates.match(lot_id, plate) or plate
+    return plate
@@ -0,0 +1,115 @@
+"""
+Hồ sơ xe theo biển số (VehicleProfile)
+
+Khi xe ra, quầy thu ngân cần biết xe còn nợ từ các lần trước không - trước
+đây phải quét danh sách chưa thanh toán của cả bãi. Hồ sơ được cộng dồn
+(UPDATE ... SET x = x + n) ở các đường ghi:
+    - record_entry   xe vào: +1 lượt, last_seen
+    - record_exit    xe ra với phiên chưa thanh toán: + phí vào nợ
+    - record_paid    thu tiền (parking/payments.py): trừ nợ
+Cổng đọc hồ sơ bằng một lần tra index theo biển số (lookup). Các đường ghi
+hàng loạt (dọn phiên treo, sinh dữ liệu) gọi rebuild() để tính lại từ
+ParkingSession cho các biển số liên quan.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from .models import ParkingSession, VehicleProfile
+
+
+REBUILD_BATCH_SIZE = 2000
+
+
+def lookup(plate):
+    """
+    Hồ sơ của biển số (một truy vấn theo index unique)
+
+    Returns:
+        dict | None: {'visit_count', 'last_seen', 'unpaid_count', 'outstanding_amount', 'subscription_until'}
+    """
+    return VehicleProfile.objects.filter(license_plate=plate).values(
+        'visit_count', 'last_seen', 'unpaid_count', 'outstanding_amount', 'subscription_until',
+    ).first()
+
+
+def _increment(plate, last_seen=None, **deltas):
+    """Cộng `deltas` vào hồ sơ của biển số, tạo hồ sơ nếu chưa có"""
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if last_seen is not None:
+        changes['last_seen'] = last_seen
+    rows = VehicleProfile.objects.filter(license_plate=plate)
+    if rows.update(updated_at=timezone.now(), **changes):
+        return
+    try:
+        with transaction.atomic():
+            VehicleProfile.objects.create(license_plate=plate, last_seen=last_seen, **deltas)
+    except IntegrityError:
+        # Yêu cầu khác vừa tạo hồ sơ của biển số này
+        rows.update(updated_at=timezone.now(), **changes)
+
+
+def record_entry(plate, when):
+    _increment(plate, last_seen=when, visit_count=1)
+
+
+def record_exit(session):
+    """Ghi nhận phiên vừa kết thúc (chỉ cộng nợ nếu phiên chưa thanh toán)"""
+    if session.payment_status == 'UNPAID' and session.fee:
+        _increment(session.license_plate, last_seen=session.exit_time,
+                   unpaid_count=1, outstanding_amount=session.fee)
+    else:
+        _increment(session.license_plate, last_seen=session.exit_time)
+
+
+def record_paid(plate, count, amount):
+    """Trừ nợ sau khi thu tiền `count` phiên của biển số, tổng `amount`"""
+    _increment(plate, unpaid_count=-count, outstanding_amount=-amount)
+
+
+def rebuild(plates=None):
+    """
+    Tính lại hồ sơ từ ParkingSession (cho các biển số `plates`, None: tất cả)
+
+    Returns:
+        int: số hồ sơ được ghi
+    """
+    sessions = ParkingSession.objects.all()
+    if plates is not None:
+        sessions = sessions.filter(license_plate__in=list(plates))
+    unpaid = Q(status='COMPLETED', payment_status='UNPAID')
+    rows = sessions.values('license_plate').annotate(
+        visits=Count('id'),
+        last_entry=Max('entry_time'),
+        last_exit=Max('exit_time'),
+        unpaid=Count('id', filter=unpaid),
+        outstanding=Sum('fee', filter=unpaid),
+    ).order_by()
+
+    written = 0
+    batch = []
+
+    def flush():
+        VehicleProfile.objects.bulk_create(
+            batch, update_conflicts=True, unique_fields=['license_plate'],
+            update_fields=['visit_count', 'last_seen', 'unpaid_count', 'outstanding_amount', 'updated_at'],
+        )
+
+    for row in rows.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        batch.append(VehicleProfile(
+            license_plate=row['license_plate'],
+            visit_count=row['visits'],
+            last_seen=max(filter(None, (row['last_entry'], row['last_exit']))),
+            unpaid_count=row['unpaid'],
+            outstanding_amount=row['outstanding'] or 0,
+            updated_at=timezone.now(),
+        ))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            flush()
+            written += len(batch)
+            batch = []
+    if batch:
+        flush()
+        written += len(batch)
+    return written
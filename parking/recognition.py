@@ -0,0 +1,342 @@
+"""
+Nhận diện biển số phía server (tùy chọn) - Pi chỉ cần gửi frame thô
+
+Luồng xử lý:
+    receive_stream / stream_upload
+        -> recognizer_pool.submit(camera_id, frame)   (lấy mẫu theo camera, không chặn)
+        -> thread gom batch (nhiều camera chung một batch, tối đa BATCH_SIZE
+           frame hoặc đợi BATCH_TIMEOUT giây)
+        -> multiprocessing pool (WORKERS process, mỗi process nạp model 1 lần)
+        -> thread kết quả: chọn biển số tốt nhất của frame, đưa vào bộ bầu chọn
+           theo cổng (parking/voting.py, cùng logic ENTRY/EXIT với /api/upload/,
+           lần đọc lặp lại trong COOLDOWN của PLATE_VOTING được bỏ qua)
+
+Model là class cắm ngoài qua RECOGNITION['BACKEND'] (dotted path), kế thừa
+PlateRecognizer, chỉ dùng CPU. Hàng đợi/số batch đang chạy đều có giới hạn:
+quá tải thì frame bị bỏ (đếm trong stats), luồng nhận frame không bao giờ bị chặn.
+"""
+
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .plates import canonical_form, normalize
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECOGNITION = {
+    'ENABLED': False,
+    'BACKEND': 'parking.recognition.HaarCascadeRecognizer',
+    'BACKEND_OPTIONS': {},
+    'WORKERS': None,            # None: số core; 0: chạy ngay trong thread gom batch (dev/test)
+    'SAMPLE_INTERVAL': 0.5,     # giây giữa 2 frame được nhận diện của cùng camera
+    'BATCH_SIZE': 8,
+    'BATCH_TIMEOUT': 0.05,      # giây đợi gom đủ batch
+    'MAX_PENDING': 64,          # frame chờ nhận diện tối đa
+    'MIN_CONFIDENCE': 0.8,
+}
+
+PlateResult = namedtuple('PlateResult', ['plate', 'confidence', 'bbox'])
+
+
+
+def get_config():
+    config = dict(DEFAULT_RECOGNITION)
+    config.update(getattr(settings, 'RECOGNITION', {}))
+    return config
+
+
+# ==================== INTERFACE MODEL ====================
+
+class PlateRecognizer:
+    """
+    Interface model nhận diện biển số (chạy trong process worker, chỉ CPU)
+
+    Class con cài đặt load() (nạp model, gọi 1 lần mỗi process) và
+    recognize() (nhận một batch ảnh BGR numpy, trả danh sách PlateResult
+    cho từng ảnh).
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def load(self):
+        pass
+
+    def recognize(self, images):
+        raise NotImplementedError
+
+
+class HaarCascadeRecognizer(PlateRecognizer):
+    """
+    Định vị biển số bằng Haar cascade của OpenCV, đọc ký tự bằng Tesseract
+
+    BACKEND_OPTIONS:
+        cascade: đường dẫn file cascade (mặc định haarcascade_russian_plate_number.xml của OpenCV)
+        tesseract_config: tham số cho pytesseract
+    """
+
+    def load(self):
+        import os
+        import cv2
+
+        path = self.options.get('cascade') or os.path.join(cv2.data.haarcascades,
+                                                           'haarcascade_russian_plate_number.xml')
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise ImproperlyConfigured(f'Cannot load plate cascade: {path}')
+        try:
+            import pytesseract
+        except ImportError:
+            raise ImproperlyConfigured('HaarCascadeRecognizer requires pytesseract (pip install pytesseract)')
+        self.pytesseract = pytesseract
+        self.tesseract_config = self.options.get(
+            'tesseract_config', '--psm 7 -c tessedit_char_whitelist=0123456789ABCDEFGHKLMNPSTUVXYZ'
+        )
+
+    def recognize(self, images):
+        import cv2
+
+        results = []
+        for image in images:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            plates = []
+            for (x, y, w, h) in self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4):
+                crop = cv2.threshold(gray[y:y + h, x:x + w], 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+                data = self.pytesseract.image_to_data(crop, config=self.tesseract_config,
+                                                      output_type=self.pytesseract.Output.DICT)
+                words = [(text, float(conf)) for text, conf in zip(data['text'], data['conf'])
+                         if text.strip() and float(conf) >= 0]
+                if words:
+                    text = ''.join(text for text, _ in words)
+                    confidence = min(conf for _, conf in words) / 100
+                    plates.append(PlateResult(text, confidence, (int(x), int(y), int(w), int(h))))
+            results.append(plates)
+        return results
+
+
+# ==================== PROCESS WORKER ====================
+
+_worker_recognizer = None
+
+
+def _init_worker(backend, options):
+    global _worker_recognizer
+    _worker_recognizer = import_string(backend)(**options)
+    _worker_recognizer.load()
+
+
+def _recognize_batch(jpegs):
+    """Chạy trong process worker: giải mã JPEG rồi nhận diện cả batch"""
+    import cv2
+    import numpy as np
+
+    images, index = [], []
+    for i, jpeg in enumerate(jpegs):
+        image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append(image)
+            index.append(i)
+
+    results = [[] for _ in jpegs]
+    if images:
+        for i, plates in zip(index, _worker_recognizer.recognize(images)):
+            results[i] = [tuple(p) for p in plates]
+    return results
+
+
+def normalize_plate(text):
+    """Chuẩn hóa chuỗi OCR theo cấu trúc biển số (xem parking/plates.py)"""
+    return canonical_form(normalize(text))
+
+
+# ==================== POOL ====================
+
+class RecognizerPool:
+    def __init__(self):
+        self.config = get_config()
+        self._queue = queue.Queue(maxsize=self.config['MAX_PENDING'])
+        self._results = queue.Queue()
+        self._last_sampled = {}       # camera_id -> thời điểm lấy mẫu gần nhất
+        self._pool = None
+        self._in_flight = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counters = {
+            'submitted': 0, 'sampled': 0, 'skipped': 0, 'dropped': 0,
+            'batches': 0, 'frames': 0, 'plates': 0, 'events': 0, 'errors': 0,
+        }
+        self.latencies = deque(maxlen=1000)   # lấy mẫu -> có kết quả (giây)
+        self.started_at = None
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.counters[key] += amount
+
+    def start(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            workers = self.config['WORKERS']
+            if workers is None:
+                workers = multiprocessing.cpu_count()
+            if workers:
+                # spawn: process con không thừa kế các thread/kết nối database của server
+                context = multiprocessing.get_context('spawn')
+                self._pool = context.Pool(workers, initializer=_init_worker,
+                                          initargs=(self.config['BACKEND'], self.config['BACKEND_OPTIONS']))
+                self._in_flight = threading.BoundedSemaphore(workers * 2)
+            else:
+                _init_worker(self.config['BACKEND'], self.config['BACKEND_OPTIONS'])
+            threading.Thread(target=self._batch_loop, name='recognition-batcher', daemon=True).start()
+            threading.Thread(target=self._result_loop, name='recognition-results', daemon=True).start()
+            self.started_at = time.time()
+            self._started = True
+
+    def submit(self, camera_id, frame):
+        """
+        Đưa một frame vừa nhận vào hàng đợi nhận diện (không chặn)
+
+        Chỉ lấy mẫu mỗi SAMPLE_INTERVAL giây một frame cho từng camera.
+
+        Returns:
+            bool: True nếu frame được lấy mẫu
+        """
+        if not self.enabled:
+            return False
+        self._count('submitted')
+        now = time.time()
+        if now - self._last_sampled.get(camera_id, 0) < self.config['SAMPLE_INTERVAL']:
+            self._count('skipped')
+            return False
+
+        self.start()
+        try:
+            # bytes(): frame có thể là memoryview của request body, cần copy để gửi sang process khác
+            self._queue.put_nowait((camera_id, bytes(frame), now))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._last_sampled[camera_id] = now
+        self._count('sampled')
+        return True
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.config['BATCH_TIMEOUT']
+            while len(batch) < self.config['BATCH_SIZE']:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._count('batches')
+            jpegs = [jpeg for _, jpeg, _ in batch]
+            if self._pool is None:
+                try:
+                    self._results.put((batch, _recognize_batch(jpegs)))
+                except Exception:
+                    self._count('errors')
+                    logger.exception('Plate recognition failed')
+                continue
+
+            self._in_flight.acquire()
+            self._pool.apply_async(
+                _recognize_batch, (jpegs,),
+                callback=lambda results, batch=batch: self._on_batch_done(batch, results),
+                error_callback=lambda exc: self._on_batch_error(exc),
+            )
+
+    def _on_batch_done(self, batch, results):
+        self._in_flight.release()
+        self._results.put((batch, results))
+
+    def _on_batch_error(self, exc):
+        self._in_flight.release()
+        self._count('errors')
+        logger.error('Plate recognition failed: %s', exc)
+
+    def _result_loop(self):
+        while True:
+            batch, results = self._results.get()
+            try:
+                self.handle_results(batch, results)
+            except Exception:
+                logger.exception('Failed to handle recognition results')
+
+    def handle_results(self, batch, results):
+        """Chọn biển số tốt nhất mỗi frame và đưa vào logic ENTRY/EXIT"""
+        now = time.time()
+        with self._stats_lock:
+            self.counters['frames'] += len(batch)
+            self.latencies.extend(now - sampled_at for _, _, sampled_at in batch)
+
+        for (camera_id, jpeg, sampled_at), plates in zip(batch, results):
+            candidates = [PlateResult(normalize_plate(p[0]), p[1], p[2]) for p in plates]
+            candidates = [p for p in candidates if p.plate and p.confidence >= self.config['MIN_CONFIDENCE']]
+            if not candidates:
+                continue
+            self._count('plates', len(candidates))
+            best = max(candidates, key=lambda p: p.confidence)
+            self.emit(camera_id, best, jpeg, sampled_at)
+
+    def emit(self, camera_id, result, jpeg, sampled_at):
+        from django.core.files.base import ContentFile
+        from django.db import close_old_connections
+
+        from .device_auth import secret_cache
+        from .gate_decision import gate_decisions
+        from .lots import get_default_lot
+        from .voting import plate_voter
+
+        close_old_connections()
+        device = secret_cache.get(camera_id)
+        if device and device.lot_id:
+            lot_id, gate_id = device.lot_id, device.gate_id
+        else:
+            lot_id, gate_id = get_default_lot().id, None
+
+        image = ContentFile(jpeg, name=f'{camera_id}_{int(sampled_at * 1000)}.jpg')
+        # Các frame liên tiếp của cùng một xe được gom và bầu chọn trước khi ghi ENTRY/EXIT
+        if plate_voter.enabled:
+            plate_voter.submit(result.plate, result.confidence, camera_id, image, lot_id, gate_id, wait=False)
+        else:
+            gate_decisions.decide(result.plate, result.confidence, camera_id, image, lot_id, gate_id)
+        self._count('events')
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self.counters)
+            latencies = sorted(self.latencies)
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        data.update(
+            enabled=self.enabled,
+            started=self._started,
+            pending=self._queue.qsize(),
+            frames_per_second=round(data['frames'] / elapsed, 2) if elapsed else 0.0,
+            latency_p50=round(latencies[len(latencies) // 2], 4) if latencies else None,
+            latency_p95=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4) if latencies else None,
+        )
+        return data
+
+
+recognizer_pool = RecognizerPool()
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CameraDevice, Gate, Lot, Subscription
+
+
+@receiver([post_save, post_delete], sender=CameraDevice)
+def invalidate_device_secret(sender, instance, **kwargs):
+    """Xóa khóa bí mật khỏi cache khi thiết bị bị sửa/xóa (đổi key, khóa thiết bị)"""
+    from .device_auth import secret_cache
+    secret_cache.invalidate(instance.device_id)
+
+
+@receiver([post_save, post_delete], sender=Lot)
+@receiver([post_save, post_delete], sender=Gate)
+def invalidate_lot(sender, instance, **kwargs):
+    from .lots import invalidate_lot_cache
+    invalidate_lot_cache()
+
+
+@receiver([post_save, post_delete], sender=Subscription)
+def invalidate_subscriptions(sender, instance, **kwargs):
+    """Nạp lại chỉ mục vé tháng và cập nhật hồ sơ xe khi vé được thêm/sửa/xóa"""
+    from .subscriptions import subscriptions, sync_profiles
+    subscriptions.invalidate()
+    sync_profiles([instance.license_plate])
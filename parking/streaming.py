@@ -0,0 +1,298 @@
+"""
+Frame broker cho stream camera
+
+Giữ frame mới nhất của từng camera trong bộ nhớ (và ghi ra
+media/streams/<src>.jpg để các worker khác đọc được), đồng thời kiểm soát
+tốc độ nhận frame: frame đến nhanh hơn tốc độ tiêu thụ của broker
+(TARGET_FPS) bị bỏ ngay từ đầu.
+
+Thứ tự decorator trên endpoint nhận frame:
+    @frame_size_limit          Content-Length (411/413)
+    @frame_admission           token bucket của camera theo header (429)
+    @device_required()         xác thực thiết bị (đọc body để kiểm chữ ký)
+Cả hai kiểm tra đầu chạy trước khi body được đọc, nên frame bị bỏ không tốn
+công tính HMAC. Chỉ camera đã đăng ký (CameraDevice) mới có trạng thái trong
+broker, nên số series metrics không tăng theo mã camera tùy ý; request thiếu
+header xác thực bị từ chối trước khi tiêu token của camera thật.
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .device_auth import TokenBucket, get_config as get_device_auth_config, secret_cache
+
+
+DEFAULT_STREAM_INGEST = {
+    'TARGET_FPS': 30,              # tốc độ tiêu thụ của broker / viewer
+    'BURST': 15,                   # số frame được vượt tạm thời
+    'MAX_FRAME_BYTES': 1024 * 1024,
+    'STREAM_DIR': 'media/streams',
+    # X-Frame-Seq lùi quá số này được coi là Pi khởi động lại (reset seq)
+    'SEQ_RESET_WINDOW': 100,
+    # Ring buffer N giây frame gần nhất mỗi camera (để cắt clip quanh lúc nhận diện)
+    'RING_SECONDS': 10,
+    'RING_MAX_BYTES': 32 * 1024 * 1024,   # giới hạn bộ nhớ mỗi camera
+}
+
+
+# Mã camera được ghép vào đường dẫn file trong STREAM_DIR
+CAMERA_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def valid_camera_id(camera_id):
+    return bool(camera_id) and CAMERA_ID_PATTERN.match(camera_id) is not None
+
+
+def get_config():
+    config = dict(DEFAULT_STREAM_INGEST)
+    config.update(getattr(settings, 'STREAM_INGEST', {}))
+    return config
+
+
+@dataclass
+class CameraStream:
+    """Trạng thái stream của một camera trong process hiện tại"""
+    camera_id: str
+    bucket: TokenBucket
+    frame: bytes = None
+    seq: int = 0
+    client_seq: int = None
+    captured_at: float = None
+    published_at: float = 0.0
+    accepted: int = 0
+    dropped_rate: int = 0
+    dropped_size: int = 0
+    dropped_stale: int = 0
+    bytes_in: int = 0
+    ring: deque = field(default_factory=deque)   # (published_at, frame) theo thời gian tăng dần
+    ring_bytes: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class FrameBroker:
+    """Nơi nhận frame từ Pi và phát lại cho các viewer (video_feed)"""
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def stream(self, camera_id):
+        stream = self._streams.get(camera_id)
+        if stream is None:
+            if not valid_camera_id(camera_id):
+                raise ValueError(f'Invalid camera id: {camera_id!r}')
+            with self._lock:
+                stream = self._streams.get(camera_id)
+                if stream is None:
+                    bucket = TokenBucket(self.config['TARGET_FPS'], self.config['BURST'])
+                    stream = self._streams[camera_id] = CameraStream(camera_id, bucket)
+        return stream
+
+    def check_size(self, camera_id, content_length):
+        """
+        Kiểm tra kích thước frame theo header Content-Length, trước khi đọc body
+
+        Không tạo trạng thái cho camera chưa có (request lúc này chưa được xác thực).
+
+        Returns:
+            str: 'ok', 'too_large' hoặc 'length_required' (thiếu/sai Content-Length, ví dụ chunked)
+        """
+        try:
+            content_length = int(content_length)
+        except (TypeError, ValueError):
+            return 'length_required'
+        if content_length > self.config['MAX_FRAME_BYTES']:
+            stream = self._streams.get(camera_id)
+            if stream is not None:
+                with stream.lock:
+                    stream.dropped_size += 1
+            return 'too_large'
+        return 'ok'
+
+    def admit(self, camera_id):
+        """
+        Quyết định nhận hay bỏ frame theo token bucket của camera (sau khi xác thực)
+
+        Returns:
+            tuple: (status, retry_after) với status là 'ok' hoặc 'rate_limited'
+        """
+        stream = self.stream(camera_id)
+        allowed, retry_after = stream.bucket.consume()
+        if not allowed:
+            with stream.lock:
+                stream.dropped_rate += 1
+            return 'rate_limited', retry_after
+        return 'ok', 0.0
+
+    def publish(self, camera_id, frame, persist=True, seq=None, captured_at=None):
+        """
+        Lưu frame mới nhất vào bộ nhớ và (mặc định) ghi atomic ra file
+
+        Args:
+            frame (bytes | memoryview): dữ liệu JPEG, được giữ nguyên không copy
+            seq (int, optional): số thứ tự frame phía Pi - frame cũ/trùng bị bỏ
+            captured_at (float, optional): thời điểm chụp (unix giây)
+
+        Returns:
+            bool: False nếu frame bị bỏ vì đến trễ (seq cũ hơn frame hiện tại)
+        """
+        stream = self.stream(camera_id)
+        with stream.lock:
+            # Bỏ frame đến trễ/trùng; seq lùi xa hoặc stream ngắt > 2s coi như Pi khởi động lại
+            if seq is not None and stream.client_seq is not None and time.time() - stream.published_at < 2:
+                if stream.client_seq - self.config['SEQ_RESET_WINDOW'] < seq <= stream.client_seq:
+                    stream.dropped_stale += 1
+                    return False
+            stream.frame = frame
+            stream.seq += 1
+            stream.client_seq = seq
+            stream.captured_at = captured_at
+            stream.published_at = time.time()
+            stream.accepted += 1
+            stream.bytes_in += len(frame)
+
+            # Ring buffer: chỉ giữ tham chiếu frame, bỏ frame cũ khi quá thời gian/dung lượng
+            ring = stream.ring
+            ring.append((stream.published_at, frame))
+            stream.ring_bytes += len(frame)
+            oldest_allowed = stream.published_at - self.config['RING_SECONDS']
+            while ring and (stream.ring_bytes > self.config['RING_MAX_BYTES'] or ring[0][0] < oldest_allowed):
+                stream.ring_bytes -= len(ring.popleft()[1])
+
+        if persist:
+            stream_dir = self.config['STREAM_DIR']
+            os.makedirs(stream_dir, exist_ok=True)
+            frame_path = os.path.join(stream_dir, f'{camera_id}.jpg')
+            temp_path = os.path.join(stream_dir, f'{camera_id}.tmp')
+            # Ghi vào file tạm trước rồi replace atomic (tránh viewer đọc file đang ghi)
+            with open(temp_path, 'wb') as f:
+                f.write(frame)
+            os.replace(temp_path, frame_path)
+        return True
+
+    def latest(self, camera_id, max_age=None):
+        """Frame mới nhất trong bộ nhớ process này (None nếu chưa có hoặc quá cũ)"""
+        stream = self._streams.get(camera_id)
+        if stream is None or stream.frame is None:
+            return None
+        if max_age is not None and time.time() - stream.published_at > max_age:
+            return None
+        return stream.frame
+
+    def frames_between(self, camera_id, start, end):
+        """
+        Các frame trong ring buffer có thời điểm nhận trong [start, end]
+
+        Returns:
+            list[tuple]: (published_at, frame) theo thứ tự thời gian
+        """
+        stream = self._streams.get(camera_id)
+        if stream is None:
+            return []
+        with stream.lock:
+            return [(at, frame) for at, frame in stream.ring if start <= at <= end]
+
+    def stats(self):
+        """Số frame nhận/bỏ theo từng camera"""
+        data = {}
+        for camera_id, stream in list(self._streams.items()):
+            with stream.lock:
+                data[camera_id] = {
+                    'accepted': stream.accepted,
+                    'dropped_rate_limited': stream.dropped_rate,
+                    'dropped_too_large': stream.dropped_size,
+                    'dropped_stale': stream.dropped_stale,
+                    'bytes_in': stream.bytes_in,
+                    'seq': stream.seq,
+                    'client_seq': stream.client_seq,
+                    'last_frame_at': stream.published_at or None,
+                    'ring_frames': len(stream.ring),
+                    'ring_bytes': stream.ring_bytes,
+                }
+        return data
+
+
+broker = FrameBroker()
+
+
+def _camera_id(request, kwargs):
+    # /api/stream/<src> lấy camera từ URL, /api/stream_upload/ lấy từ header
+    return kwargs.get('src') or request.headers.get('X-Camera-Id')
+
+
+def frame_size_limit(view_func):
+    """
+    Decorator cho endpoint nhận frame, đặt ngoài cùng: bỏ frame quá
+    MAX_FRAME_BYTES theo Content-Length trước khi body được đọc vào bộ nhớ.
+    Request không có Content-Length (chunked) bị từ chối với 411 vì không
+    giới hạn được kích thước trước khi đọc; mã camera sai định dạng: 400.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        camera_id = _camera_id(request, kwargs)
+        if request.method != 'POST' or not camera_id:
+            return view_func(request, *args, **kwargs)
+        if not valid_camera_id(camera_id):
+            return JsonResponse({"status": "error", "msg": "Invalid camera id"}, status=400)
+
+        status = broker.check_size(camera_id, request.META.get('CONTENT_LENGTH'))
+        if status == 'length_required':
+            return JsonResponse({"status": "error", "msg": "Content-Length required"}, status=411)
+        if status == 'too_large':
+            return JsonResponse({
+                "status": "error",
+                "msg": "Frame too large",
+                "max_frame_bytes": broker.config['MAX_FRAME_BYTES'],
+            }, status=413)
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def frame_admission(view_func):
+    """
+    Decorator cho endpoint nhận frame, đặt ngoài device_required: giới hạn
+    tốc độ theo camera trước khi body được đọc để kiểm chữ ký. Chỉ dựa vào
+    header (X-Device-Id phải trùng mã camera) và chỉ nhận camera đã đăng ký.
+
+    Phản hồi backpressure (429) kèm Retry-After và X-Target-FPS để client
+    Pi tự điều chỉnh tốc độ gửi.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        camera_id = _camera_id(request, kwargs)
+        if request.method != 'POST' or not camera_id:
+            return view_func(request, *args, **kwargs)
+
+        device_id = request.headers.get('X-Device-Id')
+        if device_id is None and get_device_auth_config()['REQUIRED']:
+            return JsonResponse({"status": "error", "msg": "Missing device credentials"}, status=401)
+        if device_id is not None and device_id != camera_id:
+            return JsonResponse({"status": "error", "msg": "camera_id does not match device"}, status=403)
+        if secret_cache.get(camera_id) is None:
+            return JsonResponse({"status": "error", "msg": "Unknown camera"}, status=403)
+
+        status, retry_after = broker.admit(camera_id)
+        if status == 'rate_limited':
+            target_fps = broker.config['TARGET_FPS']
+            response = JsonResponse({
+                "status": "error",
+                "msg": "Too many frames",
+                "target_fps": target_fps,
+                "retry_after_ms": int(retry_after * 1000),
+            }, status=429)
+            response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+            response['X-Target-FPS'] = str(target_fps)
+            return response
+
+        return view_func(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,167 @@
+"""
+Vé tháng / danh sách xe miễn phí (Subscription)
+
+Phiên của xe có vé còn hạn (theo ngày ra, đúng bãi hoặc vé mọi bãi) được
+miễn phí: complete_session đặt fee = 0, payment_status = 'FREE'.
+
+Cổng không truy vấn database để kiểm tra: SubscriptionIndex giữ dict
+biển số -> các khoảng hiệu lực trong bộ nhớ (tra O(1)). Chỉ mục được xóa
+ngay khi Subscription đổi trong process hiện tại (parking/signals.py); các
+worker khác sau INDEX_TTL giây kiểm tra "phiên bản" của bảng (số dòng, lần
+sửa cuối - một câu aggregate) và chỉ nạp lại khi bảng đã đổi.
+
+Nhập hàng loạt danh sách vé (import_rows, lệnh import_subscriptions) ghi
+bằng bulk_create rồi cập nhật VehicleProfile.subscription_until.
+"""
+
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .lots import get_lot
+from .models import Subscription, VehicleProfile
+from .plates import canonical_form, normalize
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_TTL = 30               # giây
+IMPORT_BATCH_SIZE = 2000
+
+
+def _day(moment):
+    return timezone.localtime(moment).date() if isinstance(moment, datetime) else moment
+
+
+class SubscriptionIndex:
+    """Biển số -> [(lot_id | None, valid_from, valid_until)] của các vé đang hiệu lực"""
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._plates = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _windows(self):
+        plates = self._plates
+        if plates is not None and time.monotonic() - self._checked_at < self.ttl:
+            return plates
+
+        version = Subscription.objects.aggregate(count=Count('id'), changed=Max('updated_at'))
+        version = (version['count'], version['changed'])
+        if plates is None or version != self._version:
+            plates = {}
+            rows = Subscription.objects.filter(
+                is_active=True, valid_until__gte=timezone.localtime().date() - timedelta(days=1),
+            ).values_list('license_plate', 'lot_id', 'valid_from', 'valid_until')
+            for plate, lot_id, valid_from, valid_until in rows.iterator():
+                plates.setdefault(plate, []).append((lot_id, valid_from, valid_until))
+            logger.debug('Loaded %d subscription plates', len(plates))
+        with self._lock:
+            self._plates, self._version, self._checked_at = plates, version, time.monotonic()
+        return plates
+
+    def valid_until(self, plate, lot_id=None, moment=None):
+        """
+        Vé của `plate` còn hiệu lực tại bãi `lot_id` vào ngày của `moment` (mặc định: bây giờ)
+
+        Returns:
+            date | None: ngày hết hạn xa nhất trong các vé khớp
+        """
+        windows = self._windows().get(plate)
+        if not windows:
+            return None
+        day = _day(moment or timezone.now())
+        return max((until for lot, start, until in windows
+                    if (lot is None or lot == lot_id) and start <= day <= until), default=None)
+
+    def invalidate(self):
+        with self._lock:
+            self._plates = None
+
+
+subscriptions = SubscriptionIndex()
+
+
+def _batches(items, size=IMPORT_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_profiles(plates):
+    """Cập nhật VehicleProfile.subscription_until (ngày hết hạn xa nhất của vé đang hiệu lực)"""
+    now = timezone.now()
+    for batch in _batches(set(plates)):
+        until = dict(
+            Subscription.objects.filter(license_plate__in=batch, is_active=True)
+            .values('license_plate').annotate(until=Max('valid_until')).values_list('license_plate', 'until')
+            .order_by()
+        )
+        VehicleProfile.objects.bulk_create(
+            [VehicleProfile(license_plate=plate, subscription_until=day, updated_at=now) for plate, day in until.items()],
+            update_conflicts=True, unique_fields=['license_plate'], update_fields=['subscription_until', 'updated_at'],
+        )
+        expired = [plate for plate in batch if plate not in until]
+        if expired:
+            VehicleProfile.objects.filter(license_plate__in=expired).update(subscription_until=None, updated_at=now)
+
+
+def import_rows(rows, dry_run=False):
+    """
+    Nhập danh sách vé: mỗi dòng là dict license_plate, valid_from, valid_until
+    (YYYY-MM-DD) và tùy chọn lot (mã bãi), kind, holder, note. Dòng trùng hẳn
+    một vé đã có (cùng biển số, bãi, loại, thời hạn) được bỏ qua.
+
+    Returns:
+        dict: {'created', 'skipped', 'errors': [(số dòng, lỗi)]}
+    """
+    kinds = dict(Subscription.KIND_CHOICES)
+    pending, errors, seen = [], [], set()
+    for line, row in enumerate(rows, start=1):
+        try:
+            plate = canonical_form(normalize(row.get('license_plate')))
+            if not plate:
+                raise ValueError('thiếu biển số')
+            valid_from = date.fromisoformat((row.get('valid_from') or '').strip())
+            valid_until = date.fromisoformat((row.get('valid_until') or '').strip())
+            if valid_until < valid_from:
+                raise ValueError('valid_until trước valid_from')
+            kind = (row.get('kind') or 'MONTHLY').strip().upper()
+            if kind not in kinds:
+                raise ValueError(f'loại vé "{kind}" không hợp lệ')
+            lot_code = (row.get('lot') or '').strip()
+            lot = get_lot(lot_code) if lot_code else None
+            if lot_code and lot is None:
+                raise ValueError(f'bãi đỗ "{lot_code}" không tồn tại')
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        key = (plate, lot.id if lot else None, kind, valid_from, valid_until)
+        if key in seen:
+            continue
+        seen.add(key)
+        pending.append(Subscription(
+            license_plate=plate, lot=lot, kind=kind, valid_from=valid_from, valid_until=valid_until,
+            holder=(row.get('holder') or '').strip(), note=(row.get('note') or '').strip(),
+        ))
+
+    existing = set()
+    for batch in _batches({item.license_plate for item in pending}):
+        existing.update(Subscription.objects.filter(license_plate__in=batch).values_list(
+            'license_plate', 'lot_id', 'kind', 'valid_from', 'valid_until'))
+    new = [item for item in pending
+           if (item.license_plate, item.lot_id, item.kind, item.valid_from, item.valid_until) not in existing]
+
+    if not dry_run and new:
+        Subscription.objects.bulk_create(new, batch_size=IMPORT_BATCH_SIZE)   # bulk_create không gửi signal
+        subscriptions.invalidate()
+        sync_profiles({item.license_plate for item in new})
+        logger.info('Imported %d subscriptions', len(new), extra={'skipped': len(pending) - len(new),
+                                                                  'errors': len(errors)})
+    return {'created': len(new), 'skipped': len(pending) - len(new), 'errors': errors}
@@ -0,0 +1,159 @@
+"""
+Dọn phiên ACTIVE bị "treo" (lỡ mất lần đọc EXIT)
+
+Phiên không bao giờ được đóng làm danh sách xe đang đỗ phình to (mỗi lần
+poll get_active_sessions tính lại phí cho từng dòng) và biến lần vào sau của
+xe thành EXIT sai. Chính sách (settings.SESSION_SWEEP):
+    - đỗ quá FLAG_AFTER_HOURS giờ: đánh dấu needs_review
+    - đỗ quá CLOSE_AFTER_HOURS giờ: tự đóng (TIMEOUT), thời điểm ra = lúc quét
+    - có phiên khác của cùng biển số vào SAU phiên này (xe đã vào lại ở bãi
+      khác): tự đóng (CONTRADICTED), thời điểm ra = lúc xe vào lại
+Phiên tự đóng luôn có needs_review để nhân viên kiểm tra phí. Trường hợp xe
+vào lại ở cổng chỉ-vào của cùng bãi được xử lý ngay tại gate.
+
+Mỗi lô tối đa BATCH_SIZE phiên, cập nhật bằng một câu UPDATE có điều kiện
+status='ACTIVE' nên không ghi đè phiên vừa được đóng bởi EXIT thật.
+
+Chạy định kỳ: `python manage.py sweep_sessions` từ cron, hoặc
+`sweep_sessions --loop` như một process riêng (quét mỗi INTERVAL giây).
+Không có scheduler trong worker web (hay migrate/shell/test), tránh nhiều
+process cùng cập nhật một lô phiên và cùng dựng lại VehicleProfile.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+from django.utils import timezone
+
+from .models import ParkingSession
+from . import profiles
+from .plates import active_plates
+from .subscriptions import subscriptions
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_SWEEP = {
+    'ENABLED': True,
+    'INTERVAL': 300,              # giây giữa 2 lần quét (sweep_sessions --loop)
+    'FLAG_AFTER_HOURS': 24,
+    'CLOSE_AFTER_HOURS': 72,      # None: không tự đóng theo thời gian
+    'CLOSE_CONTRADICTED': True,
+    'BATCH_SIZE': 500,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_SESSION_SWEEP)
+    config.update(getattr(settings, 'SESSION_SWEEP', {}))
+    return config
+
+
+def _batches(queryset, size):
+    """Chia danh sách (id, ...) thành các lô, luôn đọc lô đầu tiên còn lại"""
+    rows = list(queryset[:size])
+    while rows:
+        yield rows
+        if len(rows) < size:
+            return
+        last_id = rows[-1][0]
+        rows = list(queryset.filter(id__gt=last_id)[:size])
+
+
+def _close(rows, reason, dry_run):
+    """
+    Đóng một lô phiên ACTIVE
+
+    Args:
+        rows: list[(id, license_plate, lot_id, entry_time, exit_time)]
+
+    Returns:
+        int: số phiên thực sự được đóng
+    """
+    if dry_run:
+        return len(rows)
+
+    calculate_fee = ParkingSession().calculate_fee
+    exit_times, durations, fees, free_ids = [], [], [], []
+    for session_id, plate, lot_id, entry_time, exit_time in rows:
+        duration_minutes = max(0, int((exit_time - entry_time).total_seconds() / 60))
+        # Xe có vé tháng còn hạn: miễn phí như khi ra bình thường (xem complete_session)
+        free = subscriptions.valid_until(plate, lot_id, exit_time) is not None
+        if free:
+            free_ids.append(session_id)
+        exit_times.append(When(id=session_id, then=Value(exit_time)))
+        durations.append(When(id=session_id, then=Value(duration_minutes)))
+        fees.append(When(id=session_id, then=Value(0 if free else calculate_fee(duration_minutes))))
+
+    closed = ParkingSession.objects.filter(id__in=[row[0] for row in rows], status='ACTIVE').update(
+        status='COMPLETED',
+        payment_status=Case(When(id__in=free_ids, then=Value('FREE')), default=Value('UNPAID')),
+        close_reason=reason,
+        needs_review=True,
+        exit_time=Case(*exit_times, default=F('exit_time')),
+        duration_minutes=Case(*durations, default=F('duration_minutes')),
+        fee=Case(*fees, default=F('fee')),
+        updated_at=timezone.now(),
+    )
+    for lot_id in {row[2] for row in rows}:
+        active_plates.invalidate(lot_id)
+    # Số phiên đóng được có thể ít hơn lô (xe vừa ra thật) - tính lại hồ sơ thay vì cộng dồn
+    profiles.rebuild({row[1] for row in rows})
+    return closed
+
+
+def sweep_sessions(now=None, config=None, dry_run=False):
+    """
+    Đánh dấu / tự đóng các phiên ACTIVE theo chính sách
+
+    Returns:
+        dict: số phiên theo quyết định {'contradicted', 'timed_out', 'flagged'}
+              và 'rollups': các (bãi, ngày) có phiên bị đóng, cần tính lại thống kê
+    """
+    config = config or get_config()
+    now = now or timezone.now()
+    summary = {'contradicted': 0, 'timed_out': 0, 'flagged': 0}
+    touched = set()
+    active = ParkingSession.objects.filter(status='ACTIVE').order_by('id')
+
+    def close_all(queryset, reason, key):
+        for rows in _batches(queryset, config['BATCH_SIZE']):
+            closed = _close(rows, reason, dry_run)
+            summary[key] += closed
+            touched.update((row[2], timezone.localtime(row[4]).date().isoformat()) for row in rows)
+            logger.info('%s %d stale sessions (%s)', 'Would close' if dry_run else 'Closed', closed, reason,
+                        extra={'reason': reason, 'session_ids': [row[0] for row in rows],
+                               'plates': [row[1] for row in rows], 'dry_run': dry_run})
+
+    # 1. Biển số đã vào lại (phiên sau) -> phiên này đã kết thúc trước lúc đó
+    if config['CLOSE_CONTRADICTED']:
+        next_entry = ParkingSession.objects.filter(
+            license_plate=OuterRef('license_plate'), entry_time__gt=OuterRef('entry_time'),
+        ).order_by('entry_time').values('entry_time')[:1]
+        contradicted = active.annotate(next_entry=Subquery(next_entry)).filter(next_entry__isnull=False)
+        close_all(contradicted.values_list('id', 'license_plate', 'lot_id', 'entry_time', 'next_entry'),
+                  'CONTRADICTED', 'contradicted')
+
+    # 2. Quá thời gian tối đa
+    if config['CLOSE_AFTER_HOURS'] is not None:
+        cutoff = now - timedelta(hours=config['CLOSE_AFTER_HOURS'])
+        timed_out = active.filter(entry_time__lt=cutoff).annotate(closed_at=Value(now))
+        close_all(timed_out.values_list('id', 'license_plate', 'lot_id', 'entry_time', 'closed_at'),
+                  'TIMEOUT', 'timed_out')
+
+    # 3. Đỗ lâu bất thường -> chỉ đánh dấu
+    cutoff = now - timedelta(hours=config['FLAG_AFTER_HOURS'])
+    flag = active.filter(entry_time__lt=cutoff, needs_review=False).values_list('id', 'license_plate')
+    for rows in _batches(flag, config['BATCH_SIZE']):
+        ids = [row[0] for row in rows]
+        flagged = len(ids) if dry_run else ParkingSession.objects.filter(
+            id__in=ids, status='ACTIVE').update(needs_review=True, updated_at=timezone.now())
+        summary['flagged'] += flagged
+        logger.info('%s %d long-running sessions for review', 'Would flag' if dry_run else 'Flagged', flagged,
+                    extra={'session_ids': ids, 'plates': [row[1] for row in rows], 'dry_run': dry_run})
+
+    summary['rollups'] = sorted(touched, key=str)
+    return summary
+
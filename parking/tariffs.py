@@ -0,0 +1,202 @@
+"""
+Mô phỏng biểu phí trên dữ liệu lịch sử và dự báo doanh thu
+
+Trước khi sửa ParkingSession.calculate_fee, chạy thử biểu phí mới trên các
+phiên đã hoàn thành để biết doanh thu sẽ thay đổi thế nào:
+    - biểu phí là dict (xem CURRENT_TARIFF - đúng bằng calculate_fee hiện tại)
+    - thời lượng đỗ đọc theo lô CHUNK_SIZE dòng (values_list, keyset theo id)
+      và tính giá cả lô bằng numpy, không tạo object ORM; giờ ra được đổi sang
+      unix timestamp ngay trong SQL (EpochSeconds: SQLite, PostgreSQL, MySQL),
+      nhanh hơn để Django chuyển từng dòng sang datetime có múi giờ
+    - kết quả: doanh thu thực thu (cột fee) và doanh thu mô phỏng, chênh lệch
+      theo ngày (giờ ra) và theo khung thời lượng đỗ (analytics.DWELL_BINS)
+
+Dự báo: trung bình doanh thu cùng thứ trong tuần của FORECAST_WEEKS tuần gần
+nhất (từ DailyRollup), nhân thêm tỉ lệ doanh thu mô phỏng / thực thu nếu có.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import BigIntegerField, Func, IntegerField, Sum
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .analytics import DWELL_BINS, _day_start, dwell_labels
+from .models import DailyRollup, ParkingSession
+
+
+CURRENT_TARIFF = {
+    'FREE_MINUTES': 0,        # đỗ dưới số phút này: miễn phí
+    'BASE_FEE': 5000,         # phí cố định cho BASE_MINUTES phút đầu
+    'BASE_MINUTES': 90,
+    'UNIT_FEE': 3000,         # mỗi UNIT_MINUTES phút tiếp theo (làm tròn lên)
+    'UNIT_MINUTES': 60,
+    'MAX_FEE': None,          # phí tối đa một lượt, None: không giới hạn
+}
+
+CHUNK_SIZE = 50000
+FORECAST_WEEKS = 8
+
+
+class EpochSeconds(Func):
+    """Unix timestamp (giây, số nguyên) của cột datetime, tính trong SQL"""
+    output_field = BigIntegerField()
+    template = 'FLOOR(EXTRACT(EPOCH FROM %(expressions)s))'     # PostgreSQL
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # '%%%%' -> '%%' sau khi ghép template -> '%' khi backend đổi tham số sang '?'
+        return self.as_sql(compiler, connection, template="CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)",
+                           **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # Django đặt múi giờ kết nối là UTC nên UNIX_TIMESTAMP đọc đúng giá trị đã lưu
+        return self.as_sql(compiler, connection, template='FLOOR(UNIX_TIMESTAMP(%(expressions)s))', **extra_context)
+
+
+def parse_tariff(values):
+    """
+    Biểu phí từ dict người dùng gửi lên (khóa thiếu lấy theo CURRENT_TARIFF)
+
+    Raises:
+        ValueError: khóa lạ hoặc giá trị không hợp lệ
+    """
+    unknown = set(values) - set(CURRENT_TARIFF)
+    if unknown:
+        raise ValueError(f"Khóa biểu phí không hợp lệ: {', '.join(sorted(unknown))}")
+    tariff = dict(CURRENT_TARIFF)
+    for key, value in values.items():
+        if value is None and key == 'MAX_FEE':
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{key} phải là số nguyên')
+        if value < 0 or (key == 'UNIT_MINUTES' and value == 0):
+            raise ValueError(f'{key} không hợp lệ')
+        tariff[key] = value
+    return tariff
+
+
+def price(durations, tariff):
+    """
+    Tính phí cho cả mảng thời lượng đỗ (phút) - cùng công thức với calculate_fee
+
+    Returns:
+        np.ndarray: phí (int64)
+    """
+    durations = np.asarray(durations, dtype=np.int64)
+    extra = np.maximum(durations - tariff['BASE_MINUTES'], 0)
+    units = -(-extra // tariff['UNIT_MINUTES'])        # làm tròn lên
+    fees = tariff['BASE_FEE'] + units * tariff['UNIT_FEE']
+    if tariff['MAX_FEE'] is not None:
+        fees = np.minimum(fees, tariff['MAX_FEE'])
+    return np.where(durations < tariff['FREE_MINUTES'], 0, fees)
+
+
+def _chunks(queryset, size):
+    """Đọc các dòng values_list (cột đầu là id) theo lô, keyset theo id"""
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id')[:size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < size:
+            return
+        last_id = rows[-1][0]
+
+
+def simulate(tariff, first_day, last_day, lot_ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Doanh thu của các phiên ra trong [first_day, last_day] theo biểu phí `tariff`
+
+    Returns:
+        dict: tổng, chênh lệch theo ngày ('days') và theo khung thời lượng ('durations')
+    """
+    n_days = (last_day - first_day).days + 1
+    start = _day_start(first_day)
+    start_ts = start.timestamp()
+    queryset = ParkingSession.objects.filter(
+        status='COMPLETED', duration_minutes__isnull=False,
+        exit_time__gte=start, exit_time__lt=start + timedelta(days=n_days),
+    )
+    if lot_ids is not None:
+        queryset = queryset.filter(lot_id__in=lot_ids)
+    queryset = queryset.annotate(
+        exit_ts=EpochSeconds('exit_time'), fee_value=Cast('fee', IntegerField()),
+    ).values_list('id', 'exit_ts', 'duration_minutes', 'fee_value')
+
+    n_bins = len(DWELL_BINS)
+    day_count = np.zeros(n_days, dtype=np.int64)
+    day_current = np.zeros(n_days, dtype=np.int64)
+    day_simulated = np.zeros(n_days, dtype=np.int64)
+    bin_count = np.zeros(n_bins, dtype=np.int64)
+    bin_current = np.zeros(n_bins, dtype=np.int64)
+    bin_simulated = np.zeros(n_bins, dtype=np.int64)
+
+    for rows in _chunks(queryset, chunk_size):
+        _, exit_times, durations, fees = zip(*rows)
+        exit_ts = np.asarray(exit_times, dtype=np.int64)
+        durations = np.asarray(durations, dtype=np.int64)
+        current = np.asarray(fees, dtype=np.int64)
+        simulated = price(durations, tariff)
+
+        day_index = np.clip(((exit_ts - start_ts) // 86400).astype(np.int64), 0, n_days - 1)
+        bin_index = np.clip(np.searchsorted(DWELL_BINS, durations, side='right') - 1, 0, n_bins - 1)
+        day_count += np.bincount(day_index, minlength=n_days)
+        day_current += np.bincount(day_index, weights=current, minlength=n_days).astype(np.int64)
+        day_simulated += np.bincount(day_index, weights=simulated, minlength=n_days).astype(np.int64)
+        bin_count += np.bincount(bin_index, minlength=n_bins)
+        bin_current += np.bincount(bin_index, weights=current, minlength=n_bins).astype(np.int64)
+        bin_simulated += np.bincount(bin_index, weights=simulated, minlength=n_bins).astype(np.int64)
+
+    def rows_of(labels, count, current, simulated):
+        return [
+            {'label': label, 'sessions': int(n), 'current': int(c), 'simulated': int(s), 'delta': int(s - c)}
+            for label, n, c, s in zip(labels, count, current, simulated)
+        ]
+
+    total_current, total_simulated = int(day_current.sum()), int(day_simulated.sum())
+    return {
+        'sessions': int(day_count.sum()),
+        'current': total_current,
+        'simulated': total_simulated,
+        'delta': total_simulated - total_current,
+        'ratio': round(total_simulated / total_current, 4) if total_current else None,
+        'days': rows_of([(first_day + timedelta(days=i)).isoformat() for i in range(n_days)],
+                        day_count, day_current, day_simulated),
+        'durations': rows_of(dwell_labels(), bin_count, bin_current, bin_simulated),
+    }
+
+
+def forecast(days, lot_ids=None, ratio=None, weeks=FORECAST_WEEKS, today=None):
+    """
+    Dự báo doanh thu `days` ngày tới theo mùa vụ tuần từ DailyRollup
+
+    Returns:
+        list[dict]: [{'date', 'baseline', 'simulated'}] - simulated = baseline * ratio
+    """
+    today = today or timezone.localtime().date()
+    first_day = today - timedelta(weeks=weeks)
+    rollups = DailyRollup.objects.filter(date__gte=first_day, date__lt=today)
+    if lot_ids is not None:
+        rollups = rollups.filter(lot_id__in=lot_ids)
+    revenue = np.zeros(weeks * 7, dtype=np.float64)
+    observed = np.zeros(weeks * 7, dtype=np.int64)
+    for day, value in rollups.values('date').annotate(total=Sum('revenue')).values_list('date', 'total').order_by():
+        revenue[(day - first_day).days] = float(value or 0)
+        observed[(day - first_day).days] = 1
+
+    # revenue[i] là ngày first_day + i: gom theo thứ trong tuần, trung bình các ngày có số liệu
+    by_weekday = revenue.reshape(weeks, 7).sum(axis=0) / np.maximum(observed.reshape(weeks, 7).sum(axis=0), 1)
+    result = []
+    for i in range(days):
+        day = today + timedelta(days=i)
+        baseline = int(round(by_weekday[(day - first_day).days % 7]))
+        result.append({
+            'date': day.isoformat(),
+            'baseline': baseline,
+            'simulated': int(round(baseline * ratio)) if ratio is not None else None,
+        })
+    return result
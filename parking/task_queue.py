@@ -0,0 +1,305 @@
+"""
+Hàng đợi tác vụ nền chạy trong process (không cần broker ngoài)
+
+- Mỗi tác vụ được ghi thành 1 file JSON trong SPOOL_DIR/pending trước khi
+  chạy (ghi file tạm rồi rename atomic) nên không mất khi server khởi động lại
+- Worker là các thread "lane": tác vụ cùng `key` (ví dụ biển số xe) luôn
+  vào cùng một lane nên được chạy đúng thứ tự. Thứ tự này chỉ được đảm bảo
+  trong một process: tác vụ cùng key do các process khác nhau đưa vào (hoặc
+  khôi phục lúc khởi động) có thể chạy song song hoặc đảo thứ tự
+- Tác vụ lỗi được ghi lại vào pending/ kèm `not_before` và thử lại sau
+  backoff tăng dần (timer đưa lại vào lane, lane không ngủ); trong lúc chờ,
+  các tác vụ sau cùng key được giữ lại để không chạy vượt lên trước. Quá
+  MAX_RETRIES thì chuyển sang SPOOL_DIR/failed
+- Nhiều process dùng chung SPOOL_DIR: file được "nhận" bằng os.rename sang
+  thư mục running/ nên mỗi tác vụ chỉ chạy một lần
+
+Dùng:
+    @task('render_receipt')
+    def render_receipt(session_id): ...
+
+    enqueue('render_receipt', key=plate, session_id=session.id)
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TASK_QUEUE = {
+    'SPOOL_DIR': 'var/tasks',
+    'WORKERS': 4,
+    'MAX_RETRIES': 5,
+    'RETRY_BACKOFF': 2.0,      # giây, nhân đôi sau mỗi lần lỗi
+    'MAX_BACKOFF': 60.0,
+    'EAGER': False,            # True: chạy ngay trong request (dùng cho test)
+}
+
+_registry = {}
+
+
+def get_config():
+    config = dict(DEFAULT_TASK_QUEUE)
+    config.update(getattr(settings, 'TASK_QUEUE', {}))
+    return config
+
+
+def task(name):
+    """Đăng ký một hàm làm tác vụ nền với tên `name`"""
+    def decorator(func):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+class TaskQueue:
+    def __init__(self):
+        self._lanes = []
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._round_robin = 0
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=1000)   # enqueue -> bắt đầu chạy (giây)
+        self.run_times = deque(maxlen=1000)
+
+    # ---------- spool ----------
+
+    def _dir(self, state):
+        path = os.path.join(self.config['SPOOL_DIR'], state)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _write(self, state, filename, payload):
+        directory = self._dir(state)
+        temp_path = os.path.join(directory, f'.{filename}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(temp_path, os.path.join(directory, filename))
+
+    # ---------- lanes ----------
+
+    def start(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self.config = get_config()
+            for index in range(self.config['WORKERS']):
+                lane = queue.Queue()
+                thread = threading.Thread(target=self._run_lane, args=(lane,), name=f'task-lane-{index}', daemon=True)
+                self._lanes.append(lane)
+                thread.start()
+            self._started = True
+            self._recover()
+
+    def _lane_for(self, key):
+        if key is None:
+            self._round_robin += 1
+            return self._lanes[self._round_robin % len(self._lanes)]
+        return self._lanes[zlib.crc32(str(key).encode('utf-8')) % len(self._lanes)]
+
+    def _recover(self):
+        """Đưa lại các tác vụ còn trong spool (do server tắt giữa chừng) vào hàng đợi"""
+        running_dir = self._dir('running')
+        for filename in os.listdir(running_dir):
+            pid = filename.split('-', 1)[0]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                try:
+                    os.rename(os.path.join(running_dir, filename),
+                              os.path.join(self._dir('pending'), filename.split('-', 1)[1]))
+                except OSError:
+                    pass
+
+        for filename in sorted(os.listdir(self._dir('pending'))):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self._dir('pending'), filename), encoding='utf-8') as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._lane_for(payload.get('key')).put((filename, payload.get('key'), False))
+
+    def enqueue(self, name, key=None, **kwargs):
+        """
+        Đưa tác vụ vào hàng đợi
+
+        Args:
+            name (str): tên tác vụ đã đăng ký bằng @task
+            key (str, optional): khóa thứ tự - tác vụ cùng key chạy tuần tự (trong process này)
+            **kwargs: tham số (phải serialize được bằng JSON)
+
+        Returns:
+            str: id tác vụ
+        """
+        if name not in _registry:
+            raise KeyError(f'Unknown task: {name}')
+
+        config = get_config()
+        if config['EAGER']:
+            _registry[name](**kwargs)
+            return None
+
+        self.start()
+        task_id = uuid.uuid4().hex
+        payload = {
+            'id': task_id,
+            'name': name,
+            'key': key,
+            'kwargs': kwargs,
+            'attempts': 0,
+            'enqueued_at': time.time(),
+        }
+        # Tên file bắt đầu bằng thời gian để khi khôi phục vẫn giữ thứ tự
+        filename = f'{time.time_ns():020d}-{task_id}.json'
+        self._write('pending', filename, payload)
+        with self._stats_lock:
+            self.enqueued += 1
+        self._lane_for(key).put((filename, key, False))
+        return task_id
+
+    def _run_lane(self, lane):
+        # key -> các tác vụ cùng key đến sau một tác vụ đang chờ thử lại (mỗi key chỉ thuộc một lane)
+        deferred = {}
+        while True:
+            filename, key, is_retry = lane.get()
+            if not is_retry and key in deferred:
+                deferred[key].append(filename)
+                continue
+            while filename is not None:
+                try:
+                    delay = self._process(filename)
+                except Exception:
+                    logger.exception('Task lane crashed while processing %s', filename)
+                    delay = None
+                if delay is not None:
+                    if key is not None:
+                        deferred.setdefault(key, deque())
+                    timer = threading.Timer(delay, lane.put, args=((filename, key, True),))
+                    timer.daemon = True
+                    timer.start()
+                    break
+                # Xong (hoặc hỏng hẳn): chạy tiếp các tác vụ cùng key đã giữ lại, đúng thứ tự
+                held = deferred.get(key)
+                if held:
+                    filename = held.popleft()
+                else:
+                    deferred.pop(key, None)
+                    filename = None
+
+    def _process(self, filename):
+        """
+        Chạy một tác vụ trong spool
+
+        Returns:
+            float | None: số giây cần chờ trước khi thử lại (tác vụ đã được ghi lại vào pending/)
+        """
+        pending_path = os.path.join(self._dir('pending'), filename)
+        running_path = os.path.join(self._dir('running'), f'{os.getpid()}-{filename}')
+        try:
+            os.rename(pending_path, running_path)   # process khác đã nhận tác vụ này
+        except OSError:
+            return
+
+        with open(running_path, encoding='utf-8') as f:
+            payload = json.load(f)
+
+        started = time.time()
+        if payload.get('not_before', 0) > started:
+            # Tác vụ đang chờ thử lại (vd: vừa khôi phục lúc khởi động): trả về pending/ và đợi tiếp
+            os.rename(running_path, pending_path)
+            return payload['not_before'] - started
+
+        func = _registry.get(payload['name'])
+        if payload['attempts'] == 0:
+            with self._stats_lock:
+                self.wait_times.append(started - payload['enqueued_at'])
+        try:
+            if func is None:
+                raise KeyError(f"Unknown task: {payload['name']}")
+            func(**payload['kwargs'])
+        except Exception as e:
+            payload['attempts'] += 1
+            payload['last_error'] = str(e)
+            if func is None or payload['attempts'] > self.config['MAX_RETRIES']:
+                logger.exception('Task %s (%s) failed permanently', payload['name'], payload['id'])
+                self._write('failed', filename, payload)
+                os.remove(running_path)
+                with self._stats_lock:
+                    self.failed += 1
+                return None
+            with self._stats_lock:
+                self.retried += 1
+            logger.warning('Task %s (%s) failed, retry #%d: %s',
+                           payload['name'], payload['id'], payload['attempts'], e)
+            delay = min(self.config['RETRY_BACKOFF'] * 2 ** (payload['attempts'] - 1), self.config['MAX_BACKOFF'])
+            payload['not_before'] = time.time() + delay
+            self._write('pending', filename, payload)
+            os.remove(running_path)
+            return delay
+
+        with self._stats_lock:
+            self.completed += 1
+            self.run_times.append(time.time() - started)
+        os.remove(running_path)
+        return None
+
+    def stats(self):
+        """Độ sâu hàng đợi, số tác vụ đã chạy/lỗi và độ trễ"""
+        with self._stats_lock:
+            wait_times = sorted(self.wait_times)
+            run_times = sorted(self.run_times)
+            data = {
+                'started': self._started,
+                'enqueued': self.enqueued,
+                'completed': self.completed,
+                'retried': self.retried,
+                'failed': self.failed,
+            }
+        data['depth'] = sum(lane.qsize() for lane in self._lanes)
+        data['lane_depths'] = [lane.qsize() for lane in self._lanes]
+        data['wait_seconds'] = _percentiles(wait_times)
+        data['run_seconds'] = _percentiles(run_times)
+        return data
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'max': None}
+    return {
+        'p50': round(values[len(values) // 2], 4),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 4),
+        'max': round(values[-1], 4),
+    }
+
+
+task_queue = TaskQueue()
+
+
+def enqueue(name, key=None, **kwargs):
+    return task_queue.enqueue(name, key=key, **kwargs)
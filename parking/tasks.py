@@ -0,0 +1,91 @@
+"""
+Các tác vụ nền sau khi xe vào/ra (không ảnh hưởng quyết định mở barrier)
+"""
+
+import os
+from datetime import date as date_cls, datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .task_queue import enqueue, task
+
+
+@task('refresh_daily_rollup')
+def refresh_daily_rollup(lot_id, date):
+    """
+    Tính lại DailyRollup của một bãi trong một ngày (idempotent - chạy lại
+    khi retry không bị cộng trùng)
+    """
+    from .models import DailyOccupancy, DailyRollup, ParkingSession
+
+    day = date_cls.fromisoformat(date)
+    start_time = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    end_time = start_time + timedelta(days=1)
+
+    exits = ParkingSession.objects.filter(
+        lot_id=lot_id, status='COMPLETED', exit_time__gte=start_time, exit_time__lt=end_time
+    ).aggregate(count=Count('id'), revenue=Sum('fee'), duration=Sum('duration_minutes'))
+    entries = ParkingSession.objects.filter(
+        lot_id=lot_id, entry_time__gte=start_time, entry_time__lt=end_time
+    ).count()
+
+    DailyRollup.objects.update_or_create(
+        lot_id=lot_id,
+        date=day,
+        defaults={
+            'entries': entries,
+            'exits': exits['count'],
+            'revenue': exits['revenue'] or 0,
+            'total_duration_minutes': exits['duration'] or 0,
+        },
+    )
+    # Chuỗi lượng xe đã lưu của ngày này không còn đúng (xem parking/analytics.py)
+    DailyOccupancy.objects.filter(lot_id=lot_id, date=day).delete()
+
+
+@task('render_receipt')
+def render_receipt(session_id):
+    """Ghi hóa đơn dạng text vào media/receipts/<năm>/<tháng>/ để in hoặc tra cứu"""
+    from .models import ParkingSession
+
+    session = ParkingSession.objects.select_related('lot').get(id=session_id)
+    breakdown = session.get_fee_breakdown()
+    entry_time = timezone.localtime(session.entry_time)
+    exit_time = timezone.localtime(session.exit_time)
+
+    lines = [
+        f"HÓA ĐƠN GỬI XE #{session.id}",
+        f"Bãi đỗ: {session.lot or '-'}",
+        f"Biển số: {session.license_plate}",
+        f"Giờ vào: {entry_time.strftime('%d/%m/%Y %H:%M:%S')}",
+        f"Giờ ra:  {exit_time.strftime('%d/%m/%Y %H:%M:%S')}",
+        f"Thời lượng: {session.duration_minutes} phút",
+        f"90 phút đầu: {breakdown['first_period_fee']:,}đ",
+        f"Giờ thêm: {breakdown['additional_hours']} x 3,000đ = {breakdown['additional_fee']:,}đ",
+        f"TỔNG: {breakdown['total']:,}đ",
+    ]
+
+    directory = os.path.join(settings.MEDIA_ROOT, 'receipts', exit_time.strftime('%Y'), exit_time.strftime('%m'))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f'session_{session.id}.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+@task('sweep_stale_sessions')
+def sweep_stale_sessions():
+    """Dọn phiên ACTIVE bị treo theo chính sách SESSION_SWEEP (xem parking/sweeper.py)"""
+    from .sweeper import sweep_sessions
+
+    summary = sweep_sessions()
+    for lot_id, day in summary['rollups']:
+        enqueue('refresh_daily_rollup', key=f'rollup:{lot_id}:{day}', lot_id=lot_id, date=day)
+
+
+@task('generate_thumbnails')
+def generate_thumbnails(detection_id):
+    """Tạo ảnh thu nhỏ WebP/JPEG cho ảnh nhận diện (xem parking/thumbnails.py)"""
+    from .thumbnails import generate_for_detection
+
+    generate_for_detection(detection_id)
@@ -1,3 +1,1683 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.http import JsonResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+
+from . import (
+    analytics, benchmarks, camera_health, clips, datagen, device_auth, gate, gate_decision, log, metrics, plates,
+    recognition, streaming, tariffs, task_queue, thumbnails, voting,
+)
+from .models import ParkingSession, VehicleDetection
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def make_results(self, p95, queries):
+        return {'scenarios': {'dashboard': {'GET /api/sessions/active/': {'p95_ms': p95, 'avg_queries': queries}}}}
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmarks.percentile(values, 50), 50)
+        self.assertEqual(benchmarks.percentile(values, 95), 95)
+        self.assertEqual(benchmarks.percentile(values, 99), 99)
+        self.assertIsNone(benchmarks.percentile([], 50))
+
+    def test_within_threshold_is_not_regression(self):
+        baseline = self.make_results(100, 3)
+        self.assertEqual(benchmarks.compare(self.make_results(115, 3), baseline, 0.2), [])
+
+    def test_latency_and_query_regressions_are_reported(self):
+        baseline = self.make_results(100, 3)
+        regressions = benchmarks.compare(self.make_results(150, 6), baseline, 0.2)
+        self.assertEqual(len(regressions), 2)
+
+
+class DataGenerationTests(SimpleTestCase):
+    def make_config(self):
+        from datetime import datetime
+        from django.utils import timezone
+
+        return datagen.GenerationConfig(
+            seed=1,
+            end=timezone.make_aware(datetime(2026, 3, 1, 12, 0)),
+            days=30,
+            regulars=50,
+            lots={1: {'code': 'a', 'capacity': 10, 'entry_gates': [], 'exit_gates': []}},
+        )
+
+    def test_plan_distributes_all_sessions(self):
+        plan = datagen.plan_days(self.make_config(), 1000)
+        self.assertAlmostEqual(sum(count for _, _, count in plan), 1000, delta=1)
+
+    def test_chunks_are_deterministic(self):
+        config = self.make_config()
+        chunk = datagen.plan_days(config, 1000)[0]
+        datagen.init_worker(config)
+        first = datagen.generate_chunk(chunk)
+        self.assertEqual(first, datagen.generate_chunk(chunk))
+        sessions, detections = first
+        self.assertEqual(len(sessions), chunk[2])
+        self.assertTrue(all(row[1] <= config.end for row in sessions))
+        self.assertEqual(len(detections), sum(2 if row[5] == 'COMPLETED' else 1 for row in sessions))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get('/api/latest_detections/')
+        self.client.force_login(User.objects.create_user('quanly', is_staff=True))
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('parking_http_request_duration_seconds_count{view="latest_detections",method="GET"} 1', body)
+        self.assertIn('parking_db_queries_per_request_bucket{view="latest_detections",le="+Inf"} 1', body)
+        self.assertIn('parking_task_queue_depth', body)
+
+    def test_streaming_connections_are_tracked(self):
+        def content():
+            yield b'abc'
+            yield b'de'
+
+        request = RequestFactory().get('/video_feed/cam1')
+        request.resolver_match = resolve('/video_feed/cam1')
+        response = metrics.MetricsMiddleware(lambda r: StreamingHttpResponse(content()))(request)
+        self.assertEqual(metrics.registry.streams_open['video_feed'], 1)
+        self.assertEqual(b''.join(response.streaming_content), b'abcde')
+        response.close()
+        self.assertEqual(metrics.registry.streams_open['video_feed'], 0)
+        self.assertEqual(metrics.registry.response_bytes['video_feed'], 5)
+
+    @override_settings(METRICS={'SLOW_REQUEST_MS': 0})
+    def test_slow_request_log_includes_sql(self):
+        self.client.force_login(User.objects.create_user('staff'))
+        with self.assertLogs('parking.metrics.slow', 'WARNING') as logs:
+            self.client.get('/api/latest_detections/')
+        self.assertIn('parking_vehicledetection', logs.output[0])
+
+    @override_settings(METRICS={'TOKEN': 'secret'})
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_are_private_without_token_unless_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.client.force_login(User.objects.create_user('cashier'))
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+        self.client.force_login(User.objects.create_user('quanly', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.client.logout()
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class StructuredLoggingTests(SimpleTestCase):
+    def make_record(self, msg='Stream file too old (%.1fs) for %s', args=(12.0, 'cam1'), **extra):
+        record = logging.LogRecord('parking.views', logging.WARNING, __file__, 10, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_rate_limit_filter_suppresses_repeats_and_reports_count(self):
+        rate_limit = log.RateLimitFilter(interval=60, burst=2)
+        passed = [rate_limit.filter(self.make_record()) for _ in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+
+        rate_limit.interval = 0
+        record = self.make_record()
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.suppressed, 3)
+
+    def test_rate_limit_filter_keeps_distinct_messages_from_one_call_site(self):
+        rate_limit = log.RateLimitFilter(interval=60, burst=2)
+        plates = [f'51G{n:05d}' for n in range(20)]
+
+        # Cùng dòng code nhưng mỗi xe một biển số: không xe nào bị nuốt log
+        passed = [rate_limit.filter(self.make_record('ENTRY %s', (plate,))) for plate in plates]
+
+        self.assertEqual(passed, [True] * 20)
+        # Lặp lại đúng một dòng thì vẫn bị chặn sau `burst` lần
+        repeats = [rate_limit.filter(self.make_record('ENTRY %s', (plates[0],))) for _ in range(2)]
+        self.assertEqual(repeats, [True, False])
+
+    def test_async_handler_writes_json_lines(self):
+        stream = io.StringIO()
+        handler = log.AsyncStreamHandler(stream=stream)
+        handler.setFormatter(log.JsonFormatter())
+        handler.handle(self.make_record(plate='30A12345'))
+        handler.close()
+
+        data = json.loads(stream.getvalue())
+        self.assertEqual(data['msg'], 'Stream file too old (12.0s) for cam1')
+        self.assertEqual(data['level'], 'WARNING')
+        self.assertEqual(data['plate'], '30A12345')
+
+    def test_level_overrides(self):
+        logger = logging.getLogger('parking.test_overrides')
+        log.apply_level_overrides('parking.test_overrides=ERROR, bad')
+        self.assertEqual(logger.level, logging.ERROR)
+
+
+class CameraHealthTests(SimpleTestCase):
+    def setUp(self):
+        stream_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, stream_dir, ignore_errors=True)
+        config = dict(streaming.get_config(), STREAM_DIR=stream_dir)
+        self.broker = streaming.FrameBroker(config)
+        self.supervisor = camera_health.CameraSupervisor(self.broker, camera_health.DEFAULT_CAMERA_HEALTH)
+
+    def test_states_and_stale_event(self):
+        events = []
+
+        def on_stale(sender, camera_id, **kwargs):
+            events.append(camera_id)
+
+        camera_health.camera_stale.connect(on_stale)
+        self.addCleanup(camera_health.camera_stale.disconnect, on_stale)
+
+        self.broker.publish('cam1', b'\xff\xd8' + bytes(100), persist=False)
+        now = time.time()
+        self.supervisor.check(now)
+        self.assertEqual(self.supervisor.state('cam1'), 'live')
+
+        self.supervisor.check(now + 5)
+        self.assertEqual(self.supervisor.state('cam1'), 'degraded')
+
+        self.supervisor.check(now + 30)
+        self.assertEqual(self.supervisor.state('cam1'), 'stale')
+        self.assertEqual(events, ['cam1'])
+        self.assertEqual([e['to'] for e in self.supervisor.events], ['live', 'degraded', 'stale'])
+
+    def test_frames_written_by_other_workers_are_tracked(self):
+        with open(os.path.join(self.broker.config['STREAM_DIR'], 'cam2.jpg'), 'wb') as f:
+            f.write(b'\xff\xd8')
+        self.supervisor.check()
+        health = self.supervisor.get('cam2')
+        self.assertEqual(health.state, 'live')
+        self.assertIsNone(health.fps)
+
+    def test_detection_rate(self):
+        self.broker.publish('cam1', b'\xff\xd8', persist=False)
+        self.supervisor.record_detection('cam1', at=time.time() - 3600)
+        self.supervisor.record_detection('cam1')
+        self.supervisor.check()
+        self.assertEqual(self.supervisor.get('cam1').detections, 1)
+
+
+class FrameRingTests(SimpleTestCase):
+    def make_broker(self, **overrides):
+        return streaming.FrameBroker(dict(streaming.get_config(), **overrides))
+
+    def test_ring_is_bounded_by_bytes(self):
+        broker = self.make_broker(RING_MAX_BYTES=1000)
+        for i in range(10):
+            broker.publish('cam1', bytes([i]) * 300, persist=False)
+        frames = broker.frames_between('cam1', 0, time.time() + 1)
+        self.assertEqual([frame[0] for _, frame in frames], [7, 8, 9])
+        self.assertEqual(broker.stats()['cam1']['ring_bytes'], 900)
+
+    def test_ring_drops_old_frames(self):
+        broker = self.make_broker(RING_SECONDS=0)
+        broker.publish('cam1', b'old', persist=False)
+        stream = broker.stream('cam1')
+        stream.ring[0] = (stream.ring[0][0] - 5, stream.ring[0][1])
+        broker.publish('cam1', b'new', persist=False)
+        self.assertEqual([frame for _, frame in broker.frames_between('cam1', 0, time.time() + 1)], [b'new'])
+
+
+class StreamIngestTests(TestCase):
+    def setUp(self):
+        from . import views
+        from .lots import get_default_lot
+        from .models import CameraDevice
+
+        self.stream_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.stream_dir, ignore_errors=True)
+        self.device = CameraDevice.objects.create(device_id='cam1', lot=get_default_lot())
+        # TARGET_FPS = 1: bucket gần như không nạp lại trong thời gian chạy test
+        self.broker = streaming.FrameBroker(dict(
+            streaming.get_config(), TARGET_FPS=1, BURST=3, MAX_FRAME_BYTES=1000, STREAM_DIR=self.stream_dir,
+        ))
+        cache = device_auth.DeviceSecretCache()
+        patches = [
+            mock.patch.object(streaming, 'broker', self.broker),
+            mock.patch.object(views, 'broker', self.broker),
+            mock.patch.object(streaming, 'secret_cache', cache),
+            mock.patch.object(device_auth, 'secret_cache', cache),
+            mock.patch.object(device_auth, 'rate_limiter', device_auth.RateLimiter({})),
+            mock.patch.object(views.supervisor, 'start'),
+            mock.patch.object(views.recognizer_pool, 'submit'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post_frame(self, body=b'\xff\xd8jpeg', camera_id='cam1', signed=True, **headers):
+        # Client Pi luôn gửi Content-Length, kể cả body rỗng (test client của Django thì bỏ qua)
+        extra = {'HTTP_X_CAMERA_ID': camera_id, 'CONTENT_LENGTH': str(len(body))}
+        if signed:
+            timestamp = str(int(time.time()))
+            extra.update(
+                HTTP_X_DEVICE_ID=self.device.device_id,
+                HTTP_X_TIMESTAMP=timestamp,
+                HTTP_X_SIGNATURE=device_auth.compute_signature(
+                    self.device.secret_key, self.device.device_id, timestamp, body
+                ),
+            )
+        extra.update({'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()})
+        return self.client.post('/api/stream_upload/', body, content_type='image/jpeg', **extra)
+
+    def test_oversize_frame_is_rejected_before_authentication(self):
+        self.assertEqual(self.post_frame().status_code, 200)
+
+        with mock.patch.object(device_auth, 'authenticate_device') as authenticate:
+            response = self.post_frame(b'\xff' * 1001)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(json.loads(response.content)['max_frame_bytes'], 1000)
+        authenticate.assert_not_called()
+        self.assertEqual(self.broker.stats()['cam1']['dropped_too_large'], 1)
+
+    def test_missing_content_length_is_rejected(self):
+        request = RequestFactory().post('/api/stream_upload/', b'\xff\xd8jpeg', content_type='image/jpeg',
+                                        HTTP_X_CAMERA_ID='cam1')
+        del request.META['CONTENT_LENGTH']
+
+        response = resolve('/api/stream_upload/').func(request)
+
+        self.assertEqual(response.status_code, 411)
+
+    def test_frames_over_budget_get_backpressure(self):
+        statuses = [self.post_frame().status_code for _ in range(3)]
+        with mock.patch.object(device_auth, 'authenticate_device') as authenticate:
+            response = self.post_frame()
+
+        self.assertEqual(statuses, [200, 200, 200])
+        # Frame vượt ngưỡng bị bỏ trước khi đọc body để kiểm chữ ký, một 429 duy nhất
+        authenticate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response['X-Target-FPS'], '1')
+        self.assertEqual(json.loads(response.content)['target_fps'], 1)
+        stats = self.broker.stats()['cam1']
+        self.assertEqual((stats['accepted'], stats['dropped_rate_limited']), (3, 1))
+
+    def test_unauthenticated_frames_do_not_consume_camera_budget(self):
+        for _ in range(5):
+            self.assertEqual(self.post_frame(signed=False).status_code, 401)
+        # Thiết bị khác không thể tiêu token của cam1
+        self.assertEqual(self.post_frame(signed=False, x_device_id='cam2').status_code, 403)
+
+        self.assertEqual(self.post_frame().status_code, 200)
+        self.assertEqual(self.broker.stats()['cam1']['dropped_rate_limited'], 0)
+
+    @override_settings(DEVICE_AUTH=dict(settings.DEVICE_AUTH, REQUIRED=False))
+    def test_unsigned_frames_for_unknown_cameras_are_not_tracked(self):
+        response = self.post_frame(camera_id='ghost_cam', signed=False)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('ghost_cam', self.broker.stats())
+        self.assertEqual(self.post_frame(signed=False).status_code, 200)
+
+
+    def test_raw_frame_lands_in_broker_without_copy(self):
+        body = b'\xff\xd8' + bytes(range(256)) + b'\xff\xd9'
+        response = self.post_frame(body, x_frame_seq='7', x_frame_timestamp='1700000000.25')
+
+        self.assertEqual(json.loads(response.content), {"status": "ok", "seq": 7})
+        frame = self.broker.latest('cam1')
+        self.assertIsInstance(frame, memoryview)
+        self.assertEqual(bytes(frame), body)
+        self.assertEqual(self.broker.stream('cam1').captured_at, 1700000000.25)
+        with open(os.path.join(self.stream_dir, 'cam1.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), body)
+
+    def test_invalid_frame_headers_and_empty_body_are_rejected(self):
+        self.assertEqual(self.post_frame(x_frame_seq='abc').status_code, 400)
+        self.assertEqual(self.post_frame(x_frame_timestamp='yesterday').status_code, 400)
+        self.assertEqual(self.post_frame(b'').status_code, 400)
+        self.assertEqual(self.broker.stats()['cam1']['accepted'], 0)
+
+    def test_duplicate_and_out_of_order_frames_are_dropped(self):
+        self.broker.config['BURST'] = 10
+        statuses = [json.loads(self.post_frame(x_frame_seq=str(seq)).content)['status'] for seq in (5, 5, 4, 6)]
+
+        self.assertEqual(statuses, ['ok', 'stale', 'stale', 'ok'])
+        stats = self.broker.stats()['cam1']
+        self.assertEqual((stats['accepted'], stats['dropped_stale'], stats['client_seq']), (2, 2, 6))
+
+    def test_seq_far_behind_is_treated_as_device_restart(self):
+        broker = streaming.FrameBroker(dict(streaming.get_config(), SEQ_RESET_WINDOW=10))
+        self.assertTrue(broker.publish('cam1', b'a', persist=False, seq=50))
+        self.assertFalse(broker.publish('cam1', b'b', persist=False, seq=45))
+        self.assertTrue(broker.publish('cam1', b'c', persist=False, seq=1))
+
+        self.assertEqual(bytes(broker.latest('cam1')), b'c')
+
+    def test_camera_id_must_be_a_slug(self):
+        for camera_id in ('../settings', 'cam 1', 'x' * 65):
+            self.assertEqual(self.post_frame(camera_id=camera_id).status_code, 400)
+        with self.assertRaises(ValueError):
+            self.broker.stream('../../etc/passwd')
+        self.assertEqual(os.listdir(self.stream_dir), [])
+
+class ClipWriterTests(TestCase):
+    def test_clip_contains_frames_around_event(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        broker = streaming.FrameBroker(dict(streaming.get_config(), STREAM_DIR=media_root))
+        writer = clips.ClipWriter(broker)
+        detection = VehicleDetection.objects.create(license_plate='30A12345', confidence=0.9, event_type='ENTRY')
+
+        for frame in (b'\xff\xd8one\xff\xd9', b'\xff\xd8two\xff\xd9'):
+            broker.publish('cam1', frame, persist=False)
+        stream = broker.stream('cam1')
+        # Frame quá xa trước sự kiện không nằm trong clip
+        stream.ring.appendleft((time.time() - 60, b'too-old'))
+
+        with override_settings(MEDIA_ROOT=media_root):
+            name = writer.write_clip('cam1', detection.id, time.time())
+        with open(os.path.join(media_root, name), 'rb') as f:
+            self.assertEqual(f.read(), b'\xff\xd8one\xff\xd9\xff\xd8two\xff\xd9')
+        detection.refresh_from_db()
+        self.assertEqual(detection.clip.name, name)
+
+        self.assertIsNone(writer.write_clip('cam_without_frames', detection.id, time.time()))
+        # Sự kiện ghi lại muộn từ journal: ring buffer không còn giữ đủ khoảng quanh lúc đó
+        self.assertIsNone(writer.write_clip('cam1', detection.id, time.time() - 60))
+
+
+class FakeRecognizer(recognition.PlateRecognizer):
+    def recognize(self, images):
+        return [[recognition.PlateResult('30a-123.45', 0.95, (0, 0, 10, 10))] for _ in images]
+
+
+@override_settings(RECOGNITION={'ENABLED': True, 'BACKEND': 'parking.tests.FakeRecognizer', 'WORKERS': 0,
+                                'SAMPLE_INTERVAL': 60, 'COOLDOWN': 60})
+class RecognitionTests(TestCase):
+    def jpeg(self):
+        import cv2
+        import numpy as np
+        return cv2.imencode('.jpg', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+
+    def test_frames_are_sampled_per_camera(self):
+        pool = recognition.RecognizerPool()
+        pool._started = True   # không chạy thread nền trong test
+        self.assertTrue(pool.submit('cam1', b'a'))
+        self.assertFalse(pool.submit('cam1', b'b'))
+        self.assertTrue(pool.submit('cam2', b'c'))
+        self.assertEqual((pool.counters['sampled'], pool.counters['skipped']), (2, 1))
+
+    def test_results_are_voted_into_one_entry(self):
+        recognition._init_worker('parking.tests.FakeRecognizer', {})
+        pool = recognition.RecognizerPool()
+        voter = voting.PlateVoter(dict(voting.DEFAULT_PLATE_VOTING))
+        voter._started = True   # chốt lượt trong thread test
+        batch = [('cam1', self.jpeg(), time.time()), ('cam1', b'not a jpeg', time.time())]
+        results = recognition._recognize_batch([jpeg for _, jpeg, _ in batch])
+        self.assertEqual(results[1], [])
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with mock.patch.object(voting, 'plate_voter', voter), override_settings(MEDIA_ROOT=media_root), \
+                self.captureOnCommitCallbacks():
+            pool.handle_results(batch, results)
+            pool.handle_results(batch, results)
+            voter.flush()
+            pool.handle_results(batch, results)
+
+        session = ParkingSession.objects.get()
+        self.assertEqual(session.license_plate, '30A12345')
+        self.assertEqual(session.status, 'ACTIVE')
+        self.assertEqual(VehicleDetection.objects.count(), 1)
+        self.assertEqual(pool.counters['events'], 3)
+        self.assertEqual((voter.counters['committed'], voter.counters['duplicates']), (1, 1))
+
+
+class PlateCanonicalizationTests(TestCase):
+    def setUp(self):
+        plates.active_plates.invalidate()
+
+    def test_canonical_form_follows_plate_grammar(self):
+        self.assertEqual(plates.canonical_form(plates.normalize('51g-123.45')), '51G12345')
+        self.assertEqual(plates.canonical_form(plates.normalize('5IG-1234S')), '51G12345')
+        self.assertEqual(plates.canonical_form('51612345'), '51G12345')
+        self.assertEqual(plates.canonical_form('29Y3O3658'), '29Y303658')
+        self.assertEqual(plates.canonical_form('30LD12345'), '30LD12345')
+        self.assertEqual(plates.canonical_form('ABC'), 'ABC')
+
+    def test_confusable_read_resolves_to_active_plate(self):
+        from .lots import get_default_lot
+
+        lot_id = get_default_lot().id
+        with self.captureOnCommitCallbacks():
+            entry = gate.process_plate_read('51G-123.45', 0.9, 'cam1', None, lot_id, None)
+            exit_ = gate.process_plate_read('51G1234S', 0.9, 'cam1', None, lot_id, None)
+
+        self.assertEqual((entry['event_type'], exit_['event_type']), ('ENTRY', 'EXIT'))
+        self.assertEqual(entry['session_id'], exit_['session_id'])
+        self.assertEqual(VehicleDetection.objects.filter(raw_plate='51G-123.45').count(), 1)
+
+    def test_skeleton_match_uses_active_session(self):
+        from .lots import get_default_lot
+
+        lot_id = get_default_lot().id
+        ParkingSession.objects.create(license_plate='30LD12345', status='ACTIVE', lot_id=lot_id,
+                                      entry_time=timezone.now())
+        self.assertEqual(plates.canonicalize('30L012345', lot_id), '30LD12345')
+        self.assertEqual(plates.canonicalize('30L012345'), '30L012345')
+
+
+class PlateVotingTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+
+        plates.active_plates.invalidate()
+        self.lot_id = get_default_lot().id
+        self.voter = voting.PlateVoter(dict(voting.DEFAULT_PLATE_VOTING))
+        self.voter._started = True   # chốt lượt trong thread test
+
+    def submit(self, plate, confidence, source='gate_cam'):
+        self.voter.submit(plate, confidence, source, None, self.lot_id, None, wait=False)
+
+    def test_vote_is_weighted_per_character(self):
+        vehicle_pass = voting.VehiclePass('key', self.lot_id, None, 0)
+        for plate, confidence in [('51G12345', 0.4), ('51G12845', 0.5), ('51G72345', 0.3), ('51G1234', 0.9)]:
+            vehicle_pass.add(voting.Read(plate, plate, confidence, 'cam', None, 0))
+        plate, confidence, score = vehicle_pass.vote()
+        self.assertEqual(plate, '51G12345')
+        self.assertEqual((confidence, score), (0.4, 0.4))
+
+    def test_pass_commits_one_detection_and_transition(self):
+        with self.captureOnCommitCallbacks():
+            self.submit('51G-128.45', 0.5)
+            self.submit('51G-123.45', 0.4)
+            self.assertEqual(self.voter.flush(), [])     # chưa đủ confidence, chưa hết thời gian
+            self.submit('51G1234S', 0.6)
+            result, = self.voter.flush()
+
+        self.assertEqual((result['event_type'], result['plate'], result['reads']), ('ENTRY', '51G12345', 3))
+        detection = VehicleDetection.objects.get()
+        self.assertEqual(detection.raw_plate, '51G1234S')
+        self.assertEqual(ParkingSession.objects.filter(status='ACTIVE').count(), 1)
+
+    def test_timed_out_wait_opens_barrier_and_pass_is_still_recorded(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        voter = voting.PlateVoter(dict(voting.DEFAULT_PLATE_VOTING, MAX_LATENCY=0.0))
+        voter._started = True   # không có thread chốt: request đợi quá hạn
+        upload = SimpleUploadedFile('plate.jpg', b'\xff\xd8jpeg', content_type='image/jpeg')
+
+        result = voter.submit('51G12345', 0.1, 'gate_cam', upload, self.lot_id, None)
+        self.assertEqual((result['action'], result['pending'], result['event_type']), ('open_barrier', True, 'ENTRY'))
+        upload.close()   # Django đóng file upload khi request kết thúc
+        with override_settings(MEDIA_ROOT=media_root), self.captureOnCommitCallbacks():
+            committed, = voter.flush(now=time.monotonic() + 5)
+
+        # Barrier đã mở nên lượt confidence thấp vẫn được ghi, kèm ảnh
+        self.assertEqual(committed['event_type'], 'ENTRY')
+        self.assertEqual(ParkingSession.objects.filter(status='ACTIVE').count(), 1)
+        detection = VehicleDetection.objects.get()
+        with override_settings(MEDIA_ROOT=media_root), detection.image_path.open('rb') as f:
+            self.assertEqual(f.read(), b'\xff\xd8jpeg')
+        self.assertEqual((voter.counters['timeouts'], voter.counters['errors']), (1, 0))
+
+    def test_low_confidence_pass_is_rejected_after_latency_cap(self):
+        self.submit('51G12345', 0.0)
+        self.assertEqual(self.voter.flush(), [])
+        result, = self.voter.flush(now=time.monotonic() + 5)
+        self.assertEqual(result['action'], 'retry')
+        self.assertFalse(VehicleDetection.objects.exists())
+
+    def test_different_vehicle_closes_pass(self):
+        with self.captureOnCommitCallbacks():
+            self.submit('51G12345', 0.5)
+            self.submit('30A98765', 0.5)
+            first, = self.voter.flush()
+            second, = self.voter.flush(now=time.monotonic() + 5)
+        self.assertEqual((first['plate'], second['plate']), ('51G12345', '30A98765'))
+        self.assertEqual(ParkingSession.objects.count(), 2)
+
+
+class SessionSweepTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+
+        plates.active_plates.invalidate()
+        self.lot = get_default_lot()
+        self.now = timezone.now()
+
+    def session(self, plate, hours_ago, lot=None):
+        return ParkingSession.objects.create(license_plate=plate, status='ACTIVE', lot=lot or self.lot,
+                                             entry_time=self.now - timedelta(hours=hours_ago))
+
+    def test_periodic_sweep_runs_only_from_the_loop_command(self):
+        from django.core.management import call_command
+
+        from .management.commands import sweep_sessions
+
+        self.session('30A10000', 100)
+        # Chỉ process `sweep_sessions --loop` quét định kỳ; dừng vòng lặp sau lần ngủ thứ hai
+        with mock.patch.object(sweep_sessions.time, 'sleep', side_effect=[None, KeyboardInterrupt]) as sleep:
+            call_command('sweep_sessions', '--loop', stdout=io.StringIO())
+
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(ParkingSession.objects.filter(status='ACTIVE').count(), 0)
+
+    def test_sweep_closes_and_flags_in_batches(self):
+        from .models import Lot
+        from .sweeper import DEFAULT_SESSION_SWEEP, sweep_sessions
+
+        other_lot = Lot.objects.create(code='other', name='Bãi khác', capacity=10)
+        timed_out = [self.session(f'30A1000{i}', 100) for i in range(3)]
+        flagged = self.session('30A20000', 30)
+        contradicted = self.session('30A30000', 5)
+        self.session('30A30000', 2, lot=other_lot)
+        fresh = self.session('30A40000', 1)
+
+        config = dict(DEFAULT_SESSION_SWEEP, BATCH_SIZE=2)
+        self.assertEqual(sweep_sessions(now=self.now, config=config, dry_run=True)['timed_out'], 3)
+        self.assertEqual(ParkingSession.objects.filter(status='ACTIVE').count(), 7)
+
+        summary = sweep_sessions(now=self.now, config=config)
+        self.assertEqual((summary['contradicted'], summary['timed_out'], summary['flagged']), (1, 3, 1))
+
+        contradicted.refresh_from_db()
+        self.assertEqual((contradicted.status, contradicted.close_reason), ('COMPLETED', 'CONTRADICTED'))
+        self.assertEqual(contradicted.duration_minutes, 180)
+        for session in timed_out:
+            session.refresh_from_db()
+            self.assertEqual((session.close_reason, session.needs_review, session.duration_minutes),
+                             ('TIMEOUT', True, 6000))
+            self.assertEqual(session.fee, session.calculate_fee(6000))
+        flagged.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((flagged.status, flagged.needs_review), ('ACTIVE', True))
+        self.assertEqual((fresh.status, fresh.needs_review), ('ACTIVE', False))
+
+    def test_reentry_at_entry_only_gate_closes_stale_session(self):
+        from .models import Gate
+
+        entry_gate = Gate.objects.create(lot=self.lot, code='in', direction='ENTRY')
+        stale = self.session('51G12345', 3)
+        with self.captureOnCommitCallbacks():
+            result = gate.process_plate_read('51G12345', 0.9, 'cam_in', None, self.lot.id, entry_gate.id)
+
+        self.assertEqual(result['event_type'], 'ENTRY')
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.close_reason, stale.needs_review), ('COMPLETED', 'CONTRADICTED', True))
+        self.assertEqual(ParkingSession.objects.filter(status='ACTIVE').count(), 1)
+
+
+class TaskQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        override = override_settings(TASK_QUEUE={
+            'SPOOL_DIR': self.spool_dir, 'WORKERS': 3, 'MAX_RETRIES': 2,
+            'RETRY_BACKOFF': 0.05, 'MAX_BACKOFF': 0.08, 'EAGER': False,
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        self.calls = []
+        registry = mock.patch.dict(task_queue._registry)
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.queue = task_queue.TaskQueue()
+
+    def spool(self, state):
+        path = os.path.join(self.spool_dir, state)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def wait_for(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline, 'task queue did not settle in time')
+            time.sleep(0.01)
+
+    def test_enqueued_task_is_spooled_then_run(self):
+        release = threading.Event()
+
+        @task_queue.task('test_blocking')
+        def blocking(value):
+            release.wait(5)
+            self.calls.append(value)
+
+        self.queue.enqueue('test_blocking', value=1)
+        self.wait_for(lambda: self.spool('running'))
+        self.assertEqual(self.queue.stats()['enqueued'], 1)
+        self.assertTrue(self.spool('running')[0].startswith(f'{os.getpid()}-'))
+
+        release.set()
+        self.wait_for(lambda: self.queue.stats()['completed'] == 1)
+        self.assertEqual(self.calls, [1])
+        self.assertEqual((self.spool('pending'), self.spool('running')), ([], []))
+        with self.assertRaises(KeyError):
+            self.queue.enqueue('not_registered')
+
+    def test_tasks_with_same_key_run_in_order(self):
+        @task_queue.task('test_record')
+        def record(plate, index):
+            time.sleep(0.001 * (index % 3))
+            self.calls.append((plate, index))
+
+        for index in range(30):
+            self.queue.enqueue('test_record', key=f'plate{index % 4}', plate=f'plate{index % 4}', index=index)
+        self.wait_for(lambda: self.queue.stats()['completed'] == 30)
+
+        for plate in ('plate0', 'plate1', 'plate2', 'plate3'):
+            order = [index for key, index in self.calls if key == plate]
+            self.assertEqual(order, sorted(order))
+
+    def test_failed_task_is_retried_with_backoff(self):
+        attempts = []
+
+        @task_queue.task('test_flaky')
+        def flaky():
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                raise RuntimeError('database is locked')
+
+        @task_queue.task('test_record')
+        def record(index):
+            self.calls.append((index, len(attempts)))
+
+        # Một key khác rơi vào cùng lane với 'plate'
+        neighbour = next(f'plate{n}' for n in range(100)
+                         if zlib.crc32(f'plate{n}'.encode('utf-8')) % 3 == zlib.crc32(b'plate') % 3)
+
+        self.queue.enqueue('test_flaky', key='plate')
+        self.queue.enqueue('test_record', key='plate', index=1)
+        self.wait_for(lambda: len(attempts) == 1 and self.spool('pending'))
+        self.queue.enqueue('test_record', key=neighbour, index=2)
+        self.wait_for(lambda: self.queue.stats()['completed'] == 3)
+
+        self.assertEqual(len(attempts), 3)
+        # Backoff 0.05s rồi nhân đôi (tối đa MAX_BACKOFF 0.08s)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.05)
+        self.assertGreaterEqual(attempts[2] - attempts[1], 0.08)
+        # Lane không ngủ trong lúc chờ: key khác chạy ngay, cùng key thì đợi tác vụ lỗi chạy xong
+        self.assertEqual(self.calls, [(2, 1), (1, 3)])
+        stats = self.queue.stats()
+        self.assertEqual((stats['retried'], stats['failed']), (2, 0))
+        self.assertEqual((self.spool('pending'), self.spool('failed')), ([], []))
+
+    def test_task_waiting_for_retry_is_spooled_with_not_before(self):
+        @task_queue.task('test_record')
+        def record(index):
+            self.calls.append(index)
+
+        os.makedirs(os.path.join(self.spool_dir, 'pending'))
+        filename = f'{1:020d}-task1.json'
+        not_before = time.time() + 0.1
+        with open(os.path.join(self.spool_dir, 'pending', filename), 'w', encoding='utf-8') as f:
+            json.dump({'id': 'task1', 'name': 'test_record', 'key': 'plate', 'kwargs': {'index': 1},
+                       'attempts': 1, 'enqueued_at': time.time(), 'not_before': not_before}, f)
+
+        # Khôi phục lúc khởi động vẫn tôn trọng not_before
+        self.queue.start()
+        self.wait_for(lambda: self.queue.stats()['completed'] == 1)
+        self.assertEqual(self.calls, [1])
+        self.assertGreaterEqual(time.time(), not_before)
+
+    def test_task_moves_to_failed_after_max_retries(self):
+        @task_queue.task('test_broken')
+        def broken():
+            self.calls.append('attempt')
+            raise ValueError('bad receipt template')
+
+        task_id = self.queue.enqueue('test_broken')
+        self.wait_for(lambda: self.queue.stats()['failed'] == 1)
+
+        self.assertEqual(len(self.calls), 3)
+        [filename] = self.spool('failed')
+        with open(os.path.join(self.spool_dir, 'failed', filename), encoding='utf-8') as f:
+            payload = json.load(f)
+        self.assertEqual((payload['id'], payload['attempts'], payload['last_error']),
+                         (task_id, 3, 'bad receipt template'))
+        self.assertEqual((self.spool('pending'), self.spool('running')), ([], []))
+
+    def test_start_recovers_tasks_of_dead_processes(self):
+        @task_queue.task('test_record')
+        def record(index):
+            self.calls.append(index)
+
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        for state, prefix, index in (('running', f'{dead.pid}-', 1), ('pending', '', 2),
+                                     ('running', f'{os.getppid()}-', 3)):
+            os.makedirs(os.path.join(self.spool_dir, state), exist_ok=True)
+            filename = f'{prefix}{index:020d}-task{index}.json'
+            with open(os.path.join(self.spool_dir, state, filename), 'w', encoding='utf-8') as f:
+                json.dump({'id': f'task{index}', 'name': 'test_record', 'key': 'plate', 'kwargs': {'index': index},
+                           'attempts': 0, 'enqueued_at': time.time()}, f)
+
+        self.queue.start()
+        self.wait_for(lambda: self.queue.stats()['completed'] == 2)
+
+        # Tác vụ của process đã chết được chạy lại theo thứ tự; của process còn sống thì giữ nguyên
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(self.spool('running'), [f'{os.getppid()}-{3:020d}-task3.json'])
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        import cv2
+        import numpy as np
+        from django.core.files.base import ContentFile
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        jpeg = cv2.imencode('.jpg', np.full((600, 800, 3), 128, dtype=np.uint8))[1].tobytes()
+        self.detection = VehicleDetection.objects.create(
+            license_plate='30A12345', confidence=0.9, event_type='ENTRY',
+            image_path=ContentFile(jpeg, name='plate.jpg'),
+        )
+        self.client.force_login(User.objects.create_user('cashier', password='x'))
+
+    def test_generate_and_serve_immutable_thumbnails(self):
+        import cv2
+
+        digest = thumbnails.generate_for_detection(self.detection.id)
+        self.detection.refresh_from_db()
+        self.assertEqual(self.detection.image_digest, digest)
+
+        urls = thumbnails.thumbnail_urls_for_images([self.detection.image_path.name])[self.detection.image_path.name]
+        response = self.client.get(urls['sm'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Cache-Control'], f"private, max-age={365 * 24 * 3600}, immutable")
+        image = cv2.imdecode(np.frombuffer(b''.join(response.streaming_content), np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(image.shape[:2], (120, 160))
+
+        response = self.client.get(urls['sm'], HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_thumbnail_is_rendered_lazily(self):
+        digest = thumbnails.generate_for_detection(self.detection.id)
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, 'thumbs'))
+
+        response = self.client.get(f'/thumbs/{digest}_md.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(self.client.get(f'/thumbs/{"0" * 32}_md.webp').status_code, 404)
+        self.assertEqual(self.client.get(f'/thumbs/{digest}_xl.webp').status_code, 404)
+
+    def test_thumbnails_require_login(self):
+        digest = thumbnails.generate_for_detection(self.detection.id)
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, 'thumbs'))
+        self.client.logout()
+
+        self.assertEqual(self.client.get(f'/thumbs/{digest}_sm.webp').status_code, 403)
+        self.assertEqual(self.client.get(f'/media/thumbs/{digest[:2]}/{digest}_sm.webp').status_code, 403)
+        # Request chưa đăng nhập không được kích hoạt việc tạo ảnh
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'thumbs')))
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(media_root, 'detections'))
+        with open(os.path.join(media_root, 'detections', 'plate.jpg'), 'wb') as f:
+            f.write(b'0123456789')
+        self.user = User.objects.create_user('cashier', password='x')
+
+    def test_requires_login_and_handles_conditional_get(self):
+        self.assertEqual(self.client.get('/media/detections/plate.jpg').status_code, 403)
+
+        self.client.force_login(self.user)
+        response = self.client.get('/media/detections/plate.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual((response['Content-Type'], response['Accept-Ranges']), ('image/jpeg', 'bytes'))
+
+        self.assertEqual(self.client.get('/media/detections/plate.jpg', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         304)
+        self.assertEqual(self.client.get('/media/detections/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/../smartparking/settings.py').status_code, 404)
+
+    def test_range_requests(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/media/detections/plate.jpg', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+        response = self.client.get('/media/detections/plate.jpg', HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        self.assertEqual(self.client.get('/media/detections/plate.jpg', HTTP_RANGE='bytes=20-').status_code, 416)
+
+    @override_settings(MEDIA_SERVING={'BACKEND': 'nginx'})
+    def test_offloads_to_front_end_server(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/media/detections/plate.jpg')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/detections/plate.jpg')
+        self.assertEqual(response.content, b'')
+
+
+class OccupancyAnalyticsTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+
+        self.lot = get_default_lot()
+        self.day = timezone.localtime().date() - timedelta(days=2)
+
+    def at(self, hour, minute=0, days=0):
+        return analytics._day_start(self.day) + timedelta(days=days, hours=hour, minutes=minute)
+
+    def session(self, entry, exit_time=None):
+        return ParkingSession.objects.create(
+            license_plate='51G12345', lot=self.lot, entry_time=entry, exit_time=exit_time,
+            status='COMPLETED' if exit_time else 'ACTIVE',
+            duration_minutes=int((exit_time - entry).total_seconds() // 60) if exit_time else None,
+        )
+
+    def test_series_from_sessions(self):
+        self.session(self.at(-1), self.at(8, 10))      # vào từ hôm trước
+        self.session(self.at(8, 2), self.at(9, 0))
+        self.session(self.at(8, 7), self.at(8, 9))
+        self.session(self.at(23, 55))                   # chưa ra
+
+        data = analytics.compute_days(self.lot.id, self.day, self.day)[self.day]
+        bucket = 8 * 12                                 # khung 08:00-08:05
+        self.assertEqual(data['occupancy'][bucket:bucket + 4], [1, 2, 1, 1])
+        self.assertEqual(data['peak'][bucket:bucket + 3], [2, 3, 1])
+        self.assertEqual((sum(data['arrivals']), sum(data['departures'])), (3, 3))
+        self.assertEqual(data['dwell'][0], 1)           # 2 phút
+        self.assertEqual(data['dwell'][analytics.DWELL_BINS.index(480)], 1)   # 9 giờ 10 phút
+        self.assertEqual(data['occupancy'][-1], 1)
+
+        response = self.client.get('/api/analytics/occupancy/', {
+            'start': self.day.isoformat(), 'end': self.day.isoformat(), 'bucket': 60})
+        body = response.json()
+        self.assertEqual((len(body['labels']), body['labels'][8]), (24, f'{self.day.isoformat()} 08:00'))
+        self.assertEqual((body['occupancy'][8], body['peak'][8], body['arrivals'][8]), (1, 3, 2))
+
+        peaks = self.client.get('/api/analytics/peaks/', {'start': self.day.isoformat(), 'end': self.day.isoformat()})
+        self.assertEqual(peaks.json()['days'], [{'date': self.day.isoformat(), 'peak': 3, 'time': '08:05'}])
+        self.assertEqual(self.client.get('/api/analytics/occupancy/', {'bucket': 7}).status_code, 400)
+
+    def test_completed_days_are_cached_until_rollup(self):
+        from .models import DailyOccupancy
+        from .tasks import refresh_daily_rollup
+
+        self.session(self.at(10), self.at(11))
+        params = {'start': self.day.isoformat()}
+        self.assertEqual(self.client.get('/api/analytics/dwell/', params).json()['counts'][3], 1)
+        # Hôm kia và hôm qua được lưu, hôm nay luôn tính lại
+        self.assertEqual(DailyOccupancy.objects.count(), 2)
+
+        # Phiên thêm trực tiếp vào DB: ngày đã lưu chưa đổi cho tới khi tính lại rollup
+        self.session(self.at(12), self.at(13, 30))
+        self.assertEqual(self.client.get('/api/analytics/dwell/', params).json()['counts'][4], 0)
+
+        refresh_daily_rollup(self.lot.id, self.day.isoformat())
+        counts = self.client.get('/api/analytics/dwell/', params).json()['counts']
+        self.assertEqual((counts[3], counts[4]), (1, 1))
+
+
+class TariffSimulationTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+
+        self.lot = get_default_lot()
+        self.day = timezone.localtime().date() - timedelta(days=3)
+
+    def test_current_tariff_matches_calculate_fee(self):
+        durations = np.arange(0, 3000)
+        expected = [int(ParkingSession().calculate_fee(int(minutes))) for minutes in durations]
+        self.assertEqual(tariffs.price(durations, tariffs.CURRENT_TARIFF).tolist(), expected)
+
+    def test_simulation_and_forecast(self):
+        from .models import DailyRollup
+
+        for days, minutes in ((0, 20), (0, 150), (1, 2000)):
+            exit_time = analytics._day_start(self.day) + timedelta(days=days, hours=23, minutes=30)
+            ParkingSession.objects.create(
+                license_plate='51G12345', lot=self.lot, status='COMPLETED', duration_minutes=minutes,
+                entry_time=exit_time - timedelta(minutes=minutes), exit_time=exit_time,
+                fee=ParkingSession().calculate_fee(minutes),
+            )
+        DailyRollup.objects.create(lot=self.lot, date=self.day, revenue=70000)
+        self.client.force_login(User.objects.create_user('quanly', is_staff=True))
+
+        response = self.client.post(
+            '/api/analytics/tariff-simulation/?lot=default', content_type='application/json',
+            data={'start': self.day.isoformat(), 'end': (self.day + timedelta(days=1)).isoformat(),
+                  'tariff': {'BASE_FEE': 6000, 'MAX_FEE': 20000}, 'forecast_days': 7},
+        )
+        body = response.json()
+        simulation = body['simulation']
+        # 20 phút: 5000 -> 6000, 150 phút: 8000 -> 9000, 2000 phút: 101000 -> 20000 (trần)
+        self.assertEqual((simulation['sessions'], simulation['current'], simulation['simulated']),
+                         (3, 114000, 35000))
+        self.assertEqual([row['delta'] for row in simulation['days']], [2000, -81000])
+        durations = {row['label']: row['delta'] for row in simulation['durations']}
+        self.assertEqual((durations['15-30'], durations['120-180'], durations['1440+']), (1000, 1000, -81000))
+
+        forecast = {row['date']: row for row in body['forecast']}
+        same_weekday = (self.day + timedelta(days=7)).isoformat()
+        self.assertEqual(forecast[same_weekday]['baseline'], 70000)
+        self.assertEqual(forecast[same_weekday]['simulated'], round(70000 * simulation['ratio']))
+
+        response = self.client.post('/api/analytics/tariff-simulation/', content_type='application/json',
+                                    data={'tariff': {'HOURLY': 1}})
+        self.assertEqual(response.status_code, 400)
+
+    def test_simulation_requires_staff_and_csrf_token(self):
+        url = '/api/analytics/tariff-simulation/'
+        self.assertEqual(self.client.post(url, content_type='application/json', data={}).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('cashier'))
+        self.assertEqual(self.client.post(url, content_type='application/json', data={}).status_code, 403)
+
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.force_login(User.objects.create_user('quanly', is_staff=True))
+        self.assertEqual(csrf_client.post(url, content_type='application/json', data={}).status_code, 403)
+
+
+class SettlementTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+
+        self.lot = get_default_lot()
+        self.user = User.objects.create_user('cashier', password='x')
+
+    def session(self, plate, fee, status='COMPLETED', payment_status='UNPAID'):
+        now = timezone.now()
+        return ParkingSession.objects.create(
+            license_plate=plate, lot=self.lot, status=status, payment_status=payment_status, fee=fee,
+            entry_time=now - timedelta(hours=1), exit_time=now if status == 'COMPLETED' else None,
+        )
+
+    def settle(self, query='', **data):
+        return self.client.post(f'/api/sessions/settle/{query}', data=data, content_type='application/json').json()
+
+    def test_bulk_settle_is_idempotent_with_outcomes(self):
+        from .models import Payment
+
+        unpaid = [self.session('30A12345', 5000), self.session('51G67890', 8000)]
+        active = self.session('30A11111', 0, status='ACTIVE')
+        free = self.session('30A22222', 0, payment_status='FREE')
+        self.client.force_login(self.user)
+        ids = [s.id for s in unpaid] + [active.id, free.id, 999999]
+
+        body = self.settle(session_ids=ids, method='TRANSFER')
+        self.assertEqual((body['paid_count'], body['paid_amount']), (2, 13000))
+        self.assertEqual([r['outcome'] for r in body['results']],
+                         ['paid', 'paid', 'not_completed', 'free', 'not_found'])
+        payments = Payment.objects.filter(batch=body['batch'])
+        self.assertEqual(sorted(payments.values_list('amount', flat=True)), [5000, 8000])
+        self.assertEqual({(p.method, p.cashier_id) for p in payments}, {('TRANSFER', self.user.id)})
+
+        again = self.settle(session_ids=ids)
+        self.assertEqual((again['paid_count'], again['results'][0]['outcome']), (0, 'already_paid'))
+        self.assertEqual(Payment.objects.count(), 2)
+
+    def test_settle_by_plate_and_single_pay_endpoint(self):
+        from .models import Payment
+
+        first, second = self.session('30A12345', 5000), self.session('30A12345', 3000)
+        other = self.session('51G67890', 8000)
+        self.client.force_login(self.user)
+
+        body = self.settle('?lot=default', license_plate='30a-123.45')
+        self.assertEqual(sorted(r['id'] for r in body['results']), [first.id, second.id])
+        other.refresh_from_db()
+        self.assertEqual(other.payment_status, 'UNPAID')
+
+        response = self.client.post(f'/api/sessions/{other.id}/pay/')
+        self.assertEqual(response.json()['session']['payment_status'], 'PAID')
+        self.assertEqual(self.client.post(f'/api/sessions/{other.id}/pay/').status_code, 400)
+        self.assertEqual(Payment.objects.filter(session=other).count(), 1)
+        self.assertEqual(self.settle(session_ids='x')['success'], False)
+
+    def test_settle_requires_login_and_csrf_token(self):
+        from .models import Payment
+
+        unpaid = self.session('30A12345', 5000)
+        anonymous = self.client.post('/api/sessions/settle/', data={'license_plate': '30A12345'},
+                                     content_type='application/json')
+        self.assertEqual(anonymous.status_code, 302)
+
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post('/api/sessions/settle/', data={'license_plate': '30A12345'},
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        unpaid.refresh_from_db()
+        self.assertEqual(unpaid.payment_status, 'UNPAID')
+        self.assertFalse(Payment.objects.exists())
+
+    def test_settlement_needs_an_authenticated_cashier(self):
+        from django.contrib.auth.models import AnonymousUser
+
+        from .models import Payment
+        from .payments import SettlementError, settle
+
+        unpaid = self.session('30A12345', 5000)
+        for cashier in (None, AnonymousUser()):
+            with self.assertRaises(SettlementError) as raised:
+                settle(session_ids=[unpaid.id], cashier=cashier)
+            self.assertEqual(raised.exception.status, 403)
+        self.assertEqual(self.client.post(f'/api/sessions/{unpaid.id}/pay/').status_code, 302)
+        unpaid.refresh_from_db()
+        self.assertEqual(unpaid.payment_status, 'UNPAID')
+        self.assertFalse(Payment.objects.exists())
+
+
+class PaymentLedgerTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+
+        self.lot = get_default_lot()
+        self.users = [User.objects.create_user(name, password='x') for name in ('thungan1', 'thungan2')]
+
+    def session(self, fee):
+        now = timezone.now()
+        return ParkingSession.objects.create(license_plate='30A12345', lot=self.lot, status='COMPLETED', fee=fee,
+                                             entry_time=now - timedelta(hours=1), exit_time=now)
+
+    def test_shift_bounds(self):
+        from .payments import shift_bounds
+
+        def local(hour, minute=0):
+            return timezone.make_aware(timezone.datetime(2025, 11, 17, hour, minute))
+
+        self.assertEqual(shift_bounds(local(5, 59)), (local(22) - timedelta(days=1), local(6)))
+        self.assertEqual(shift_bounds(local(6)), (local(6), local(14)))
+        self.assertEqual(shift_bounds(local(23)), (local(22), local(6) + timedelta(days=1)))
+
+    def test_running_totals_and_append_only(self):
+        from .models import Payment, ShiftTotal
+        from .payments import collected_totals, settle
+
+        settle([self.session(5000).id, self.session(8000).id], cashier=self.users[0])
+        settle([self.session(3000).id], cashier=self.users[0], method='TRANSFER')
+        settle([self.session(2000).id], cashier=self.users[1])
+        self.assertEqual(ShiftTotal.objects.count(), 2)
+
+        with self.assertNumQueries(2):
+            totals = collected_totals(cashier=self.users[0])
+        self.assertEqual((totals['shift']['amount'], totals['shift']['count']), (18000, 4))
+        self.assertEqual(totals['mine'], {'count': 3, 'amount': 16000, 'cash_amount': 13000})
+        self.assertEqual(totals['today']['amount'], 18000)
+        self.assertEqual([c['cashier'] for c in totals['shift']['cashiers']], ['thungan1', 'thungan2'])
+
+        payment = Payment.objects.first()
+        with self.assertRaises(TypeError):
+            payment.save()
+        with self.assertRaises(TypeError):
+            Payment.objects.filter(id=payment.id).update(amount=0)
+        with self.assertRaises(TypeError):
+            Payment.objects.all().delete()
+
+        self.assertEqual(self.client.get('/api/payments/totals/').status_code, 302)
+        self.client.force_login(self.users[1])
+        self.assertEqual(self.client.get('/api/payments/totals/').json()['mine']['amount'], 2000)
+        # Sổ thanh toán (tên thu ngân, biển số, số tiền) chỉ dành cho quản trị viên
+        self.assertEqual(self.client.get('/api/payments/ledger/').status_code, 403)
+        self.client.force_login(User.objects.create_user('quanly', password='x', is_staff=True))
+        response = self.client.get('/api/payments/ledger/', {'cashier': 'thungan1'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'created_at,batch,cashier,lot,license_plate,session_id,method,amount')
+        self.assertEqual(sorted(line.rsplit(',', 2)[1:] for line in lines[1:]),
+                         [['CASH', '5000'], ['CASH', '8000'], ['TRANSFER', '3000']])
+
+
+class VehicleProfileTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+
+        plates.active_plates.invalidate()
+        self.lot_id = get_default_lot().id
+
+    def visit(self):
+        with self.captureOnCommitCallbacks():
+            entry = gate.process_plate_read('51G12345', 0.9, 'cam1', None, self.lot_id, None)
+            exit_ = gate.process_plate_read('51G12345', 0.9, 'cam1', None, self.lot_id, None)
+        return entry, exit_
+
+    def test_profile_tracks_visits_debt_and_payments(self):
+        from .models import VehicleProfile
+        from .payments import settle
+        from .profiles import rebuild
+
+        first_entry, first_exit = self.visit()
+        self.assertEqual((first_entry['visit_count'], first_exit['outstanding_debt']), (1, 0))
+
+        second_entry, second_exit = self.visit()
+        self.assertEqual((second_entry['outstanding_debt'], second_exit['outstanding_debt']), (5000, 5000))
+        self.assertEqual(second_exit['debt_message'], 'Xe còn nợ 5,000đ từ các lần trước')
+        profile = VehicleProfile.objects.get(license_plate='51G12345')
+        self.assertEqual((profile.visit_count, profile.unpaid_count, profile.outstanding_amount), (2, 2, 10000))
+
+        cashier = User.objects.create_user('cashier', password='x')
+        settle(session_ids=[first_exit['session_id']], cashier=cashier)
+        self.assertEqual(self.client.get('/api/vehicles/51G12345/').status_code, 302)
+        self.client.force_login(cashier)
+        body = self.client.get('/api/vehicles/51g-123.45/').json()['profile']
+        self.assertEqual((body['unpaid_count'], body['outstanding_amount']), (1, 5000))
+
+        # Tính lại từ ParkingSession cho cùng kết quả với cộng dồn
+        VehicleProfile.objects.all().delete()
+        self.assertEqual(rebuild(), 1)
+        profile = VehicleProfile.objects.get(license_plate='51G12345')
+        self.assertEqual((profile.visit_count, profile.unpaid_count, profile.outstanding_amount), (2, 1, 5000))
+
+
+class SubscriptionTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+        from .subscriptions import subscriptions
+
+        plates.active_plates.invalidate()
+        subscriptions.invalidate()
+        self.addCleanup(subscriptions.invalidate)
+        self.lot_id = get_default_lot().id
+
+    def visit(self):
+        with self.captureOnCommitCallbacks():
+            gate.process_plate_read('51G12345', 0.9, 'cam1', None, self.lot_id, None)
+            return gate.process_plate_read('51G12345', 0.9, 'cam1', None, self.lot_id, None)
+
+    def test_subscriber_exit_is_free_without_query(self):
+        from .models import Subscription, VehicleProfile
+        from .subscriptions import subscriptions
+
+        today = timezone.localtime().date()
+        Subscription.objects.create(license_plate='51g-123.45', valid_from=today, valid_until=today)
+        self.assertEqual(VehicleProfile.objects.get(license_plate='51G12345').subscription_until, today)
+
+        self.assertEqual(subscriptions.valid_until('51G12345', self.lot_id), today)
+        with self.assertNumQueries(0):
+            self.assertEqual(subscriptions.valid_until('51G12345', self.lot_id), today)
+            self.assertIsNone(subscriptions.valid_until('30A12345', self.lot_id))
+
+        exit_ = self.visit()
+        self.assertEqual((exit_['fee'], exit_['payment_status']), (0, 'FREE'))
+        self.assertEqual(exit_['subscription_until'], today.isoformat())
+        self.assertEqual(VehicleProfile.objects.get(license_plate='51G12345').unpaid_count, 0)
+
+    def test_expired_or_other_lot_subscription_pays(self):
+        from .models import Lot, Subscription
+
+        today = timezone.localtime().date()
+        other = Lot.objects.create(code='other', name='Bãi khác')
+        Subscription.objects.create(license_plate='51G12345', lot=other, valid_from=today, valid_until=today)
+        Subscription.objects.create(license_plate='51G12345', valid_from=today - timedelta(days=40),
+                                    valid_until=today - timedelta(days=10))
+
+        exit_ = self.visit()
+        self.assertEqual(exit_['payment_status'], 'UNPAID')
+        self.assertIsNone(exit_['subscription_until'])
+
+    def test_import_rows(self):
+        from .models import Subscription, VehicleProfile
+        from .subscriptions import import_rows
+
+        rows = [
+            {'license_plate': '51G-123.45', 'valid_from': '2025-01-01', 'valid_until': '2025-01-31'},
+            {'license_plate': '30A12345', 'valid_from': '2025-01-01', 'valid_until': '2025-01-31', 'kind': 'staff'},
+            {'license_plate': '30A99999', 'valid_from': '2025-02-01', 'valid_until': '2025-01-01'},
+            {'license_plate': '30A88888', 'valid_from': '2025-01-01', 'valid_until': '2025-01-31', 'lot': 'nope'},
+        ]
+        result = import_rows(rows)
+        self.assertEqual((result['created'], result['skipped']), (2, 0))
+        self.assertEqual([line for line, _ in result['errors']], [3, 4])
+        self.assertEqual(Subscription.objects.get(license_plate='30A12345').kind, 'STAFF')
+
+        # Nhập lại cùng danh sách không tạo trùng
+        self.assertEqual(import_rows(rows[:2])['skipped'], 2)
+        self.assertEqual(Subscription.objects.count(), 2)
+        self.assertEqual(VehicleProfile.objects.get(license_plate='51G12345').subscription_until, date(2025, 1, 31))
+
+
+class AsyncReadApiTests(TestCase):
+    ENDPOINTS = [
+        '/api/revenue/stats/?period=month',
+        '/api/sessions/active/',
+        '/api/sessions/unpaid/',
+        '/api/sessions/history/?page=1&limit=5&payment_status=UNPAID',
+        '/api/latest_detections/',
+    ]
+
+    def setUp(self):
+        from .lots import get_default_lot
+
+        lot = get_default_lot()
+        now = timezone.now()
+        for i in range(6):
+            session = ParkingSession.objects.create(license_plate=f'30A1234{i}', entry_time=now - timedelta(hours=3),
+                                                    lot=lot)
+            if i % 3:
+                session.complete_session(now - timedelta(minutes=i))
+            VehicleDetection.objects.create(license_plate=session.license_plate, confidence=0.9,
+                                            event_type='ENTRY', lot=lot)
+        self.client.force_login(User.objects.create_user('poller', password='x'))
+
+    def get_all(self, use_async):
+        from .urls import read_api_patterns
+
+        urlconf = type('UrlConf', (), {'urlpatterns': read_api_patterns(use_async)})
+        with override_settings(ROOT_URLCONF=urlconf):
+            return [self.client.get(path).json() for path in self.ENDPOINTS]
+
+    def test_async_views_match_sync_views(self):
+        sync_bodies = self.get_all(False)
+        self.assertEqual(sync_bodies[1]['count'], 2)
+        self.assertEqual(sync_bodies[3]['total'], 4)
+        self.assertEqual(self.get_all(True), sync_bodies)
+
+    async def test_async_view_under_async_client(self):
+        from django.test import AsyncClient
+
+        from .urls import read_api_patterns
+
+        urlconf = type('UrlConf', (), {'urlpatterns': read_api_patterns(True)})
+        with override_settings(ROOT_URLCONF=urlconf):
+            response = await AsyncClient().get('/api/sessions/unpaid/?lot=missing')
+            self.assertEqual(response.status_code, 404)
+            body = (await AsyncClient().get('/api/sessions/unpaid/')).json()
+        self.assertEqual((body['count'], body['total_debt']), (4, 44000))
+
+
+class LotScopingTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+        from .models import Lot
+
+        self.main = get_default_lot()
+        self.north = Lot.objects.create(code='north', name='Bãi Bắc', capacity=20)
+        Lot.objects.create(code='closed', name='Bãi đã đóng', capacity=50, is_active=False)
+        now = timezone.now()
+        # Bãi chính: 1 xe đang đỗ, 2 phiên đã ra; bãi Bắc: 2 xe đang đỗ, 1 phiên đã ra
+        for lot, lot_plates, completed in ((self.main, ['30A11111', '30A22222', '30A33333'], 2),
+                                        (self.north, ['51G11111', '51G22222', '51G33333'], 1)):
+            for i, plate in enumerate(lot_plates):
+                session = ParkingSession.objects.create(license_plate=plate, entry_time=now - timedelta(hours=3),
+                                                        lot=lot)
+                if i < completed:
+                    session.complete_session(now - timedelta(minutes=i + 1))
+        self.client.force_login(User.objects.create_user('manager', password='x'))
+
+    def test_lot_parameter_scopes_read_queries(self):
+        for lot, active, completed in ((self.main, 1, 2), (self.north, 2, 1)):
+            sessions = ParkingSession.objects.filter(lot=lot, status='COMPLETED')
+            revenue = self.client.get(f'/api/revenue/stats/?period=month&lot={lot.code}').json()
+            self.assertEqual(revenue['total_transactions'], completed)
+            self.assertEqual(revenue['total_revenue'], int(sum(session.fee for session in sessions)))
+            active_body = self.client.get(f'/api/sessions/active/?lot={lot.code}').json()
+            self.assertEqual(active_body['count'], active)
+            self.assertTrue(all(row['license_plate'].startswith('30A' if lot is self.main else '51G')
+                                for row in active_body['sessions']))
+            self.assertEqual(self.client.get(f'/api/sessions/history/?lot={lot.code}').json()['total'], completed)
+
+        # Không truyền ?lot= là tất cả các bãi
+        self.assertEqual(self.client.get('/api/sessions/active/').json()['count'], 3)
+        self.assertEqual(self.client.get('/api/revenue/stats/?period=month').json()['total_transactions'], 3)
+
+    def test_unknown_lot_is_not_found(self):
+        for path in ('/api/revenue/stats/', '/api/sessions/active/', '/api/sessions/unpaid/',
+                     '/api/sessions/history/'):
+            response = self.client.get(f'{path}?lot=missing')
+            self.assertEqual(response.status_code, 404, path)
+            self.assertFalse(response.json()['success'])
+
+    def test_lots_summary_totals(self):
+        body = self.client.get('/api/lots/summary/').json()
+
+        lots = {item['code']: item for item in body['lots']}
+        self.assertEqual(sorted(lots), ['default', 'north'])
+        self.assertEqual((lots['default']['occupied'], lots['default']['transactions']), (1, 2))
+        self.assertEqual((lots['north']['occupied'], lots['north']['transactions']), (2, 1))
+        self.assertEqual(lots['north']['revenue'],
+                         int(sum(s.fee for s in ParkingSession.objects.filter(lot=self.north, status='COMPLETED'))))
+        for key, total in body['totals'].items():
+            self.assertEqual(total, sum(item[key] for item in body['lots']), key)
+        self.assertEqual(body['totals']['capacity'], self.main.capacity + 20)
+
+
+class LotMigrationTests(TransactionTestCase):
+    """0009_lot_gate chuyển dữ liệu một bãi cũ sang bãi mặc định"""
+    serialized_rollback = True
+
+    def setUp(self):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+
+        from .lots import invalidate_lot_cache
+
+        invalidate_lot_cache()
+        self.addCleanup(invalidate_lot_cache)
+        self.executor = MigrationExecutor(connection)
+        self.addCleanup(self.migrate_to_latest)
+
+    def migrate(self, target):
+        self.executor.loader.build_graph()
+        self.executor.migrate([('parking', target)])
+        return self.executor.loader.project_state(('parking', target)).apps
+
+    def migrate_to_latest(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.executor.loader.graph.leaf_nodes())
+
+    def test_existing_rows_are_assigned_to_default_lot(self):
+        old_apps = self.migrate('0008_cameradevice')
+        now = timezone.now()
+        old_apps.get_model('parking', 'ParkingSession').objects.create(license_plate='30A12345', entry_time=now)
+        old_apps.get_model('parking', 'VehicleDetection').objects.create(license_plate='30A12345', confidence=0.9,
+                                                                         event_type='ENTRY')
+        CameraDevice = old_apps.get_model('parking', 'CameraDevice')
+        CameraDevice.objects.create(device_id='main_cam', secret_key='x')
+        CameraDevice.objects.create(device_id='north_cam', secret_key='x', lot='north', gate='in')
+
+        new_apps = self.migrate('0009_lot_gate')
+
+        Lot = new_apps.get_model('parking', 'Lot')
+        default_lot = Lot.objects.get(code='default')
+        self.assertEqual(new_apps.get_model('parking', 'ParkingSession').objects.get().lot_id, default_lot.id)
+        self.assertEqual(new_apps.get_model('parking', 'VehicleDetection').objects.get().lot_id, default_lot.id)
+        cameras = {camera.device_id: camera for camera in new_apps.get_model('parking', 'CameraDevice').objects.all()}
+        self.assertEqual(cameras['main_cam'].lot_id, default_lot.id)
+        self.assertIsNone(cameras['main_cam'].gate_id)
+        north = Lot.objects.get(code='north')
+        self.assertEqual(cameras['north_cam'].lot_id, north.id)
+        self.assertEqual(new_apps.get_model('parking', 'Gate').objects.get(id=cameras['north_cam'].gate_id).lot_id,
+                         north.id)
+
+class GateDecisionTests(SimpleTestCase):
+    def setUp(self):
+        plates.active_plates.invalidate()
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        self.release = threading.Event()
+        self.written = []
+
+    def slow_writer(self, event):
+        self.release.wait(5)
+        image = event['image'].read() if event['image'] is not None else None
+        self.written.append((event['plate'], image))
+        return {'status': 'ok', 'plate': event['plate'], 'action': 'open_barrier'}
+
+    def test_slow_writes_degrade_to_journal_and_replay_in_order(self):
+        service = gate_decision.GateDecisionService(dict(
+            gate_decision.DEFAULT_GATE_DECISION, LATENCY_BUDGET_MS=20, DEGRADE_AFTER=2,
+            JOURNAL_DIR=self.journal_dir, REPLAY_INTERVAL=60,
+        ), writer=self.slow_writer)
+
+        first = service.decide('51G12345', 0.9, 'cam1', None, 1, None)
+        self.assertEqual((first['event_type'], first['action'], first['pending']), ('ENTRY', 'open_barrier', True))
+        service.decide('30A11111', 0.9, 'cam1', None, 1, None)
+        self.assertTrue(service.degraded)
+
+        # Database chậm: vào journal, lần đọc sau của cùng xe được đoán là EXIT
+        entry = service.decide('29B22222', 0.9, 'cam1', ContentFile(b'jpeg', name='cam1/plate.jpg'), 1, None)
+        exit_ = service.decide('29B22222', 0.9, 'cam1', None, 1, None)
+        self.assertEqual((entry['event_type'], exit_['event_type']), ('ENTRY', 'EXIT'))
+        self.assertEqual(service.stats()['journal_depth'], 2)
+
+        self.release.set()
+        self.assertEqual(service.replay(), 2)
+        self.assertEqual(sorted(plate for plate, _ in self.written[:2]), ['30A11111', '51G12345'])
+        self.assertEqual(self.written[2:], [('29B22222', b'jpeg'), ('29B22222', None)])
+        self.assertFalse(service.degraded)
+
+        self.assertNotIn('pending', service.decide('51G99999', 0.9, 'cam1', None, 1, None))
+        stats = service.stats()
+        self.assertEqual((stats['written'], stats['pending'], stats['journaled'], stats['replayed']), (1, 2, 2, 2))
+        self.assertEqual((stats['journal_depth'], stats['mode']), (0, 'normal'))
+
+        with mock.patch.object(gate_decision, 'gate_decisions', service):
+            text = metrics.registry.render()
+        self.assertIn('parking_gate_decision_seconds_bucket{outcome="journaled",le="0.005"}', text)
+        self.assertIn('parking_gate_decisions_total{outcome="pending"} 2', text)
+
+    def test_degraded_mode_and_replay_are_shared_between_processes(self):
+        import fcntl
+
+        self.release.set()
+        config = dict(gate_decision.DEFAULT_GATE_DECISION, JOURNAL_DIR=self.journal_dir, REPLAY_INTERVAL=60)
+        # Hai service cùng JOURNAL_DIR đóng vai hai worker
+        first = gate_decision.GateDecisionService(config, writer=self.slow_writer)
+        second = gate_decision.GateDecisionService(config, writer=self.slow_writer)
+
+        first._enter_degraded('database is locked')
+        self.assertTrue(second.degraded)
+        # Worker còn lại cũng ghi journal, không ghi database vượt lên trước sự kiện cũ hơn
+        self.assertTrue(first.decide('51G12345', 0.9, 'cam1', None, 1, None)['pending'])
+        self.assertTrue(second.decide('51G12345', 0.9, 'cam2', None, 1, None)['pending'])
+        self.assertEqual(self.written, [])
+
+        with first._file_lock('replay.lock', fcntl.LOCK_EX):
+            self.assertEqual(second.replay(), 0)
+        self.assertEqual(second.replay(), 2)
+        self.assertEqual(self.written, [('51G12345', None), ('51G12345', None)])
+        self.assertFalse(first.degraded)
+        self.assertNotIn('pending', first.decide('30A11111', 0.9, 'cam1', None, 1, None))
+
+    def test_restart_with_journal_degrades_once(self):
+        config = dict(gate_decision.DEFAULT_GATE_DECISION, JOURNAL_DIR=self.journal_dir)
+        service = gate_decision.GateDecisionService(config)
+        service._enter_degraded('test')
+        service.decide('51G12345', 0.9, 'cam1', None, 1, None)
+        os.remove(os.path.join(self.journal_dir, 'degraded'))
+
+        restarted = [gate_decision.GateDecisionService(config) for _ in range(2)]
+        for worker in restarted:
+            worker._recover()
+        self.assertTrue(all(worker.degraded for worker in restarted))
+        self.assertEqual([worker.counters['degraded'] for worker in restarted], [1, 0])
+
+
+class GateJournalReplayTests(TestCase):
+    def test_journaled_event_is_replayed_with_original_time(self):
+        from .lots import get_default_lot
+
+        journal_dir, media_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for path in (journal_dir, media_root):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        service = gate_decision.GateDecisionService(dict(gate_decision.DEFAULT_GATE_DECISION, JOURNAL_DIR=journal_dir))
+        service._enter_degraded('test')
+        moment = timezone.now() - timedelta(minutes=5)
+
+        with override_settings(MEDIA_ROOT=media_root), mock.patch.object(gate, 'clip_writer') as clip_writer, \
+                mock.patch.object(gate, 'enqueue'), self.captureOnCommitCallbacks(execute=True):
+            with mock.patch.object(gate_decision.timezone, 'now', return_value=moment):
+                result = service.decide('51G-123.45', 0.9, 'cam1', ContentFile(b'jpeg', name='plate.jpg'),
+                                        get_default_lot().id, None)
+            self.assertTrue(result['pending'])
+            self.assertFalse(ParkingSession.objects.exists())
+            self.assertEqual(service.replay(), 1)
+
+        session = ParkingSession.objects.get()
+        self.assertEqual((session.license_plate, session.entry_time), ('51G12345', moment))
+        detection = VehicleDetection.objects.get()
+        self.assertTrue(detection.image_path.name.startswith('detections/'))
+        # Lần phát hiện và clip cũng theo thời điểm gốc, không phải lúc ghi lại
+        self.assertEqual(detection.detected_at, moment)
+        clip_writer.schedule.assert_called_once_with('cam1', detection.id, event_time=moment.timestamp())
+        self.assertFalse(service.degraded)
+
+
+class GateDecisionWriteThroughTests(TransactionTestCase):
+    """Đường ghi thật qua thread pool (TestCase luôn ở trong transaction nên chỉ ghi đồng bộ)"""
+    serialized_rollback = True
+
+    def setUp(self):
+        from .lots import get_default_lot, invalidate_lot_cache
+
+        invalidate_lot_cache()
+        self.addCleanup(invalidate_lot_cache)
+        plates.active_plates.invalidate()
+        self.lot_id = get_default_lot().id
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        for name in ('schedule_post_event_tasks', 'clip_writer'):
+            patcher = mock.patch.object(gate, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+        self.fail_first = True
+
+    def slow_writer(self, event):
+        from django.db import OperationalError
+
+        self.release.wait(5)
+        if self.fail_first:
+            self.fail_first = False
+            raise OperationalError('database is locked')
+        return gate_decision.write_event(event)
+
+    def test_late_failed_write_replays_before_newer_journaled_events(self):
+        service = gate_decision.GateDecisionService(dict(
+            gate_decision.DEFAULT_GATE_DECISION, LATENCY_BUDGET_MS=20, DEGRADE_AFTER=1,
+            JOURNAL_DIR=self.journal_dir, REPLAY_INTERVAL=60,
+        ), writer=self.slow_writer)
+        self.addCleanup(lambda: service._executor.shutdown(wait=True))
+
+        entry = service.decide('51G12345', 0.9, 'cam1', None, self.lot_id, None)
+        self.assertEqual((entry['action'], entry['pending']), ('open_barrier', True))
+        self.assertTrue(service.degraded)
+        self.assertFalse(ParkingSession.objects.exists())
+
+        exit_ = service.decide('51G12345', 0.9, 'cam1', None, self.lot_id, None)
+        self.assertEqual((exit_['action'], exit_['pending']), ('open_barrier', True))
+        self.assertEqual(len(os.listdir(os.path.join(self.journal_dir, 'pending'))), 1)
+
+        # Lần ghi đầu lỗi muộn, vào journal sau lần ra nhưng vẫn được ghi lại trước
+        self.release.set()
+        self.assertEqual(service.replay(), 2)
+        session = ParkingSession.objects.get()
+        self.assertEqual(session.status, 'COMPLETED')
+        self.assertLess(session.entry_time, session.exit_time)
+        self.assertEqual(list(VehicleDetection.objects.order_by('detected_at').values_list('event_type', flat=True)),
+                         ['ENTRY', 'EXIT'])
+        self.assertFalse(service.degraded)
+        self.assertEqual(os.listdir(os.path.join(self.journal_dir, 'pending')), [])
+
+
+class DeviceAuthTests(TestCase):
+    def setUp(self):
+        from .lots import get_default_lot
+        from .models import CameraDevice
+
+        self.device = CameraDevice.objects.create(device_id='gate_cam', lot=get_default_lot())
+        # Bucket không tự nạp (rate = 0) để kiểm tra 429 không phụ thuộc thời gian
+        self.limiter = device_auth.RateLimiter({'ingest': (0, 2), 'upload': (0, 5)})
+        for name, value in (('secret_cache', device_auth.DeviceSecretCache()), ('rate_limiter', self.limiter)):
+            patcher = mock.patch.object(device_auth, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def view(self, scope='ingest'):
+        def echo(request):
+            return JsonResponse({"device": request.device.device_id if request.device else None})
+        return device_auth.device_required(scope)(echo)
+
+    def signed_request(self, body=b'plate=51G12345', timestamp=None, secret=None, signed_body=None, device_id='gate_cam'):
+        timestamp = str(int(time.time()) if timestamp is None else int(timestamp))
+        signature = device_auth.compute_signature(
+            secret or self.device.secret_key, device_id, timestamp, body if signed_body is None else signed_body
+        )
+        return RequestFactory().post(
+            '/api/upload/', body, content_type='application/x-www-form-urlencoded',
+            HTTP_X_DEVICE_ID=device_id, HTTP_X_TIMESTAMP=timestamp, HTTP_X_SIGNATURE=signature,
+        )
+
+    def test_valid_signature_attaches_device(self):
+        response = self.view()(self.signed_request())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"device": "gate_cam"})
+
+    def test_bad_signature_is_rejected(self):
+        wrong_key = self.view()(self.signed_request(secret='not-the-secret'))
+        tampered_body = self.view()(self.signed_request(body=b'plate=99A99999', signed_body=b'plate=51G12345'))
+
+        self.assertEqual(wrong_key.status_code, 401)
+        self.assertEqual(tampered_body.status_code, 401)
+        self.assertEqual(json.loads(wrong_key.content)['msg'], 'Invalid signature')
+
+    def test_missing_credentials_are_rejected(self):
+        response = self.view()(RequestFactory().post('/api/upload/', b'', content_type='application/octet-stream'))
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_stale_timestamp_is_rejected_as_replay(self):
+        max_skew = device_auth.get_config()['MAX_CLOCK_SKEW']
+        # Chữ ký hợp lệ nhưng được gửi lại sau khi đã ra khỏi cửa sổ thời gian
+        replayed = self.view()(self.signed_request(timestamp=time.time() - max_skew - 30))
+        future = self.view()(self.signed_request(timestamp=time.time() + max_skew + 30))
+
+        self.assertEqual(replayed.status_code, 401)
+        self.assertEqual(json.loads(replayed.content)['msg'], 'Timestamp outside allowed window')
+        self.assertEqual(future.status_code, 401)
+
+    def test_disabled_device_is_forbidden(self):
+        self.assertEqual(self.view()(self.signed_request()).status_code, 200)
+
+        # Tắt thiết bị: signal xóa entry trong cache nên request kế tiếp bị chặn ngay
+        self.device.is_active = False
+        self.device.save()
+        response = self.view()(self.signed_request())
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.view()(self.signed_request(device_id='unknown_cam')).status_code, 403)
+
+    def test_rate_limit_returns_429_with_retry_after(self):
+        ingest = self.view('ingest')
+        statuses = [ingest(self.signed_request()).status_code for _ in range(2)]
+        limited = ingest(self.signed_request())
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(limited['Retry-After'], '1')
+
+    def test_rate_limit_buckets_are_scoped(self):
+        ingest = self.view('ingest')
+        for _ in range(3):
+            ingest(self.signed_request())
+
+        # Hết token 'ingest' không ảnh hưởng tới 'upload'; scope không cấu hình hoặc None thì không giới hạn
+        self.assertEqual(ingest(self.signed_request()).status_code, 429)
+        self.assertEqual(self.view('upload')(self.signed_request()).status_code, 200)
+        self.assertEqual(self.view('unlimited')(self.signed_request()).status_code, 200)
+        self.assertEqual(self.view(None)(self.signed_request()).status_code, 200)
+        self.assertEqual(self.limiter.consume('other_cam', 'ingest'), (True, 0.0))
+
+    def test_device_cannot_stream_for_another_camera(self):
+        request = self.signed_request(body=b'\xff\xd8frame')
+        request.META['HTTP_X_CAMERA_ID'] = 'other_cam'
+        request.META['CONTENT_TYPE'] = 'application/octet-stream'
+
+        response = resolve('/api/stream_upload/').func(request)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(json.loads(response.content)['msg'], 'camera_id does not match device')
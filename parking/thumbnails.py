@@ -0,0 +1,170 @@
+"""
+Ảnh thu nhỏ (WebP/JPEG) cho ảnh nhận diện biển số trên dashboard
+
+Dashboard/quầy thu ngân chỉ cần ảnh nhỏ nhưng trước đây tải nguyên ảnh gốc
+mỗi lần refresh. Với mỗi ảnh nhận diện:
+    - tác vụ nền 'generate_thumbnails' (đưa vào hàng đợi khi ghi detection)
+      tính digest nội dung ảnh gốc, lưu vào VehicleDetection.image_digest và
+      tạo các kích thước trong SIZES
+    - file nằm ở MEDIA_ROOT/<THUMB_DIR>/<2 ký tự đầu>/<digest>_<size>.<format>
+      (đặt tên theo nội dung: cùng tên = cùng ảnh, không bao giờ phải làm mới)
+    - view `thumbnail` phục vụ file với Cache-Control immutable; file chưa có
+      (ảnh cũ, tác vụ chưa chạy) thì được tạo ngay khi có request đầu tiên
+API trả URL ảnh thu nhỏ cạnh đường dẫn ảnh gốc (None khi chưa có digest).
+"""
+
+import hashlib
+import logging
+import os
+import re
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.urls import reverse
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THUMBNAILS = {
+    'ENABLED': True,
+    'SIZES': {'sm': 160, 'md': 480},   # cạnh dài tối đa (px), không phóng to ảnh nhỏ hơn
+    'FORMAT': 'webp',                  # 'webp' hoặc 'jpg'
+    'QUALITY': 80,
+    'THUMB_DIR': 'thumbs',
+    'MAX_AGE': 365 * 24 * 3600,        # giây - tên file theo nội dung nên cache được mãi
+}
+
+NAME_PATTERN = re.compile(r'^(?P<digest>[0-9a-f]{32})_(?P<size>\w+)\.(?P<format>webp|jpg)$')
+
+_ENCODE_PARAMS = {
+    'webp': lambda quality: [cv2.IMWRITE_WEBP_QUALITY, quality],
+    'jpg': lambda quality: [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1],
+}
+
+
+def get_config():
+    config = dict(DEFAULT_THUMBNAILS)
+    config.update(getattr(settings, 'THUMBNAILS', {}))
+    return config
+
+
+def digest_bytes(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def thumbnail_name(digest, size, image_format, config=None):
+    """Đường dẫn ảnh thu nhỏ, tương đối với MEDIA_ROOT"""
+    config = config or get_config()
+    return f"{config['THUMB_DIR']}/{digest[:2]}/{digest}_{size}.{image_format}"
+
+
+def thumbnail_urls(digest, config=None):
+    """
+    URL các kích thước ảnh thu nhỏ
+
+    Returns:
+        dict | None: {size: url}, None nếu ảnh chưa có digest
+    """
+    config = config or get_config()
+    if not digest or not config['ENABLED']:
+        return None
+    return {
+        size: reverse('thumbnail', args=[f"{digest}_{size}.{config['FORMAT']}"])
+        for size in config['SIZES']
+    }
+
+
+def thumbnail_urls_for_images(names, config=None):
+    """
+    URL ảnh thu nhỏ cho nhiều ảnh gốc (entry_image/exit_image của phiên) - 1 truy vấn
+
+    Returns:
+        dict: {tên ảnh gốc: {size: url} | None}
+    """
+    from .models import VehicleDetection
+
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    digests = dict(VehicleDetection.objects.filter(image_path__in=names).exclude(image_digest='')
+                   .values_list('image_path', 'image_digest'))
+    return {name: thumbnail_urls(digests.get(name), config) for name in names}
+
+
+async def athumbnail_urls_for_images(names, config=None):
+    """Bản async của thumbnail_urls_for_images"""
+    from .models import VehicleDetection
+
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    rows = VehicleDetection.objects.filter(image_path__in=names).exclude(image_digest='').values_list(
+        'image_path', 'image_digest')
+    digests = {name: digest async for name, digest in rows}
+    return {name: thumbnail_urls(digests.get(name), config) for name in names}
+
+
+def render(data, max_edge, image_format, quality):
+    """
+    Thu nhỏ ảnh (bytes) để cạnh dài nhất <= max_edge
+
+    Returns:
+        bytes | None: None nếu không giải mã được ảnh
+    """
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = max_edge / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(f'.{image_format}', image, _ENCODE_PARAMS[image_format](quality))
+    return encoded.tobytes() if ok else None
+
+
+def generate(source_path, config=None, formats=None):
+    """
+    Tạo các kích thước còn thiếu cho một ảnh gốc
+
+    Returns:
+        str | None: digest của ảnh gốc, None nếu không đọc/giải mã được
+    """
+    config = config or get_config()
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    digest = digest_bytes(data)
+
+    for image_format in formats or [config['FORMAT']]:
+        for size, max_edge in config['SIZES'].items():
+            path = os.path.join(settings.MEDIA_ROOT, thumbnail_name(digest, size, image_format, config))
+            if os.path.exists(path):
+                continue
+            encoded = render(data, max_edge, image_format, config['QUALITY'])
+            if encoded is None:
+                logger.warning('Cannot decode image %s', source_path)
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(encoded)
+            os.replace(temp_path, path)
+    return digest
+
+
+def generate_for_detection(detection_id, config=None):
+    """Tạo ảnh thu nhỏ cho ảnh của một VehicleDetection và lưu digest"""
+    from .models import VehicleDetection
+
+    detection = VehicleDetection.objects.filter(id=detection_id).only('id', 'image_path', 'image_digest').first()
+    if detection is None or not detection.image_path:
+        return None
+    try:
+        digest = generate(detection.image_path.path, config)
+    except FileNotFoundError:
+        logger.warning('Image for detection #%s is missing', detection_id)
+        return None
+    if digest and digest != detection.image_digest:
+        VehicleDetection.objects.filter(id=detection_id).update(image_digest=digest)
+    return digest
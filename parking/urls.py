@@ -1,9 +1,26 @@
-from django.urls import path
+from django.urls import path, re_path
 
 from parking import api, api_views
-from . import views
+from . import async_views, media, metrics, views
 from django.conf import settings
-from django.conf.urls.static import static
+
+
+# API chỉ đọc được dashboard poll liên tục - có bản async (parking/async_views.py)
+READ_API_ROUTES = [
+    ('api/latest_detections/', views, 'latest_detections'),
+    ('api/revenue/stats/', api_views, 'revenue_statistics'),
+    ('api/sessions/active/', api_views, 'get_active_sessions'),
+    ('api/sessions/unpaid/', api_views, 'get_unpaid_sessions'),
+    ('api/sessions/history/', api_views, 'get_transaction_history'),
+]
+
+
+def read_api_patterns(use_async):
+    """URL của READ_API_ROUTES trỏ tới bản async (chạy ASGI) hoặc bản sync"""
+    return [path(route, getattr(async_views if use_async else module, name), name=name)
+            for route, module, name in READ_API_ROUTES]
+
+
 urlpatterns = [
     path('', views.home, name='home'),
     path('login/', views.login_view, name='login'),
@@ -22,20 +39,42 @@ urlpatterns = [
    # API endpoints - Video & Detection
     path('video_feed/<str:src>', views.video_feed, name='video_feed'),
     path('api/stream/<str:src>', views.receive_stream, name='receive_stream'),
+    path('api/stream_upload/', views.stream_upload, name='stream_upload'),
+    path('api/streams/stats/', views.stream_stats, name='stream_stats'),
+    path('api/cameras/health/', views.camera_health, name='camera_health'),
+    path('api/tasks/stats/', views.task_queue_stats, name='task_queue_stats'),
     path('api/upload/', views.upload_license_plate, name='upload_license_plate'),
-    path('api/latest_detections/', views.latest_detections, name='latest_detections'),
+    path('thumbs/<str:name>', views.thumbnail, name='thumbnail'),
     path('api/toggle_barrier/', views.toggle_barrier, name='toggle_barrier'),
+    path('api/parking_status/', views.get_parking_status, name='get_parking_status'),
     
     # API endpoints - Thống kê doanh thu
-    path('api/revenue/stats/', api_views.revenue_statistics, name='revenue_statistics'),
     path('api/revenue/daily/', api_views.revenue_by_day, name='revenue_by_day'),
     path('api/revenue/monthly/', api_views.revenue_by_month, name='revenue_by_month'),
     
     # API endpoints - Quản lý giao dịch
-    path('api/sessions/active/', api_views.get_active_sessions, name='get_active_sessions'),
     path('api/sessions/<int:session_id>/', api_views.get_session_detail, name='get_session_detail'),
     path('api/sessions/<int:session_id>/pay/', api_views.mark_session_paid, name='mark_session_paid'),
-    path('api/sessions/unpaid/', api_views.get_unpaid_sessions, name='get_unpaid_sessions'),
-    path('api/sessions/history/', api_views.get_transaction_history, name='get_transaction_history'),
-   
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('api/sessions/settle/', api_views.settle_sessions, name='settle_sessions'),
+    path('api/vehicles/<str:plate>/', api_views.vehicle_profile, name='vehicle_profile'),
+    path('api/payments/totals/', api_views.payment_totals, name='payment_totals'),
+    path('api/payments/ledger/', api_views.payment_ledger, name='payment_ledger'),
+    
+    # API endpoints - Nhiều bãi đỗ
+    path('api/lots/summary/', api_views.lots_summary, name='lots_summary'),
+
+    # API endpoints - Phân tích lượng xe
+    path('api/analytics/occupancy/', api_views.occupancy_series, name='occupancy_series'),
+    path('api/analytics/dwell/', api_views.dwell_histogram, name='dwell_histogram'),
+    path('api/analytics/peaks/', api_views.peak_load, name='peak_load'),
+    path('api/analytics/tariff-simulation/', api_views.tariff_simulation, name='tariff_simulation'),
+
+    # API chỉ đọc: bản async khi settings.ASYNC_READ_API (chạy ASGI)
+    *read_api_patterns(getattr(settings, 'ASYNC_READ_API', False)),
+
+    # Prometheus
+    path('metrics', metrics.metrics_view, name='metrics'),
+
+    # File media: Django kiểm tra quyền, nginx/apache gửi file (xem parking/media.py)
+    re_path(rf'^{settings.MEDIA_URL.strip("/")}/(?P<path>.+)$', media.serve_media, name='media'),
+]
\ No newline at end of file
@@ -1,5 +1,6 @@
-from django.http import StreamingHttpResponse, JsonResponse, HttpResponse
+from django.http import StreamingHttpResponse, JsonResponse, HttpResponse, HttpResponseForbidden, Http404
 from django.shortcuts import render, redirect
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
@@ -12,36 +13,50 @@ import json
 import cv2
 import numpy as np
 import math
+import logging
+
+from .device_auth import device_required
+from .gate_decision import gate_decisions
+from .task_queue import task_queue
+from .lots import get_default_lot, lot_from_request
+from .streaming import broker, frame_admission, frame_size_limit, valid_camera_id
+from .camera_health import supervisor
+from .clips import clip_writer
+from .recognition import recognizer_pool
+from .voting import plate_voter
+from . import thumbnails
+from .media import can_view, serve_file
+
+logger = logging.getLogger(__name__)
 
 # Global variables for stream handling
-streams = {}
-stream_locks = {}
 detection_history = deque(maxlen=200)  # Keep last 200 detections
 
 def get_stream_frame(camera_id):
-    """Get the latest frame from a specific camera stream (from file)"""
+    """Get the latest frame from a specific camera stream (memory, then file)"""
     import os
     import time
     
-    frame_path = f'media/streams/{camera_id}.jpg'
-    
-    # Kiểm tra file tồn tại và còn mới (dưới 10 giây)
-    if os.path.exists(frame_path):
-        file_age = time.time() - os.path.getmtime(frame_path)
-        if file_age > 10:
-            print(f"⚠️ Stream file too old ({file_age:.1f}s) for {camera_id}")
-            return None
-            
-        try:
-            # Đọc file với retry nếu bị lock
-            for _ in range(3):  # Thử 3 lần
-                try:
-                    with open(frame_path, 'rb') as f:
-                        return f.read()
-                except (IOError, OSError):
-                    time.sleep(0.01)  # Đợi 10ms rồi thử lại
-        except Exception as e:
-            print(f"❌ Error reading frame: {e}")
+    # Frame trong bộ nhớ (nếu Pi gửi vào chính worker này) - không cần đọc file
+    frame = broker.latest(camera_id, max_age=1)
+    if frame is not None:
+        return frame
+
+    # Độ mới của stream do camera supervisor tính ở thread nền - không stat file mỗi lần đọc
+    if supervisor.state(camera_id) not in ('live', 'degraded'):
+        return None
+
+    frame_path = os.path.join(broker.config['STREAM_DIR'], f'{camera_id}.jpg')
+    try:
+        # Đọc file với retry nếu bị lock
+        for _ in range(3):  # Thử 3 lần
+            try:
+                with open(frame_path, 'rb') as f:
+                    return f.read()
+            except (IOError, OSError):
+                time.sleep(0.01)  # Đợi 10ms rồi thử lại
+    except Exception as e:
+        logger.warning('Error reading frame for %s: %s', camera_id, e)
     return None
 
 def gen_frames(camera_id):
@@ -56,8 +71,11 @@ def gen_frames(camera_id):
                 last_frame = frame  # Cập nhật frame mới nhất
                 yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
             elif last_frame is not None:
-                # Nếu không có frame mới, hiển thị lại frame cũ
+                # Nếu không có frame mới, hiển thị lại frame cũ (camera mất tín hiệu thì gửi thưa lại)
                 yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + last_frame + b'\r\n')
+                if supervisor.state(camera_id) == 'stale':
+                    time.sleep(0.5)
+                    continue
             else:
                 # Nếu chưa có frame nào, yield empty frame để giữ connection
                 time.sleep(0.1)
@@ -66,17 +84,20 @@ def gen_frames(camera_id):
             time.sleep(0.033)  # ~30 FPS (1/30 = 0.033s)
         except GeneratorExit:
             # Client đóng connection - exit gracefully
-            print(f"Stream closed for camera: {camera_id}")
+            logger.debug('Stream closed for camera: %s', camera_id)
             break
         except Exception as e:
             # Log lỗi nhưng không dừng generator
-            print(f"Error in gen_frames for {camera_id}: {e}")
+            logger.exception('Error in gen_frames for %s', camera_id)
             time.sleep(0.1)
             continue
 
 @login_required
 def video_feed(request, src):
     """View for video stream với keep-alive headers"""
+    if not valid_camera_id(src):
+        raise Http404('Unknown camera')
+    supervisor.start()
     response = StreamingHttpResponse(
         gen_frames(src),
         content_type='multipart/x-mixed-replace; boundary=frame'
@@ -89,63 +110,86 @@ def video_feed(request, src):
     return response
 
 @csrf_exempt
+@frame_size_limit
+@frame_admission
+@device_required()
 def stream_upload(request):
-    """API endpoint for receiving camera frames"""
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            camera_id = data.get('camera_id')
-            frame_data = data.get('frame')
-            
-            if camera_id is None or frame_data is None:
-                return JsonResponse({"status": "error", "message": "Missing camera_id or frame"}, status=400)
+    """
+    API nhận frame dạng nhị phân (không base64/JSON)
+
+    POST /api/stream_upload/
+    Content-Type: image/jpeg
+    Headers:
+        X-Camera-Id: mã camera
+        X-Frame-Seq: số thứ tự frame (tùy chọn)
+        X-Frame-Timestamp: thời điểm chụp, unix giây (tùy chọn)
+    Body: JPEG thô
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Method not allowed"}, status=405)
+
+    supervisor.start()
+    camera_id = request.headers.get('X-Camera-Id')
+    if not camera_id:
+        return JsonResponse({"status": "error", "message": "Missing X-Camera-Id"}, status=400)
+    if request.device and camera_id != request.device.device_id:
+        return JsonResponse({"status": "error", "message": "camera_id does not match device"}, status=403)
+
+    try:
+        seq = request.headers.get('X-Frame-Seq')
+        seq = int(seq) if seq is not None else None
+        captured_at = request.headers.get('X-Frame-Timestamp')
+        captured_at = float(captured_at) if captured_at is not None else None
+    except ValueError:
+        return JsonResponse({"status": "error", "message": "Invalid frame headers"}, status=400)
+
+    if not request.body:
+        return JsonResponse({"status": "error", "message": "Empty frame"}, status=400)
+
+    try:
+        # memoryview: broker giữ tham chiếu tới body, không copy frame
+        frame = memoryview(request.body)
+        accepted = broker.publish(camera_id, frame, seq=seq, captured_at=captured_at)
+        if accepted:
+            # Nhận diện phía server (nếu bật): lấy mẫu theo camera, không chặn
+            recognizer_pool.submit(camera_id, frame)
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+    return JsonResponse({"status": "ok" if accepted else "stale", "seq": seq})
+
+def _detection_row(det):
+    return {
+        "time": timezone.localtime(det.detected_at).strftime("%Y-%m-%d %H:%M:%S"),
+        "plate": det.license_plate,
+        "raw_plate": det.raw_plate,
+        "conf": f"{det.confidence:.2%}",
+        "path": det.image_path.name if det.image_path else None,
+        "thumbs": thumbnails.thumbnail_urls(det.image_digest),
+        "clip": det.clip.name if det.clip else None,
+        "event": det.event_type
+    }
 
-            # Initialize lock for new camera
-            if camera_id not in stream_locks:
-                stream_locks[camera_id] = threading.Lock()
-            
-            # Store frame
-            with stream_locks[camera_id]:
-                streams[camera_id] = frame_data.encode('utf-8')
-            
-            return JsonResponse({"status": "ok"})
-        except json.JSONDecodeError:
-            return JsonResponse({"status": "error", "message": "Invalid JSON"}, status=400)
-        except Exception as e:
-            return JsonResponse({"status": "error", "message": str(e)}, status=500)
-            
-    return JsonResponse({"status": "error", "message": "Method not allowed"}, status=405)
 
 @login_required
 def latest_detections(request):
     """API endpoint for getting latest detections from DATABASE"""
     try:
         from .models import VehicleDetection
-        from django.utils import timezone as tz
         
-        # Lấy 20 detection mới nhất từ database
-        detections = VehicleDetection.objects.all().order_by('-detected_at')[:20]
+        lot, error = lot_from_request(request)
+        if error:
+            return JsonResponse({'success': False, 'message': error}, status=404)
+
+        # Lấy 20 detection mới nhất từ database (theo bãi nếu có ?lot=)
+        detections = VehicleDetection.objects.all()
+        if lot is not None:
+            detections = detections.filter(lot=lot)
+        detections = detections.order_by('-detected_at')[:20]
         
-        latest = None
-        if detections:
-            latest_det = detections[0]
-            # Convert UTC sang giờ local (Asia/Ho_Chi_Minh)
-            local_time = tz.localtime(latest_det.detected_at)
-            latest = {
-                "time": local_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "plate": latest_det.license_plate,
-                "conf": f"{latest_det.confidence:.2%}",
-                "path": latest_det.image_path.name if latest_det.image_path else None,
-                "event": latest_det.event_type
-            }
-        
-        history = [{
-            "time": tz.localtime(det.detected_at).strftime("%Y-%m-%d %H:%M:%S"),
-            "plate": det.license_plate,
-            "conf": f"{det.confidence:.2%}",
-            "path": det.image_path.name if det.image_path else None,
-            "event": det.event_type
-        } for det in detections]
+        history = [_detection_row(det) for det in detections]
+        # Dòng mới nhất (giờ đã convert UTC sang giờ local Asia/Ho_Chi_Minh)
+        latest = history[0] if history else None
         
         return JsonResponse({
             'success': True,
@@ -180,19 +224,32 @@ def upload_detection(request):
 
 @login_required
 def get_parking_status(request):
-    """API endpoint for getting parking lot status"""
-    # Implement your parking status logic here
-    status = {
-        str(i): {
-            "occupied": False,
-            "plate": None,
-            "entry_time": None
-        } for i in range(1, 7)
-    }
+    """API endpoint for getting parking lot status (?lot=<mã bãi>, mặc định bãi chính)"""
+    from .models import ParkingSession
+
+    lot, error = lot_from_request(request)
+    if error:
+        return JsonResponse({"status": "error", "msg": error}, status=404)
+    if lot is None:
+        lot = get_default_lot()
+
+    # Chỗ đỗ không gắn cảm biến riêng: xếp các xe đang đỗ lần lượt vào từng chỗ
+    active = list(ParkingSession.objects.filter(lot=lot, status='ACTIVE').order_by('entry_time').values(
+        'license_plate', 'entry_time'
+    )[:lot.capacity])
+    status = {}
+    for i in range(1, lot.capacity + 1):
+        session = active[i - 1] if i <= len(active) else None
+        status[str(i)] = {
+            "occupied": session is not None,
+            "plate": session['license_plate'] if session else None,
+            "entry_time": timezone.localtime(session['entry_time']).strftime("%Y-%m-%d %H:%M:%S") if session else None
+        }
     return JsonResponse({
+        "lot": lot.code,
         "status": status,
-        "total_spots": 6,
-        "occupied_spots": 0
+        "total_spots": lot.capacity,
+        "occupied_spots": ParkingSession.objects.filter(lot=lot, status='ACTIVE').count()
     })
 
 @csrf_exempt
@@ -355,16 +412,18 @@ from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 
 @csrf_exempt
+@device_required('ingest')
 def upload_license_plate(request):
     """Nhận dữ liệu từ Raspberry Pi: ảnh + thông tin biển số (TỰ ĐỘNG ENTRY/EXIT)"""
     if request.method == "POST":
         try:
-            from .models import VehicleDetection, ParkingSession
-            from django.core.files.storage import default_storage
-            
             plate = request.POST.get("plate", "").strip().upper()
             confidence_str = request.POST.get("confidence", "0")
-            source = request.POST.get("source", "raspberrypi_cam")
+            # Thiết bị đã xác thực thì dùng device_id làm nguồn camera
+            if request.device:
+                source = request.device.device_id
+            else:
+                source = request.POST.get("source", "raspberrypi_cam")
             image_file = request.FILES.get("image")
 
             if not plate:
@@ -376,111 +435,104 @@ def upload_license_plate(request):
             except:
                 confidence = 0.0
 
-            # ⭐ TỰ ĐỘNG XÁC ĐỊNH EVENT TYPE (Lần 1 = ENTRY, Lần 2 = EXIT)
-            active_session = ParkingSession.objects.filter(
-                license_plate=plate,
-                status='ACTIVE'
-            ).first()
-            
-            if active_session:
-                event_type = 'EXIT'
-                message = f'🚗 Xe {plate} RA bãi'
+            # Bãi/cổng lấy theo camera đã đăng ký, camera lạ thuộc bãi mặc định
+            if request.device and request.device.lot_id:
+                lot_id, gate_id = request.device.lot_id, request.device.gate_id
             else:
-                event_type = 'ENTRY'
-                message = f'🚗 Xe {plate} VÀO bãi'
-
-            # Lưu ảnh - Django ImageField sẽ tự động lưu vào media/detections/
-            # ✅ LƯU VÀO DATABASE (VehicleDetection)
-            detection = VehicleDetection.objects.create(
-                license_plate=plate,
-                confidence=confidence,
-                event_type=event_type,
-                camera_source=source,
-                image_path=image_file if image_file else None  # Django tự động lưu file
-            )
-            
-            # Lấy đường dẫn file đã lưu
-            filename = detection.image_path.name if detection.image_path else None
-
-            # ✅ XỬ LÝ PARKING SESSION
-            response_data = {
-                "status": "ok",
-                "plate": plate,
-                "confidence": f"{confidence:.2%}",
-                "event_type": event_type,
-                "message": message,
-                "detection_id": detection.id,
-                "file": filename
-            }
-
-            if event_type == 'ENTRY':
-                # Tạo phiên đỗ xe mới
-                session = ParkingSession.objects.create(
-                    license_plate=plate,
-                    entry_time=timezone.now(),
-                    entry_image=filename,
-                    status='ACTIVE'
-                )
-                response_data['session_id'] = session.id
-                response_data['action'] = 'open_barrier'
-                print(f"✅ ENTRY: {plate} from {source} ({confidence:.2%}) -> Session #{session.id}")
-                
-            elif event_type == 'EXIT':
-                # Kết thúc phiên đỗ xe - TỰ ĐỘNG TÍNH TOÁN
-                active_session.complete_session(timezone.now(), filename)
-                
-                # Lấy chi tiết phí để trả về
-                fee_breakdown = active_session.get_fee_breakdown()
-                
-                response_data['session_id'] = active_session.id
-                response_data['duration_minutes'] = active_session.duration_minutes
-                response_data['fee'] = int(active_session.fee)
-                response_data['payment_status'] = active_session.payment_status
-                response_data['fee_breakdown'] = fee_breakdown
-                response_data['action'] = 'open_barrier'
-                
-                # Message thân thiện
-                if active_session.fee == 0:
-                    response_data['display_message'] = f"Cảm ơn! Miễn phí ({active_session.duration_minutes} phút)"
-                else:
-                    response_data['display_message'] = f"Phí đỗ xe: {int(active_session.fee):,}đ ({active_session.duration_minutes} phút)"
-                
-                print(f"✅ EXIT: {plate} from {source} ({confidence:.2%}) -> {active_session.duration_minutes}p, {active_session.fee:,.0f} VNĐ")
+                lot_id, gate_id = get_default_lot().id, None
 
+            # Gom các lần đọc của cùng lượt xe rồi mới ghi ENTRY/EXIT (xem parking/voting.py)
+            if plate_voter.enabled:
+                response_data = plate_voter.submit(plate, confidence, source, image_file, lot_id, gate_id)
+            else:
+                response_data = gate_decisions.decide(plate, confidence, source, image_file, lot_id, gate_id)
             return JsonResponse(response_data)
 
         except Exception as e:
-            import traceback
-            print(f"❌ Error in upload_license_plate: {str(e)}")
-            print(traceback.format_exc())
+            logger.exception('Error in upload_license_plate')
             return JsonResponse({"status": "error", "msg": str(e)})
 
     return JsonResponse({"status": "error", "msg": "Invalid method"})
 
+@login_required
+def task_queue_stats(request):
+    """Độ sâu hàng đợi tác vụ nền, số tác vụ lỗi/thử lại và độ trễ"""
+    return JsonResponse({'success': True, 'queue': task_queue.stats()})
+
 @csrf_exempt
+@frame_size_limit
+@frame_admission
+@device_required()
 def receive_stream(request, src):
-    """Nhận stream từ Raspberry Pi (POST từng frame MJPEG) - Atomic write"""
+    """Nhận stream từ Raspberry Pi (POST từng frame MJPEG) - qua frame broker"""
     if request.method == 'POST':
+        supervisor.start()
+        if request.device and src != request.device.device_id:
+            return HttpResponse("Stream does not belong to this device", status=403)
         try:
-            import os
-            import shutil
-            
-            os.makedirs('media/streams', exist_ok=True)
-            frame_path = f'media/streams/{src}.jpg'
-            temp_path = f'media/streams/{src}.tmp'
-            
-            # Ghi vào file tạm trước
-            with open(temp_path, 'wb') as f:
-                f.write(request.body)
-            
-            # Sau đó move atomic (tránh đọc file đang ghi)
-            shutil.move(temp_path, frame_path)
-            
+            if broker.publish(src, request.body):
+                recognizer_pool.submit(src, request.body)
             return HttpResponse("OK", status=200)
         except Exception as e:
             return HttpResponse(str(e), status=500)
     return HttpResponse("Only POST allowed", status=405)
 
+
+@login_required
+def stream_stats(request):
+    """Thống kê số frame nhận/bỏ theo từng camera"""
+    return JsonResponse({
+        'success': True,
+        'target_fps': broker.config['TARGET_FPS'],
+        'max_frame_bytes': broker.config['MAX_FRAME_BYTES'],
+        'cameras': broker.stats(),
+        'clips': clip_writer.stats(),
+        'recognition': recognizer_pool.stats(),
+        'voting': plate_voter.stats(),
+        'gate_decision': gate_decisions.stats(),
+    })
+
+
+@login_required
+def camera_health(request):
+    """Trạng thái live/degraded/stale của từng camera (do camera supervisor tính nền)"""
+    supervisor.start()
+    return JsonResponse({
+        'success': True,
+        'cameras': supervisor.snapshot(),
+        'events': list(supervisor.events)[-50:],
+    })
+
+
+def thumbnail(request, name):
+    """
+    Ảnh thu nhỏ theo digest nội dung: <digest>_<size>.<webp|jpg>
+
+    Tên file đổi khi nội dung đổi nên được cache vĩnh viễn (immutable), nhưng
+    chỉ trong cache của trình duyệt: ảnh có biển số nên cần đăng nhập như media.
+    File chưa có trên đĩa thì tạo ngay từ ảnh gốc của detection có digest đó.
+    """
+    match = thumbnails.NAME_PATTERN.match(name)
+    config = thumbnails.get_config()
+    if not match or match['size'] not in config['SIZES']:
+        raise Http404('Unknown thumbnail')
+
+    relative_path = thumbnails.thumbnail_name(match['digest'], match['size'], match['format'], config)
+    if not can_view(request, relative_path):
+        return HttpResponseForbidden('Login required')
+    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, relative_path)):
+        from .models import VehicleDetection
+
+        detection = VehicleDetection.objects.filter(image_digest=match['digest']).exclude(image_path='').first()
+        if detection is None:
+            raise Http404('Unknown thumbnail')
+        try:
+            thumbnails.generate(detection.image_path.path, config, formats=[match['format']])
+        except FileNotFoundError:
+            raise Http404('Original image is missing')
+
+    return serve_file(request, relative_path, cache_control=f"private, max-age={config['MAX_AGE']}, immutable")
+
 from django.http import StreamingHttpResponse
 from django.views.decorators import gzip
 
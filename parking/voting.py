@@ -0,0 +1,321 @@
+"""
+Gom nhiều lần đọc biển số của một lượt xe qua cổng rồi mới ghi ENTRY/EXIT
+
+Một lần đọc sai (confidence thấp, có khi 0.0 khi Pi gửi sai định dạng) nếu
+ghi ngay sẽ tạo phiên "ma" phải xóa tay. Thay vào đó mỗi cổng (hoặc camera
+nếu chưa gán cổng) có một "lượt xe" (VehiclePass) gom các lần đọc đến gần
+nhau; biển số được bầu theo từng ký tự, trọng số là confidence. Lượt được
+chốt khi:
+    - tổng confidence của các lần đọc trùng biển số được bầu >= COMMIT_CONFIDENCE
+    - không có lần đọc mới trong PASS_GAP giây (xe đã qua)
+    - đã quá MAX_LATENCY giây từ lần đọc đầu (barrier phải mở kịp)
+    - có lần đọc khác hẳn (xe khác đến cổng)
+Mỗi lượt ghi đúng một VehicleDetection và một lần ENTRY/EXIT. Lượt có
+confidence sau bầu < MIN_CONFIDENCE không được ghi (Pi nhận action "retry").
+Trong COOLDOWN giây sau khi chốt, lần đọc cùng biển số ở cùng cổng trả lại
+kết quả đã chốt (duplicate) thay vì tạo lượt mới.
+
+Một thread nền tìm các lượt đến hạn và giao cho COMMIT_LANES thread ghi
+(lượt của cùng một cổng luôn vào cùng lane nên được ghi đúng thứ tự, cổng
+chậm không chặn các cổng khác); request /api/upload/ đợi kết quả của lượt
+mình tham gia (tối đa MAX_LATENCY + 1 giây). Quá thời gian đó Pi nhận quyết
+định tạm mở barrier ("pending": true) và lượt đó chắc chắn được ghi, kể cả
+khi confidence sau bầu thấp - barrier đã mở. Bộ đệm nằm trong bộ nhớ của từng
+process: khi chạy nhiều worker, các lần đọc của cùng một cổng nên đi vào
+cùng worker (sticky theo device) để được gom chung.
+"""
+
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .plates import canonical_form, normalize, skeleton
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLATE_VOTING = {
+    'ENABLED': True,
+    'PASS_GAP': 0.3,              # giây không có lần đọc mới -> xe đã qua
+    'MAX_LATENCY': 1.0,           # giây tối đa từ lần đọc đầu đến khi chốt
+    'COMMIT_CONFIDENCE': 0.9,     # tổng confidence các lần đọc trùng khớp để chốt sớm
+    'MIN_CONFIDENCE': 0.3,        # thấp hơn: không ghi ENTRY/EXIT
+    'COOLDOWN': 10.0,             # giây coi lần đọc cùng biển số ở cùng cổng là trùng
+    'MAX_READS': 20,              # số lần đọc tối đa trong một lượt
+    'COMMIT_LANES': 4,            # số thread ghi lượt xe (mỗi cổng cố định một lane)
+}
+
+# Lần đọc confidence 0.0 vẫn được tính (rất nhẹ) để lượt chỉ toàn lần đọc lỗi vẫn có kết quả
+MIN_WEIGHT = 0.01
+
+Read = namedtuple('Read', ['plate', 'raw', 'confidence', 'source', 'image', 'at'])
+
+
+def get_config():
+    config = dict(DEFAULT_PLATE_VOTING)
+    config.update(getattr(settings, 'PLATE_VOTING', {}))
+    return config
+
+
+def same_vehicle(a, b):
+    """Hai biển số có thể là cùng một xe đọc sai vài ký tự (so theo khung, từng vị trí)"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    matches = sum(x == y for x, y in zip(skeleton(a), skeleton(b)))
+    return matches * 2 >= max(len(a), len(b))
+
+
+class VehiclePass:
+    """Các lần đọc của một lượt xe tại một cổng"""
+
+    def __init__(self, key, lot_id, gate_id, at):
+        self.key = key
+        self.lot_id = lot_id
+        self.gate_id = gate_id
+        self.first_at = at
+        self.last_at = at
+        self.reads = []
+        self.done = threading.Event()
+        self.result = None
+        self.committing = False   # commit đã bắt đầu quyết định ghi/bỏ lượt
+        self.opened = False       # request đợi quá hạn đã nhận quyết định tạm mở barrier
+
+    def add(self, read):
+        self.reads.append(read)
+        self.last_at = read.at
+
+    def vote(self):
+        """
+        Bầu biển số theo từng ký tự, trọng số là confidence
+
+        Returns:
+            tuple: (biển số, confidence, tổng confidence các lần đọc trùng khớp)
+        """
+        weight_by_length = {}
+        for read in self.reads:
+            weight_by_length[len(read.plate)] = weight_by_length.get(len(read.plate), 0) + max(read.confidence, MIN_WEIGHT)
+        length = max(weight_by_length, key=weight_by_length.get)
+        reads = [read for read in self.reads if len(read.plate) == length]
+
+        chars, shares = [], []
+        for i in range(length):
+            tally = {}
+            for read in reads:
+                tally[read.plate[i]] = tally.get(read.plate[i], 0) + max(read.confidence, MIN_WEIGHT)
+            char, weight = max(tally.items(), key=lambda item: item[1])
+            chars.append(char)
+            shares.append(weight / sum(tally.values()))
+        plate = ''.join(chars)
+
+        agreeing = [read.confidence for read in reads if read.plate == plate]
+        if agreeing:
+            confidence = max(agreeing)
+        else:
+            # Không lần đọc nào đúng hẳn: độ tin cậy theo mức đồng thuận từng ký tự
+            confidence = sum(shares) / length * max(read.confidence for read in reads)
+        return plate, confidence, sum(agreeing)
+
+    def best_read(self, plate):
+        """Lần đọc đại diện (ảnh, chuỗi gốc): trùng biển số được bầu và confidence cao nhất"""
+        reads = [read for read in self.reads if read.plate == plate] or self.reads
+        with_image = [read for read in reads if read.image is not None]
+        return max(with_image or reads, key=lambda read: read.confidence)
+
+
+class PlateVoter:
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._passes = {}         # key -> VehiclePass đang gom
+        self._closed = []         # lượt bị đóng sớm (xe khác đến), chờ chốt
+        self._recent = {}         # key -> (biển số, hết hạn, kết quả) của lượt vừa chốt
+        self._cond = threading.Condition()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._lanes = []
+        self.counters = {'reads': 0, 'passes': 0, 'committed': 0, 'rejected': 0, 'duplicates': 0, 'errors': 0,
+                         'timeouts': 0}
+        self.latencies = deque(maxlen=1000)   # lần đọc đầu -> chốt (giây)
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    def start(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._lanes = [ThreadPoolExecutor(1, thread_name_prefix=f'plate-commit-{index}')
+                           for index in range(self.config['COMMIT_LANES'])]
+            thread = threading.Thread(target=self._run, name='plate-voter', daemon=True)
+            thread.start()
+            self._started = True
+
+    # ---------- nhận lần đọc ----------
+
+    def submit(self, raw_plate, confidence, source, image_file, lot_id, gate_id, wait=True):
+        """
+        Đưa một lần đọc vào lượt xe của cổng
+
+        Args:
+            wait (bool): đợi lượt được chốt và trả kết quả (request từ Pi);
+                False: trả về ngay (nhận diện phía server)
+
+        Returns:
+            dict | None: dữ liệu phản hồi cho Pi (giống gate.process_plate_read)
+        """
+        self.start()
+        now = time.monotonic()
+        if image_file is not None:
+            # Lượt có thể được chốt sau khi request trả về (quá hạn), file upload bị đóng khi request kết thúc
+            image_file.seek(0)
+            image_file = ContentFile(image_file.read(), name=os.path.basename(image_file.name))
+        read = Read(canonical_form(normalize(raw_plate)), raw_plate, confidence, source, image_file, now)
+        key = (lot_id, gate_id or source)
+
+        with self._cond:
+            self.counters['reads'] += 1
+            recent = self._recent.get(key)
+            if recent and recent[1] > now and skeleton(recent[0]) == skeleton(read.plate):
+                self.counters['duplicates'] += 1
+                return dict(recent[2], duplicate=True)
+
+            vehicle_pass = self._passes.get(key)
+            if vehicle_pass is not None and not same_vehicle(vehicle_pass.vote()[0], read.plate):
+                self._closed.append(self._passes.pop(key))
+                vehicle_pass = None
+            if vehicle_pass is None:
+                vehicle_pass = self._passes[key] = VehiclePass(key, lot_id, gate_id, now)
+                self.counters['passes'] += 1
+            vehicle_pass.add(read)
+            self._cond.notify()
+
+        if not wait:
+            return None
+        timeout = self.config['MAX_LATENCY'] + 1.0
+        if vehicle_pass.done.wait(timeout):
+            return vehicle_pass.result
+        with self._cond:
+            if not vehicle_pass.committing:
+                # Chưa được chốt: mở barrier tạm, commit sau đó phải ghi lượt này
+                vehicle_pass.opened = True
+        if not vehicle_pass.opened and vehicle_pass.done.wait(timeout):
+            return vehicle_pass.result
+        return self._timed_out(vehicle_pass)
+
+    def _timed_out(self, vehicle_pass):
+        from .gate_decision import gate_decisions
+
+        with self._cond:
+            self.counters['timeouts'] += 1
+            plate, confidence, _ = vehicle_pass.vote()
+        read = vehicle_pass.best_read(plate)
+        logger.warning('Plate pass %s not committed in time, opening barrier provisionally', plate,
+                       extra={'plate': plate, 'source': read.source, 'gate_id': vehicle_pass.gate_id})
+        return gate_decisions.provisional_decision(plate, confidence, vehicle_pass.lot_id, vehicle_pass.gate_id,
+                                                   raw_plate=read.raw)
+
+    # ---------- chốt lượt ----------
+
+    def _deadline(self, vehicle_pass):
+        return min(vehicle_pass.last_at + self.config['PASS_GAP'],
+                   vehicle_pass.first_at + self.config['MAX_LATENCY'])
+
+    def _is_due(self, vehicle_pass, now):
+        return (now >= self._deadline(vehicle_pass)
+                or len(vehicle_pass.reads) >= self.config['MAX_READS']
+                or vehicle_pass.vote()[2] >= self.config['COMMIT_CONFIDENCE'])
+
+    def _take_due(self, now):
+        due, self._closed = self._closed, []
+        for key, vehicle_pass in list(self._passes.items()):
+            if self._is_due(vehicle_pass, now):
+                due.append(self._passes.pop(key))
+        for key, recent in list(self._recent.items()):
+            if recent[1] <= now:
+                del self._recent[key]
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = self._take_due(time.monotonic())
+                if not due:
+                    deadlines = [self._deadline(p) for p in self._passes.values()]
+                    self._cond.wait(max(0.0, min(deadlines) - time.monotonic()) if deadlines else None)
+                    continue
+            for vehicle_pass in due:
+                self._lane(vehicle_pass.key).submit(self.commit, vehicle_pass)
+
+    def _lane(self, key):
+        return self._lanes[zlib.crc32(repr(key).encode('utf-8')) % len(self._lanes)]
+
+    def flush(self, now=None):
+        """Chốt các lượt đến hạn ngay trong thread gọi (dùng khi không chạy thread nền)"""
+        with self._cond:
+            due = self._take_due(time.monotonic() if now is None else now)
+        for vehicle_pass in due:
+            self.commit(vehicle_pass)
+        return [vehicle_pass.result for vehicle_pass in due]
+
+    def commit(self, vehicle_pass):
+        """Ghi một VehicleDetection + ENTRY/EXIT cho lượt xe và báo cho các request đang đợi"""
+        from django.db import close_old_connections
+
+        from .gate_decision import gate_decisions
+
+        with self._cond:
+            vehicle_pass.committing = True
+            plate, confidence, _ = vehicle_pass.vote()
+        read = vehicle_pass.best_read(plate)
+        now = time.monotonic()
+
+        try:
+            if confidence < self.config['MIN_CONFIDENCE'] and not vehicle_pass.opened:
+                with self._cond:
+                    self.counters['rejected'] += 1
+                logger.warning('Rejected low confidence pass %s (%.2f, %d reads)', plate, confidence,
+                               len(vehicle_pass.reads), extra={'plate': plate, 'source': read.source})
+                result = {"status": "error", "msg": "Low confidence plate read", "action": "retry",
+                          "plate": plate, "confidence": f"{confidence:.2%}"}
+            else:
+                close_old_connections()
+                result = gate_decisions.decide(plate, confidence, read.source, read.image, vehicle_pass.lot_id,
+                                               vehicle_pass.gate_id, raw_plate=read.raw)
+                result['reads'] = len(vehicle_pass.reads)
+                with self._cond:
+                    self._recent[vehicle_pass.key] = (result['plate'], now + self.config['COOLDOWN'], result)
+                    self.counters['committed'] += 1
+        except Exception as e:
+            with self._cond:
+                self.counters['errors'] += 1
+            logger.exception('Failed to commit plate pass %s', plate)
+            result = {"status": "error", "msg": str(e)}
+
+        self.latencies.append(now - vehicle_pass.first_at)
+        vehicle_pass.result = result
+        vehicle_pass.done.set()
+        return result
+
+    def stats(self):
+        with self._cond:
+            data = dict(self.counters)
+            data['open_passes'] = len(self._passes)
+        latencies = sorted(self.latencies)
+        data.update(
+            enabled=self.enabled,
+            decision_p50=round(latencies[len(latencies) // 2], 4) if latencies else None,
+            decision_p95=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4) if latencies else None,
+        )
+        return data
+
+
+plate_voter = PlateVoter()
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'parking.metrics.MetricsMiddleware',  # Đặt đầu tiên để đo toàn bộ request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',  # Thêm LocaleMiddleware
@@ -175,3 +176,146 @@ CORS_ALLOW_METHODS = [
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Xác thực thiết bị camera (Raspberry Pi) - xem parking/device_auth.py
+DEVICE_AUTH = {
+    'REQUIRED': True,             # False: cho phép request không ký (chỉ dùng khi dev)
+    'MAX_CLOCK_SKEW': 300,        # giây
+    'SECRET_CACHE_SIZE': 256,
+    'SECRET_CACHE_TTL': 60,       # giây
+    'RATE_LIMITS': {
+        # scope: (token/giây, burst)
+        'ingest': (2, 10),        # /api/upload/
+    },
+}
+
+# Nhận stream frame từ camera - xem parking/streaming.py
+STREAM_INGEST = {
+    'TARGET_FPS': 30,                 # frame/giây tối đa mỗi camera (quá sẽ trả 429)
+    'BURST': 15,
+    'MAX_FRAME_BYTES': 1024 * 1024,   # frame lớn hơn trả 413
+    'STREAM_DIR': os.path.join(MEDIA_ROOT, 'streams'),
+    'RING_SECONDS': 10,               # giữ N giây frame gần nhất mỗi camera để cắt clip
+    'RING_MAX_BYTES': 32 * 1024 * 1024,
+}
+
+# Hàng đợi tác vụ nền (thống kê ngày, hóa đơn, ...) - xem parking/task_queue.py
+TASK_QUEUE = {
+    'SPOOL_DIR': os.path.join(BASE_DIR, 'var', 'tasks'),
+    'WORKERS': 4,
+    'MAX_RETRIES': 5,
+    'RETRY_BACKOFF': 2.0,
+    'MAX_BACKOFF': 60.0,
+    'EAGER': False,
+}
+
+# Đo latency / số query theo view, xuất tại /metrics (Prometheus) - xem parking/metrics.py
+METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 1000,          # None: tắt log request chậm (kèm SQL của request)
+    'SLOW_LOG_MAX_QUERIES': 20,
+    'TOKEN': os.environ.get('METRICS_TOKEN'),   # "Authorization: Bearer <token>"; không đặt: chỉ staff (trừ khi DEBUG)
+}
+
+# Logging: JSON một dòng mỗi record, ghi ở thread nền (không chặn request),
+# chặn log lặp lại - xem parking/log.py. Chỉnh level từng module khi chạy bằng
+# biến môi trường LOG_LEVELS="parking.gate=DEBUG,parking.views=WARNING"
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'parking.log.JsonFormatter'},
+    },
+    'filters': {
+        'rate_limit': {'()': 'parking.log.RateLimitFilter', 'interval': 10, 'burst': 5},
+    },
+    'handlers': {
+        'async_json': {
+            '()': 'parking.log.AsyncStreamHandler',
+            'stream': 'ext://sys.stdout',
+            'max_queue': 10000,
+            'formatter': 'json',
+            'filters': ['rate_limit'],
+        },
+    },
+    'root': {'handlers': ['async_json'], 'level': 'WARNING'},
+    'loggers': {
+        'django': {'handlers': ['async_json'], 'level': 'INFO', 'propagate': False},
+        'parking': {'level': 'INFO'},
+        'parking.api': {'level': 'WARNING'},
+        'parking.streaming': {'level': 'WARNING'},
+    },
+}
+
+# Clip MJPEG quanh mỗi lần nhận diện (đối chiếu khi khiếu nại) - xem parking/clips.py
+CLIP_RECORDING = {
+    'ENABLED': True,
+    'PRE_SECONDS': 3.0,       # lấy từ ring buffer của frame broker
+    'POST_SECONDS': 2.0,
+    'MAX_PENDING': 100,
+}
+
+# Nhận diện biển số phía server từ frame stream (tắt mặc định - Pi tự nhận diện) - xem parking/recognition.py
+RECOGNITION = {
+    'ENABLED': False,
+    'BACKEND': 'parking.recognition.HaarCascadeRecognizer',   # class kế thừa PlateRecognizer
+    'BACKEND_OPTIONS': {},
+    'WORKERS': None,              # None: số core CPU
+    'SAMPLE_INTERVAL': 0.5,       # mỗi camera nhận diện tối đa 2 frame/giây
+    'BATCH_SIZE': 8,
+    'MIN_CONFIDENCE': 0.8,
+}
+
+# Phục vụ /media/: Django kiểm tra quyền, truyền file giao cho nginx (X-Accel-Redirect) hoặc
+# apache (X-Sendfile); 'django' dùng FileResponse (sendfile qua wsgi.file_wrapper) - xem parking/media.py
+MEDIA_SERVING = {
+    'BACKEND': os.environ.get('MEDIA_BACKEND', 'django'),
+    'ACCEL_PREFIX': '/protected-media/',
+    'LOGIN_REQUIRED': True,
+}
+
+# Ảnh thu nhỏ cho dashboard (tạo nền khi có detection, phục vụ ở /thumbs/) - xem parking/thumbnails.py
+THUMBNAILS = {
+    'ENABLED': True,
+    'SIZES': {'sm': 160, 'md': 480},
+    'FORMAT': 'webp',
+    'QUALITY': 80,
+}
+
+# Dọn phiên ACTIVE bị treo (lỡ mất lần đọc EXIT) - xem parking/sweeper.py
+SESSION_SWEEP = {
+    'ENABLED': True,
+    'INTERVAL': 300,              # giây giữa 2 lần quét của `manage.py sweep_sessions --loop` (hoặc dùng cron)
+    'FLAG_AFTER_HOURS': 24,       # đánh dấu cần kiểm tra
+    'CLOSE_AFTER_HOURS': 72,      # tự đóng (None: không bao giờ)
+    'CLOSE_CONTRADICTED': True,   # tự đóng khi biển số đã vào lại ở nơi khác
+}
+
+# Bản async (ORM async) của các API chỉ đọc được poll liên tục - bật khi chạy ASGI (uvicorn/daphne
+# smartparking.asgi:application), dưới WSGI giữ bản sync. Xem parking/async_views.py
+ASYNC_READ_API = os.environ.get('ASYNC_READ_API', '').lower() in ('1', 'true', 'yes')
+
+# Gom các lần đọc biển số của một lượt xe qua cổng trước khi ghi ENTRY/EXIT - xem parking/voting.py
+PLATE_VOTING = {
+    'ENABLED': True,
+    'PASS_GAP': 0.3,              # giây không có lần đọc mới -> xe đã qua
+    'MAX_LATENCY': 1.0,           # barrier mở chậm nhất sau lần đọc đầu
+    'COMMIT_CONFIDENCE': 0.9,
+    'MIN_CONFIDENCE': 0.3,
+    'COOLDOWN': 10.0,
+}
+
+# Quyết định mở barrier trong ngân sách thời gian, database chậm thì ghi journal rồi ghi lại sau
+# - xem parking/gate_decision.py
+GATE_DECISION = {
+    'ENABLED': True,
+    'LATENCY_BUDGET_MS': 150,     # chờ ghi database tối đa, quá thì trả quyết định tạm (pending)
+    'DEGRADE_AFTER': 3,           # số lần ghi liên tiếp quá ngân sách -> chế độ degraded (journal)
+    'JOURNAL_DIR': os.path.join(BASE_DIR, 'var', 'gate_journal'),
+    'REPLAY_INTERVAL': 5.0,       # giây giữa các lần thử ghi lại journal
+}
+
+# Sổ thanh toán: tổng thu theo ca cộng dồn mỗi lần ghi - xem parking/payments.py
+PAYMENT_LEDGER = {
+    'SHIFT_STARTS': ['06:00', '14:00', '22:00'],   # giờ bắt đầu các ca (ca đêm thuộc ngày bắt đầu ca)
+}
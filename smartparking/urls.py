@@ -1,7 +1,6 @@
 from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 
 from django.urls import path, include
 from django.conf.urls.i18n import i18n_patterns
@@ -11,6 +10,4 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('parking.urls')),  # Trang chủ
 ]
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 